@@ -54,7 +54,8 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
 
     def __init__(self, name, password, max_builds=None,
                  notify_on_missing=[], missing_timeout=3600,
-                 properties={}, locks=None, keepalive_interval=3600):
+                 properties={}, locks=None, keepalive_interval=3600,
+                 compress_updates=False):
         """
         @param name: botname this machine will supply when it connects
         @param password: password this machine will supply when
@@ -68,6 +69,9 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         @param locks: A list of locks that must be acquired before this slave
                       can be used
         @type locks: dictionary
+        @param compress_updates: if true, ask the slave to compress the output
+                                 of its commands before sending it
+        @type compress_updates: boolean
         """
         service.MultiService.__init__(self)
         self.slavename = name
@@ -107,6 +111,7 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         self.missing_timeout = missing_timeout
         self.missing_timer = None
         self.keepalive_interval = keepalive_interval
+        self.compress_updates = compress_updates
 
         self.detached_subs = None
 
@@ -212,6 +217,7 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         self.access = new.access
         self.notify_on_missing = new.notify_on_missing
         self.keepalive_interval = new.keepalive_interval
+        self.compress_updates = new.compress_updates
 
         if self.missing_timeout != new.missing_timeout:
             running_missing_timer = self.missing_timer
@@ -27,16 +27,19 @@ class GitPoller(base.PollingChangeSource):
     """This source will poll a remote git repo for changes and submit
     them to the change master."""
     
-    compare_attrs = ["repourl", "branch", "workdir",
+    compare_attrs = ["repourl", "branch", "branches", "workdir",
                      "pollInterval", "gitbin", "usetimestamps",
                      "category", "project"]
-                     
+
+    # fields of each commit in the output of 'git log', each preceded by a NUL
+    LOG_FORMAT = r'%x00%H%x00%ct%x00%aN <%aE>%x00%s%n%b%x00'
+
     def __init__(self, repourl, branch='master', 
                  workdir=None, pollInterval=10*60, 
                  gitbin='git', usetimestamps=True,
                  category=None, project=None,
                  pollinterval=-2, fetch_refspec=None,
-                 encoding='utf-8', name=None):
+                 encoding='utf-8', name=None, branches=None):
 
         # for backward compatibility; the parameter used to be spelled with 'i'
         if pollinterval != -2:
@@ -47,7 +50,9 @@ class GitPoller(base.PollingChangeSource):
         if project is None: project = ''
 
         self.repourl = repourl
-        self.branch = branch
+        # the first branch is the one checked out in the working directory
+        self.branches = list(branches or [branch])
+        self.branch = self.branches[0]
         self.fetch_refspec = fetch_refspec
         self.encoding = encoding
         self.lastChange = time.time()
@@ -58,7 +63,7 @@ class GitPoller(base.PollingChangeSource):
         self.category = category
         self.project = project
         self.changeCount = 0
-        self.commitInfo  = {}
+        self.changedBranches = []
         self.initLock = defer.DeferredLock()
         
         if self.workdir == None:
@@ -80,6 +85,9 @@ class GitPoller(base.PollingChangeSource):
             d.addErrback(log.err, 'while initializing GitPoller repository')
         else:
             log.msg("GitPoller repository already exists")
+            # make sure any newly-configured branches are being tracked
+            d = self.initBranches()
+            d.addErrback(log.err, 'while initializing GitPoller branches')
 
         # call this *after* initRepository, so that the initLock is locked first
         base.PollingChangeSource.startService(self)
@@ -136,6 +144,7 @@ class GitPoller(base.PollingChangeSource):
             d.addErrback(self._stop_on_failure)
             return d
         d.addCallback(set_master)
+        d.addCallback(lambda _ : self._create_branches())
         def get_rev(_):
             d = utils.getProcessOutputAndValue(self.gitbin,
                     ['rev-parse', self.branch],
@@ -151,12 +160,27 @@ class GitPoller(base.PollingChangeSource):
         d.addCallback(print_rev)
         return d
 
+    @deferredLocked('initLock')
+    def initBranches(self):
+        return self._create_branches()
+
+    @defer.inlineCallbacks
+    def _create_branches(self):
+        # create a local branch for each of the other branches, so that their
+        # new commits can be found with 'git log branch..origin/branch'
+        for branch in self.branches[1:]:
+            stdout, stderr, code = yield utils.getProcessOutputAndValue(
+                    self.gitbin, ['branch', branch, 'origin/%s' % branch],
+                    path=self.workdir, env=os.environ)
+            if code == 0:
+                log.msg('gitpoller: created local branch %s' % branch)
+
     def describe(self):
         status = ""
         if not self.master:
             status = "[STOPPED - check log]"
         str = 'GitPoller watching the remote git repository %s, branch: %s %s' \
-                % (self.repourl, self.branch, status)
+                % (self.repourl, ', '.join(self.branches), status)
         return str
 
     @deferredLocked('initLock')
@@ -168,53 +192,55 @@ class GitPoller(base.PollingChangeSource):
         d.addErrback(self._catch_up_failure)
         return d
 
-    def _get_commit_comments(self, rev):
-        args = ['log', rev, '--no-walk', r'--format=%s%n%b']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=os.environ, errortoo=False )
-        def process(git_output):
-            stripped_output = git_output.strip().decode(self.encoding)
-            if len(stripped_output) == 0:
-                raise EnvironmentError('could not get commit comment for rev')
-            return stripped_output
-        d.addCallback(process)
-        return d
-
-    def _get_commit_timestamp(self, rev):
-        # unix timestamp
-        args = ['log', rev, '--no-walk', r'--format=%ct']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=os.environ, errortoo=False )
-        def process(git_output):
-            stripped_output = git_output.strip()
+    def _parse_log(self, git_output):
+        """
+        Parse the output of C{git log} run with L{LOG_FORMAT}, C{--name-only}
+        and C{-z}, returning a list of (rev, timestamp, author, files,
+        comments) tuples in the order git gave them.
+        """
+        # each commit is the four NUL-prefixed fields of LOG_FORMAT, then an
+        # empty field, then the NUL-terminated filenames (the first of which
+        # is preceded by a newline)
+        fields = git_output.split('\0')[1:]
+        commits = []
+        i = 0
+        while i + 4 <= len(fields) and fields[i]:
+            rev, timestamp, author, comments = fields[i:i+4]
+            i += 5
+            files = []
+            while i < len(fields) and fields[i]:
+                files.append(fields[i])
+                i += 1
+            i += 1
+            if files:
+                files[0] = files[0][1:]
+
+            author = author.strip().decode(self.encoding)
+            if not author:
+                raise EnvironmentError('could not get commit author for rev %s'
+                                       % rev)
+            comments = comments.strip().decode(self.encoding)
+            if not comments:
+                raise EnvironmentError('could not get commit comment for rev %s'
+                                       % rev)
             if self.usetimestamps:
                 try:
-                    stamp = float(stripped_output)
-                except Exception, e:
-                        log.msg('gitpoller: caught exception converting output \'%s\' to timestamp' % stripped_output)
-                        raise e
-                return stamp
+                    timestamp = float(timestamp)
+                except ValueError:
+                    log.msg('gitpoller: caught exception converting output '
+                            '\'%s\' to timestamp' % timestamp)
+                    raise
             else:
-                return None
-        d.addCallback(process)
-        return d
-
-    def _get_commit_files(self, rev):
-        args = ['log', rev, '--name-only', '--no-walk', r'--format=%n']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=os.environ, errortoo=False )
-        def process(git_output):
-            fileList = git_output.split()
-            return fileList
-        d.addCallback(process)
-        return d
-            
-    def _get_commit_author(self, rev):
-        args = ['log', rev, '--no-walk', r'--format=%aN <%aE>']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=os.environ, errortoo=False )
-        def process(git_output):
-            stripped_output = git_output.strip().decode(self.encoding)
-            if len(stripped_output) == 0:
-                raise EnvironmentError('could not get commit author for rev')
-            return stripped_output
-        d.addCallback(process)
+                timestamp = None
+            commits.append((rev, timestamp, author, files, comments))
+        return commits
+
+    def _get_commits(self, branch):
+        args = ['log', '%s..origin/%s' % (branch, branch),
+                '--format=' + self.LOG_FORMAT, '--name-only', '-z']
+        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir,
+                                   env=os.environ, errortoo=False)
+        d.addCallback(self._parse_log)
         return d
 
     def _get_changes(self):
@@ -238,51 +264,36 @@ class GitPoller(base.PollingChangeSource):
 
     @defer.inlineCallbacks
     def _process_changes(self, unused_output):
-        # get the change list
-        revListArgs = ['log', '%s..origin/%s' % (self.branch, self.branch), r'--format=%H']
         self.changeCount = 0
-        results = yield utils.getProcessOutput(self.gitbin, revListArgs,
-                    path=self.workdir, env=os.environ, errortoo=False )
-
-        # process oldest change first
-        revList = results.split()
-        if not revList:
-            return
-
-        revList.reverse()
-        self.changeCount = len(revList)
-            
-        log.msg('gitpoller: processing %d changes: %s in "%s"'
-                % (self.changeCount, revList, self.workdir) )
-
-        for rev in revList:
-            dl = defer.DeferredList([
-                self._get_commit_timestamp(rev),
-                self._get_commit_author(rev),
-                self._get_commit_files(rev),
-                self._get_commit_comments(rev),
-            ], consumeErrors=True)
-
-            results = yield dl
-
-            # check for failures
-            failures = [ r[1] for r in results if not r[0] ]
-            if failures:
-                # just fail on the first error; they're probably all related!
-                raise failures[0]
-
-            timestamp, author, files, comments = [ r[1] for r in results ]
-            yield self.master.addChange(
-                   author=author,
-                   revision=rev,
-                   files=files,
-                   comments=comments,
-                   when_timestamp=epoch2datetime(timestamp),
-                   branch=self.branch,
-                   category=self.category,
-                   project=self.project,
-                   repository=self.repourl,
-                   src='git')
+        self.changedBranches = []
+        changes = []
+        for branch in self.branches:
+            commits = yield self._get_commits(branch)
+            if not commits:
+                continue
+
+            # process oldest change first
+            commits.reverse()
+            self.changeCount += len(commits)
+            self.changedBranches.append(branch)
+
+            log.msg('gitpoller: processing %d changes on branch %s in "%s"'
+                    % (len(commits), branch, self.workdir))
+
+            for rev, timestamp, author, files, comments in commits:
+                changes.append(dict(
+                       author=author,
+                       revision=rev,
+                       files=files,
+                       comments=comments,
+                       when_timestamp=epoch2datetime(timestamp),
+                       branch=branch,
+                       category=self.category,
+                       project=self.project,
+                       repository=self.repourl,
+                       src='git'))
+
+        yield self.master.addChanges(changes)
 
     def _process_changes_failure(self, f):
         log.msg('gitpoller: repo poll failed')
@@ -290,15 +301,21 @@ class GitPoller(base.PollingChangeSource):
         # eat the failure to continue along the defered chain - we still want to catch up
         return None
         
+    @defer.inlineCallbacks
     def _catch_up(self, res):
         if self.changeCount == 0:
             log.msg('gitpoller: no changes, no catch_up')
             return
-        log.msg('gitpoller: catching up tracking branch')
-        args = ['reset', '--hard', 'origin/%s' % (self.branch,)]
-        d = utils.getProcessOutputAndValue(self.gitbin, args, path=self.workdir, env=os.environ)
-        d.addCallback(self._convert_nonzero_to_failure)
-        return d
+        for branch in self.changedBranches:
+            log.msg('gitpoller: catching up tracking branch %s' % branch)
+            if branch == self.branch:
+                args = ['reset', '--hard', 'origin/%s' % (branch,)]
+            else:
+                # other branches are not checked out, so just move the ref
+                args = ['branch', '-f', branch, 'origin/%s' % (branch,)]
+            res = yield utils.getProcessOutputAndValue(self.gitbin, args,
+                    path=self.workdir, env=os.environ)
+            self._convert_nonzero_to_failure(res)
 
     def _catch_up_failure(self, f):
         log.err(f)
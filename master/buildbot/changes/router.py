@@ -0,0 +1,221 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import re
+from twisted.python import failure, log
+from buildbot.process import metrics
+from buildbot.changes.filter import ChangeFilter
+
+class Route(object):
+    """
+    A consumer of changes, with the L{ChangeFilter} (or None) that selects
+    the changes it receives.  Call C{unsubscribe} to remove the route.
+    """
+
+    def __init__(self, router, position, change_filter, consumer):
+        self.router = router
+        self.position = position
+        self.change_filter = change_filter
+        self.consumer = consumer
+
+    def accepts(self, change):
+        return (self.change_filter is None
+                or self.change_filter.filter_change(change))
+
+    def unsubscribe(self):
+        self.router.removeRoute(self)
+
+
+class RegexGroup(object):
+    """
+    The routes that are indexed on a regular expression for one change
+    attribute.  The expressions are combined into a single alternation, so
+    that a change that matches none of them is rejected with one match.
+    """
+
+    def __init__(self):
+        self.routes = []
+        self.patterns = []
+        self.combined = None
+
+    def add(self, route, regex):
+        self.routes.append(route)
+        self.patterns.append(regex.pattern)
+
+    def compile(self):
+        try:
+            self.combined = re.compile('|'.join([ '(?:%s)' % p
+                                                  for p in self.patterns ]))
+        except re.error:
+            # fall back to checking every route
+            self.combined = None
+
+    def candidates(self, value):
+        if not self.routes or value is None:
+            # a regular expression never matches a missing value
+            return []
+        if self.combined is not None:
+            try:
+                if not self.combined.match(value):
+                    return []
+            except TypeError:
+                # not a string; let the filters decide
+                pass
+        return self.routes
+
+
+class ChangeRouter(object):
+    """
+    Delivers each change only to the routes whose filters accept it.
+
+    Rather than evaluating every route's filter for every change, the router
+    indexes the routes by one attribute that their filters check.  A filter
+    that requires one of a list of values is indexed in a hash of those
+    values, and the regular expressions for each attribute are combined into
+    a single matcher.  The full filter is then evaluated only for the routes
+    that the index selects.  The index is rebuilt when the next change arrives
+    after routes are added or removed, which in practice means once after
+    each reconfig.
+
+    The number of filters evaluated is logged in the
+    C{ChangeRouter.filter_evaluations} metric, along with the number of
+    changes in C{ChangeRouter.changes_routed}.
+    """
+
+    # change attributes that can be indexed, in order of preference
+    indexed_attrs = ('branch', 'project', 'repository', 'category')
+
+    _default_flags = re.compile('').flags
+
+    def __init__(self):
+        self.routes = []
+        self._next_position = 0
+        self._index = None
+
+    def addRoute(self, change_filter, consumer):
+        """
+        Add a route delivering the changes accepted by C{change_filter} (or
+        all changes, if it is None) to C{consumer}, returning a L{Route}.
+        """
+        route = Route(self, self._next_position, change_filter, consumer)
+        self._next_position += 1
+        self.routes.append(route)
+        self._index = None
+        return route
+
+    def removeRoute(self, route):
+        if route in self.routes:
+            self.routes.remove(route)
+            self._index = None
+
+    def _buildIndex(self):
+        exact = dict((attr, {}) for attr in self.indexed_attrs)
+        regexes = dict((attr, RegexGroup()) for attr in self.indexed_attrs)
+        unindexed = []
+        for route in self.routes:
+            if not self._indexRoute(route, exact, regexes):
+                unindexed.append(route)
+        for group in regexes.itervalues():
+            group.compile()
+        self._index = (exact, regexes, unindexed)
+
+    def _indexRoute(self, route, exact, regexes):
+        # only the checks of a plain ChangeFilter are known to be required
+        change_filter = route.change_filter
+        if not isinstance(change_filter, ChangeFilter):
+            return False
+        if (change_filter.__class__.filter_change.im_func
+                is not ChangeFilter.filter_change.im_func):
+            return False
+        checks = dict((attr, (filt_list, filt_re))
+                      for (filt_list, filt_re, filt_fn, attr)
+                      in change_filter.checks)
+
+        # prefer a list of exact values, which can be hashed
+        for attr in self.indexed_attrs:
+            filt_list = checks.get(attr, (None, None))[0]
+            if filt_list is None:
+                continue
+            try:
+                for value in filt_list:
+                    exact[attr].setdefault(value, []).append(route)
+            except TypeError:
+                # unhashable value; undo any partial indexing
+                for routes in exact[attr].itervalues():
+                    if route in routes:
+                        routes.remove(route)
+                continue
+            return True
+
+        # then a regular expression that can be combined with the others
+        for attr in self.indexed_attrs:
+            filt_re = checks.get(attr, (None, None))[1]
+            if filt_re is None or not hasattr(filt_re, 'pattern'):
+                continue
+            # expressions with groups or flags cannot be safely combined
+            if filt_re.groups or filt_re.flags != self._default_flags:
+                continue
+            regexes[attr].add(route, filt_re)
+            return True
+
+        return False
+
+    def getRoutes(self, change):
+        """
+        Return the routes that accept C{change}, in the order they were added.
+        """
+        if self._index is None:
+            self._buildIndex()
+        exact, regexes, unindexed = self._index
+
+        candidates = set(unindexed)
+        for attr in self.indexed_attrs:
+            value = getattr(change, attr, '')
+            try:
+                candidates.update(exact[attr].get(value, ()))
+            except TypeError:
+                # unhashable value, which no exact filter can match
+                pass
+            candidates.update(regexes[attr].candidates(value))
+
+        evaluations = 0
+        accepted = []
+        for route in sorted(candidates, key=lambda r : r.position):
+            if route.change_filter is not None:
+                evaluations += 1
+            try:
+                if route.accepts(change):
+                    accepted.append(route)
+            except:
+                log.err(failure.Failure(),
+                        'while filtering %s for %s' % (change, route.consumer))
+
+        metrics.MetricCountEvent.log("ChangeRouter.changes_routed", 1)
+        metrics.MetricCountEvent.log("ChangeRouter.filter_evaluations",
+                                     evaluations)
+        return accepted
+
+    def routeChanges(self, changes):
+        """
+        Sort C{changes} by route, returning a list of (consumer, changes)
+        tuples for each route that accepts any of them, in the order the
+        routes were added.  The changes for each consumer keep their order.
+        """
+        batches = {}
+        for change in changes:
+            for route in self.getRoutes(change):
+                batches.setdefault(route, []).append(change)
+        return [ (route.consumer, batches[route])
+                 for route in sorted(batches, key=lambda r : r.position) ]
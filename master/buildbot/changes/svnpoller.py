@@ -357,7 +357,8 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
     @defer.inlineCallbacks
     def submit_changes(self, changes):
         for chdict in changes:
-            yield self.master.addChange(src='svn', **chdict)
+            chdict['src'] = 'svn'
+        yield self.master.addChanges(changes)
 
     def finished_ok(self, res):
         if self.cachepath:
@@ -71,6 +71,8 @@ class MasterConfig(object):
         self.mergeRequests = None
         self.codebaseGenerator = None
         self.prioritizeBuilders = None
+        self.batchBuildRequestClaims = False
+        self.builderConcurrency = 1
         self.slavePortnum = None
         self.multiMaster = False
         self.debugPassword = None
@@ -90,6 +92,7 @@ class MasterConfig(object):
         self.caches = dict(
             Builds=15,
             Changes=10,
+            BuildRequests=5000,
         )
         self.schedulers = {}
         self.builders = []
@@ -100,7 +103,8 @@ class MasterConfig(object):
         self.revlink = default_revlink_matcher
 
     _known_config_keys = set([
-        "buildbotURL", "buildCacheSize", "builders", "buildHorizon", "caches",
+        "batchBuildRequestClaims", "buildbotURL", "buildCacheSize",
+        "builderConcurrency", "builders", "buildHorizon", "caches",
         "change_source", "codebaseGenerator", "changeCacheSize", "changeHorizon",
         'db', "db_poll_interval", "db_url", "debugPassword", "eventHorizon",
         "logCompressionLimit", "logCompressionMethod", "logHorizon",
@@ -249,9 +253,9 @@ class MasterConfig(object):
 
         if 'logCompressionMethod' in config_dict:
             logCompressionMethod = config_dict.get('logCompressionMethod')
-            if logCompressionMethod not in ('bz2', 'gz'):
-                errors.addError(
-                        "c['logCompressionMethod'] must be 'bz2' or 'gz'")
+            if logCompressionMethod not in ('bz2', 'gz', 'blocks'):
+                errors.addError("c['logCompressionMethod'] must be 'bz2', "
+                                "'gz', or 'blocks'")
             self.logCompressionMethod = logCompressionMethod
 
         copy_int_param('logMaxSize')
@@ -283,6 +287,14 @@ class MasterConfig(object):
         else:
             self.prioritizeBuilders = prioritizeBuilders
 
+        if 'batchBuildRequestClaims' in config_dict:
+            self.batchBuildRequestClaims = \
+                    config_dict['batchBuildRequestClaims']
+
+        copy_int_param('builderConcurrency')
+        if self.builderConcurrency is None or self.builderConcurrency < 1:
+            errors.addError("c['builderConcurrency'] must be at least 1")
+
         if 'slavePortnum' in config_dict:
             slavePortnum = config_dict.get('slavePortnum')
             if isinstance(slavePortnum, int):
@@ -13,9 +13,10 @@
 #
 # Copyright Buildbot Team Members
 
+import bisect
 import itertools
 import sqlalchemy as sa
-from twisted.internet import reactor
+from twisted.internet import reactor, defer
 from twisted.python import log
 from buildbot.db import base
 from buildbot.util import epoch2datetime, datetime2epoch
@@ -29,6 +30,145 @@ class NotClaimedError(Exception):
 class BrDict(dict):
     pass
 
+class UnclaimedBuildRequestIndex(object):
+    """
+    An in-memory index of the unclaimed, incomplete build requests known to
+    this master, grouped by builder name and ordered by submission time.
+
+    The index is only a hint: the authoritative answer to "is this request
+    still unclaimed?" is the claim itself, which will fail with
+    L{AlreadyClaimedError} for stale entries.  Builders for which the index
+    may be wrong are marked stale, and re-queried on their next use.
+
+    Loads from the database run in a thread, so they can race with updates
+    made in the reactor thread.  While any load is in progress, updates are
+    journaled and then replayed over the loaded snapshot when it arrives.
+
+    The C{generation} counter is incremented by every change to the index, so
+    that results derived from it can tell when they are out of date.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.generation = 0
+        self._brdicts = {} # brid -> brdict
+        self._builders = {} # buildername -> sorted [(submitted_at, brid)]
+        self._stale = set()
+        self._journal = None
+        self._loads = 0
+
+    def isCurrent(self, buildername=None):
+        """Is the index current for C{buildername}, or for every builder if
+        C{buildername} is None?"""
+        if buildername is None:
+            return self.loaded and not self._stale
+        return self.loaded and buildername not in self._stale
+
+    def getBuildRequests(self, buildername):
+        """Return copies of the indexed brdicts for C{buildername}, oldest
+        first"""
+        return [ BrDict(self._brdicts[brid])
+                 for (_, brid) in self._builders.get(buildername, []) ]
+
+    def getCounts(self):
+        """Return a dictionary mapping builder names to a tuple (count,
+        oldest submitted_at) of their indexed requests"""
+        return dict((buildername, (len(keys), keys[0][0]))
+                    for buildername, keys in self._builders.iteritems())
+
+    def getBuildernames(self, brids):
+        return set([ self._brdicts[brid]['buildername']
+                     for brid in brids if brid in self._brdicts ])
+
+    def add(self, brdict):
+        self._log('add', brdict)
+        self._add(brdict)
+        self.generation += 1
+
+    def remove(self, brids):
+        self._log('remove', brids)
+        self._remove(brids)
+        self.generation += 1
+
+    def invalidate(self, buildernames=None):
+        """Mark the given builders, or the whole index if C{buildernames} is
+        None, as needing a reload from the database"""
+        self._log('invalidate', buildernames)
+        self._invalidate(buildernames)
+        self.generation += 1
+
+    def startLoad(self):
+        """Note that a load has begun, returning a token to pass to
+        L{finishLoad}"""
+        if self._journal is None:
+            self._journal = []
+        self._loads += 1
+        return len(self._journal)
+
+    def finishLoad(self, token, brdicts, buildername=None, partial=False):
+        """Apply the results of a load begun with L{startLoad}.  If
+        C{partial} is true, C{brdicts} are simply added to the index.
+        Otherwise, if C{buildername} is None, C{brdicts} is taken to be the
+        complete set of unclaimed requests, or else the complete set for that
+        builder.  Pass None for C{brdicts} if the load failed."""
+        journal = self._journal[token:]
+        self._loads -= 1
+        if not self._loads:
+            self._journal = None
+
+        if brdicts is None:
+            return
+
+        self.generation += 1
+        if partial:
+            pass
+        elif buildername is None:
+            self._brdicts = {}
+            self._builders = {}
+            self._stale = set()
+            self.loaded = True
+        else:
+            self._remove([ brid for (_, brid)
+                           in self._builders.get(buildername, []) ])
+            self._stale.discard(buildername)
+
+        for brdict in brdicts:
+            self._add(BrDict(brdict))
+
+        # replay anything that happened while the load was in progress
+        for op, arg in journal:
+            getattr(self, '_' + op)(arg)
+
+    def _log(self, op, arg):
+        if self._journal is not None:
+            self._journal.append((op, arg))
+
+    def _add(self, brdict):
+        brid = brdict['brid']
+        if brid in self._brdicts:
+            self._remove([brid])
+        self._brdicts[brid] = brdict
+        bisect.insort(self._builders.setdefault(brdict['buildername'], []),
+                      (brdict['submitted_at'], brid))
+
+    def _remove(self, brids):
+        for brid in brids:
+            brdict = self._brdicts.pop(brid, None)
+            if brdict is None:
+                continue
+            buildername = brdict['buildername']
+            keys = self._builders[buildername]
+            key = (brdict['submitted_at'], brid)
+            del keys[bisect.bisect_left(keys, key)]
+            if not keys:
+                del self._builders[buildername]
+
+    def _invalidate(self, buildernames):
+        if buildernames is None:
+            self.loaded = False
+        else:
+            self._stale.update(buildernames)
+
 # private decorator to add a _master_objectid keyword argument, querying from
 # the master
 def with_master_objectid(fn):
@@ -44,6 +184,20 @@ def with_master_objectid(fn):
 class BuildRequestsConnectorComponent(base.DBConnectorComponent):
     # Documentation is in developer/database.rst
 
+    # how long the results of a grouped count query may be re-used, if the
+    # index of unclaimed requests has not changed in the meantime
+    unclaimedCountsMaxAge = 5
+
+    def __init__(self, connector):
+        base.DBConnectorComponent.__init__(self, connector)
+        self.unclaimed = UnclaimedBuildRequestIndex()
+        # Deferreds waiting for an in-progress load of the whole index
+        self._unclaimed_waiters = None
+        # (time, index generation, counts) from the last grouped count query
+        self._unclaimed_counts = None
+        # Deferreds waiting for an in-progress grouped count query
+        self._unclaimed_counts_waiters = None
+
     @with_master_objectid
     def getBuildRequest(self, brid, _master_objectid=None):
         def thd(conn):
@@ -94,7 +248,113 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
             return [ self._brdictFromRow(row, _master_objectid)
                      for row in res.fetchall() ]
-        return self.db.pool.do(thd)
+
+        # any query for unclaimed requests also refreshes the index
+        if claimed is None or claimed or complete:
+            return self.db.pool.do(thd)
+
+        token = self.unclaimed.startLoad()
+        d = self.db.pool.do(thd)
+        def index(brdicts):
+            if bsid is not None:
+                self.unclaimed.finishLoad(token, brdicts, partial=True)
+            else:
+                self.unclaimed.finishLoad(token, brdicts,
+                                          buildername=buildername)
+            return brdicts
+        def index_failed(f):
+            self.unclaimed.finishLoad(token, None)
+            return f
+        d.addCallbacks(index, index_failed)
+        return d
+
+    def getUnclaimedBuildRequests(self, buildername):
+        if self.unclaimed.isCurrent(buildername):
+            return defer.succeed(self.unclaimed.getBuildRequests(buildername))
+
+        if self.unclaimed.loaded:
+            d = self.getBuildRequests(buildername=buildername, claimed=False)
+        else:
+            d = self._loadUnclaimed()
+        d.addCallback(lambda _ :
+                self.unclaimed.getBuildRequests(buildername))
+        return d
+
+    def _loadUnclaimed(self):
+        # load the entire index in one query, no matter how many builders are
+        # asking for it at the same time
+        if self._unclaimed_waiters is not None:
+            d = defer.Deferred()
+            self._unclaimed_waiters.append(d)
+            return d
+
+        self._unclaimed_waiters = []
+        d = self.getBuildRequests(claimed=False)
+        def notify(res):
+            waiters, self._unclaimed_waiters = self._unclaimed_waiters, None
+            for waiter in waiters:
+                waiter.callback(res)
+            return res
+        d.addBoth(notify)
+        return d
+
+    def getUnclaimedBuildRequestCounts(self, _reactor=reactor):
+        if self.unclaimed.isCurrent():
+            return defer.succeed(self.unclaimed.getCounts())
+
+        # otherwise, count the requests for all builders in one query, and
+        # re-use the results briefly, until the index changes
+        generation = self.unclaimed.generation
+        if self._unclaimed_counts is not None:
+            counted_at, counted_generation, counts = self._unclaimed_counts
+            if (counted_generation == generation and
+                _reactor.seconds() - counted_at < self.unclaimedCountsMaxAge):
+                return defer.succeed(dict(counts))
+
+        if self._unclaimed_counts_waiters is not None:
+            d = defer.Deferred()
+            self._unclaimed_counts_waiters.append(d)
+            return d
+
+        def thd(conn):
+            reqs_tbl = self.db.model.buildrequests
+            claims_tbl = self.db.model.buildrequest_claims
+            q = sa.select([ reqs_tbl.c.buildername,
+                            sa.func.count(reqs_tbl.c.id),
+                            sa.func.min(reqs_tbl.c.submitted_at) ],
+                from_obj=[ reqs_tbl.outerjoin(claims_tbl,
+                                    reqs_tbl.c.id == claims_tbl.c.brid) ],
+                whereclause=((claims_tbl.c.claimed_at == None) &
+                             (reqs_tbl.c.complete == 0)),
+                group_by=[ reqs_tbl.c.buildername ])
+            res = conn.execute(q)
+            counts = {}
+            for buildername, count, submitted_at in res.fetchall():
+                if submitted_at:
+                    submitted_at = epoch2datetime(submitted_at)
+                counts[buildername] = (count, submitted_at)
+            res.close()
+            return counts
+
+        self._unclaimed_counts_waiters = []
+        counted_at = _reactor.seconds()
+        d = self.db.pool.do(thd)
+        def keep(counts):
+            # the counts may already be out of date if the index changed
+            # while the query ran
+            if self.unclaimed.generation == generation:
+                self._unclaimed_counts = (counted_at, generation,
+                                          dict(counts))
+            return counts
+        d.addCallback(keep)
+        def notify(res):
+            waiters = self._unclaimed_counts_waiters
+            self._unclaimed_counts_waiters = None
+            for waiter in waiters:
+                waiter.callback(res)
+            return res
+        d.addBoth(notify)
+        return d
 
     @with_master_objectid
     def claimBuildRequests(self, brids, claimed_at=None, _reactor=reactor,
@@ -105,21 +365,100 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
             claimed_at = _reactor.seconds()
 
         def thd(conn):
-            transaction = conn.begin()
+            self._claimThd(conn, brids, claimed_at, _master_objectid)
+
+        d = self.db.pool.do(thd)
+        def index(res):
+            self.unclaimed.remove(brids)
+            return res
+        def index_failed(f):
+            # some of these requests were claimed elsewhere, so the index is
+            # out of date for their builders
+            if f.check(AlreadyClaimedError):
+                self.unclaimed.invalidate(
+                        self.unclaimed.getBuildernames(brids))
+            return f
+        d.addCallbacks(index, index_failed)
+        return d
+
+    @with_master_objectid
+    def claimBuildRequestGroups(self, groups, claimed_at=None,
+                            _reactor=reactor, _master_objectid=None):
+        if claimed_at is not None:
+            claimed_at = datetime2epoch(claimed_at)
+        else:
+            claimed_at = _reactor.seconds()
+
+        def thd(conn):
             tbl = self.db.model.buildrequest_claims
 
+            # find out which of these requests are already claimed, in batches
+            # of 100 as usual
+            claimed = set()
+            iterator = iter(set(itertools.chain(*groups)))
+            while 1:
+                batch = list(itertools.islice(iterator, 100))
+                if not batch:
+                    break
+                res = conn.execute(sa.select([ tbl.c.brid ],
+                                    whereclause=tbl.c.brid.in_(batch)))
+                claimed.update([ row.brid for row in res.fetchall() ])
+
+            won = [ not claimed.intersection(group) for group in groups ]
+            rows = [ dict(brid=id, objectid=_master_objectid,
+                          claimed_at=claimed_at)
+                     for group, ok in zip(groups, won) if ok
+                     for id in group ]
+            if not rows:
+                return won
+
+            # and try to claim the rest in one transaction
+            transaction = conn.begin()
             try:
-                q = tbl.insert()
-                conn.execute(q, [ dict(brid=id, objectid=_master_objectid,
-                                    claimed_at=claimed_at)
-                                  for id in brids ])
+                conn.execute(tbl.insert(), rows)
             except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
                 transaction.rollback()
-                raise AlreadyClaimedError
+            else:
+                transaction.commit()
+                return won
+
+            # another master claimed some of these since we looked, so fall
+            # back to claiming each group on its own
+            for i, group in enumerate(groups):
+                if not won[i]:
+                    continue
+                try:
+                    self._claimThd(conn, group, claimed_at, _master_objectid)
+                except AlreadyClaimedError:
+                    won[i] = False
+            return won
 
-            transaction.commit()
+        d = self.db.pool.do(thd)
+        def index(won):
+            for group, ok in zip(groups, won):
+                if ok:
+                    self.unclaimed.remove(group)
+                else:
+                    self.unclaimed.invalidate(
+                            self.unclaimed.getBuildernames(group))
+            return won
+        d.addCallback(index)
+        return d
 
-        return self.db.pool.do(thd)
+    def _claimThd(self, conn, brids, claimed_at, master_objectid):
+        transaction = conn.begin()
+        tbl = self.db.model.buildrequest_claims
+
+        try:
+            q = tbl.insert()
+            conn.execute(q, [ dict(brid=id, objectid=master_objectid,
+                                claimed_at=claimed_at)
+                              for id in brids ])
+        except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
+            transaction.rollback()
+            raise AlreadyClaimedError
+
+        transaction.commit()
 
     @with_master_objectid
     def reclaimBuildRequests(self, brids, _reactor=reactor,
@@ -176,7 +515,34 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                     raise
 
             transaction.commit()
-        return self.db.pool.do(thd)
+
+            # fetch the now-unclaimed requests, to add them to the index
+            reqs_tbl = self.db.model.buildrequests
+            iterator = iter(brids)
+            unclaimed = []
+            while 1:
+                batch = list(itertools.islice(iterator, 100))
+                if not batch:
+                    break
+                q = sa.select([ reqs_tbl.outerjoin(claims_tbl,
+                                    reqs_tbl.c.id == claims_tbl.c.brid) ],
+                        whereclause=(reqs_tbl.c.id.in_(batch)
+                                    & (claims_tbl.c.claimed_at == None)
+                                    & (reqs_tbl.c.complete == 0)))
+                res = conn.execute(q)
+                unclaimed.extend([ self._brdictFromRow(row, _master_objectid)
+                                   for row in res.fetchall() ])
+            return unclaimed
+
+        token = self.unclaimed.startLoad()
+        d = self.db.pool.do(thd)
+        def index(unclaimed):
+            self.unclaimed.finishLoad(token, unclaimed, partial=True)
+        def index_failed(f):
+            self.unclaimed.finishLoad(token, None)
+            return f
+        d.addCallbacks(index, index_failed)
+        return d
 
     @with_master_objectid
     def completeBuildRequests(self, brids, results, complete_at=None,
@@ -220,7 +586,12 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                     transaction.rollback()
                     raise NotClaimedError
             transaction.commit()
-        return self.db.pool.do(thd)
+        d = self.db.pool.do(thd)
+        def index(res):
+            self.unclaimed.remove(brids)
+            return res
+        d.addCallback(index)
+        return d
 
     def unclaimExpiredRequests(self, old, _reactor=reactor):
         def thd(conn):
@@ -240,6 +611,8 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
             if count != 0:
                 log.msg("unclaimed %d expired buildrequests (over %d seconds "
                         "old)" % (count, old))
+                # we don't know which builders these belonged to
+                self.unclaimed.invalidate()
         d.addCallback(log_nonzero_count)
         return d
 
@@ -33,16 +33,21 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             revision=None, when_timestamp=None, branch=None,
             category=None, revlink='', properties={}, repository='', codebase='',
             project='', uid=None, _reactor=reactor):
-        assert project is not None, "project must be a string, not None"
-        assert repository is not None, "repository must be a string, not None"
-
-        if when_timestamp is None:
-            when_timestamp = epoch2datetime(_reactor.seconds())
+        d = self.addChanges([ dict(author=author, files=files,
+                comments=comments, is_dir=is_dir, revision=revision,
+                when_timestamp=when_timestamp, branch=branch,
+                category=category, revlink=revlink, properties=properties,
+                repository=repository, codebase=codebase, project=project,
+                uid=uid) ], _reactor=_reactor)
+        d.addCallback(lambda changeids : changeids[0])
+        return d
 
-        # verify that source is 'Change' for each property
-        for pv in properties.values():
-            assert pv[1] == 'Change', ("properties must be qualified with"
-                                       "source 'Change'")
+    def addChanges(self, changes, _reactor=reactor):
+        changes = [ self._changeArgs(**ch) for ch in changes ]
+        now = epoch2datetime(_reactor.seconds())
+        for ch in changes:
+            if ch['when_timestamp'] is None:
+                ch['when_timestamp'] = now
 
         def thd(conn):
             # note that in a read-uncommitted database like SQLite this
@@ -54,62 +59,113 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             transaction = conn.begin()
 
             ch_tbl = self.db.model.changes
+            files_tbl = self.db.model.change_files
+            props_tbl = self.db.model.change_properties
 
-            self.check_length(ch_tbl.c.author, author)
-            self.check_length(ch_tbl.c.comments, comments)
-            self.check_length(ch_tbl.c.branch, branch)
-            self.check_length(ch_tbl.c.revision, revision)
-            self.check_length(ch_tbl.c.revlink, revlink)
-            self.check_length(ch_tbl.c.category, category)
-            self.check_length(ch_tbl.c.repository, repository)
-            self.check_length(ch_tbl.c.project, project)
-
-            r = conn.execute(ch_tbl.insert(), dict(
-                author=author,
-                comments=comments,
-                is_dir=is_dir,
-                branch=branch,
-                revision=revision,
-                revlink=revlink,
-                when_timestamp=datetime2epoch(when_timestamp),
-                category=category,
-                repository=repository,
-                codebase=codebase,
-                project=project))
-            changeid = r.inserted_primary_key[0]
-            if files:
-                tbl = self.db.model.change_files
-                for f in files:
-                    self.check_length(tbl.c.filename, f)
-                conn.execute(tbl.insert(), [
-                    dict(changeid=changeid, filename=f)
-                        for f in files
-                    ])
-            if properties:
-                tbl = self.db.model.change_properties
-                inserts = [
-                    dict(changeid=changeid,
+            changeids = []
+            file_rows = []
+            prop_rows = []
+            user_rows = []
+            for ch in changes:
+                for col in ('author', 'comments', 'branch', 'revision',
+                            'revlink', 'category', 'repository', 'project'):
+                    self.check_length(ch_tbl.c[col], ch[col])
+
+                # the changeid is needed for the other tables, so the changes
+                # themselves must be inserted one at a time
+                r = conn.execute(ch_tbl.insert(), dict(
+                    author=ch['author'],
+                    comments=ch['comments'],
+                    is_dir=ch['is_dir'],
+                    branch=ch['branch'],
+                    revision=ch['revision'],
+                    revlink=ch['revlink'],
+                    when_timestamp=datetime2epoch(ch['when_timestamp']),
+                    category=ch['category'],
+                    repository=ch['repository'],
+                    codebase=ch['codebase'],
+                    project=ch['project']))
+                changeid = r.inserted_primary_key[0]
+                changeids.append(changeid)
+
+                for f in ch['files'] or []:
+                    self.check_length(files_tbl.c.filename, f)
+                    file_rows.append(dict(changeid=changeid, filename=f))
+                for k, v in ch['properties'].iteritems():
+                    row = dict(changeid=changeid,
                         property_name=k,
                         property_value=json.dumps(v))
-                    for k,v in properties.iteritems()
-                ]
-                for i in inserts:
-                    self.check_length(tbl.c.property_name,
-                            i['property_name'])
-                    self.check_length(tbl.c.property_value,
-                            i['property_value'])
-
-                conn.execute(tbl.insert(), inserts)
-            if uid:
-                ins = self.db.model.change_users.insert()
-                conn.execute(ins, dict(changeid=changeid, uid=uid))
+                    self.check_length(props_tbl.c.property_name,
+                            row['property_name'])
+                    self.check_length(props_tbl.c.property_value,
+                            row['property_value'])
+                    prop_rows.append(row)
+                if ch['uid']:
+                    user_rows.append(dict(changeid=changeid, uid=ch['uid']))
+
+            if file_rows:
+                conn.execute(files_tbl.insert(), file_rows)
+            if prop_rows:
+                conn.execute(props_tbl.insert(), prop_rows)
+            if user_rows:
+                conn.execute(self.db.model.change_users.insert(), user_rows)
 
             transaction.commit()
 
-            return changeid
+            return changeids
         d = self.db.pool.do(thd)
+
+        def prime_cache(changeids):
+            # the new changes are about to be fetched by whoever added them,
+            # so cache them now rather than reading them back
+            cache = self.getChange.cache
+            for changeid, ch in zip(changeids, changes):
+                cache.add(changeid, self._chdict_from_args(changeid, ch))
+            return changeids
+        d.addCallback(prime_cache)
         return d
 
+    def _changeArgs(self, author=None, files=None, comments=None, is_dir=0,
+            revision=None, when_timestamp=None, branch=None,
+            category=None, revlink='', properties={}, repository='',
+            codebase='', project='', uid=None):
+        assert project is not None, "project must be a string, not None"
+        assert repository is not None, "repository must be a string, not None"
+
+        # verify that source is 'Change' for each property
+        for pv in properties.values():
+            assert pv[1] == 'Change', ("properties must be qualified with"
+                                       "source 'Change'")
+
+        return dict(author=author, files=files, comments=comments,
+                is_dir=is_dir, revision=revision,
+                when_timestamp=when_timestamp, branch=branch,
+                category=category, revlink=revlink, properties=properties,
+                repository=repository, codebase=codebase, project=project,
+                uid=uid)
+
+    def _chdict_from_args(self, changeid, ch):
+        # build the chdict that getChange would return for a change added
+        # with the given arguments, including the round trip through the
+        # database's representations of timestamps and properties
+        return ChDict(
+            changeid=changeid,
+            author=ch['author'],
+            files=list(ch['files'] or []),
+            comments=ch['comments'],
+            is_dir=ch['is_dir'],
+            revision=ch['revision'],
+            when_timestamp=epoch2datetime(
+                datetime2epoch(ch['when_timestamp'])),
+            branch=ch['branch'],
+            category=ch['category'],
+            revlink=ch['revlink'],
+            properties=dict((k, (json.loads(json.dumps(v))[0], 'Change'))
+                            for k, v in ch['properties'].iteritems()),
+            repository=ch['repository'],
+            codebase=ch['codebase'],
+            project=ch['project'])
+
     @base.cached("chdicts")
     def getChange(self, changeid):
         assert changeid >= 0
@@ -126,6 +182,44 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
         d = self.db.pool.do(thd)
         return d
 
+    def getChanges(self, changeids):
+        # changes that are already cached are not fetched again, and the rest
+        # are fetched with a few set-based queries, rather than one set of
+        # queries per change
+        cache = self.getChange.cache
+        chdicts = {}
+        missing = set()
+        for changeid in changeids:
+            chdict = cache.get_cached(changeid)
+            if chdict is None:
+                missing.add(changeid)
+            else:
+                chdicts[changeid] = chdict
+
+        def thd(conn):
+            changes_tbl = self.db.model.changes
+            loaded = {}
+            remaining = sorted(missing)
+            while remaining:
+                batch, remaining = remaining[:100], remaining[100:]
+                q = changes_tbl.select(
+                        whereclause=changes_tbl.c.changeid.in_(batch))
+                rows = conn.execute(q).fetchall()
+                loaded.update(self._chdicts_from_change_rows_thd(conn, rows))
+            return loaded
+
+        if missing:
+            d = self.db.pool.do(thd)
+        else:
+            d = defer.succeed({})
+        def add_to_cache(loaded):
+            for changeid, chdict in loaded.iteritems():
+                cache.add(changeid, chdict)
+            chdicts.update(loaded)
+            return [ chdicts.get(changeid) for changeid in changeids ]
+        d.addCallback(add_to_cache)
+        return d
+
     def getChangeUids(self, changeid):
         assert changeid >= 0
         def thd(conn):
@@ -152,10 +246,7 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
         d = self.db.pool.do(thd)
 
         # then turn those into changes, using the cache
-        def get_changes(changeids):
-            return defer.gatherResults([ self.getChange(changeid)
-                                         for changeid in changeids ])
-        d.addCallback(get_changes)
+        d.addCallback(self.getChanges)
         return d
 
     def getLatestChangeid(self):
@@ -207,10 +298,19 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
     def _chdict_from_change_row_thd(self, conn, ch_row):
         # This method must be run in a db.pool thread, and returns a chdict
         # given a row from the 'changes' table
+        return self._chdicts_from_change_rows_thd(conn,
+                                    [ ch_row ])[ch_row.changeid]
+
+    def _chdicts_from_change_rows_thd(self, conn, ch_rows):
+        # This method must be run in a db.pool thread, and returns a dictionary
+        # of chdicts keyed by changeid, given rows from the 'changes' table.
+        # The files and properties are fetched with one query each.
         change_files_tbl = self.db.model.change_files
         change_properties_tbl = self.db.model.change_properties
 
-        chdict = ChDict(
+        chdicts = {}
+        for ch_row in ch_rows:
+            chdicts[ch_row.changeid] = ChDict(
                 changeid=ch_row.changeid,
                 author=ch_row.author,
                 files=[], # see below
@@ -225,12 +325,15 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                 repository=ch_row.repository,
                 codebase=ch_row.codebase,
                 project=ch_row.project)
+        if not chdicts:
+            return chdicts
+        changeids = chdicts.keys()
 
         query = change_files_tbl.select(
-                whereclause=(change_files_tbl.c.changeid == ch_row.changeid))
+                whereclause=change_files_tbl.c.changeid.in_(changeids))
         rows = conn.execute(query)
         for r in rows:
-            chdict['files'].append(r.filename)
+            chdicts[r.changeid]['files'].append(r.filename)
 
         # and properties must be given without a source, so strip that, but
         # be flexible in case users have used a development version where the
@@ -245,13 +348,13 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             return v, s
 
         query = change_properties_tbl.select(
-                whereclause=(change_properties_tbl.c.changeid == ch_row.changeid))
+                whereclause=change_properties_tbl.c.changeid.in_(changeids))
         rows = conn.execute(query)
         for r in rows:
             try:
                 v, s = split_vs(json.loads(r.property_value))
-                chdict['properties'][r.property_name] = (v,s)
+                chdicts[r.changeid]['properties'][r.property_name] = (v,s)
             except ValueError:
                 pass
 
-        return chdict
+        return chdicts
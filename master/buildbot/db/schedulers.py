@@ -15,37 +15,137 @@
 
 import sqlalchemy as sa
 import sqlalchemy.exc
+from twisted.internet import defer
+from twisted.python import failure
 from buildbot.db import base
 
+class CoalescedOperation(object):
+    """
+    A database operation that is run for a batch of requests at once.  The
+    first request starts the operation right away; requests made while it is
+    running are combined into a single run once it finishes.  C{thd} is called
+    in a database thread with a connection and the list of requests, and
+    returns a list of results, one per request.  C{db} is the
+    L{DBConnector}, whose pool is used.
+    """
+
+    def __init__(self, db, thd):
+        self.db = db
+        self.thd = thd
+        self.queue = []
+        self.running = False
+
+    def request(self, req):
+        d = defer.Deferred()
+        self.queue.append((req, d))
+        if not self.running:
+            self._run()
+        return d
+
+    def _run(self):
+        queue, self.queue = self.queue, []
+        self.running = True
+        d = self.db.pool.do(self.thd, [ req for req, _ in queue ])
+        def done(results):
+            self.running = False
+            if isinstance(results, failure.Failure):
+                for _, waiter in queue:
+                    waiter.errback(results)
+            else:
+                for (_, waiter), result in zip(queue, results):
+                    waiter.callback(result)
+            if self.queue and not self.running:
+                self._run()
+        d.addBoth(done)
+
+
 class SchedulersConnectorComponent(base.DBConnectorComponent):
     # Documentation is in developer/database.rst
 
+    def __init__(self, connector):
+        base.DBConnectorComponent.__init__(self, connector)
+        # when a batch of changes is delivered to many schedulers at once,
+        # their classifications are written in a few transactions, and at
+        # startup their existing classifications are read in a few queries,
+        # rather than one of each per scheduler
+        self._classify = CoalescedOperation(connector,
+                                            self._classifyChanges_thd)
+        self._getClassifications = CoalescedOperation(connector,
+                                            self._getChangeClassifications_thd)
+
     def classifyChanges(self, objectid, classifications):
-        def thd(conn):
+        return self._classify.request((objectid, classifications))
+
+    def _classifyChanges_thd(self, conn, requests):
+        # combine the requests, with later classifications of the same change
+        # taking precedence
+        combined = {}
+        for objectid, classifications in requests:
+            combined.setdefault(objectid, {}).update(classifications)
+
+        tbl = self.db.model.scheduler_changes
+        transaction = conn.begin()
+        try:
+            for objectid, classifications in combined.iteritems():
+                self._writeClassifications_thd(conn, objectid, classifications)
+        except (sqlalchemy.exc.ProgrammingError,
+                sqlalchemy.exc.IntegrityError):
+            # another master inserted some of the same rows in the meantime,
+            # so fall back to inserting or updating one row at a time
+            transaction.rollback()
             transaction = conn.begin()
-            tbl = self.db.model.scheduler_changes
-            ins_q = tbl.insert()
+            for objectid, classifications in combined.iteritems():
+                upd_q = tbl.update(
+                        ((tbl.c.objectid == objectid)
+                        & (tbl.c.changeid == sa.bindparam('wc_changeid'))))
+                for changeid, important in classifications.items():
+                    imp_int = important and 1 or 0
+                    try:
+                        conn.execute(tbl.insert(),
+                                objectid=objectid,
+                                changeid=changeid,
+                                important=imp_int)
+                    except (sqlalchemy.exc.ProgrammingError,
+                            sqlalchemy.exc.IntegrityError):
+                        # insert failed, so try an update
+                        conn.execute(upd_q,
+                                wc_changeid=changeid,
+                                important=imp_int)
+        transaction.commit()
+        return [ None ] * len(requests)
+
+    def _writeClassifications_thd(self, conn, objectid, classifications):
+        tbl = self.db.model.scheduler_changes
+
+        # find which of the changes are already classified, so that they can
+        # be updated and the rest inserted, each with a single statement
+        existing = set()
+        remaining = sorted(classifications)
+        while remaining:
+            batch, remaining = remaining[:100], remaining[100:]
+            q = sa.select([ tbl.c.changeid ],
+                    whereclause=((tbl.c.objectid == objectid)
+                                 & tbl.c.changeid.in_(batch)))
+            existing.update([ r.changeid for r in conn.execute(q) ])
+
+        # convert the 'important' values into integers, since that is the
+        # column type
+        inserts = []
+        updates = []
+        for changeid, important in sorted(classifications.items()):
+            imp_int = important and 1 or 0
+            if changeid in existing:
+                updates.append(dict(wc_changeid=changeid, important=imp_int))
+            else:
+                inserts.append(dict(objectid=objectid, changeid=changeid,
+                                    important=imp_int))
+        if inserts:
+            conn.execute(tbl.insert(), inserts)
+        if updates:
             upd_q = tbl.update(
                     ((tbl.c.objectid == objectid)
                     & (tbl.c.changeid == sa.bindparam('wc_changeid'))))
-            for changeid, important in classifications.items():
-                # convert the 'important' value into an integer, since that
-                # is the column type
-                imp_int = important and 1 or 0
-                try:
-                    conn.execute(ins_q,
-                            objectid=objectid,
-                            changeid=changeid,
-                            important=imp_int)
-                except (sqlalchemy.exc.ProgrammingError,
-                        sqlalchemy.exc.IntegrityError):
-                    # insert failed, so try an update
-                    conn.execute(upd_q,
-                            wc_changeid=changeid,
-                            important=imp_int)
-
-            transaction.commit()
-        return self.db.pool.do(thd)
+            conn.execute(upd_q, updates)
 
     def flushChangeClassifications(self, objectid, less_than=None):
         def thd(conn):
@@ -59,18 +159,33 @@ class SchedulersConnectorComponent(base.DBConnectorComponent):
 
     class Thunk: pass
     def getChangeClassifications(self, objectid, branch=Thunk):
+        if branch is self.Thunk:
+            return self._getClassifications.request(objectid)
         def thd(conn):
             sch_ch_tbl = self.db.model.scheduler_changes
             ch_tbl = self.db.model.changes
 
-            wc = (sch_ch_tbl.c.objectid == objectid)
-            if branch is not self.Thunk:
-                wc = wc & (
-                    (sch_ch_tbl.c.changeid == ch_tbl.c.changeid) &
-                    (ch_tbl.c.branch == branch))
+            wc = ((sch_ch_tbl.c.objectid == objectid) &
+                  (sch_ch_tbl.c.changeid == ch_tbl.c.changeid) &
+                  (ch_tbl.c.branch == branch))
             q = sa.select(
                 [ sch_ch_tbl.c.changeid, sch_ch_tbl.c.important ],
                 whereclause=wc)
             return dict([ (r.changeid, [False,True][r.important])
                           for r in conn.execute(q) ])
         return self.db.pool.do(thd)
+
+    def _getChangeClassifications_thd(self, conn, objectids):
+        sch_ch_tbl = self.db.model.scheduler_changes
+        results = dict((objectid, {}) for objectid in objectids)
+        remaining = sorted(results)
+        while remaining:
+            batch, remaining = remaining[:100], remaining[100:]
+            q = sa.select(
+                [ sch_ch_tbl.c.objectid, sch_ch_tbl.c.changeid,
+                  sch_ch_tbl.c.important ],
+                whereclause=sch_ch_tbl.c.objectid.in_(batch))
+            for r in conn.execute(q):
+                results[r.objectid][r.changeid] = [False,True][r.important]
+        # each request gets its own copy, in case it is modified
+        return [ dict(results[objectid]) for objectid in objectids ]
@@ -320,6 +320,13 @@ class IBuilderStatus(Interface):
         @returns: list of objects via Deferred
         """
 
+    def getPendingBuildRequestCount():
+        """
+        Get the number of unclaimed build requests for this builder.
+
+        @returns: integer via Deferred
+        """
+
     def getCurrentBuilds():
         """Return a list containing an IBuildStatus object for each build
         currently in progress."""
@@ -779,6 +786,18 @@ class IStatusLog(Interface):
 
         To unsubscribe the consumer, use C{producer.stopProducing}."""
 
+    def produceChunks(consumer, channels=[], start=None, end=None,
+                      lastLines=None):
+        """Like C{subscribeConsumer}, but only send the part of the log
+        selected by the other arguments (as for C{getChunks}), and then
+        finish the consumer, even if the log itself is not finished.  Returns
+        a Deferred that fires once the chunks start to be sent; finding the
+        last lines of a log may take several reactor turns."""
+
+    def getTextLength(channels):
+        """Return the number of bytes of text logged so far in the given
+        channels, or None if this is not known."""
+
     # once the log has finished, the following methods make sense. They can
     # be called earlier, but they will only return the contents of the log up
     # to the point at which they were called. You will lose items that are
@@ -804,10 +823,17 @@ class IStatusLog(Interface):
         """Return one big string with the contents of the Log. This merges
         all chunks (including headers) together."""
 
-    def getChunks():
+    def getChunks(channels=[], onlyText=False, start=None, end=None,
+                  lastLines=None):
         """Generate a list of (channel, text) tuples. 'channel' is a number,
         0 for stdout, 1 for stderr, 2 for header. (note that stderr is merged
-        into stdout if PTYs are in use)."""
+        into stdout if PTYs are in use).
+
+        If 'channels' is given, only chunks in those channels are generated.
+        If 'onlyText' is true, just the text of each chunk is generated.
+        'start' and 'end' limit the output to that range of offsets in the
+        text of the selected channels, and 'lastLines' limits it to the last
+        that many lines."""
 
 class IStatusLogConsumer(Interface):
     """I am an object which can be passed to IStatusLog.subscribeConsumer().
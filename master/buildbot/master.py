@@ -27,7 +27,7 @@ import buildbot
 import buildbot.pbmanager
 from buildbot.util import subscription, epoch2datetime
 from buildbot.status.master import Status
-from buildbot.changes import changes
+from buildbot.changes import changes, router
 from buildbot.changes.manager import ChangeManager
 from buildbot import interfaces
 from buildbot.process.builder import BuilderControl
@@ -94,6 +94,7 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # subscription points
         self._change_subs = \
                 subscription.SubscriptionPoint("changes")
+        self._change_router = router.ChangeRouter()
         self._new_buildrequest_subs = \
                 subscription.SubscriptionPoint("buildrequest_additions")
         self._new_buildset_subs = \
@@ -412,7 +413,67 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
         @returns: L{Change} instance via Deferred
         """
-        metrics.MetricCountEvent.log("added_changes", 1)
+        d = self.addChanges([ dict(author=author, who=who, files=files,
+                comments=comments, isdir=isdir, is_dir=is_dir,
+                revision=revision, when=when, when_timestamp=when_timestamp,
+                branch=branch, category=category, revlink=revlink,
+                properties=properties, repository=repository,
+                codebase=codebase, project=project, src=src) ])
+        d.addCallback(lambda added : added[0])
+        return d
+
+    @defer.inlineCallbacks
+    def addChanges(self, changelist):
+        """
+        Add several changes to the buildmaster at once, and act on them.
+
+        Each element of C{changelist} is a dictionary of keyword arguments to
+        L{addChange}.  Each distinct author is looked up only once, all of the
+        changes are added to the database in a single transaction, and
+        subscribers registered with L{subscribeToChangeBatches} are given the
+        whole list in one call.
+
+        @param changelist: the changes to add
+        @type changelist: list of dictionaries
+
+        @returns: list of L{Change} instances via Deferred
+        """
+        if not changelist:
+            defer.returnValue([])
+
+        metrics.MetricCountEvent.log("added_changes", len(changelist))
+
+        chargs = [ self._getChangeArgs(**kwargs) for kwargs in changelist ]
+
+        # create user objects, looking up each author only once
+        uids = yield users.createUserObjects(self,
+                [ (ch['author'], src) for ch, src in chargs if src ])
+        for ch, src in chargs:
+            ch['uid'] = src and uids[(ch['author'], src)] or None
+
+        # add the changes to the database, and convert the changeids to
+        # Change instances
+        changeids = yield self.db.changes.addChanges(
+                [ ch for ch, src in chargs ])
+        chdicts = yield self.db.changes.getChanges(changeids)
+        added = []
+        for chdict in chdicts:
+            change = yield changes.Change.fromChdict(self, chdict)
+            msg = u"added change %s to database" % change
+            log.msg(msg.encode('utf-8', 'replace'))
+            added.append(change)
+
+        # only deliver messages immediately if we're not polling
+        if not self.config.db['db_poll_interval']:
+            self._deliverChanges(added)
+        defer.returnValue(added)
+
+    def _getChangeArgs(self, who=None, files=None, comments=None, author=None,
+            isdir=None, is_dir=None, revision=None, when=None,
+            when_timestamp=None, branch=None, category=None, revlink='',
+            properties={}, repository='', codebase=None, project='', src=None):
+        # translate the arguments to addChange into arguments for
+        # db.changes.addChange, returning them along with the source
 
         # handle translating deprecated names into new names for db.changes
         def handle_deprec(oldname, old, newname, new, default=None,
@@ -459,38 +520,23 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
                 codebase = self.config.codebaseGenerator(chdict)
             else:
                 codebase = ''
-            
-        d = defer.succeed(None)
-        if src:
-            # create user object, returning a corresponding uid
-            d.addCallback(lambda _ : users.createUserObject(self, author, src))
-         
-        # add the Change to the database
-        d.addCallback(lambda uid :
-                          self.db.changes.addChange(author=author, files=files,
-                                          comments=comments, is_dir=is_dir,
-                                          revision=revision,
-                                          when_timestamp=when_timestamp,
-                                          branch=branch, category=category,
-                                          revlink=revlink, properties=properties,
-                                          repository=repository, codebase=codebase,
-                                          project=project, uid=uid))
-
-        # convert the changeid to a Change instance
-        d.addCallback(lambda changeid :
-            self.db.changes.getChange(changeid))
-        d.addCallback(lambda chdict :
-            changes.Change.fromChdict(self, chdict))
-
-        def notify(change):
-            msg = u"added change %s to database" % change
-            log.msg(msg.encode('utf-8', 'replace'))
-            # only deliver messages immediately if we're not polling
-            if not self.config.db['db_poll_interval']:
-                self._change_subs.deliver(change)
-            return change
-        d.addCallback(notify)
-        return d
+
+        return dict(author=author, files=files, comments=comments,
+                    is_dir=is_dir, revision=revision,
+                    when_timestamp=when_timestamp, branch=branch,
+                    category=category, revlink=revlink,
+                    properties=properties, repository=repository,
+                    codebase=codebase, project=project), src
+
+    def _deliverChanges(self, changelist):
+        for change in changelist:
+            self._change_subs.deliver(change)
+        for callback, routed in self._change_router.routeChanges(changelist):
+            try:
+                callback(routed)
+            except:
+                log.err(failure.Failure(),
+                        'while invoking callback %s for changes' % (callback,))
 
     def subscribeToChanges(self, callback):
         """
@@ -501,6 +547,26 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         """
         return self._change_subs.subscribe(callback)
 
+    def subscribeToChangeBatches(self, callback, change_filter=None):
+        """
+        Request that C{callback} be called with each batch of Change objects
+        added to the cluster, as a list.  Changes added together with
+        L{addChanges} are delivered in a single call.
+
+        If C{change_filter} is given, only the changes it accepts are
+        delivered, and C{callback} is not called for a batch with no such
+        changes.  This is much cheaper than filtering in the callback, as the
+        master indexes the filters of all subscriptions so that most of them
+        need not be evaluated for each change.
+
+        Note: this method will go away in 0.9.x
+
+        @param change_filter: filter for the delivered changes
+        @type change_filter: L{buildbot.changes.filter.ChangeFilter} instance
+        @returns: subscription object with an C{unsubscribe} method
+        """
+        return self._change_router.addRoute(change_filter, callback)
+
     def addBuildset(self, **kwargs):
         """
         Add a buildset to the buildmaster and act on it.  Interface is
@@ -510,16 +576,21 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         resulting builds.
         """
         d = self.db.buildsets.addBuildset(**kwargs)
+        @defer.inlineCallbacks
         def notify((bsid,brids)):
             log.msg("added buildset %d to database" % bsid)
             # note that buildset additions are only reported on this master
             self._new_buildset_subs.deliver(bsid=bsid, **kwargs)
             # only deliver messages immediately if we're not polling
             if not self.config.db['db_poll_interval']:
+                # fetch the new requests in one query, which also adds them to
+                # the unclaimed request index used by the builders
+                yield self.db.buildrequests.getBuildRequests(bsid=bsid,
+                                                             claimed=False)
                 for bn, brid in brids.iteritems():
                     self.buildRequestAdded(bsid=bsid, brid=brid,
                                            buildername=bn)
-            return (bsid,brids)
+            defer.returnValue((bsid,brids))
         d.addCallback(notify)
         return d
 
@@ -669,7 +740,7 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
             change = yield changes.Change.fromChdict(self, chdict)
 
-            self._change_subs.deliver(change)
+            self._deliverChanges([ change ])
 
             self._last_processed_change = changeid
             need_setState = True
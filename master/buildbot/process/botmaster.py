@@ -328,6 +328,10 @@ class BuildRequestDistributor(service.Service):
     are still working on the previous build request, then this class will
     correctly re-prioritize invocations of builders' C{maybeStartBuild}
     methods.
+
+    Up to C{builderConcurrency} builders are invoked at once.  A builder is
+    never invoked while a previous invocation is still running, nor while
+    another builder that shares one of its slaves is running.
     """
 
     def __init__(self, botmaster):
@@ -343,11 +347,27 @@ class BuildRequestDistributor(service.Service):
         self.activity_lock = defer.DeferredLock()
         self.active = False
 
+        # per-builder timers measuring time spent in _pending_builders
+        self._queue_timers = {}
+
+        # Deferreds for running invocations, keyed by a tuple of builder
+        # names, and the builder and slave names they have locked
+        self._active_calls = {}
+        self._active_builders = set()
+        self._active_slaves = set()
+
+        # Deferred which fires when the activity loop should look for more
+        # work to do
+        self._wakeup = None
+
     def stopService(self):
         # let the parent stopService succeed between activity; then the loop
-        # will stop calling itself, since self.running is false
+        # will stop calling itself, since self.running is false.  Any builders
+        # still running at that time are allowed to finish.
         d = self.activity_lock.acquire()
         d.addCallback(lambda _ : service.Service.stopService(self))
+        d.addCallback(lambda _ :
+                defer.DeferredList(self._active_calls.values()))
         d.addBoth(lambda _ : self.activity_lock.release())
         return d
 
@@ -377,13 +397,28 @@ class BuildRequestDistributor(service.Service):
             # the lock
             existing_pending = set(self._pending_builders)
 
+            # start measuring how long the new builders wait
+            for bldr_name in new_builders - existing_pending:
+                if bldr_name not in self._queue_timers:
+                    timer = metrics.Timer(
+                        "BuildRequestDistributor.queueWait.%s" % (bldr_name,))
+                    timer.start()
+                    self._queue_timers[bldr_name] = timer
+
             # then sort the new, expanded set of builders
             self._pending_builders = \
                 yield self._sortBuilders(list(existing_pending | new_builders))
 
+            # forget about any that were not sorted (e.g., removed builders)
+            for bldr_name in (set(self._queue_timers)
+                              - set(self._pending_builders)):
+                del self._queue_timers[bldr_name]
+
             # start the activity loop, if we aren't already working on that.
             if not self.active:
                 self._activityLoop()
+            else:
+                self._wake()
         except:
             log.err(Failure(),
                     "while attempting to start builds on %s" % self.name)
@@ -395,16 +430,11 @@ class BuildRequestDistributor(service.Service):
     def _defaultSorter(self, master, builders):
         timer = metrics.Timer("BuildRequestDistributor._defaultSorter()")
         timer.start()
-        # perform an asynchronous schwarzian transform, transforming None
-        # into sys.maxint so that it sorts to the end
-        def xform(bldr):
-            d = defer.maybeDeferred(lambda :
-                    bldr.getOldestRequestTime())
-            d.addCallback(lambda time :
-                (((time is None) and None or time),bldr))
-            return d
-        xformed = yield defer.gatherResults(
-                [ xform(bldr) for bldr in builders ])
+        # get the oldest request time of every builder at once, and perform a
+        # schwarzian transform, leaving None for builders without requests
+        counts = yield master.db.buildrequests.getUnclaimedBuildRequestCounts()
+        xformed = [ (counts.get(bldr.name, (0, None))[1], bldr)
+                    for bldr in builders ]
 
         # sort the transformed list synchronously, comparing None to the end of
         # the list
@@ -459,23 +489,44 @@ class BuildRequestDistributor(service.Service):
         while 1:
             yield self.activity_lock.acquire()
 
-            # lock pending_builders, pop an element from it, and release
+            # lock pending_builders, start as many builders as we can, and
+            # release
             yield self.pending_builders_lock.acquire()
 
             # bail out if we shouldn't keep looping
-            if not self.running or not self._pending_builders:
+            if (not self.running or
+                    not (self._pending_builders or self._active_calls)):
                 self.pending_builders_lock.release()
                 self.activity_lock.release()
                 break
 
-            bldr_name = self._pending_builders.pop(0)
+            if self.master.config.batchBuildRequestClaims:
+                # take all of the pending builders at once
+                if not self._active_calls:
+                    bldr_names = self._pending_builders
+                    self._pending_builders = []
+                    self._startCall(bldr_names, [],
+                            self._callBuildersBatched, bldr_names,
+                            "from batched build start for builders %r"
+                            % (bldr_names,))
+            else:
+                for bldr_name, slavenames in self._takeRunnableBuilders():
+                    self._startCall([ bldr_name ], slavenames,
+                            self._callABuilder, bldr_name,
+                            "from maybeStartBuild for builder '%s'"
+                            % (bldr_name,))
+
+            # wait until one of the running builders finishes, or more builders
+            # are added.  Note that releasing the lock may add more builders
+            # immediately.
+            wakeup = None
+            if self._active_calls:
+                wakeup = self._wakeup = defer.Deferred()
+
             self.pending_builders_lock.release()
 
-            try:
-                yield self._callABuilder(bldr_name)
-            except:
-                log.err(Failure(),
-                        "from maybeStartBuild for builder '%s'" % (bldr_name,))
+            if wakeup:
+                yield wakeup
 
             self.activity_lock.release()
 
@@ -484,6 +535,62 @@ class BuildRequestDistributor(service.Service):
         self.active = False
         self._quiet()
 
+    def _takeRunnableBuilders(self):
+        # remove builders that can run now from _pending_builders, in priority
+        # order, and return a list of (buildername, slavenames) tuples
+        concurrency = self.master.config.builderConcurrency
+        runnable = []
+        blocked = []
+        for bldr_name in self._pending_builders:
+            if len(self._active_calls) + len(runnable) >= concurrency:
+                blocked.append(bldr_name)
+                continue
+
+            bldr = self.botmaster.builders.get(bldr_name)
+            if not bldr:
+                self._queue_timers.pop(bldr_name, None)
+                continue
+
+            slavenames = set()
+            if bldr.config:
+                slavenames = set(bldr.config.slavenames)
+            if (bldr_name in self._active_builders
+                    or slavenames & self._active_slaves):
+                blocked.append(bldr_name)
+                continue
+
+            runnable.append((bldr_name, slavenames))
+            # lock it now, so that the remaining builders see the lock
+            self._active_builders.add(bldr_name)
+            self._active_slaves.update(slavenames)
+
+        self._pending_builders = blocked
+        return runnable
+
+    def _startCall(self, bldr_names, slavenames, fn, arg, errmsg):
+        for bldr_name in bldr_names:
+            timer = self._queue_timers.pop(bldr_name, None)
+            if timer:
+                timer.stop()
+
+        self._active_builders.update(bldr_names)
+        self._active_slaves.update(slavenames)
+
+        key = tuple(bldr_names)
+        d = self._active_calls[key] = defer.maybeDeferred(fn, arg)
+        d.addErrback(log.err, errmsg)
+        def done(_):
+            del self._active_calls[key]
+            self._active_builders.difference_update(bldr_names)
+            self._active_slaves.difference_update(slavenames)
+            self._wake()
+        d.addCallback(done)
+
+    def _wake(self):
+        if self._wakeup:
+            d, self._wakeup = self._wakeup, None
+            d.callback(None)
+
     def _callABuilder(self, bldr_name):
         # get the actual builder object
         bldr = self.botmaster.builders.get(bldr_name)
@@ -494,6 +601,69 @@ class BuildRequestDistributor(service.Service):
         d.addErrback(log.err, 'in maybeStartBuild for %r' % (bldr,))
         return d
 
+    @defer.inlineCallbacks
+    def _callBuildersBatched(self, bldr_names):
+        # plan builds for all of the given builders, in priority order, then
+        # claim all of the requests in a single database operation and start
+        # the builds whose claims succeeded
+        timer = metrics.Timer(
+                'BuildRequestDistributor._callBuildersBatched()')
+        timer.start()
+
+        plans = []
+        retry = set()
+        # each slave gets at most one new build per pass, since planning a
+        # build doesn't make the slave busy
+        reserved_slaves = set()
+        for bldr_name in bldr_names:
+            bldr = self.botmaster.builders.get(bldr_name)
+            if not bldr:
+                continue
+
+            # if a reserved slave would otherwise be available to this builder,
+            # it will need another pass
+            if [ sb for sb in bldr.slaves
+                 if sb.slave in reserved_slaves and sb.isAvailable() ]:
+                retry.add(bldr_name)
+
+            try:
+                plan = yield bldr.planBuilds(reserved_slaves=reserved_slaves)
+            except:
+                log.err(Failure(),
+                        "from planBuilds for builder '%s'" % (bldr_name,))
+                continue
+
+            for slavebuilder, brdicts in plan:
+                reserved_slaves.add(slavebuilder.slave)
+                plans.append((bldr, slavebuilder, brdicts))
+
+        if plans:
+            won = yield self.master.db.buildrequests.claimBuildRequestGroups(
+                    [ [ brdict['brid'] for brdict in brdicts ]
+                      for (_, _, brdicts) in plans ])
+
+            dl = []
+            for (bldr, slavebuilder, brdicts), claimed in zip(plans, won):
+                if claimed:
+                    d = bldr.startClaimedBuild(slavebuilder, brdicts)
+                    d.addErrback(log.err,
+                            'in startClaimedBuild for %r' % (bldr,))
+                    dl.append(d)
+                else:
+                    # try again with a fresh view of the requests
+                    retry.add(bldr.name)
+            yield defer.gatherResults(dl)
+
+        for bldr_name in bldr_names:
+            bldr = self.botmaster.builders.get(bldr_name)
+            if bldr:
+                bldr.updateBigStatus()
+
+        timer.stop()
+
+        if retry:
+            self.maybeStartBuildsOn(retry)
+
     def _quiet(self):
         # shim for tests
         pass # pragma: no cover
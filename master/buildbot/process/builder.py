@@ -116,13 +116,12 @@ class Builder(config.ReconfigurableServiceMixin,
 
         @returns: datetime instance or None, via Deferred
         """
-        unclaimed = yield self.master.db.buildrequests.getBuildRequests(
-                        buildername=self.name, claimed=False)
+        unclaimed = yield self.master.db.buildrequests.\
+                getUnclaimedBuildRequests(self.name)
 
         if unclaimed:
-            unclaimed = [ brd['submitted_at'] for brd in unclaimed ]
-            unclaimed.sort()
-            defer.returnValue(unclaimed[0])
+            # these are sorted by submitted_at, so the first is the oldest
+            defer.returnValue(unclaimed[0]['submitted_at'])
         else:
             defer.returnValue(None)
 
@@ -474,49 +473,25 @@ class Builder(config.ReconfigurableServiceMixin,
             self.updateBigStatus()
             return
 
-        # now, get the available build requests
-        unclaimed_requests = \
-            yield self.master.db.buildrequests.getBuildRequests(
-                    buildername=self.name, claimed=False)
+        # now, get the available build requests; these are sorted by
+        # submitted_at, so the first is the oldest
+        unclaimed_requests = yield self.master.db.buildrequests.\
+                getUnclaimedBuildRequests(self.name)
 
         if not unclaimed_requests:
             self.updateBigStatus()
             return
 
-        # sort by submitted_at, so the first is the oldest
-        unclaimed_requests.sort(key=lambda brd : brd['submitted_at'])
-
         # get the mergeRequests function for later
         mergeRequests_fn = self._getMergeRequestsFn()
 
         # match them up until we're out of options
         while available_slavebuilders and unclaimed_requests:
-            # first, choose a slave (using nextSlave)
-            slavebuilder = yield self._chooseSlave(available_slavebuilders)
-
-            if not slavebuilder:
-                break
-
-            if slavebuilder not in available_slavebuilders:
-                log.msg(("nextSlave chose a nonexistent slave for builder "
-                         "'%s'; cannot start build") % self.name)
-                break
-
-            # then choose a request (using nextBuild)
-            brdict = yield self._chooseBuild(unclaimed_requests)
-
-            if not brdict:
-                break
-
-            if brdict not in unclaimed_requests:
-                log.msg(("nextBuild chose a nonexistent request for builder "
-                         "'%s'; cannot start build") % self.name)
+            match = yield self._matchRequests(available_slavebuilders,
+                                    unclaimed_requests, mergeRequests_fn)
+            if not match:
                 break
-
-            # merge the chosen request with any compatible requests in the
-            # queue
-            brdicts = yield self._mergeRequests(brdict, unclaimed_requests,
-                                    mergeRequests_fn)
+            slavebuilder, brdicts = match
 
             # try to claim the build requests
             brids = [ brdict['brid'] for brdict in brdicts ]
@@ -527,9 +502,8 @@ class Builder(config.ReconfigurableServiceMixin,
                 # re-fetch the now-partially-claimed build requests and keep
                 # trying to match them
                 self._breakBrdictRefloops(unclaimed_requests)
-                unclaimed_requests = \
-                    yield self.master.db.buildrequests.getBuildRequests(
-                            buildername=self.name, claimed=False)
+                unclaimed_requests = yield self.master.db.buildrequests.\
+                        getUnclaimedBuildRequests(self.name)
 
                 # go around the loop again
                 continue
@@ -538,21 +512,7 @@ class Builder(config.ReconfigurableServiceMixin,
             # requests.  Note that if the build fails from here on out (e.g.,
             # because a slave has failed), it will be handled outside of this
             # loop. TODO: test that!
-
-            # _startBuildFor expects BuildRequest objects, so cook some up
-            breqs = yield defer.gatherResults(
-                    [ self._brdictToBuildRequest(brdict)
-                      for brdict in brdicts ])
-
-            build_started = yield self._startBuildFor(slavebuilder, breqs)
-
-            if not build_started:
-                # build was not started, so unclaim the build requests
-                yield self.master.db.buildrequests.unclaimBuildRequests(brids)
-
-                # and try starting builds again.  If we still have a working slave,
-                # then this may re-claim the same buildrequests
-                self.botmaster.maybeStartBuildsForBuilder(self.name)
+            yield self.startClaimedBuild(slavebuilder, brdicts)
 
             # finally, remove the buildrequests and slavebuilder from the
             # respective queues
@@ -565,9 +525,131 @@ class Builder(config.ReconfigurableServiceMixin,
         self.updateBigStatus()
         return
 
+    @defer.inlineCallbacks
+    def planBuilds(self, reserved_slaves=()):
+        """
+        Match available slaves with unclaimed build requests, exactly as
+        L{maybeStartBuild} would, but without claiming the requests or
+        starting any builds.  This is used by the L{BuildRequestDistributor}
+        to claim requests for many builders at once; the caller should claim
+        the requests in each group, and pass the successful groups to
+        L{startClaimedBuild}.
+
+        @param reserved_slaves: L{BuildSlave} instances which should not be
+        considered available, because they have already been promised to
+        another builder
+        @returns: list of (slavebuilder, brdicts) tuples, via Deferred
+        """
+        if not self.running:
+            defer.returnValue([])
+            return
+
+        available_slavebuilders = [ sb for sb in self.slaves
+                                    if sb.isAvailable()
+                                    and sb.slave not in reserved_slaves ]
+        if not available_slavebuilders:
+            defer.returnValue([])
+            return
+
+        unclaimed_requests = yield self.master.db.buildrequests.\
+                getUnclaimedBuildRequests(self.name)
+
+        mergeRequests_fn = self._getMergeRequestsFn()
+
+        plan = []
+        while available_slavebuilders and unclaimed_requests:
+            match = yield self._matchRequests(available_slavebuilders,
+                                    unclaimed_requests, mergeRequests_fn)
+            if not match:
+                break
+            slavebuilder, brdicts = match
+            plan.append(match)
+
+            for brdict in brdicts:
+                unclaimed_requests.remove(brdict)
+            available_slavebuilders.remove(slavebuilder)
+
+        # the BuildRequest objects stay cached in the brdicts, so it's safe to
+        # break the loops for the planned requests, too
+        self._breakBrdictRefloops(unclaimed_requests)
+        for slavebuilder, brdicts in plan:
+            self._breakBrdictRefloops(brdicts)
+        defer.returnValue(plan)
+
+    @defer.inlineCallbacks
+    def startClaimedBuild(self, slavebuilder, brdicts):
+        """
+        Start a build on C{slavebuilder} for the given build requests, which
+        must already be claimed by this master.  If the build cannot be
+        started, the requests are unclaimed again and the builder is
+        re-triggered.
+
+        @param slavebuilder: the slavebuilder to build on
+        @param brdicts: build request dictionaries for the build
+        @returns: boolean indicating whether the build started, via Deferred
+        """
+        # _startBuildFor expects BuildRequest objects, so cook some up
+        breqs = yield defer.gatherResults(
+                [ self._brdictToBuildRequest(brdict)
+                  for brdict in brdicts ])
+
+        build_started = yield self._startBuildFor(slavebuilder, breqs)
+
+        if not build_started:
+            # build was not started, so unclaim the build requests
+            brids = [ brdict['brid'] for brdict in brdicts ]
+            yield self.master.db.buildrequests.unclaimBuildRequests(brids)
+
+            # and try starting builds again.  If we still have a working slave,
+            # then this may re-claim the same buildrequests
+            self.botmaster.maybeStartBuildsForBuilder(self.name)
+
+        defer.returnValue(build_started)
+
     # a few utility functions to make the maybeStartBuild a bit shorter and
     # easier to read
 
+    @defer.inlineCallbacks
+    def _matchRequests(self, available_slavebuilders, unclaimed_requests,
+                       mergeRequests_fn):
+        """
+        Choose a slave and a (merged) set of requests to build on it, using
+        C{nextSlave}, C{nextBuild} and C{mergeRequests}.
+
+        @returns: (slavebuilder, brdicts) or None, via Deferred
+        """
+        # first, choose a slave (using nextSlave)
+        slavebuilder = yield self._chooseSlave(available_slavebuilders)
+
+        if not slavebuilder:
+            defer.returnValue(None)
+            return
+
+        if slavebuilder not in available_slavebuilders:
+            log.msg(("nextSlave chose a nonexistent slave for builder "
+                     "'%s'; cannot start build") % self.name)
+            defer.returnValue(None)
+            return
+
+        # then choose a request (using nextBuild)
+        brdict = yield self._chooseBuild(unclaimed_requests)
+
+        if not brdict:
+            defer.returnValue(None)
+            return
+
+        if brdict not in unclaimed_requests:
+            log.msg(("nextBuild chose a nonexistent request for builder "
+                     "'%s'; cannot start build") % self.name)
+            defer.returnValue(None)
+            return
+
+        # merge the chosen request with any compatible requests in the
+        # queue
+        brdicts = yield self._mergeRequests(brdict, unclaimed_requests,
+                                mergeRequests_fn)
+        defer.returnValue((slavebuilder, brdicts))
+
     def _chooseSlave(self, available_slavebuilders):
         """
         Choose the next slave, using the C{nextSlave} configuration if
@@ -646,11 +728,21 @@ class Builder(config.ReconfigurableServiceMixin,
 
         # gather the mergeable requests
         merged_request_objects = [breq_object]
-        for other_breq_object in unclaimed_request_objects:
-            if (yield defer.maybeDeferred(
-                        lambda : mergeRequests_fn(self, breq_object,
-                                                  other_breq_object))):
-                merged_request_objects.append(other_breq_object)
+        if mergeRequests_fn == Builder._defaultMergeRequestFn:
+            # the default function is an equivalence on merge keys, so a
+            # single pass comparing keys will do
+            merge_key = breq_object.getMergeKey()
+            if merge_key is not None:
+                merged_request_objects.extend(
+                    [ other_breq_object
+                      for other_breq_object in unclaimed_request_objects
+                      if other_breq_object.getMergeKey() == merge_key ])
+        else:
+            for other_breq_object in unclaimed_request_objects:
+                if (yield defer.maybeDeferred(
+                            lambda : mergeRequests_fn(self, breq_object,
+                                                      other_breq_object))):
+                    merged_request_objects.append(other_breq_object)
 
         # convert them back to brdicts and return
         merged_requests = [ br.brdict for br in merged_request_objects ]
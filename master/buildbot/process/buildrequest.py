@@ -186,6 +186,20 @@ class BuildRequest(object):
                 return False
         return True
 
+    def getMergeKey(self):
+        """
+        Return a hashable key summarizing L{canBeMergedWith}: two requests can
+        be merged exactly when their keys are equal.  Requests which cannot be
+        merged with anything return None.
+        """
+        keys = []
+        for c in sorted(self.sources.iterkeys()):
+            key = self.sources[c].getMergeKey()
+            if key is None:
+                return None
+            keys.append(key)
+        return tuple(keys)
+
     def mergeSourceStampsWith(self, others):
         """ Returns one merged sourcestamp for every codebase """
         #get all codebases from all requests
@@ -14,10 +14,10 @@
 # Copyright Buildbot Team Members
 
 import re
+import zlib
 
 from zope.interface import implements
 from twisted.internet import reactor, defer, error
-from twisted.protocols import basic
 from twisted.spread import pb
 from twisted.python import log, components
 from twisted.python.failure import Failure
@@ -42,6 +42,14 @@ class RemoteCommand(pb.Referenceable):
     rc = None
     debug = False
 
+    # slaves at least this new can send updates as lists of (logname, data)
+    # tuples, which carry interleaved output from several logs in order
+    ORDERED_UPDATES_SLAVE_VERSION = "2.17"
+
+    # slaves at least this new can compress their output updates, if their
+    # BuildSlave has compress_updates set
+    COMPRESSED_UPDATES_SLAVE_VERSION = "2.18"
+
     def __init__(self, remote_command, args, ignore_updates=False,
             collectStdout=False, successfulRC=(0,)):
         self.logs = {}
@@ -109,8 +117,16 @@ class RemoteCommand(pb.Referenceable):
         # We will receive remote_update messages as the command runs.
         # We will get a single remote_complete when it finishes.
         # We should fire self.deferred when the command is done.
+        args = self.args
+        if not self.step.slaveVersionIsOlderThan(self.remote_command,
+                                        self.ORDERED_UPDATES_SLAVE_VERSION):
+            args = dict(args, ordered_updates=True)
+            if (self.buildslave.compress_updates and
+                    not self.step.slaveVersionIsOlderThan(self.remote_command,
+                                    self.COMPRESSED_UPDATES_SLAVE_VERSION)):
+                args['compress_updates'] = True
         d = self.remote.callRemote("startCommand", self, self.commandID,
-                                   self.remote_command, self.args)
+                                   self.remote_command, args)
         return d
 
     def _finished(self, failure=None):
@@ -162,16 +178,36 @@ class RemoteCommand(pb.Referenceable):
         I am called by the slave's L{buildbot.slave.bot.SlaveBuilder} so
         I can receive updates from the running remote command.
 
+        Each update is either a dictionary, or (from slaves that were asked
+        for ordered updates) a list of (logname, data) tuples, in the order
+        the output was produced, where the logname is 'stdout', 'stderr',
+        'header', or ('log', name) for a logfile.  Slaves that were asked to
+        compress their updates may send such a list as a dictionary with the
+        single key 'zlib', whose value is a tuple of a list of (logname,
+        length) tuples and the zlib-compressed concatenation of the data.
+
         @type  updates: list of [object, int]
         @param updates: list of updates from the remote command
         """
         self.buildslave.messageReceivedFromSlave()
         max_updatenum = 0
+        raw_bytes = wire_bytes = 0
         for (update, num) in updates:
             #log.msg("update[%d]:" % num)
             try:
+                if isinstance(update, dict) and 'zlib' in update:
+                    wire_bytes += len(update['zlib'][1])
+                    update = self._decompressUpdate(update['zlib'])
+                    raw_bytes += self._outputBytes(update)
+                else:
+                    size = self._outputBytes(update)
+                    raw_bytes += size
+                    wire_bytes += size
                 if self.active and not self.ignore_updates:
-                    self.remoteUpdate(update)
+                    if isinstance(update, list):
+                        self.remoteOrderedUpdate(update)
+                    else:
+                        self.remoteUpdate(update)
             except:
                 # log failure, terminate build, let slave retire the update
                 self._finished(Failure())
@@ -179,8 +215,33 @@ class RemoteCommand(pb.Referenceable):
                 # skip the rest but ack them all
             if num > max_updatenum:
                 max_updatenum = num
+        if raw_bytes:
+            metrics.countSlaveUpdateBytes(self.buildslave.slavename,
+                                          raw_bytes, wire_bytes)
         return max_updatenum
 
+    def _decompressUpdate(self, compressed):
+        pieces, zdata = compressed
+        data = zlib.decompress(zdata)
+        update = []
+        pos = 0
+        for logname, length in pieces:
+            update.append((logname, data[pos:pos+length]))
+            pos += length
+        return update
+
+    def _outputBytes(self, update):
+        # the number of bytes of output in an update
+        if isinstance(update, list):
+            return sum([ len(data) for logname, data in update ])
+        size = 0
+        for key in ('stdout', 'stderr', 'header'):
+            if key in update:
+                size += len(update[key])
+        if 'log' in update:
+            size += len(update['log'][1])
+        return size
+
     def remote_complete(self, failure=None):
         """
         Called by the slave's L{buildbot.slave.bot.SlaveBuilder} to
@@ -225,6 +286,17 @@ class RemoteCommand(pb.Referenceable):
         else:
             log.msg("%s.addToLog: no such log %s" % (self, logname))
 
+    @metrics.countMethod('RemoteCommand.remoteOrderedUpdate()')
+    def remoteOrderedUpdate(self, update):
+        # deliver each piece of output as an update of its own, so that the
+        # logs see it in the order it was produced
+        for logname, data in update:
+            if isinstance(logname, tuple):
+                # ('log', name)
+                self.remoteUpdate({'log' : (logname[1], data)})
+            else:
+                self.remoteUpdate({logname : data})
+
     @metrics.countMethod('RemoteCommand.remoteUpdate()')
     def remoteUpdate(self, update):
         if self.debug:
@@ -305,18 +377,55 @@ class LogObserver:
         pass
 
 
-class LogLineObserver(LogObserver):
+class LineSplitter(object):
+    """
+    Splits a stream of data into lines, returning all of the complete lines
+    in each chunk of data at once.  Lines longer than MAX_LENGTH are dropped.
+    The C{delimiter} and C{MAX_LENGTH} attributes are named as for Twisted's
+    C{LineOnlyReceiver}, which this replaces.
+    """
+
+    delimiter = "\n"
+    MAX_LENGTH = 16384
+
     def __init__(self):
-        self.stdoutParser = basic.LineOnlyReceiver()
-        self.stdoutParser.delimiter = "\n"
-        self.stdoutParser.lineReceived = self.outLineReceived
-        self.stdoutParser.transport = self # for the .disconnecting attribute
-        self.disconnecting = False
+        self.partial = ""
+        self.discarding = False
+
+    def split(self, data):
+        """
+        Return a list of the lines completed by C{data}, not including the
+        delimiters.
+        """
+        if self.partial:
+            data = self.partial + data
+        lines = data.split(self.delimiter)
+        self.partial = lines.pop()
+        if self.discarding and lines:
+            # the rest of a line that was too long
+            del lines[0]
+            self.discarding = False
+        if len(self.partial) > self.MAX_LENGTH:
+            self.partial = ""
+            self.discarding = True
+        # no line can be longer than the data it came from
+        if len(data) > self.MAX_LENGTH:
+            lines = [ l for l in lines if len(l) <= self.MAX_LENGTH ]
+        return lines
+
 
-        self.stderrParser = basic.LineOnlyReceiver()
-        self.stderrParser.delimiter = "\n"
-        self.stderrParser.lineReceived = self.errLineReceived
-        self.stderrParser.transport = self
+class LogLineObserver(LogObserver):
+    """
+    A L{LogObserver} that receives complete lines.  Lines are delivered in
+    batches, with all of the lines completed by each chunk of output, to
+    C{outLinesReceived} and C{errLinesReceived}; by default these call
+    C{outLineReceived} and C{errLineReceived} for each line.  Observers that
+    do much work per line should override the batch methods.
+    """
+
+    def __init__(self):
+        self.stdoutParser = LineSplitter()
+        self.stderrParser = LineSplitter()
 
     def setMaxLineLength(self, max_length):
         """
@@ -328,10 +437,26 @@ class LogLineObserver(LogObserver):
         self.stderrParser.MAX_LENGTH = max_length
 
     def outReceived(self, data):
-        self.stdoutParser.dataReceived(data)
+        lines = self.stdoutParser.split(data)
+        if lines:
+            self.outLinesReceived(lines)
 
     def errReceived(self, data):
-        self.stderrParser.dataReceived(data)
+        lines = self.stderrParser.split(data)
+        if lines:
+            self.errLinesReceived(lines)
+
+    def outLinesReceived(self, lines):
+        """This will be called with a list of complete stdout lines (not
+        including the delimiters)."""
+        for line in lines:
+            self.outLineReceived(line)
+
+    def errLinesReceived(self, lines):
+        """This will be called with a list of complete stderr lines (not
+        including the delimiters)."""
+        for line in lines:
+            self.errLineReceived(line)
 
     def outLineReceived(self, line):
         """This will be called with complete stdout lines (not including the
@@ -707,7 +832,7 @@ class BuildStep(object, properties.PropertiesMixin):
         sv = self.build.getSlaveCommandVersion(command, None)
         if sv is None:
             return True
-        if map(int, sv.split(".")) < map(int, minversion.split(".")):
+        if map(int, str(sv).split(".")) < map(int, minversion.split(".")):
             return True
         return False
 
@@ -83,6 +83,14 @@ def countMethod(counter):
         return wrapper
     return decorator
 
+def countSlaveUpdateBytes(slavename, raw, wire):
+    """
+    Count the bytes of command output received from a buildslave, both before
+    (C{raw}) and after (C{wire}) any compression on the way.
+    """
+    MetricCountEvent.log('SlaveUpdates.%s.raw_bytes' % slavename, raw)
+    MetricCountEvent.log('SlaveUpdates.%s.wire_bytes' % slavename, wire)
+
 class Timer(object):
     # For testing
     _reactor = None
@@ -60,6 +60,26 @@ def createUserObject(master, author, src=None):
             attr_type=usdict['attr_type'],
             attr_data=usdict['attr_data'])
 
+@defer.inlineCallbacks
+def createUserObjects(master, authors):
+    """
+    Like L{createUserObject}, but for a number of (author, src) pairs at once,
+    as for a batch of changes.  Each distinct author is only looked up once.
+
+    @param master: link to Buildmaster for database operations
+    @type master: master.Buildmaster instance
+
+    @param authors: (author, src) pairs
+    @type authors: list of tuples
+
+    @returns: dictionary mapping (author, src) to uid (or None) via Deferred
+    """
+    uids = {}
+    for author, src in authors:
+        if (author, src) not in uids:
+            uids[(author, src)] = yield createUserObject(master, author, src)
+    defer.returnValue(uids)
+
 def getUserContact(master, contact_type=None, uid=None):
     """
     This is a simple getter function that returns a user attribute
@@ -186,7 +186,8 @@ class BaseScheduler(service.MultiService, ComparableMixin):
         Subclasses should call this method from startService to register to
         receive changes.  The BaseScheduler class will take care of filtering
         the changes (using change_filter) and (if fileIsImportant is not None)
-        classifying them.  See L{gotChange}.  Returns a Deferred.
+        classifying them.  See L{gotChange} and L{gotChanges}.  Returns a
+        Deferred.
 
         @param fileIsImportant: a callable provided by the user to distinguish
         important and unimportant changes
@@ -205,37 +206,49 @@ class BaseScheduler(service.MultiService, ComparableMixin):
 
         # register for changes with master
         assert not self._change_subscription
-        def changeCallback(change):
-            # ignore changes delivered while we're not running
-            if not self._change_subscription:
-                return
-
-            if change_filter and not change_filter.filter_change(change):
-                return
+        def classify(change):
+            # return whether the change is important, or None to ignore it;
+            # the master has already applied change_filter
             if change.codebase not in self.codebases:
                 log.msg('change contains codebase %s that is not processed by this scheduler' % change.codebase)
-                return
+                return None
             if fileIsImportant:
                 try:
                     important = fileIsImportant(change)
                     if not important and onlyImportant:
-                        return
+                        return None
                 except:
                     log.err(failure.Failure(),
                             'in fileIsImportant check for %s' % change)
-                    return
+                    return None
             else:
                 important = True
+            return important
+
+        def changesCallback(changes):
+            # ignore changes delivered while we're not running
+            if not self._change_subscription:
+                return
+
+            classified = []
+            for change in changes:
+                important = classify(change)
+                if important is not None:
+                    classified.append((change, important))
+            if not classified:
+                return
 
             # use change_consumption_lock to ensure the service does not stop
-            # while this change is being processed
+            # while these changes are being processed
             d = self._change_consumption_lock.acquire()
-            d.addCallback(lambda _ : self.gotChange(change, important))
+            d.addCallback(lambda _ : self.gotChanges(classified))
             def release(x):
                 self._change_consumption_lock.release()
             d.addBoth(release)
             d.addErrback(log.err, 'while processing change')
-        self._change_subscription = self.master.subscribeToChanges(changeCallback)
+        self._change_subscription = \
+                self.master.subscribeToChangeBatches(changesCallback,
+                        change_filter=change_filter)
 
         return defer.succeed(None)
 
@@ -270,6 +283,25 @@ class BaseScheduler(service.MultiService, ComparableMixin):
         """
         raise NotImplementedError
 
+    @defer.inlineCallbacks
+    def gotChanges(self, changes):
+        """
+        Called when a batch of changes is received, such as the changes
+        from a single poll; returns a Deferred.  Subclasses can override this
+        to handle the whole batch at once.  The default implementation calls
+        L{gotChange} for each change, in order.
+
+        @param changes: the new changes, each with its importance
+        @type changes: list of (L{buildbot.changes.changes.Change},
+        boolean) tuples
+        @returns: Deferred
+        """
+        for change, important in changes:
+            try:
+                yield self.gotChange(change, important)
+            except:
+                log.err(failure.Failure(), 'while processing change')
+
     ## starting bulids
 
     @defer.inlineCallbacks
@@ -105,43 +105,56 @@ class BaseBasicScheduler(base.BaseScheduler):
         d.addCallback(cancel_timers)
         return d
 
-    @util.deferredLocked('_stable_timers_lock')
     def gotChange(self, change, important):
+        return self.gotChanges([ (change, important) ])
+
+    @util.deferredLocked('_stable_timers_lock')
+    @defer.inlineCallbacks
+    def gotChanges(self, changes):
         if not self.treeStableTimer:
             # if there's no treeStableTimer, we can completely ignore
-            # unimportant changes
-            if not important:
-                return defer.succeed(None)
-            # otherwise, we'll build it right away
-            return self.addBuildsetForChanges(reason='scheduler',
-                            changeids=[ change.number ])
-
-        timer_name = self.getTimerNameForChange(change)
-
-        # if we have a treeStableTimer, then record the change's importance
-        # and:
-        # - for an important change, start the timer
-        # - for an unimportant change, reset the timer if it is running
-        d = self.master.db.schedulers.classifyChanges(
-                self.objectid, { change.number : important })
-        def fix_timer(_):
+            # unimportant changes, and build the important ones right away
+            for change, important in changes:
+                if important:
+                    yield self.addBuildsetForChanges(reason='scheduler',
+                                    changeids=[ change.number ])
+            return
+
+        if not changes:
+            return
+
+        # if we have a treeStableTimer, then record the importance of the
+        # whole batch of changes at once, and for each timer:
+        # - if any of its changes are important, start the timer
+        # - otherwise, reset the timer if it is running
+        yield self.master.db.schedulers.classifyChanges(self.objectid,
+                dict([ (change.number, important)
+                       for change, important in changes ]))
+
+        timers = {}
+        for change, important in changes:
+            timer_name = self.getTimerNameForChange(change)
+            timers[timer_name] = timers.get(timer_name, False) or important
+
+        for timer_name, important in timers.iteritems():
             if not important and not self._stable_timers[timer_name]:
-                return
+                continue
             if self._stable_timers[timer_name]:
                 self._stable_timers[timer_name].cancel()
-            def fire_timer():
+            def fire_timer(timer_name=timer_name):
                 d = self.stableTimerFired(timer_name)
                 d.addErrback(log.err, "while firing stable timer")
             self._stable_timers[timer_name] = self._reactor.callLater(
                     self.treeStableTimer, fire_timer)
-        d.addCallback(fix_timer)
-        return d
 
     @defer.inlineCallbacks
     def scanExistingClassifiedChanges(self):
-        # call gotChange for each classified change.  This is called at startup
-        # and is intended to re-start the treeStableTimer for any changes that
-        # had not yet been built when the scheduler was stopped.
+        # handle all classified changes as a single batch.  This is called at
+        # startup and is intended to re-start the treeStableTimer for any
+        # changes that had not yet been built when the scheduler was stopped.
+        # The classifications of all schedulers starting at the same time are
+        # read together, and the changes are fetched with a few set-based
+        # queries, rather than one per change.
 
         # NOTE: this may double-call gotChange for changes that arrive just as
         # the scheduler starts up.  In practice, this doesn't hurt anything.
@@ -149,15 +162,17 @@ class BaseBasicScheduler(base.BaseScheduler):
                 yield self.master.db.schedulers.getChangeClassifications(
                                                                 self.objectid)
 
-        # call gotChange for each change, after first fetching it from the db
-        for changeid, important in classifications.iteritems():
-            chdict = yield self.master.db.changes.getChange(changeid)
+        changeids = sorted(classifications)
+        chdicts = yield self.master.db.changes.getChanges(changeids)
 
+        batch = []
+        for changeid, chdict in zip(changeids, chdicts):
             if not chdict:
                 continue
 
             change = yield changes.Change.fromChdict(self.master, chdict)
-            yield self.gotChange(change, important)
+            batch.append((change, classifications[changeid]))
+        yield self.gotChanges(batch)
 
     def getTimerNameForChange(self, change):
         raise NotImplementedError # see subclasses
@@ -62,6 +62,9 @@ class UpgradeMasterOptions(base.BasedirMixin, base.SubcommandOptions):
     pickle files into it, then move the pickle files out of the way (e.g. to
     changes.pck.old).
 
+    The index of each builder's finished builds, used to search build history
+    without loading every build, is rebuilt from the build pickles.
+
     When upgrading the database, this command uses the database specified in
     the master configuration file.  If you wish to use a database other than
     the default (sqlite), be sure to set that parameter before upgrading.
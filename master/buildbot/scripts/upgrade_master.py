@@ -16,14 +16,18 @@
 from __future__ import with_statement
 
 import os
+import re
 import sys
 import traceback
+from cPickle import load
 from twisted.internet import defer
 from twisted.python import util, runtime
+from twisted.persisted import styles
 from buildbot import config as config_module
 from buildbot import monkeypatches
 from buildbot.db import connector
 from buildbot.master import BuildMaster
+from buildbot.status.buildindex import BuildIndex, BuildIndexEntry
 from buildbot.util import in_reactor
 from buildbot.scripts import base
 
@@ -148,6 +152,32 @@ def upgradeDatabase(config, master_cfg):
     yield db.setup(check_version=False, verbose=not config['quiet'])
     yield db.model.upgrade()
 
+def upgradeBuildIndexes(config, master_cfg):
+    if not config['quiet']:
+        print "rebuilding build history indexes"
+
+    for builder_config in master_cfg.builders:
+        builddir = os.path.join(config['basedir'], builder_config.builddir)
+        if not os.path.isdir(builddir):
+            continue
+
+        entries = []
+        for filename in os.listdir(builddir):
+            if not re.match(r"^\d+$", filename):
+                continue
+            try:
+                with open(os.path.join(builddir, filename), "rb") as f:
+                    build = load(f)
+                styles.doUpgrade()
+                if not build.isFinished():
+                    continue
+                entries.append(BuildIndexEntry.fromBuild(build))
+            except:
+                print "Can't read build %s of builder '%s'; skipping it." % (
+                        filename, builder_config.name)
+
+        BuildIndex(builddir).rewrite(entries)
+
 @in_reactor
 @defer.inlineCallbacks
 def upgradeMaster(config, _noMonkey=False):
@@ -167,6 +197,7 @@ def upgradeMaster(config, _noMonkey=False):
 
     upgradeFiles(config)
     yield upgradeDatabase(config, master_cfg)
+    upgradeBuildIndexes(config, master_cfg)
 
     if not config['quiet']:
         print "upgrade complete"
@@ -114,13 +114,10 @@ class SourceStamp(util.ComparableMixin, styles.Versioned):
         if ssdict['changeids']:
             # sort the changeids in order, oldest to newest
             sorted_changeids = sorted(ssdict['changeids'])
-            def gci(id):
-                d = master.db.changes.getChange(id)
-                d.addCallback(lambda chdict :
-                    Change.fromChdict(master, chdict))
-                return d
-            d = defer.gatherResults([ gci(id)
-                                for id in sorted_changeids ])
+            d = master.db.changes.getChanges(sorted_changeids)
+            d.addCallback(lambda chdicts :
+                defer.gatherResults([ Change.fromChdict(master, chdict)
+                                      for chdict in chdicts ]))
         else:
             d = defer.succeed([])
         def got_changes(changes):
@@ -195,6 +192,21 @@ class SourceStamp(util.ComparableMixin, styles.Versioned):
 
         return False
 
+    def getMergeKey(self):
+        """
+        Return a hashable key summarizing L{canBeMergedWith}: two source
+        stamps can be merged exactly when their keys are equal.  Source stamps
+        which cannot be merged with anything (those with patches) return None.
+        """
+        if self.patch:
+            return None
+        if self.changes:
+            # any two change-based stamps on the same branch are compatible
+            return (self.codebase, self.repository, self.branch,
+                    self.project, True, None)
+        return (self.codebase, self.repository, self.branch,
+                self.project, False, self.revision)
+
     def mergeWith(self, others):
         """Generate a SourceStamp for the merger of me and all the other
         SourceStamps. This is called by a Build when it starts, to figure
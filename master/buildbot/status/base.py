@@ -99,6 +99,37 @@ class StatusReceiverService(StatusReceiverBase, service.Service,
 StatusReceiver = StatusReceiverService
 
 
+class SubscribingStatusReceiver(StatusReceiverService):
+    """
+    A status receiver that subscribes to the status, and to each builder, while
+    it is running.  Subclasses overriding C{builderAdded} or C{builderRemoved}
+    must call up.
+    """
+
+    def __init__(self, status):
+        self.status = status
+        self.watched = []
+
+    def startService(self):
+        StatusReceiverService.startService(self)
+        self.status.subscribe(self)
+
+    def stopService(self):
+        self.status.unsubscribe(self)
+        for w in self.watched:
+            w.unsubscribe(self)
+        self.watched = []
+        return StatusReceiverService.stopService(self)
+
+    def builderAdded(self, builderName, builder):
+        self.watched.append(builder)
+        return self # subscribe to this builder
+
+    def builderRemoved(self, builderName):
+        self.watched = [ w for w in self.watched
+                         if w.getName() != builderName ]
+
+
 class StatusReceiverPerspective(StatusReceiver, pbutil.NewCredPerspective):
     implements(IStatusReceiver)
 
@@ -447,6 +447,9 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
             log.msg("unable to save build %s-#%d" % (self.builder.name,
                                                      self.number))
             log.err()
+            return
+        if self.isFinished():
+            self.builder.getBuildIndex().add(self)
 
     def asDict(self):
         result = {}
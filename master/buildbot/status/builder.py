@@ -26,6 +26,7 @@ from buildbot import interfaces, util
 from buildbot.util.lru import LRUCache
 from buildbot.status.event import Event
 from buildbot.status.build import BuildStatus
+from buildbot.status.buildindex import BuildIndex, BuildIndexEntry
 from buildbot.status.buildrequest import BuildRequestStatus
 
 # user modules expect these symbols to be present here
@@ -61,6 +62,7 @@ class BuilderStatus(styles.Versioned):
     category = None
     currentBigState = "offline" # or idle/waiting/interlocked/building
     basedir = None # filled in by our parent
+    buildIndex = None # created on demand by getBuildIndex
 
     def __init__(self, buildername, category, master):
         self.name = buildername
@@ -89,6 +91,7 @@ class BuilderStatus(styles.Versioned):
         d = styles.Versioned.__getstate__(self)
         d['watchers'] = []
         del d['buildCache']
+        d.pop('buildIndex', None)
         for b in self.currentBuilds:
             b.saveYourself()
             # TODO: push a 'hey, build was interrupted' event
@@ -163,6 +166,12 @@ class BuilderStatus(styles.Versioned):
     def makeBuildFilename(self, number):
         return os.path.join(self.basedir, "%d" % number)
 
+    def getBuildIndex(self):
+        """Return the L{BuildIndex} summarizing this builder's history"""
+        if self.buildIndex is None or self.buildIndex.basedir != self.basedir:
+            self.buildIndex = BuildIndex(self.basedir)
+        return self.buildIndex
+
     def getBuildByNumber(self, number):
         return self.buildCache.get(number)
 
@@ -235,6 +244,8 @@ class BuilderStatus(styles.Versioned):
         if earliest_build == 0:
             return
 
+        self.getBuildIndex().prune(earliest_build)
+
         # skim the directory and delete anything that shouldn't be there anymore
         build_re = re.compile(r"^([0-9]+)$")
         build_log_re = re.compile(r"^([0-9]+)-.*$")
@@ -277,8 +288,7 @@ class BuilderStatus(styles.Versioned):
 
     def getPendingBuildRequestStatuses(self):
         db = self.status.master.db
-        d = db.buildrequests.getBuildRequests(claimed=False,
-                                              buildername=self.name)
+        d = db.buildrequests.getUnclaimedBuildRequests(self.name)
         def make_statuses(brdicts):
             return [BuildRequestStatus(self.name, brdict['brid'],
                                        self.status)
@@ -286,6 +296,12 @@ class BuilderStatus(styles.Versioned):
         d.addCallback(make_statuses)
         return d
 
+    def getPendingBuildRequestCount(self):
+        db = self.status.master.db
+        d = db.buildrequests.getUnclaimedBuildRequestCounts()
+        d.addCallback(lambda counts : counts.get(self.name, (0, None))[0])
+        return d
+
     def getCurrentBuilds(self):
         return self.currentBuilds
 
@@ -321,25 +337,36 @@ class BuilderStatus(styles.Versioned):
                                finished_before=None,
                                max_search=200):
         got = 0
+        index = self.getBuildIndex()
         for Nb in itertools.count(1):
             if Nb > self.nextBuildNumber:
                 break
             if Nb > max_search:
                 break
-            build = self.getBuild(-Nb)
-            if build is None:
-                continue
+            number = self.nextBuildNumber - Nb
             if max_buildnum is not None:
-                if build.getNumber() > max_buildnum:
+                if number > max_buildnum:
+                    continue
+            # filter on the index entry where there is one, so that builds
+            # which do not match are never unpickled
+            build = None
+            entry = index.getEntry(number)
+            if entry is None:
+                build = self.getBuild(number)
+                if build is None:
                     continue
-            if not build.isFinished():
+                entry = BuildIndexEntry.fromBuild(build)
+            if not entry.isFinished():
                 continue
             if finished_before is not None:
-                start, end = build.getTimes()
-                if end >= finished_before:
+                if entry.finished >= finished_before:
                     continue
             if branches:
-                if build.getSourceStamp().branch not in branches:
+                if not entry.matchesBranches(branches):
+                    continue
+            if build is None:
+                build = self.getBuild(number)
+                if build is None:
                     continue
             got += 1
             yield build
@@ -363,7 +390,19 @@ class BuilderStatus(styles.Versioned):
 
         eventIndex = -1
         e = self.getEvent(eventIndex)
+        index = self.getBuildIndex()
         for Nb in range(1, self.nextBuildNumber+1):
+            # consult the index first, so that builds which are filtered out
+            # are never unpickled
+            entry = index.getEntry(self.nextBuildNumber - Nb)
+            if entry is not None:
+                if entry.started < minTime:
+                    break
+                if branches and not entry.matchesBranches(branches):
+                    continue
+                if committers and not [ True for u in entry.blamelist
+                                        if u in committers ]:
+                    continue
             b = self.getBuild(-Nb)
             if not b:
                 # HACK: If this is the first build we are looking at, it is
@@ -372,10 +411,12 @@ class BuilderStatus(styles.Versioned):
                 if Nb == 1:
                     continue
                 break
-            if b.getTimes()[0] < minTime:
-                break
-            if branches and not b.getSourceStamp().branch in branches:
-                continue
+            if entry is None:
+                entry = BuildIndexEntry.fromBuild(b)
+                if entry.started < minTime:
+                    break
+                if branches and not entry.matchesBranches(branches):
+                    continue
             if categories and not b.getBuilder().getCategory() in categories:
                 continue
             if committers and not [True for c in b.getChanges() if c.who in committers]:
@@ -545,9 +586,9 @@ class BuilderStatus(styles.Versioned):
     def asDict_async(self):
         """Just like L{asDict}, but with a nonzero pendingBuilds."""
         result = self.asDict()
-        d = self.getPendingBuildRequestStatuses()
-        def combine(statuses):
-            result['pendingBuilds'] = len(statuses)
+        d = self.getPendingBuildRequestCount()
+        def combine(count):
+            result['pendingBuilds'] = count
             return result
         d.addCallback(combine)
         return d
@@ -0,0 +1,206 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+from twisted.python import log, runtime
+from buildbot.util import json
+
+class BuildIndexEntry(object):
+    """
+    A summary of a finished build, containing just enough information to
+    filter and page through a builder's history without unpickling the
+    L{BuildStatus}.
+
+    @ivar number: build number
+    @ivar started: start time (seconds since epoch)
+    @ivar finished: finish time, or None if the build is not finished
+    @ivar results: build results
+    @ivar branches: list of the branches of the build's source stamps
+    @ivar revisions: list of the revisions of the build's source stamps
+    @ivar slavename: name of the slave the build ran on
+    @ivar blamelist: list of users responsible for the build
+    """
+
+    __slots__ = ('number', 'started', 'finished', 'results', 'branches',
+                 'revisions', 'slavename', 'blamelist')
+
+    def __init__(self, number, started=None, finished=None, results=None,
+                 branches=[], revisions=[], slavename=None, blamelist=[]):
+        self.number = number
+        self.started = started
+        self.finished = finished
+        self.results = results
+        self.branches = list(branches)
+        self.revisions = list(revisions)
+        self.slavename = slavename
+        self.blamelist = list(blamelist)
+
+    @classmethod
+    def fromBuild(cls, build):
+        """
+        Summarize the given L{BuildStatus}.
+        """
+        started, finished = build.getTimes()
+        # builds that have not started yet may not have source stamps
+        sourcestamps = build.sources and build.getSourceStamps() or []
+        return cls(build.getNumber(), started=started, finished=finished,
+                   results=build.getResults(),
+                   branches=[ ss.branch for ss in sourcestamps ],
+                   revisions=[ ss.revision for ss in sourcestamps ],
+                   slavename=build.getSlavename(),
+                   blamelist=build.getResponsibleUsers())
+
+    def asList(self):
+        return [ getattr(self, attr) for attr in self.__slots__ ]
+
+    @classmethod
+    def fromList(cls, values):
+        return cls(*values)
+
+    def isFinished(self):
+        return self.finished is not None
+
+    def matchesBranches(self, branches):
+        """Return true if any of this build's branches is in C{branches}"""
+        for branch in self.branches:
+            if branch in branches:
+                return True
+        return False
+
+    def __repr__(self):
+        return "<BuildIndexEntry #%d>" % (self.number,)
+
+
+class BuildIndex(object):
+    """
+    An append-only index of the finished builds of a single builder, stored
+    in the builder's status directory alongside the build pickles.
+
+    Each line of the file is a JSON list of the attributes of a
+    L{BuildIndexEntry}.  Builds that are saved more than once get more than
+    one line; the last one wins.  The index is a hint: builds without an
+    entry must still be loaded from their pickles.
+
+    Entries for builds below the C{horizon} set by L{prune} are ignored, even
+    if they are still in the file.
+    """
+
+    filename = "build-index"
+
+    # the number of entries below the horizon to leave in the file before
+    # rewriting it
+    pruneThreshold = 100
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+        self.entries = None
+        self.horizon = 0
+        self.stale = 0 # entries below the horizon still in the file
+
+    def _path(self):
+        return os.path.join(self.basedir, self.filename)
+
+    def getEntries(self):
+        """
+        Return a dictionary of all entries, keyed by build number.  The file is
+        read on the first call, and the result is kept up to date after that.
+        """
+        if self.entries is None:
+            self.entries = self._read()
+        return self.entries
+
+    def getEntry(self, number):
+        """Return the entry for build C{number}, or None"""
+        if number < self.horizon:
+            return None
+        return self.getEntries().get(number)
+
+    def add(self, build):
+        """
+        Append an entry for the given (finished) L{BuildStatus} to the index.
+        """
+        entry = BuildIndexEntry.fromBuild(build)
+        try:
+            with open(self._path(), "a") as f:
+                f.write(json.dumps(entry.asList()) + "\n")
+        except:
+            log.msg("unable to update build index in %s" % self.basedir)
+            log.err()
+            return
+        if self.entries is not None:
+            self.entries[entry.number] = entry
+
+    def prune(self, earliest_build):
+        """
+        Forget the entries for builds numbered lower than C{earliest_build}.
+        The file is only rewritten without them once there are
+        C{pruneThreshold} of them, rather than every time a build finishes.
+        """
+        entries = self.getEntries()
+        if self.horizon:
+            # entries below the old horizon are already gone
+            numbers = xrange(self.horizon, earliest_build)
+        else:
+            numbers = [ n for n in entries if n < earliest_build ]
+        for n in numbers:
+            if n in entries:
+                del entries[n]
+                self.stale += 1
+        self.horizon = max(self.horizon, earliest_build)
+        if self.stale >= self.pruneThreshold:
+            self.rewrite(entries.values())
+
+    def rewrite(self, entries):
+        """
+        Replace the contents of the index with the given entries.
+        """
+        filename = self._path()
+        tmpfilename = filename + ".tmp"
+        try:
+            with open(tmpfilename, "w") as f:
+                for entry in sorted(entries, key=lambda e : e.number):
+                    f.write(json.dumps(entry.asList()) + "\n")
+            if runtime.platformType  == 'win32':
+                # windows cannot rename a file on top of an existing one
+                if os.path.exists(filename):
+                    os.unlink(filename)
+            os.rename(tmpfilename, filename)
+        except:
+            log.msg("unable to rewrite build index in %s" % self.basedir)
+            log.err()
+            return
+        self.entries = dict((e.number, e) for e in entries)
+        self.stale = 0
+
+    def _read(self):
+        entries = {}
+        try:
+            f = open(self._path(), "r")
+        except IOError:
+            return entries
+        with f:
+            for line in f:
+                try:
+                    entry = BuildIndexEntry.fromList(json.loads(line))
+                except (ValueError, TypeError):
+                    # most likely a partial write; the build will be loaded
+                    # from its pickle instead
+                    continue
+                if entry.number < self.horizon:
+                    continue
+                entries[entry.number] = entry
+        return entries
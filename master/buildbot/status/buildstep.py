@@ -279,9 +279,11 @@ class BuildStepStatus(styles.Versioned):
             if not loog.isFinished():
                 loog.finish()
             # if log compression is on, and it's a real LogFile,
-            # HTMLLogFiles aren't files
+            # HTMLLogFiles aren't files; logs written with the 'blocks'
+            # compression method have no uncompressed file at all
             if logCompressionLimit is not False and \
-                    isinstance(loog, LogFile):
+                    isinstance(loog, LogFile) and \
+                    os.path.exists(loog.getFilename()):
                 if os.path.getsize(loog.getFilename()) > logCompressionLimit:
                     loog_deferred = loog.compressLog()
                     if loog_deferred:
@@ -0,0 +1,168 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import itertools
+import random
+from collections import deque
+from twisted.internet import defer, reactor
+from buildbot import util
+from buildbot.status import base
+from buildbot.util.eventual import eventually
+
+class StatusEventLog(base.StatusReceiverBase):
+    """
+    Numbers the status events of the master and keeps the most recent
+    C{maxEvents} of them, so that clients can ask for the events after a
+    sequence number rather than re-reading the whole status.
+
+    Each event is a small dictionary with the C{sequence} number, the C{event}
+    name, the C{time}, and just enough information (builder name, build
+    number, step name, and so on) to identify the status objects involved.
+    Clients that want more detail can fetch those objects.
+
+    The sequence numbers start again from one when the master restarts, so
+    each run of the master has its own random C{epoch}, and a sequence number
+    only means something together with the epoch it came from.  A client
+    asking for events from another epoch must re-read the status, as must one
+    asking for events that have already been discarded.
+    """
+
+    maxEvents = 1000
+
+    _reactor = reactor # for tests
+
+    def __init__(self):
+        self.epoch = '%08x' % random.getrandbits(32)
+        self.sequence = 0
+        self.events = deque()
+        self.waiters = {} # Deferred -> timeout IDelayedCall
+        self._notifyPending = False
+
+    def addEvent(self, event, **info):
+        self.sequence += 1
+        info['sequence'] = self.sequence
+        info['event'] = event
+        info['time'] = util.now(self._reactor)
+        self.events.append(info)
+        if len(self.events) > self.maxEvents:
+            self.events.popleft()
+        # a burst of events (say, a step finishing and the next starting)
+        # wakes the waiters only once
+        if self.waiters and not self._notifyPending:
+            self._notifyPending = True
+            eventually(self._notifyWaiters)
+
+    def getEvents(self, epoch, since):
+        """
+        Return a tuple (complete, events) giving the events after sequence
+        number C{since} of C{epoch}, oldest first.  If some of those events are
+        no longer available, or C{epoch} is not the current epoch, then
+        C{complete} is False and C{events} is empty.
+        """
+        if epoch != self.epoch or since > self.sequence:
+            return False, []
+        if since == self.sequence:
+            return True, []
+        first = self.events[0]['sequence']
+        if since < first - 1:
+            return False, []
+        return True, list(itertools.islice(self.events, since - first + 1,
+                                           None))
+
+    def waitForEvents(self, epoch, since, timeout):
+        """
+        Return a Deferred that fires (with None) as soon as there are events
+        after sequence number C{since} of C{epoch}, or after C{timeout}
+        seconds, whichever comes first.  Pass the Deferred to C{stopWaiting}
+        to abandon it.
+        """
+        d = defer.Deferred()
+        if (epoch != self.epoch or since != self.sequence
+                or timeout <= 0):
+            d.callback(None)
+            return d
+        self.waiters[d] = self._reactor.callLater(timeout,
+                                                  self._timeoutWaiter, d)
+        return d
+
+    def stopWaiting(self, d):
+        """Forget a Deferred from C{waitForEvents}, without firing it."""
+        timer = self.waiters.pop(d, None)
+        if timer is not None and timer.active():
+            timer.cancel()
+
+    def _timeoutWaiter(self, d):
+        if self.waiters.pop(d, None) is not None:
+            d.callback(None)
+
+    def _notifyWaiters(self):
+        self._notifyPending = False
+        waiters, self.waiters = self.waiters, {}
+        for d, timer in waiters.iteritems():
+            if timer.active():
+                timer.cancel()
+            d.callback(None)
+
+    # status events
+
+    def builderAdded(self, builderName, builder):
+        self.addEvent('builderAdded', builderName=builderName)
+        return self # subscribe to this builder
+
+    def builderRemoved(self, builderName):
+        self.addEvent('builderRemoved', builderName=builderName)
+
+    def builderChangedState(self, builderName, state):
+        self.addEvent('builderChangedState', builderName=builderName,
+                      state=state)
+
+    def buildStarted(self, builderName, build):
+        self.addEvent('buildStarted', builderName=builderName,
+                      number=build.getNumber())
+        return self # subscribe to this build's steps
+
+    def stepStarted(self, build, step):
+        self.addEvent('stepStarted',
+                      builderName=build.getBuilder().getName(),
+                      number=build.getNumber(), step=step.getName())
+
+    def stepFinished(self, build, step, results):
+        self.addEvent('stepFinished',
+                      builderName=build.getBuilder().getName(),
+                      number=build.getNumber(), step=step.getName(),
+                      results=results[0])
+
+    def buildFinished(self, builderName, build, results):
+        self.addEvent('buildFinished', builderName=builderName,
+                      number=build.getNumber(), results=results)
+
+    def buildsetSubmitted(self, buildset):
+        self.addEvent('buildsetSubmitted', bsid=buildset.getID())
+
+    def requestSubmitted(self, request):
+        self.addEvent('requestSubmitted',
+                      builderName=request.getBuilderName())
+
+    def requestCancelled(self, builder, request):
+        self.addEvent('requestCancelled', builderName=builder.getName())
+
+    def changeAdded(self, change):
+        self.addEvent('changeAdded', number=change.number)
+
+    def slaveConnected(self, slaveName):
+        self.addEvent('slaveConnected', slaveName=slaveName)
+
+    def slaveDisconnected(self, slaveName):
+        self.addEvent('slaveDisconnected', slaveName=slaveName)
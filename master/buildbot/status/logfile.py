@@ -14,14 +14,15 @@
 # Copyright Buildbot Team Members
 
 import os
+from collections import deque
 from cStringIO import StringIO
 from bz2 import BZ2File
 from gzip import GzipFile
 
 from zope.interface import implements
 from twisted.python import log, runtime
-from twisted.internet import defer, threads, reactor
-from buildbot.util import netstrings
+from twisted.internet import defer, threads, reactor, task
+from buildbot.util import netstrings, blockfile
 from buildbot.util.eventual import eventually
 from buildbot import interfaces
 
@@ -73,16 +74,23 @@ class LogFileProducer:
     except that writeChunk() takes chunks (tuples of (channel,text)) instead
     of the normal write() which takes just text. The LogFileConsumer is
     allowed to call stopProducing, pauseProducing, and resumeProducing on the
-    producer instance it is given. """
+    producer instance it is given.
+
+    If C{chunks} is given, the producer sends just those chunks (typically
+    part of the log, from L{LogFile.getChunks}) and then finishes, without
+    following the log. """
 
     paused = False
     subscribed = False
     BUFFERSIZE = 2048
 
-    def __init__(self, logfile, consumer):
+    def __init__(self, logfile, consumer, chunks=None):
         self.logfile = logfile
         self.consumer = consumer
-        self.chunkGenerator = self.getChunks()
+        if chunks is None:
+            self.chunkGenerator = self.getChunks()
+        else:
+            self.chunkGenerator = self.getPartChunks(chunks)
         consumer.registerProducer(self, True)
 
     def getChunks(self):
@@ -120,6 +128,12 @@ class LogFileProducer:
         # during the yield.
         d.addCallback(self.logfileFinished)
 
+    def getPartChunks(self, chunks):
+        for chunk in chunks:
+            yield chunk
+        # this part of the log is complete, even if the log itself is not
+        self.logfileFinished(self.logfile)
+
     def stopProducing(self):
         # TODO: should we still call consumer.finish? probably not.
         self.paused = True
@@ -174,6 +188,75 @@ class LogFileProducer:
             self.consumer.finish()
             self.consumer = None
 
+class TailBuffer(object):
+    """
+    The last C{size} bytes of a truncated log, kept in a fixed-size ring
+    buffer along with the channel of each run of bytes.  Adding text, and
+    evicting the oldest text to make room for it, takes time proportional to
+    the length of the text, no matter how many chunks are buffered.  The
+    number of evicted bytes is counted in C{dropped}.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.buffer = bytearray(size)
+        self.start = 0 # offset of the oldest byte in the buffer
+        self.length = 0
+        self.runs = deque() # [channel, length] of each run, oldest first
+        self.dropped = 0
+
+    def append(self, channel, text):
+        n = len(text)
+        if n > self.size:
+            self.dropped += n - self.size
+            text = text[-self.size:]
+            n = self.size
+        excess = self.length + n - self.size
+        if excess > 0:
+            self._evict(excess)
+
+        # copy the text in after the newest byte, wrapping around the end
+        end = (self.start + self.length) % self.size
+        first = min(n, self.size - end)
+        self.buffer[end:end+first] = text[:first]
+        if first < n:
+            self.buffer[:n-first] = text[first:]
+        self.length += n
+
+        if self.runs and self.runs[-1][0] == channel:
+            self.runs[-1][1] += n
+        else:
+            self.runs.append([channel, n])
+
+    def _evict(self, n):
+        self.dropped += n
+        self.start = (self.start + n) % self.size
+        self.length -= n
+        while n:
+            run = self.runs[0]
+            if run[1] > n:
+                run[1] -= n
+                break
+            n -= run[1]
+            self.runs.popleft()
+
+    def getEntries(self):
+        """
+        Return the buffered text as a list of (channel, text) tuples.
+        """
+        end = self.start + self.length
+        if end <= self.size:
+            data = str(self.buffer[self.start:end])
+        else:
+            data = str(self.buffer[self.start:]) + \
+                   str(self.buffer[:end-self.size])
+        entries = []
+        pos = 0
+        for channel, n in self.runs:
+            entries.append((channel, data[pos:pos+n]))
+            pos += n
+        return entries
+
 class LogFile:
     """
     A LogFile keeps all of its contents on disk, in a non-pickle format to
@@ -184,6 +267,13 @@ class LogFile:
 
     @ivar length: length of the data in the logfile (sum of chunk sizes; not
     the length of the on-disk encoding)
+
+    @ivar chunkIndex: a sparse index of the on-disk chunks, used to begin
+    reading part-way through the file.  Every C{chunkIndexInterval}th chunk
+    gets an entry (offset, channel, lengths, lines), giving the chunk's offset
+    in the (uncompressed) file, its channel, and dictionaries of the text
+    length and the number of newlines in each channel before that chunk.
+    This is None for logs written by older versions.
     """
 
     implements(interfaces.IStatusLog, interfaces.ILogFile)
@@ -191,7 +281,7 @@ class LogFile:
     finished = False
     length = 0
     nonHeaderLength = 0
-    tailLength = 0
+    droppedBytes = 0 # output lost to truncation, beyond what the tail kept
     chunkSize = 10*1000
     runLength = 0
     # No max size by default
@@ -199,6 +289,9 @@ class LogFile:
     logMaxTailSize = None
     maxLengthExceeded = False
     runEntries = [] # provided so old pickled builds will getChunks() ok
+    chunkIndex = None # likewise, old pickled builds have no index
+    chunkIndexInterval = 100
+    compressionBlockSize = 1024*1024 # for the 'blocks' compression method
     entries = None
     BUFFERSIZE = 2048
     filename = None # relative to the Builder's basedir
@@ -227,11 +320,20 @@ class LogFile:
         dirname = os.path.dirname(fn)
         if not os.path.exists(dirname):
             os.makedirs(dirname)
-        self.openfile = open(fn, "w+")
+        if self.master.config.logCompressionMethod == "blocks":
+            # compress the log as it is written, rather than when it finishes
+            self.openfile = blockfile.BlockFile(fn + ".blocks", "w",
+                    blockSize=self.compressionBlockSize, threaded=True)
+        else:
+            self.openfile = open(fn, "w+")
         self.runEntries = []
+        self.chunkIndex = []
+        self.chunkCount = 0
+        self.channelLengths = {}
+        self.channelLines = {}
         self.watchers = []
         self.finishedWatchers = []
-        self.tailBuffer = []
+        self.tailBuffer = None # a TailBuffer, once the log is truncated
 
     def getFilename(self):
         """
@@ -252,6 +354,7 @@ class LogFile:
         """
         return os.path.exists(self.getFilename() + '.bz2') or \
             os.path.exists(self.getFilename() + '.gz') or \
+            os.path.exists(self.getFilename() + '.blocks') or \
             os.path.exists(self.getFilename())
 
     def getName(self):
@@ -315,6 +418,10 @@ class LogFile:
             return GzipFile(self.getFilename() + ".gz", "r")
         except IOError:
             pass
+        try:
+            return blockfile.BlockFile(self.getFilename() + ".blocks", "r")
+        except IOError:
+            pass
         return open(self.getFilename(), "r")
 
     def getText(self):
@@ -324,7 +431,20 @@ class LogFile:
     def getTextWithHeaders(self):
         return "".join(self.getChunks(onlyText=True))
 
-    def getChunks(self, channels=[], onlyText=False):
+    def getChunks(self, channels=[], onlyText=False, start=None, end=None,
+                  lastLines=None):
+        """
+        Generate the chunks in this log, optionally limited to some channels
+        and to part of the log's text.
+
+        @param channels: channels to include, or all channels if empty
+        @param onlyText: if true, generate text instead of (channel, text)
+        @param start: offset of the first character to include, counting only
+            the text in C{channels}
+        @param end: offset just after the last character to include
+        @param lastLines: if given, include only this many lines at the end of
+            the (selected part of the) log
+        """
         # generate chunks for everything that was logged at the time we were
         # first called, so remember how long the file was when we started.
         # Don't read beyond that point. The current contents of
@@ -338,12 +458,12 @@ class LogFile:
         # yield() calls.
 
         f = self.getFile()
+        offset, position = self._findChunkOffset(channels, start, end,
+                                                 lastLines)
         if not self.finished:
-            offset = 0
             f.seek(0, 2)
-            remaining = f.tell()
+            remaining = f.tell() - offset
         else:
-            offset = 0
             remaining = None
 
         leftover = None
@@ -354,11 +474,46 @@ class LogFile:
 
         # freeze the state of the LogFile by passing a lot of parameters into
         # a generator
-        return self._generateChunks(f, offset, remaining, leftover,
-                                    channels, onlyText)
+        chunks = self._generateChunks(f, offset, remaining, leftover,
+                                      channels, position, start, end)
+        if lastLines is not None:
+            tail = _LastLines(lastLines)
+            for chunk in chunks:
+                tail.add(chunk)
+            chunks = iter(tail.getChunks())
+        if onlyText:
+            chunks = (text for channel, text in chunks)
+        return chunks
+
+    def _findChunkOffset(self, channels, start, end, lastLines):
+        # use the chunk index to find the file offset at which to begin
+        # reading, and the position (in the selected channels' text) of that
+        # offset; without an index, everything is read from the beginning
+        if not self.chunkIndex:
+            return 0, 0
+        def selected(counts):
+            if not channels:
+                return sum(counts.itervalues())
+            return sum([ counts.get(c, 0) for c in channels ])
+
+        best = self.chunkIndex[0]
+        if start is not None:
+            for entry in self.chunkIndex:
+                if selected(entry[2]) > start:
+                    break
+                best = entry
+        elif lastLines is not None and end is None:
+            # start from the last entry with more than lastLines newlines after
+            # it, so that even a partial last line is covered
+            total = selected(self.channelLines)
+            for entry in self.chunkIndex:
+                if total - selected(entry[3]) <= lastLines:
+                    break
+                best = entry
+        return best[0], selected(best[2])
 
     def _generateChunks(self, f, offset, remaining, leftover,
-                        channels, onlyText):
+                        channels, position=0, start=None, end=None):
         chunks = []
         p = LogFileScanner(chunks.append, channels)
         f.seek(offset)
@@ -368,15 +523,28 @@ class LogFile:
         else:
             data = f.read(self.BUFFERSIZE)
 
+        def trim(text):
+            # return the part of text (which begins at position) that is
+            # between start and end
+            lo = 0
+            hi = len(text)
+            if start is not None and start > position:
+                lo = start - position
+            if end is not None and end < position + hi:
+                hi = max(end - position, 0)
+            return text[lo:hi]
+
         offset = f.tell()
         while data:
             p.dataReceived(data)
             while chunks:
                 channel, text = chunks.pop(0)
-                if onlyText:
-                    yield text
-                else:
-                    yield (channel, text)
+                if end is not None and position >= end:
+                    return
+                trimmed = trim(text)
+                position += len(text)
+                if trimmed:
+                    yield (channel, trimmed)
             f.seek(offset)
             if remaining is not None:
                 data = f.read(min(remaining, self.BUFFERSIZE))
@@ -387,10 +555,11 @@ class LogFile:
         del f
 
         if leftover:
-            if onlyText:
-                yield leftover[1]
-            else:
-                yield leftover
+            if end is not None and position >= end:
+                return
+            trimmed = trim(leftover[1])
+            if trimmed:
+                yield (leftover[0], trimmed)
 
     def readlines(self):
         """Return an iterator that produces newline-terminated lines,
@@ -417,6 +586,44 @@ class LogFile:
         p = LogFileProducer(self, consumer)
         p.resumeProducing()
 
+    def produceChunks(self, consumer, channels=[], start=None, end=None,
+                      lastLines=None):
+        """
+        Like L{subscribeConsumer}, but send only the chunks selected by the
+        arguments, as for L{getChunks}, and finish the consumer after that
+        instead of following the log.
+
+        @returns: Deferred that fires when the chunks start to be sent
+        """
+        chunks = self.getChunks(channels, start=start, end=end)
+        if lastLines is not None:
+            # the last lines are only known once everything before them (all
+            # of the log, without a chunk index) has been read, so read it a
+            # chunk at a time, letting the reactor run in between
+            tail = _LastLines(lastLines)
+            d = task.coiterate(tail.add(chunk) for chunk in chunks)
+            d.addCallback(lambda _ : iter(tail.getChunks()))
+        else:
+            d = defer.succeed(chunks)
+        def produce(chunks):
+            p = LogFileProducer(self, consumer, chunks)
+            p.resumeProducing()
+        d.addCallback(produce)
+        return d
+
+    def getTextLength(self, channels):
+        """
+        Return the number of bytes of text in C{channels} logged so far, which
+        is the offset just past the end of the text for L{getChunks}, or None
+        if this log was written by an older version that did not count it.
+        """
+        if self.chunkIndex is None:
+            return None
+        length = sum([ self.channelLengths.get(c, 0) for c in channels ])
+        if self.runEntries and self.runEntries[0][0] in channels:
+            length += self.runLength
+        return length
+
     # interface used by the build steps to add things to the log
 
     def _merge(self):
@@ -432,10 +639,20 @@ class LogFile:
         offset = 0
         while offset < len(text):
             size = min(len(text)-offset, self.chunkSize)
+            piece = text[offset:offset+size]
+            if self.chunkCount % self.chunkIndexInterval == 0:
+                self.chunkIndex.append((f.tell(), channel,
+                                        self.channelLengths.copy(),
+                                        self.channelLines.copy()))
             f.write("%d:%d" % (1 + size, channel))
-            f.write(text[offset:offset+size])
+            f.write(piece)
             f.write(",")
             offset += size
+            self.chunkCount += 1
+            self.channelLengths[channel] = \
+                    self.channelLengths.get(channel, 0) + size
+            self.channelLines[channel] = \
+                    self.channelLines.get(channel, 0) + piece.count("\n")
         self.runEntries = []
         self.runLength = 0
 
@@ -488,15 +705,11 @@ class LogFile:
 
                     # and track the tail of the text
                     if logMaxTailSize and text:
-                        # Update the tail buffer
-                        self.tailBuffer.append((channel, text))
-                        self.tailLength += len(text)
-                        while self.tailLength > logMaxTailSize:
-                            # Drop some stuff off the beginning of the buffer
-                            c,t = self.tailBuffer.pop(0)
-                            n = len(t)
-                            self.tailLength -= n
-                            assert self.tailLength >= 0
+                        if self.tailBuffer is None:
+                            self.tailBuffer = TailBuffer(logMaxTailSize)
+                        self.tailBuffer.append(channel, text)
+                    else:
+                        self.droppedBytes += len(text)
                     return
 
         # we only add to .runEntries here. _merge() is responsible for adding
@@ -541,22 +754,41 @@ class LogFile:
         """
         self._merge()
         if self.tailBuffer:
-            msg = "\nFinal %i bytes follow below:\n" % self.tailLength
+            tail = self.tailBuffer
+            msg = "\nFinal %i bytes follow below:\n" % tail.length
             tmp = self.runEntries
             self.runEntries = [(HEADER, msg)]
             self._merge()
-            self.runEntries = self.tailBuffer
-            self._merge()
+            # each run keeps its own channel
+            for entry in tail.getEntries():
+                self.runEntries = [entry]
+                self._merge()
             self.runEntries = tmp
             self._merge()
-            self.tailBuffer = []
+            self.droppedBytes += tail.dropped
+            self.tailBuffer = None
+        if self.droppedBytes:
+            # summed over all of the step's logs
+            self.step.setStatistic('log_bytes_dropped',
+                    self.step.getStatistic('log_bytes_dropped', 0)
+                    + self.droppedBytes)
 
         if self.openfile:
             # we don't do an explicit close, because there might be readers
             # shareing the filehandle. As soon as they stop reading, the
             # filehandle will be released and automatically closed.
-            self.openfile.flush()
-            self.openfile = None
+            if isinstance(self.openfile, blockfile.BlockFile):
+                # keep reading from it until the last blocks are compressed
+                openfile = self.openfile
+                d = openfile.finish()
+                def finished(_):
+                    if self.openfile is openfile:
+                        self.openfile = None
+                d.addCallback(finished)
+                d.addErrback(log.err, "while finishing %s" % openfile.filename)
+            else:
+                self.openfile.flush()
+                self.openfile = None
         self.finished = True
         watchers = self.finishedWatchers
         self.finishedWatchers = []
@@ -572,6 +804,10 @@ class LogFile:
             compressed = self.getFilename() + ".bz2.tmp"
         elif logCompressionMethod == "gz":
             compressed = self.getFilename() + ".gz.tmp"
+        elif logCompressionMethod == "blocks":
+            # this is only needed for logs that were not written as blocks
+            # in the first place
+            compressed = self.getFilename() + ".blocks.tmp"
         else:
             return defer.succeed(None)
 
@@ -581,6 +817,9 @@ class LogFile:
                 cf = BZ2File(compressed, 'w')
             elif logCompressionMethod == "gz":
                 cf = GzipFile(compressed, 'w')
+            elif logCompressionMethod == "blocks":
+                cf = blockfile.BlockFile(compressed, 'w',
+                        blockSize=self.compressionBlockSize)
             bufsize = 1024*1024
             while True:
                 buf = infile.read(bufsize)
@@ -593,8 +832,10 @@ class LogFile:
         def _renameCompressedLog(rv):
             if logCompressionMethod == "bz2":
                 filename = self.getFilename() + '.bz2'
-            else:
+            elif logCompressionMethod == "gz":
                 filename = self.getFilename() + '.gz'
+            else:
+                filename = self.getFilename() + '.blocks'
             if runtime.platformType  == 'win32':
                 # windows cannot rename a file on top of an existing one, so
                 # fall back to delete-first. There are ways this can fail and
@@ -682,6 +923,64 @@ class HTMLLogFile:
         return d
 
 
+class _LastLines(object):
+    """
+    Collects the chunks added to it, keeping only those that the last
+    C{lastLines} lines of their text can come from.
+    """
+
+    def __init__(self, lastLines):
+        self.lastLines = lastLines
+        self.kept = deque() # (newline count, chunk)
+        self.newlines = 0
+
+    def add(self, chunk):
+        if self.lastLines <= 0:
+            return
+        count = chunk[1].count("\n")
+        self.kept.append((count, chunk))
+        self.newlines += count
+        # the first chunk can go once the chunks after it have more than
+        # lastLines newlines, allowing for one at the very end of the text
+        while self.newlines - self.kept[0][0] > self.lastLines:
+            self.newlines -= self.kept.popleft()[0]
+
+    def getChunks(self):
+        return _lastLines([ chunk for count, chunk in self.kept ],
+                          self.lastLines)
+
+
+def _lastLines(chunks, lastLines):
+    """Trim a list of (channel, text) chunks to the last C{lastLines} lines
+    of their text."""
+    if lastLines <= 0:
+        return []
+    # a newline at the very end of the text does not begin another line
+    skip = 0
+    for channel, text in reversed(chunks):
+        if text:
+            skip = int(text.endswith("\n"))
+            break
+    newlines = 0
+    for i in range(len(chunks)-1, -1, -1):
+        channel, text = chunks[i]
+        pos = len(text)
+        while True:
+            pos = text.rfind("\n", 0, pos)
+            if pos == -1:
+                break
+            if skip:
+                skip = 0
+                continue
+            newlines += 1
+            if newlines == lastLines:
+                rest = text[pos+1:]
+                if rest:
+                    return [ (channel, rest) ] + chunks[i+1:]
+                return chunks[i+1:]
+    return chunks
+
+
 def _tryremove(filename, timeout, retries):
     """Try to remove a file, and if failed, try again in timeout.
     Increases the timeout by a factor of 4, and only keeps trying for
@@ -26,7 +26,7 @@ from buildbot import config, interfaces, util
 from buildbot.util import bbcollections
 from buildbot.util.eventual import eventually
 from buildbot.changes import changes
-from buildbot.status import buildset, builder, buildrequest
+from buildbot.status import buildset, builder, buildrequest, eventlog
 
 class Status(config.ReconfigurableServiceMixin, service.MultiService):
     implements(interfaces.IStatus)
@@ -36,7 +36,9 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         self.master = master
         self.botmaster = master.botmaster
         self.basedir = master.basedir
-        self.watchers = []
+        # numbers every status event, for clients that want only the changes
+        self.eventLog = eventlog.StatusEventLog()
+        self.watchers = [ self.eventLog ]
         # No default limit to the log size
         self.logMaxSize = None
 
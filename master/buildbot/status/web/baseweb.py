@@ -27,8 +27,9 @@ from buildbot.interfaces import IStatusReceiver
 from buildbot.status.web.base import StaticFile, createJinjaEnv
 from buildbot.status.web.feeds import Rss20StatusResource, \
      Atom10StatusResource
-from buildbot.status.web.waterfall import WaterfallStatusResource
-from buildbot.status.web.console import ConsoleStatusResource
+from buildbot.status.web.waterfall import WaterfallStatusResource, \
+     WaterfallCache
+from buildbot.status.web.console import ConsoleStatusResource, ConsoleCache
 from buildbot.status.web.olpb import OneLinePerBuild
 from buildbot.status.web.grid import GridStatusResource
 from buildbot.status.web.grid import TransposedGridStatusResource
@@ -36,7 +37,7 @@ from buildbot.status.web.changes import ChangesResource
 from buildbot.status.web.builder import BuildersResource
 from buildbot.status.web.buildstatus import BuildStatusStatusResource
 from buildbot.status.web.slaves import BuildSlavesResource
-from buildbot.status.web.status_json import JsonStatusResource
+from buildbot.status.web.status_json import JsonStatusResource, JsonCache
 from buildbot.status.web.about import AboutBuildbot
 from buildbot.status.web.authz import Authz
 from buildbot.status.web.auth import AuthFailResource,AuthzFailResource, LoginResource, LogoutResource
@@ -335,6 +336,16 @@ class WebStatus(service.MultiService):
         # keep track of cached connections so we can break them when we shut
         # down. See ticket #102 for more details.
         self.channels = weakref.WeakKeyDictionary()
+
+        # the cache of JSON responses, if the json feed is provided
+        self.jsonCache = None
+
+        # the recent builds and changes shown by the waterfall, created the
+        # first time it is drawn; see getWaterfallCache
+        self.waterfallCache = None
+
+        # the recent builds shown by the console; see getConsoleCache
+        self.consoleCache = None
         
         # do we want to allow change_hook
         self.change_hook_dialects = {}
@@ -479,10 +490,29 @@ class WebStatus(service.MultiService):
         if "atom" in self.provide_feeds:
             root.putChild("atom", Atom10StatusResource(status))
         if "json" in self.provide_feeds:
+            self.jsonCache = JsonCache(status)
+            self.jsonCache.setServiceParent(self)
             root.putChild("json", JsonStatusResource(status))
 
         self.site.resource = root
 
+    def getWaterfallCache(self):
+        """Return the L{WaterfallCache}, creating it the first time it is
+        needed, so that a master whose waterfall and console are never viewed
+        does not keep their builds in memory."""
+        if self.waterfallCache is None:
+            self.waterfallCache = WaterfallCache(self.getStatus())
+            self.waterfallCache.setServiceParent(self)
+        return self.waterfallCache
+
+    def getConsoleCache(self):
+        """Return the L{ConsoleCache}, creating it the first time it is
+        needed."""
+        if self.consoleCache is None:
+            self.consoleCache = ConsoleCache(self.getStatus())
+            self.consoleCache.setServiceParent(self)
+        return self.consoleCache
+
     def putChild(self, name, child_resource):
         """This behaves a lot like root.putChild() . """
         self.childrenToBeAdded[name] = child_resource
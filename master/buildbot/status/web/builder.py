@@ -494,17 +494,11 @@ class BuildersResource(HtmlResource):
                 for b in req.args.get("branch", [])
                 if b ]
 
-        # get counts of pending builds for each builder
-        brstatus_ds = []
-        brcounts = {}
-        def keep_count(statuses, builderName):
-            brcounts[builderName] = len(statuses)
-        for builderName in builders:
-            builder_status = status.getBuilder(builderName)
-            d = builder_status.getPendingBuildRequestStatuses()
-            d.addCallback(keep_count, builderName)
-            brstatus_ds.append(d)
-        yield defer.gatherResults(brstatus_ds)
+        # get counts of pending builds for all builders at once
+        master = self.getBuildmaster(req)
+        counts = yield master.db.buildrequests.getUnclaimedBuildRequestCounts()
+        brcounts = dict((builderName, counts.get(builderName, (0, None))[0])
+                        for builderName in builders)
 
         cxt['branches'] = branches
         bs = cxt['builders'] = []
@@ -131,5 +131,7 @@ class ChangeHookResource(resource.Resource):
     def submitChanges(self, changes, request, src):
         master = request.site.buildbot_service.master
         for chdict in changes:
-            change = yield master.addChange(src=src, **chdict)
+            chdict['src'] = src
+        added = yield master.addChanges(changes)
+        for change in added:
             log.msg("injected change %s" % change)
@@ -19,7 +19,7 @@ import re
 import urllib
 from twisted.internet import defer
 from buildbot import util
-from buildbot.status import builder
+from buildbot.status import base, builder
 from buildbot.status.web.base import HtmlResource
 from buildbot.changes import changes
 
@@ -78,15 +78,182 @@ class DevBuild:
 
     def __init__(self, revision, build, details):
         self.revision = revision
-        self.results =  build.getResults()
+        self.results =  build.results
+        self.number = build.number
+        self.isFinished = build.isFinished
+        self.text = build.text
+        self.eta = build.eta
+        self.details = details
+        self.when = build.when
+
+
+class BuildChange:
+    """The revision and time of one of the changes in a build."""
+
+    def __init__(self, change):
+        self.revision = change.revision
+        self.when = change.when
+
+
+stripHtml = re.compile(r'<.*?>')
+
+class ConsoleBuild:
+    """Everything the console displays about a build.  The L{ConsoleCache}
+    keeps one of these for each recent finished build, so that the console
+    can be drawn without loading builds from disk or looking at their
+    steps."""
+
+    def __init__(self, build):
         self.number = build.getNumber()
+        # The console page cannot handle builds that have more than 1 revision
+        self.singleSource = len(build.getSourceStamps()) == 1
+        # We first try "got_revision", but if it does not work, then
+        # we try "revision".
+        self.revision = build.getProperty("got_revision",
+                                          build.getProperty("revision", -1))
+        self.results = build.getResults()
         self.isFinished = build.isFinished()
         self.text = build.getText()
         self.eta = build.getETA()
-        self.details = details
         self.when = build.getTimes()[0]
-        #TODO: support multiple sourcestamps
-        self.source = build.getSourceStamps()[0]
+        self.changes = [ BuildChange(change)
+                         for change in build.getChanges() ]
+
+        # the last failed step, as shown in the details
+        self.failure = None
+        if build.getLogs():
+            for step in build.getSteps():
+                (result, reason) = step.getResults()
+                if result == builder.FAILURE:
+                    self.failure = dict(
+                        step=step.getName(),
+                        # Remove html tags from the error text.
+                        status=stripHtml.sub('', ' '.join(step.getText())),
+                        reason=reason,
+                        logs=[ log.getName() for log in step.getLogs() ])
+
+    def getNumber(self):
+        return self.number
+
+
+def historyBuilds(build):
+    """Generate a L{ConsoleBuild} for C{build} and each of the builds before
+    it, loading them as needed."""
+    while build:
+        yield ConsoleBuild(build)
+        build = build.getPreviousBuild()
+
+
+class ConsoleColumn:
+    """The recent builds of one builder, as displayed by the console.  The
+    builds are read from the builder's history when the column is first used,
+    and then kept up to date by the L{ConsoleCache}.  Running builds are kept
+    as L{BuildStatus} instances and summarized each time they are displayed;
+    finished builds are kept as L{ConsoleBuild}s.
+
+    Only the latest C{maxBuilds} builds are kept; older builds are loaded
+    from the builder's history."""
+
+    def __init__(self, builder, maxBuilds):
+        self.builder = builder
+        self.maxBuilds = maxBuilds
+        self.builds = None # oldest first; None until loaded
+        self.complete = False # True if builds covers the whole history
+
+    def load(self):
+        if self.builds is not None:
+            return
+        builds = []
+        self.complete = True
+        for Nb in range(1, self.builder.nextBuildNumber+1):
+            if len(builds) >= self.maxBuilds:
+                self.complete = False
+                break
+            build = self.builder.getBuild(-Nb)
+            if not build:
+                # HACK: Work around #601, the head build may be None if it
+                # is locked.
+                if Nb == 1:
+                    continue
+                break
+            builds.append(build)
+        self.builds = []
+        for build in reversed(builds):
+            self._addBuild(build)
+
+    def _addBuild(self, build):
+        if build.isFinished():
+            build = ConsoleBuild(build)
+        self.builds.append(build)
+        if len(self.builds) > self.maxBuilds:
+            del self.builds[0]
+            self.complete = False
+
+    def buildStarted(self, build):
+        if self.builds is not None:
+            self._addBuild(build)
+
+    def buildFinished(self, build):
+        if self.builds is None:
+            return
+        for i in range(len(self.builds)-1, -1, -1):
+            if self.builds[i] is build:
+                self.builds[i] = ConsoleBuild(build)
+                break
+
+    def getBuilds(self):
+        """Generate a L{ConsoleBuild} for each build, newest first."""
+        self.load()
+        for build in reversed(self.builds):
+            if not isinstance(build, ConsoleBuild):
+                build = ConsoleBuild(build)
+            yield build
+        if not self.complete and self.builds:
+            number = self.builds[0].getNumber()
+            for build in historyBuilds(self.builder.getBuild(number - 1)):
+                yield build
+
+
+class ConsoleCache(base.SubscribingStatusReceiver):
+    """Keeps a L{ConsoleColumn} for each builder up to date as builds start
+    and finish, so that the console does not have to walk the build history
+    on every refresh."""
+
+    # enough for the 40 revisions shown by default, doubled when
+    # filtering by committer
+    maxBuilds = 80
+
+    def __init__(self, status):
+        base.SubscribingStatusReceiver.__init__(self, status)
+        self.columns = {}
+
+    def stopService(self):
+        self.columns = {}
+        return base.SubscribingStatusReceiver.stopService(self)
+
+    def getColumn(self, builder):
+        name = builder.getName()
+        column = self.columns.get(name)
+        if column is None or column.builder is not builder:
+            column = self.columns[name] = ConsoleColumn(builder,
+                                                        self.maxBuilds)
+        return column
+
+    # status events
+
+    def builderRemoved(self, builderName):
+        self.columns.pop(builderName, None)
+        base.SubscribingStatusReceiver.builderRemoved(self, builderName)
+
+    def buildStarted(self, builderName, build):
+        column = self.columns.get(builderName)
+        if column:
+            column.buildStarted(build)
+
+    def buildFinished(self, builderName, build, results):
+        column = self.columns.get(builderName)
+        if column:
+            column.buildFinished(build)
 
 
 class ConsoleStatusResource(HtmlResource):
@@ -131,6 +298,16 @@ class ConsoleStatusResource(HtmlResource):
 
         return build
 
+    def getConsoleBuilds(self, request, builder):
+        """Generate a L{ConsoleBuild} for each build of the given builder,
+        newest first."""
+        getCache = getattr(request.site.buildbot_service,
+                           'getConsoleCache', None)
+        cache = getCache and getCache()
+        if cache:
+            return cache.getColumn(builder).getBuilds()
+        return historyBuilds(self.getHeadBuild(builder))
+
     def fetchChangesFromHistory(self, status, max_depth, max_builds, debugInfo):
         """Look at the history of the builders and try to fetch as many changes
         as possible. We need this when the main source does not contain enough
@@ -167,12 +344,20 @@ class ConsoleStatusResource(HtmlResource):
     def getAllChanges(self, request, status, debugInfo):
         master = request.site.buildbot_service.master
 
-        chdicts = yield master.db.changes.getRecentChanges(25)
+        # the waterfall keeps the recent changes in memory
+        getCache = getattr(request.site.buildbot_service,
+                           'getWaterfallCache', None)
+        cache = getCache and getCache()
+        if cache:
+            allChanges = yield cache.getRecentChanges(master)
+            allChanges = allChanges[-25:]
+        else:
+            chdicts = yield master.db.changes.getRecentChanges(25)
 
-        # convert those to Change instances
-        allChanges = yield defer.gatherResults([
-                changes.Change.fromChdict(master, chdict)
-                for chdict in chdicts ])
+            # convert those to Change instances
+            allChanges = yield defer.gatherResults([
+                    changes.Change.fromChdict(master, chdict)
+                    for chdict in chdicts ])
 
         allChanges.sort(key=self.comparator.getSortingKey())
 
@@ -189,35 +374,25 @@ class ConsoleStatusResource(HtmlResource):
         defer.returnValue(allChanges)
 
     def getBuildDetails(self, request, builderName, build):
-        """Returns an HTML list of failures for a given build."""
+        """Returns an HTML list of failures for a given L{ConsoleBuild}."""
         details = {}
-        if not build.getLogs():
+        failure = build.failure
+        if not failure:
             return details
-        
-        for step in build.getSteps():
-            (result, reason) = step.getResults()
-            if result == builder.FAILURE:
-                name = step.getName()
-
-                # Remove html tags from the error text.
-                stripHtml = re.compile(r'<.*?>')
-                strippedDetails = stripHtml.sub('', ' '.join(step.getText()))
-                
-                details['buildername'] = builderName
-                details['status'] = strippedDetails
-                details['reason'] = reason
-                logs = details['logs'] = []
-
-                if step.getLogs():
-                    for log in step.getLogs():
-                        logname = log.getName()
-                        logurl = request.childLink(
-                          "../builders/%s/builds/%s/steps/%s/logs/%s" % 
-                            (urllib.quote(builderName),
-                             build.getNumber(),
-                             urllib.quote(name),
-                             urllib.quote(logname)))
-                        logs.append(dict(url=logurl, name=logname))
+
+        details['buildername'] = builderName
+        details['status'] = failure['status']
+        details['reason'] = failure['reason']
+        logs = details['logs'] = []
+
+        for logname in failure['logs']:
+            logurl = request.childLink(
+              "../builders/%s/builds/%s/steps/%s/logs/%s" % 
+                (urllib.quote(builderName),
+                 build.number,
+                 urllib.quote(failure['step']),
+                 urllib.quote(logname)))
+            logs.append(dict(url=logurl, name=logname))
         return details
 
     def getBuildsForRevision(self, request, builder, builderName, lastRevision,
@@ -230,18 +405,19 @@ class ConsoleStatusResource(HtmlResource):
         revision = lastRevision 
 
         builds = []
-        build = self.getHeadBuild(builder)
+        allBuilds = self.getConsoleBuilds(request, builder)
         number = 0
-        while build and number < numBuilds:
+        while number < numBuilds:
+            build = next(allBuilds, None)
+            if not build:
+                break
             debugInfo["builds_scanned"] += 1
 
             # The console page cannot handle builds that have more than 1 revision
-            if len(build.getSourceStamps()) == 1:
+            if build.singleSource:
                 number += 1
                 # Get the last revision in this build.
-                # We first try "got_revision", but if it does not work, then
-                # we try "revision".
-                got_rev = build.getProperty("got_revision", build.getProperty("revision", -1))
+                got_rev = build.revision
                 if got_rev != -1 and not self.comparator.isValidRevision(got_rev):
                     got_rev = -1
 
@@ -262,20 +438,18 @@ class ConsoleStatusResource(HtmlResource):
                         devBuild, current_revision):
                         break
 
-            build = build.getPreviousBuild()
-
         return builds
 
     def getChangeForBuild(self, build, revision):
-        if not build or not build.getChanges(): # Forced build
+        if not build or not build.changes: # Forced build
             return DevBuild(revision, build, None)
         
-        for change in build.getChanges():
+        for change in build.changes:
             if change.revision == revision:
                 return change
 
         # No matching change, return the last change in build.
-        changes = list(build.getChanges())
+        changes = list(build.changes)
         changes.sort(key=self.comparator.getSortingKey())
         return changes[-1]
     
@@ -363,7 +537,7 @@ class ConsoleStatusResource(HtmlResource):
             
         return cs
 
-    def displaySlaveLine(self, status, builderList, debugInfo):
+    def displaySlaveLine(self, request, status, builderList, debugInfo):
         """Display a line the shows the current status for all the builders we
         care about."""
 
@@ -396,13 +570,12 @@ class ConsoleStatusResource(HtmlResource):
                 else:
                     # If not offline, then display the result of the last
                     # finished build.
-                    build = self.getHeadBuild(status.getBuilder(builder))
-                    while build and not build.isFinished():
-                        build = build.getPreviousBuild()
-
-                    if build:
-                        s["color"] = getResultsClass(build.getResults(), None,
-                                                      False)
+                    for build in self.getConsoleBuilds(request,
+                                                 status.getBuilder(builder)):
+                        if build.isFinished:
+                            s["color"] = getResultsClass(build.results, None,
+                                                          False)
+                            break
 
                 slaves[category].append(s)
 
@@ -540,7 +713,8 @@ class ConsoleStatusResource(HtmlResource):
 
         if builderList:
             subs["categories"] = self.displayCategories(builderList, debugInfo)
-            subs['slaves'] = self.displaySlaveLine(status, builderList, debugInfo)
+            subs['slaves'] = self.displaySlaveLine(request, status, builderList,
+                                                   debugInfo)
         else:
             subs["categories"] = []
 
@@ -78,7 +78,7 @@ class GridStatusMixin(object):
         if state == "idle" and upcoming:
             state = "waiting"
 
-        n_pending = len((yield builder.getPendingBuildRequestStatuses()))
+        n_pending = yield builder.getPendingBuildRequestCount()
 
         cxt = { 'url': path_to_builder(request, builder),
                 'name': builder.getName(),
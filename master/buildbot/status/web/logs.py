@@ -103,6 +103,14 @@ class TextLog(Resource):
         self._setContentType(req)
         self.req = req
 
+        # ?tail=N shows only the last N lines, and a byte range (text only)
+        # shows part of the log; both are streamed from the log file and
+        # finish there, instead of following the log
+        lastLines = self._getTail(req)
+        byteRange = None
+        if self.asText:
+            byteRange = self._getRange(req)
+
         if not self.asText:
             self.template = req.site.buildbot_service.templates.get_template("logs.html")                
             
@@ -113,12 +121,77 @@ class TextLog(Resource):
             data = data.encode('utf-8')                   
             req.write(data)
 
-        self.original.subscribeConsumer(ChunkConsumer(req, self))
+        if byteRange is not None:
+            self._writeRange(req, *byteRange)
+        elif lastLines is not None:
+            self._writeTail(req, lastLines)
+        else:
+            self.original.subscribeConsumer(ChunkConsumer(req, self))
         return server.NOT_DONE_YET
 
+    def _getTail(self, req):
+        try:
+            lastLines = int(req.args['tail'][0])
+        except (KeyError, IndexError, ValueError):
+            return None
+        if lastLines < 0:
+            return None
+        return lastLines
+
+    def _getRange(self, req):
+        # only a single 'bytes=first-[last]' range is supported; anything
+        # else gets the whole log, as HTTP allows
+        header = req.getHeader('range')
+        if not header or not header.startswith('bytes='):
+            return None
+        first, sep, last = header[len('bytes='):].strip().partition('-')
+        try:
+            start = int(first)
+            end = last and int(last) + 1 or None
+        except ValueError:
+            return None
+        if end is not None and end <= start:
+            return None
+        return start, end
+
+    def _writeTail(self, req, lastLines):
+        if self.asText:
+            channels = [logfile.STDOUT, logfile.STDERR]
+        else:
+            channels = []
+        self.original.produceChunks(ChunkConsumer(req, self), channels,
+                                    lastLines=lastLines)
+
+    def _writeRange(self, req, start, end):
+        channels = [logfile.STDOUT, logfile.STDERR]
+        length = self.original.getTextLength(channels)
+        if length is None:
+            # logs from older versions do not know their length, so they are
+            # sent whole, as HTTP allows
+            self.original.subscribeConsumer(ChunkConsumer(req, self))
+            return
+        # the log may still be growing, so its length is not final
+        total = self.original.isFinished() and str(length) or "*"
+        if start >= length:
+            req.setResponseCode(416)
+            req.setHeader("content-range", "bytes */%s" % total)
+            self.finished()
+            return
+        if end is None or end > length:
+            end = length
+        # the log's text is stored as utf-8, so these are offsets in the
+        # bytes that are sent
+        req.setResponseCode(206)
+        req.setHeader("content-range", "bytes %d-%d/%s"
+                      % (start, end - 1, total))
+        req.setHeader("content-length", end - start)
+        self.original.produceChunks(ChunkConsumer(req, self), channels,
+                                    start=start, end=end)
+
     def _setContentType(self, req):
         if self.asText:
             req.setHeader("content-type", "text/plain; charset=utf-8")
+            req.setHeader("accept-ranges", "bytes")
         else:
             req.setHeader("content-type", "text/html; charset=utf-8")
         
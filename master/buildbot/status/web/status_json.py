@@ -19,15 +19,20 @@
 import datetime
 import os
 import re
+from hashlib import sha1
 
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.web import html, resource, server
 
+from buildbot import util
+from buildbot.process import metrics
+from buildbot.status import base
 from buildbot.status.web.base import HtmlResource
 from buildbot.util import json
 
 
 _IS_INT = re.compile('^[-+]?\d+$')
+_EVENTS_SINCE = re.compile('^(\w+):(\d+)$')
 
 
 FLAGS = """\
@@ -82,6 +87,10 @@ EXAMPLES = """\
     - Builder information plus details information about its slaves. Neat eh?
   - /json/slaves/<A_SLAVE>
     - A specific slave.
+  - /json/events
+    - The current status event epoch and sequence number.  Add
+      since=<EPOCH>:<SEQUENCE>&wait=30 to list the events after <SEQUENCE>,
+      waiting up to 30 seconds for one.
   - /json?select=slaves/<A_SLAVE>/&select=project&select=builders/<A_BUILDER>/builds/<A_BUILD>
     - A selection of random unrelated stuff as an random example. :)
 """
@@ -120,14 +129,135 @@ def FilterOut(data):
         return data
 
 
+class JsonCache(base.SubscribingStatusReceiver):
+    """
+    Caches the rendered JSON responses, keyed by the path and query string of
+    the request, until the status changes or they are C{maxAge} seconds old.
+    The age limit keeps times and ETAs, which change without any status
+    event, reasonably fresh.
+
+    Responses that describe a single builder (its builds, steps, and so on)
+    are filed under that builder's name, and an event on a builder only
+    invalidates those and the responses that are not specific to any one
+    builder.  Events that are not specific to a builder invalidate
+    everything.
+
+    Hits and misses are counted in the C{JsonCache.hits} and
+    C{JsonCache.misses} metrics.
+    """
+
+    maxAge = 5
+    maxEntries = 500
+
+    _reactor = reactor # for tests
+
+    def __init__(self, status):
+        base.SubscribingStatusReceiver.__init__(self, status)
+        self.entries = {}
+
+    def stopService(self):
+        self.invalidate()
+        return base.SubscribingStatusReceiver.stopService(self)
+
+    def get(self, key, builderName=None):
+        """Return the cached (etag, data) for C{key}, or None."""
+        entries = self.entries.get(builderName, {})
+        entry = entries.get(key)
+        if entry is not None:
+            if util.now(self._reactor) - entry[0] <= self.maxAge:
+                metrics.MetricCountEvent.log("JsonCache.hits", 1)
+                return entry[1:]
+            del entries[key]
+        metrics.MetricCountEvent.log("JsonCache.misses", 1)
+        return None
+
+    def put(self, key, etag, data, builderName=None):
+        """
+        Cache C{etag} and C{data} for C{key}.  If the response describes a
+        single builder, C{builderName} gives its name.
+        """
+        if sum(map(len, self.entries.itervalues())) >= self.maxEntries:
+            self.invalidate()
+        self.entries.setdefault(builderName, {})[key] = \
+                (util.now(self._reactor), etag, data)
+
+    def invalidate(self, *args):
+        self.entries.clear()
+
+    def invalidateBuilder(self, builderName):
+        """
+        Forget the responses for builder C{builderName}, along with those that
+        are not specific to any builder.
+        """
+        self.entries.pop(builderName, None)
+        self.entries.pop(None, None)
+
+    # status events
+
+    def builderAdded(self, builderName, builder):
+        self.invalidate()
+        return base.SubscribingStatusReceiver.builderAdded(self, builderName,
+                                                           builder)
+
+    def builderRemoved(self, builderName):
+        self.invalidate()
+        base.SubscribingStatusReceiver.builderRemoved(self, builderName)
+
+    def builderChangedState(self, builderName, state):
+        self.invalidateBuilder(builderName)
+
+    def buildStarted(self, builderName, build):
+        self.invalidateBuilder(builderName)
+        return self # subscribe to this build's steps
+
+    def stepFinished(self, build, step, results):
+        self.invalidateBuilder(build.getBuilder().getName())
+
+    def buildFinished(self, builderName, build, results):
+        self.invalidateBuilder(builderName)
+
+    def requestSubmitted(self, request):
+        self.invalidateBuilder(request.getBuilderName())
+
+    def requestCancelled(self, builder, request):
+        self.invalidateBuilder(builder.getName())
+
+    changeAdded = invalidate
+    slaveConnected = invalidate
+    slaveDisconnected = invalidate
+
+
+def MakeETag(data):
+    """Returns a strong ETag for the given response body."""
+    return '"%s"' % sha1(data).hexdigest()
+
+
+def MatchesETag(request, etag):
+    """Returns True if the request's If-None-Match header matches etag."""
+    header = request.getHeader('if-none-match')
+    if not header:
+        return False
+    for tag in header.split(','):
+        tag = tag.strip()
+        # If-None-Match uses the weak comparison
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag or tag == '*':
+            return True
+    return False
+
+
 class JsonResource(resource.Resource):
     """Base class for json data."""
 
     contentType = "application/json"
     cache_seconds = 60
+    cacheable = True
     help = None
     pageTitle = None
     level = 0
+    # the builder this resource describes, if any, for the JsonCache
+    builderName = None
 
     def __init__(self, status):
         """Adds transparent lazy-child initialization."""
@@ -162,12 +292,33 @@ class JsonResource(resource.Resource):
         RecurseFix(res, self.level)
         resource.Resource.putChild(self, name, res)
 
+    def getJsonCache(self, request):
+        """Returns the L{JsonCache} for this request, or None."""
+        if not self.cacheable:
+            return None
+        return getattr(request.site.buildbot_service, 'jsonCache', None)
+
     def render_GET(self, request):
         """Renders a HTTP GET at the http request level."""
-        d = defer.maybeDeferred(lambda : self.content(request))
-        def handle(data):
-            if isinstance(data, unicode):
-                data = data.encode("utf-8")
+        cache = self.getJsonCache(request)
+        key = ('/'.join(request.prepath),
+               tuple(sorted([ (k, tuple(v))
+                              for k, v in request.args.iteritems() ])))
+        cached = cache and cache.get(key, self.builderName)
+        if cached:
+            d = defer.succeed(cached)
+        else:
+            d = defer.maybeDeferred(lambda : self.content(request))
+            def encode(data):
+                if isinstance(data, unicode):
+                    data = data.encode("utf-8")
+                etag = MakeETag(data)
+                if cache:
+                    cache.put(key, etag, data, self.builderName)
+                return etag, data
+            d.addCallback(encode)
+        def handle(result):
+            etag, data = result
             request.setHeader("Access-Control-Allow-Origin", "*")
             if RequestArgToBool(request, 'as_text', False):
                 request.setHeader("content-type", 'text/plain')
@@ -182,10 +333,15 @@ class JsonResource(resource.Resource):
                 request.setHeader("Expires",
                                 expires.strftime("%a, %d %b %Y %H:%M:%S GMT"))
                 request.setHeader("Pragma", "no-cache")
+            request.setHeader("ETag", etag)
+            if MatchesETag(request, etag):
+                request.setResponseCode(304)
+                return ''
             return data
         d.addCallback(handle)
         def ok(data):
-            request.write(data)
+            if data:
+                request.write(data)
             request.finish()
         def fail(f):
             request.processingFailed(f)
@@ -357,6 +513,7 @@ class BuilderPendingBuildsJsonResource(JsonResource):
     def __init__(self, status, builder_status):
         JsonResource.__init__(self, status)
         self.builder_status = builder_status
+        self.builderName = builder_status.getName()
 
     def asDict(self, request):
         # buildbot.status.builder.BuilderStatus
@@ -376,6 +533,7 @@ class BuilderJsonResource(JsonResource):
     def __init__(self, status, builder_status):
         JsonResource.__init__(self, status)
         self.builder_status = builder_status
+        self.builderName = builder_status.getName()
         self.putChild('builds', BuildsJsonResource(status, builder_status))
         self.putChild('slaves', BuilderSlavesJsonResources(status,
                                                            builder_status))
@@ -423,6 +581,7 @@ class BuildJsonResource(JsonResource):
     def __init__(self, status, build_status):
         JsonResource.__init__(self, status)
         self.build_status = build_status
+        self.builderName = build_status.getBuilder().getName()
         # TODO: support multiple sourcestamps
         sourcestamp = build_status.getSourceStamps()[0]
         self.putChild('source_stamp',
@@ -441,6 +600,7 @@ class AllBuildsJsonResource(JsonResource):
     def __init__(self, status, builder_status):
         JsonResource.__init__(self, status)
         self.builder_status = builder_status
+        self.builderName = builder_status.getName()
 
     def getChild(self, path, request):
         # Dynamic childs.
@@ -498,6 +658,7 @@ class BuildStepJsonResource(JsonResource):
         # buildbot.status.buildstep.BuildStepStatus
         JsonResource.__init__(self, status)
         self.build_step_status = build_step_status
+        self.builderName = build_step_status.getBuild().getBuilder().getName()
         # TODO self.putChild('logs', LogsJsonResource())
 
     def asDict(self, request):
@@ -512,6 +673,7 @@ class BuildStepsJsonResource(JsonResource):
     def __init__(self, status, build_status):
         JsonResource.__init__(self, status)
         self.build_status = build_status
+        self.builderName = build_status.getBuilder().getName()
         # The build steps are constantly changing until the build is done so
         # keep a reference to build_status instead
 
@@ -682,6 +844,7 @@ class MetricsJsonResource(JsonResource):
     help = """Master metrics.
 """
     title = "Metrics"
+    cacheable = False
 
     def asDict(self, request):
         metrics = self.status.getMetrics()
@@ -693,6 +856,59 @@ class MetricsJsonResource(JsonResource):
 
 
 
+class EventsJsonResource(JsonResource):
+    help = """Status events since a given sequence number.
+
+Without arguments, gives the current epoch and sequence number.  The epoch
+changes every time the master starts.  A client can read the status it needs
+along with these, for example from the root /json page, and then ask for only
+the events that come after them.
+
+  - since
+    - The epoch and sequence number of the last event already seen, as
+      <EPOCH>:<SEQUENCE>.  The events after it are listed, oldest first, each
+      with its own sequence number.  If "complete" is false, some events were
+      missed (or the master has restarted, so the epoch is different) and the
+      client should read the status again.
+  - wait
+    - If there are no events after "since", wait up to this many seconds
+      for one to happen before replying.
+"""
+    pageTitle = 'Events'
+    cacheable = False
+    maxWait = 60
+
+    def asDict(self, request):
+        eventLog = self.status.eventLog
+        since = RequestArg(request, 'since', '')
+        if not since:
+            return self.eventsDict(eventLog, eventLog.epoch, eventLog.sequence)
+        mo = _EVENTS_SINCE.match(since)
+        if not mo:
+            # a bare sequence number might be from any run of the master
+            return self.eventsDict(eventLog, None, 0)
+        epoch, since = mo.group(1), int(mo.group(2))
+        try:
+            wait = min(float(RequestArg(request, 'wait', 0)), self.maxWait)
+        except ValueError:
+            wait = 0
+        d = eventLog.waitForEvents(epoch, since, wait)
+        # don't answer a client that has gone away
+        request.notifyFinish().addErrback(lambda _ :
+                eventLog.stopWaiting(d))
+        d.addCallback(lambda _ : self.eventsDict(eventLog, epoch, since))
+        return d
+
+    def eventsDict(self, eventLog, epoch, since):
+        complete, events = eventLog.getEvents(epoch, since)
+        return {
+            'epoch' : eventLog.epoch,
+            'sequence' : eventLog.sequence,
+            'complete' : complete,
+            'events' : events,
+        }
+
+
 class JsonStatusResource(JsonResource):
     """Retrieves all json data."""
     help = """JSON status
@@ -712,14 +928,14 @@ For help on any sub directory, use url /child/help
         self.putChild('project', ProjectJsonResource(status))
         self.putChild('slaves', SlavesJsonResource(status))
         self.putChild('metrics', MetricsJsonResource(status))
+        self.putChild('events', EventsJsonResource(status))
         # This needs to be called before the first HelpResource().body call.
         self.hackExamples()
 
-    def content(self, request):
-        result = JsonResource.content(self, request)
+    def render_GET(self, request):
         # This is done to hook the downloaded filename.
         request.path = 'buildbot'
-        return result
+        return JsonResource.render_GET(self, request)
 
     def hackExamples(self):
         global EXAMPLES
@@ -23,7 +23,8 @@ import time, locale
 import operator
 
 from buildbot import interfaces, util
-from buildbot.status import builder, buildstep, build
+from buildbot.status import base, builder, buildstep, build
+from buildbot.status.buildindex import BuildIndexEntry
 from buildbot.changes import changes
 
 from buildbot.status.web.base import Box, HtmlResource, IBox, ICurrentBox, \
@@ -142,23 +143,47 @@ class BuildTopBox(components.Adapter):
         return Box(text, urlbase=url, class_="LastBuild %s" % class_)
 components.registerAdapter(BuildTopBox, builder.BuilderStatus, ITopBox)
 
+def buildStartClass(b):
+    class_ = "start"
+    if b.isFinished() and not b.getSteps():
+        # the steps have been pruned, so there won't be any indication
+        # of whether it succeeded or failed.
+        class_ = build_get_class(b)
+    return class_
+
+def makeBuildBox(req, url, reason, number, class_):
+    templates = req.site.buildbot_service.templates
+    template = templates.get_template("box_macros.html")
+    text = template.module.build_box(reason=reason,url=url,number=number)
+    return Box([text], class_="BuildStep " + class_)
+
+def makeStepBox(req, urlbase, text, logs, urls, class_, stepinfo=None):
+    # logs is a list of (name, hasContents) tuples
+    cxt = dict(text=text[:], logs=[], urls=[], stepinfo=stepinfo)
+
+    for name, hasContents in logs:
+        if hasContents:
+            url = urlbase + "/logs/%s" % urllib.quote(name)
+        else:
+            url = None
+        cxt['logs'].append(dict(name=name, url=url))
+
+    for name, target in urls:
+        cxt['urls'].append(dict(link=target,name=name))
+
+    templates = req.site.buildbot_service.templates
+    template = templates.get_template("box_macros.html")
+    text = template.module.step_box(**cxt)
+    return Box(text, class_="BuildStep " + class_)
+
 class BuildBox(components.Adapter):
     # this provides the yellow "starting line" box for each build
     implements(IBox)
 
     def getBox(self, req):
         b = self.original
-        number = b.getNumber()
-        url = path_to_build(req, b)
-        reason = b.getReason()
-        template = req.site.buildbot_service.templates.get_template("box_macros.html")
-        text = template.module.build_box(reason=reason,url=url,number=number)
-        class_ = "start"
-        if b.isFinished() and not b.getSteps():
-            # the steps have been pruned, so there won't be any indication
-            # of whether it succeeded or failed.
-            class_ = build_get_class(b)
-        return Box([text], class_="BuildStep " + class_)
+        return makeBuildBox(req, path_to_build(req, b), b.getReason(),
+                            b.getNumber(), buildStartClass(b))
 components.registerAdapter(BuildBox, build.BuildStatus, IBox)
 
 class StepBox(components.Adapter):
@@ -170,28 +195,82 @@ class StepBox(components.Adapter):
         if text is None:
             log.msg("getText() gave None", urlbase)
             text = []
-        text = text[:]
-        logs = self.original.getLogs()
-        
-        cxt = dict(text=text, logs=[], urls=[], stepinfo=self)
+        logs = [ (l.getName(), l.hasContents())
+                 for l in self.original.getLogs() ]
+        return makeStepBox(req, urlbase, text, logs,
+                           self.original.getURLs().items(),
+                           build_get_class(self.original), stepinfo=self)
+components.registerAdapter(StepBox, buildstep.BuildStepStatus, IBox)
 
-        for num in range(len(logs)):
-            name = logs[num].getName()
-            if logs[num].hasContents():
-                url = urlbase + "/logs/%s" % urllib.quote(name)
-            else:
-                url = None
-            cxt['logs'].append(dict(name=name, url=url))
+class BuildSummary(object):
+    """
+    What the waterfall shows of a finished build: a L{WaterfallColumn} keeps
+    one of these rather than the L{BuildStatus}, so that builds need not be
+    kept in memory or loaded from disk to draw the waterfall.
+    """
+    implements(interfaces.IStatusEvent)
 
-        for name, target in self.original.getURLs().items():
-            cxt['urls'].append(dict(link=target,name=name))
+    def __init__(self, b):
+        self.builderName = b.getBuilder().getName()
+        self.number = b.getNumber()
+        self.started, self.finished = b.getTimes()
+        self.reason = b.getReason()
+        self.class_ = buildStartClass(b)
 
-        template = req.site.buildbot_service.templates.get_template("box_macros.html")
-        text = template.module.step_box(**cxt)
-        
-        class_ = "BuildStep " + build_get_class(self.original)
-        return Box(text, class_=class_)
-components.registerAdapter(StepBox, buildstep.BuildStepStatus, IBox)
+    def getTimes(self):
+        return (self.started, self.finished)
+    def getText(self):
+        return []
+    def getLogs(self):
+        return []
+
+class BuildSummaryBox(components.Adapter):
+    implements(IBox)
+
+    def getBox(self, req):
+        b = self.original
+        url = (path_to_root(req) + "builders/%s/builds/%d"
+               % (urllib.quote(b.builderName, safe=''), b.number))
+        return makeBuildBox(req, url, b.reason, b.number, b.class_)
+components.registerAdapter(BuildSummaryBox, BuildSummary, IBox)
+
+class StepSummary(object):
+    """
+    What the waterfall shows of a finished step, kept in place of the
+    L{BuildStepStatus} like L{BuildSummary}.
+    """
+    implements(interfaces.IStatusEvent)
+
+    def __init__(self, step):
+        b = step.getBuild()
+        self.builderName = b.getBuilder().getName()
+        self.buildNumber = b.getNumber()
+        self.name = step.getName()
+        self.started, self.finished = step.getTimes()
+        self.text = list(step.getText() or [])
+        self.logs = [ (l.getName(), l.hasContents()) for l in step.getLogs() ]
+        self.urls = step.getURLs().items()
+        self.class_ = build_get_class(step)
+        self.hidden = step.isHidden()
+
+    def getTimes(self):
+        return (self.started, self.finished)
+    def getText(self):
+        return self.text
+    def getLogs(self):
+        return []
+
+class StepSummaryBox(components.Adapter):
+    implements(IBox)
+
+    def getBox(self, req):
+        s = self.original
+        urlbase = (path_to_root(req) + "builders/%s/builds/%d/steps/%s"
+                   % (urllib.quote(s.builderName, safe=''), s.buildNumber,
+                      urllib.quote(s.name, safe='')))
+        return makeStepBox(req, urlbase, s.text, s.logs, s.urls, s.class_,
+                           stepinfo=self)
+components.registerAdapter(StepSummaryBox, StepSummary, IBox)
 
 
 class EventBox(components.Adapter):
@@ -326,6 +405,228 @@ class ChangeEventSource(object):
                 continue
             yield change
 
+class WaterfallBuild(object):
+    """
+    A build in a L{WaterfallColumn}, with the L{BuildIndexEntry} used to
+    filter it.  While the build runs, its steps are read from the
+    L{BuildStatus}; once it finishes, the build and its steps are replaced by
+    summaries.
+    """
+
+    def __init__(self, b):
+        self.number = b.getNumber()
+        self.build = b
+        self.steps = None # summaries, once the build finishes
+        self.index = BuildIndexEntry.fromBuild(b)
+        if b.isFinished():
+            self.buildFinished()
+
+    def getSteps(self):
+        if self.steps is None:
+            return [ s for s in self.build.getSteps() if s.started ]
+        return self.steps
+
+    def buildFinished(self):
+        b = self.build
+        self.steps = [ StepSummary(s) for s in b.getSteps() if s.started ]
+        self.index = BuildIndexEntry.fromBuild(b)
+        self.build = BuildSummary(b)
+
+
+class WaterfallColumn(object):
+    """
+    The recent builds of one builder, kept in memory by the L{WaterfallCache}
+    and updated as builds start and finish, so that the waterfall can be
+    drawn without loading builds.  The builds are read from the
+    builder's history when the column is first used.
+
+    Only the latest C{maxBuilds} builds are kept; older events come from the
+    builder's own C{eventGenerator}.
+    """
+
+    def __init__(self, builder, maxBuilds):
+        self.builder = builder
+        self.maxBuilds = maxBuilds
+        self.builds = None # oldest first; None until loaded
+        self.running = {} # build number -> WaterfallBuild
+        self.complete = False # True if builds covers the whole history
+
+    def load(self):
+        if self.builds is not None:
+            return
+        builder = self.builder
+        builds = []
+        self.complete = True
+        for Nb in range(1, builder.nextBuildNumber+1):
+            if len(builds) >= self.maxBuilds:
+                self.complete = False
+                break
+            b = builder.getBuild(-Nb)
+            if not b:
+                # the latest build may be running but not yet saved; see
+                # BuilderStatus.eventGenerator
+                if Nb == 1:
+                    continue
+                break
+            builds.append(b)
+        self.builds = []
+        for b in reversed(builds):
+            self._addBuild(b)
+
+    def _addBuild(self, b):
+        wb = WaterfallBuild(b)
+        self.builds.append(wb)
+        if not b.isFinished():
+            self.running[wb.number] = wb
+        if len(self.builds) > self.maxBuilds:
+            del self.builds[0]
+            self.complete = False
+
+    def buildStarted(self, b):
+        if self.builds is not None:
+            self._addBuild(b)
+
+    def buildFinished(self, b):
+        wb = self.running.pop(b.getNumber(), None)
+        if wb:
+            wb.buildFinished()
+
+    def eventGenerator(self, branches=[], categories=[], committers=[],
+                       minTime=0):
+        """
+        Like L{BuilderStatus.eventGenerator}, but reading the recent builds
+        from memory.
+        """
+        self.load()
+        builder = self.builder
+        showBuilds = not categories or builder.getCategory() in categories
+        boundary = None
+        if not self.complete and self.builds:
+            boundary = self.builds[0].index.started
+
+        eventIndex = -1
+        e = builder.getEvent(eventIndex)
+        for wb in reversed(self.builds):
+            entry = wb.index
+            if entry.started < minTime:
+                break
+            if branches and not entry.matchesBranches(branches):
+                continue
+            if committers and not [ True for u in entry.blamelist
+                                    if u in committers ]:
+                continue
+            if not showBuilds:
+                continue
+            steps = wb.getSteps()
+            for Ns in range(1, len(steps)+1):
+                step_start = steps[-Ns].getTimes()[0]
+                while e is not None and e.getTimes()[0] > step_start:
+                    yield e
+                    eventIndex -= 1
+                    e = builder.getEvent(eventIndex)
+                yield steps[-Ns]
+            yield wb.build
+
+        while e is not None:
+            if boundary is not None and e.getTimes()[0] < boundary:
+                break
+            yield e
+            eventIndex -= 1
+            e = builder.getEvent(eventIndex)
+            if e and e.getTimes()[0] < minTime:
+                return
+
+        if boundary is not None:
+            # older than anything in memory, so go to the builder's history
+            for e in builder.eventGenerator(branches, categories, committers,
+                                            minTime):
+                if e.getTimes()[0] < boundary:
+                    yield e
+
+
+class WaterfallCache(base.SubscribingStatusReceiver):
+    """
+    Keeps a L{WaterfallColumn} for each builder, and the most recent changes,
+    up to date as the status changes, so that drawing the waterfall needs
+    neither builds loaded from disk nor a query for the recent changes.
+    """
+
+    maxBuilds = 30
+    maxChanges = 40
+
+    def __init__(self, status):
+        base.SubscribingStatusReceiver.__init__(self, status)
+        self.columns = {}
+        self.changes = None # oldest first; None until loaded
+        self._missedChanges = None
+
+    def stopService(self):
+        self.columns = {}
+        return base.SubscribingStatusReceiver.stopService(self)
+
+    def getColumn(self, builder):
+        name = builder.getName()
+        column = self.columns.get(name)
+        if column is None or column.builder is not builder:
+            column = self.columns[name] = WaterfallColumn(builder,
+                                                          self.maxBuilds)
+        return column
+
+    def getRecentChanges(self, master):
+        """
+        Return a Deferred firing with a list of the most recent changes,
+        oldest first.
+        """
+        if self.changes is not None:
+            return defer.succeed(self.changes[:])
+        if self._missedChanges is None:
+            self._missedChanges = []
+        d = master.db.changes.getRecentChanges(self.maxChanges)
+        def to_changes(chdicts):
+            return defer.gatherResults([
+                changes.Change.fromChdict(master, chdict)
+                for chdict in chdicts ])
+        d.addCallback(to_changes)
+        def keep(chs):
+            if self.changes is None:
+                self.changes = []
+                self._addChanges(chs + (self._missedChanges or []))
+                self._missedChanges = None
+            return self.changes[:]
+        d.addCallback(keep)
+        return d
+
+    def _addChanges(self, chs):
+        byNumber = dict((ch.number, ch) for ch in self.changes)
+        for ch in chs:
+            byNumber[ch.number] = ch
+        self.changes = [ byNumber[n]
+                         for n in sorted(byNumber)[-self.maxChanges:] ]
+
+    # status events
+
+    def changeAdded(self, change):
+        if self.changes is not None:
+            self._addChanges([change])
+        elif self._missedChanges is not None:
+            # a load is in progress, and may not see this change
+            self._missedChanges.append(change)
+
+    def builderRemoved(self, builderName):
+        self.columns.pop(builderName, None)
+        base.SubscribingStatusReceiver.builderRemoved(self, builderName)
+
+    def buildStarted(self, builderName, b):
+        column = self.columns.get(builderName)
+        if column:
+            column.buildStarted(b)
+
+    def buildFinished(self, builderName, b, results):
+        column = self.columns.get(builderName)
+        if column:
+            column.buildFinished(b)
+
+
 class WaterfallStatusResource(HtmlResource):
     """This builds the main status page, with the waterfall display, and
     all child pages."""
@@ -386,6 +687,11 @@ class WaterfallStatusResource(HtmlResource):
         # don't have any failed steps.
         return True
 
+    def getWaterfallCache(self, request):
+        getCache = getattr(request.site.buildbot_service,
+                           'getWaterfallCache', None)
+        return getCache and getCache()
+
     def content(self, request, ctx):
         status = self.getStatus(request)
         master = request.site.buildbot_service.master
@@ -397,30 +703,31 @@ class WaterfallStatusResource(HtmlResource):
         results = {}
 
         # recent changes
-        changes_d = master.db.changes.getRecentChanges(40)
-        def to_changes(chdicts):
-            return defer.gatherResults([
-                changes.Change.fromChdict(master, chdict)
-                for chdict in chdicts ])
-        changes_d.addCallback(to_changes)
+        cache = self.getWaterfallCache(request)
+        if cache:
+            changes_d = cache.getRecentChanges(master)
+        else:
+            changes_d = master.db.changes.getRecentChanges(40)
+            def to_changes(chdicts):
+                return defer.gatherResults([
+                    changes.Change.fromChdict(master, chdict)
+                    for chdict in chdicts ])
+            changes_d.addCallback(to_changes)
         def keep_changes(changes):
             results['changes'] = changes
         changes_d.addCallback(keep_changes)
 
-        # build request counts for each builder
+        # build request counts for each builder, all at once
         allBuilderNames = status.getBuilderNames(categories=self.categories)
-        brstatus_ds = []
         brcounts = {}
-        def keep_count(statuses, builderName):
-            brcounts[builderName] = len(statuses)
-        for builderName in allBuilderNames:
-            builder_status = status.getBuilder(builderName)
-            d = builder_status.getPendingBuildRequestStatuses()
-            d.addCallback(keep_count, builderName)
-            brstatus_ds.append(d)
+        brs_d = master.db.buildrequests.getUnclaimedBuildRequestCounts()
+        def keep_counts(counts):
+            for builderName in allBuilderNames:
+                brcounts[builderName] = counts.get(builderName, (0, None))[0]
+        brs_d.addCallback(keep_counts)
 
         # wait for it all to finish
-        d = defer.gatherResults([ changes_d ] + brstatus_ds)
+        d = defer.gatherResults([ changes_d, brs_d ])
         def call_content(_):
             return self.content_with_db_data(results['changes'],
                     brcounts, request, ctx)
@@ -562,10 +869,15 @@ class WaterfallStatusResource(HtmlResource):
         # (commit, all builders) if they have any events there. Build up the
         # array of events, and stop when we have a reasonable number.
 
-        commit_source = ChangeEventSource(changes)
+        commit_source = ChangeEventSource(changes[:])
 
         lastEventTime = util.now()
-        sources = [commit_source] + builders
+        cache = self.getWaterfallCache(request)
+        if cache:
+            sources = [commit_source] + [ cache.getColumn(b)
+                                          for b in builders ]
+        else:
+            sources = [commit_source] + builders
         changeNames = ["changes"]
         builderNames = map(lambda builder: builder.getName(), builders)
         sourceNames = changeNames + builderNames
@@ -588,6 +900,8 @@ class WaterfallStatusResource(HtmlResource):
                         # unfinished steps are always shown
                         if e.isFinished() and e.isHidden():
                             continue
+                    elif isinstance(e, StepSummary) and e.hidden:
+                        continue
 
                     break
                 event = interfaces.IStatusEvent(e)
@@ -151,7 +151,7 @@ class TrialTestCaseCounter(LogLineObserver):
     numTests = 0
     finished = False
 
-    def outLineReceived(self, line):
+    def outLinesReceived(self, lines):
         # different versions of Twisted emit different per-test lines with
         # the bwverbose reporter.
         #  2.0.0: testSlave (buildbot.test.test_runner.Create) ... [OK]
@@ -163,14 +163,18 @@ class TrialTestCaseCounter(LogLineObserver):
 
         if self.finished:
             return
-        if line.startswith("=" * 40):
-            self.finished = True
-            return
+        numTests = self.numTests
+        search = self._line_re.search
+        for line in lines:
+            if line.startswith("=" * 40):
+                self.finished = True
+                break
+            if search(line.strip()):
+                numTests += 1
 
-        m = self._line_re.search(line.strip())
-        if m:
-            testname, result = m.groups()
-            self.numTests += 1
+        # report progress once for the whole batch
+        if numTests != self.numTests:
+            self.numTests = numTests
             self.step.setProgress('tests', self.numTests)
 
 
@@ -374,10 +374,23 @@ class StringFileWriter(pb.Referenceable):
     def remote_close(self):
         pass
 
+class WarningCountingObserver(buildstep.LogObserver):
+    """
+    Passes the output of a L{WarningCountingShellCommand} to the step as it
+    arrives.
+    """
+
+    def outReceived(self, data):
+        self.step.warningOutputReceived(data)
+
+    def errReceived(self, data):
+        self.step.warningOutputReceived(data)
+
 class WarningCountingShellCommand(ShellCommand):
     renderables = [ 'suppressionFile' ]
 
     warnCount = 0
+    _warningObserver = None
     warningPattern = '.*warning[: ].*'
     # The defaults work for GNU Make.
     directoryEnterPattern = (u"make.*: Entering directory " 
@@ -388,6 +401,11 @@ class WarningCountingShellCommand(ShellCommand):
     commentEmptyLineRe = re.compile(r"^\s*(\#.*)?$")
     suppressionLineRe = re.compile(r"^\s*(.+?)\s*:\s*(.+?)\s*(?:[:]\s*([0-9]+)(?:-([0-9]+))?\s*)?$")
 
+    # expressions that cannot be combined with others without changing what
+    # they match: backreferences and anchors at the ends of the string
+    uncombinableRe = re.compile(r'\\[AZ1-9]|\(\?P=')
+    _defaultFlags = re.compile('').flags
+
     def __init__(self,
                  warningPattern=None, warningExtractor=None, maxWarnCount=None,
                  directoryEnterPattern=None, directoryLeavePattern=None,
@@ -485,6 +503,14 @@ class WarningCountingShellCommand(ShellCommand):
         self.warnCount += 1
 
     def start(self):
+        # count warnings as the output arrives, unless a subclass replaced
+        # createSummary to do its own parsing
+        if (self.createSummary.im_func is
+                WarningCountingShellCommand.createSummary.im_func):
+            self._startWarningCounting()
+            self._warningObserver = WarningCountingObserver()
+            self.addLogObserver('stdio', self._warningObserver)
+
         if self.suppressionFile == None:
             return ShellCommand.start(self)
 
@@ -524,65 +550,141 @@ class WarningCountingShellCommand(ShellCommand):
         self.addSuppression(list)
         return ShellCommand.start(self)
 
-    def createSummary(self, log):
+    def _compileWarningPatterns(self):
+        def toRe(pattern):
+            if isinstance(pattern, basestring):
+                return re.compile(pattern)
+            return pattern
+        self._warningRe = toRe(self.warningPattern)
+        self._directoryEnterRe = toRe(self.directoryEnterPattern)
+        self._directoryLeaveRe = toRe(self.directoryLeavePattern)
+
+        # a single expression that finds the lines any of those might match,
+        # so that the others are only tried on those lines
+        self._candidateRe = None
+        pieces = [ '^(?:%s)' % self._warningRe.pattern ]
+        for regex in (self._warningRe, self._directoryEnterRe,
+                      self._directoryLeaveRe):
+            if regex is None:
+                continue
+            if (regex.flags != self._defaultFlags
+                    or self.uncombinableRe.search(regex.pattern)):
+                return
+            if regex is not self._warningRe:
+                pieces.append('(?:%s)' % regex.pattern)
+        try:
+            self._candidateRe = re.compile('|'.join(pieces), re.MULTILINE)
+        except re.error:
+            pass
+
+    def _scanText(self, text, warnings):
         """
-        Match log lines against warningPattern.
+        Check each line of C{text} for warnings and changes of directory.
+        """
+        if self._candidateRe is None:
+            for line in text.split("\n"):
+                self._scanLine(line, warnings)
+            return
+
+        search = self._candidateRe.search
+        pos = 0
+        while True:
+            match = search(text, pos)
+            if not match:
+                break
+            start = text.rfind("\n", 0, match.start()) + 1
+            end = text.find("\n", match.start())
+            if end < 0:
+                self._scanLine(text[start:], warnings)
+                break
+            self._scanLine(text[start:end], warnings)
+            pos = end + 1
+
+    def _scanLine(self, line, warnings):
+        if self._directoryEnterRe:
+            match = self._directoryEnterRe.search(line)
+            if match:
+                self.directoryStack.append(match.group(1))
+                return
+        if (self._directoryLeaveRe and
+            self.directoryStack and
+            self._directoryLeaveRe.search(line)):
+                self.directoryStack.pop()
+                return
 
-        Warnings are collected into another log for this step, and the
-        build-wide 'warnings-count' is updated."""
+        match = self._warningRe.match(line)
+        if match:
+            self.maybeAddWarning(warnings, line, match)
 
+    def _startWarningCounting(self):
         self.warnCount = 0
-
-        # Now compile a regular expression from whichever warning pattern we're
-        # using
-        wre = self.warningPattern
-        if isinstance(wre, str):
-            wre = re.compile(wre)
-
-        directoryEnterRe = self.directoryEnterPattern
-        if (directoryEnterRe != None
-                and isinstance(directoryEnterRe, basestring)):
-            directoryEnterRe = re.compile(directoryEnterRe)
-
-        directoryLeaveRe = self.directoryLeavePattern
-        if (directoryLeaveRe != None
-                and isinstance(directoryLeaveRe, basestring)):
-            directoryLeaveRe = re.compile(directoryLeaveRe)
-
-        # Check if each line in the output from this command matched our
-        # warnings regular expressions. If did, bump the warnings count and
-        # add the line to the collection of lines with warnings
+        self.warningsLog = None
+        self.partialLine = ""
+        self._warningFailure = None
+        self._compileWarningPatterns()
+        self._baseWarningsStat = self.step_status.getStatistic('warnings', 0)
+        self._baseWarningsCount = self.getProperty("warnings-count", 0)
+
+    def warningOutputReceived(self, data):
+        """
+        Check the complete lines in a chunk of output for warnings.  Lines
+        with warnings are added to the 'warnings' log, and the build-wide
+        'warnings-count' is updated, as they are found.
+        """
+        if self._warningFailure is not None:
+            return
+        try:
+            self._warningOutputReceived(data)
+        except:
+            # fail the step once the command is done
+            self._warningFailure = failure.Failure()
+
+    def _warningOutputReceived(self, data):
+        end = data.rfind("\n")
+        if end < 0:
+            self.partialLine += data
+            return
+        text = self.partialLine + data[:end]
+        self.partialLine = data[end+1:]
+        self._addWarnings(text)
+
+    def _addWarnings(self, text):
         warnings = []
-        # TODO: use log.readlines(), except we need to decide about stdout vs
-        # stderr
-        for line in log.getText().split("\n"):
-            if directoryEnterRe:
-                match = directoryEnterRe.search(line)
-                if match:
-                    self.directoryStack.append(match.group(1))
-                    continue
-            if (directoryLeaveRe and
-                self.directoryStack and
-                directoryLeaveRe.search(line)):
-                    self.directoryStack.pop()
-                    continue
-
-            match = wre.match(line)
-            if match:
-                self.maybeAddWarning(warnings, line, match)
-
-        # If there were any warnings, make the log if lines with warnings
-        # available
-        if self.warnCount:
-            self.addCompleteLog("warnings (%d)" % self.warnCount,
-                    "\n".join(warnings) + "\n")
-
-        warnings_stat = self.step_status.getStatistic('warnings', 0)
-        self.step_status.setStatistic('warnings', warnings_stat + self.warnCount)
-
-        old_count = self.getProperty("warnings-count", 0)
-        self.setProperty("warnings-count", old_count + self.warnCount, "WarningCountingShellCommand")
+        self._scanText(text, warnings)
+        if not warnings:
+            return
+        if self.warningsLog is None:
+            self.warningsLog = self.addLog("warnings")
+        self.warningsLog.addStdout("\n".join(warnings) + "\n")
+        self._updateWarningCounts()
+
+    def _updateWarningCounts(self):
+        self.step_status.setStatistic('warnings',
+                self._baseWarningsStat + self.warnCount)
+        self.setProperty("warnings-count",
+                self._baseWarningsCount + self.warnCount,
+                "WarningCountingShellCommand")
 
+    def createSummary(self, log):
+        """
+        Finish matching log lines against warningPattern.
+
+        The output is checked as it arrives, so this only needs to check the
+        last line.  If the output was not observed (because start or
+        createSummary was overridden), the whole log is checked now."""
+
+        if self._warningObserver is None:
+            self._startWarningCounting()
+            for chunk in log.getChunks([STDOUT, STDERR], onlyText=True):
+                self._warningOutputReceived(chunk)
+        elif self._warningFailure is not None:
+            self._warningFailure.raiseException()
+
+        self._addWarnings(self.partialLine)
+        self.partialLine = ""
+        if self.warningsLog is not None:
+            self.warningsLog.finish()
+        self._updateWarningCounts()
 
     def evaluateCommand(self, cmd):
         if ( cmd.didFail() or
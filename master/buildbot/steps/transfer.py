@@ -16,19 +16,20 @@
 from __future__ import with_statement
 
 
-import os.path, tarfile, tempfile
+import os.path, tarfile, tempfile, threading, Queue
 try:
     from cStringIO import StringIO
     assert StringIO
 except ImportError:
     from StringIO import StringIO
-from twisted.internet import reactor
+from twisted.internet import reactor, defer
 from twisted.spread import pb
-from twisted.python import log
+from twisted.python import log, failure
 from buildbot.process import buildstep
 from buildbot.process.buildstep import BuildStep
 from buildbot.process.buildstep import SUCCESS, FAILURE, SKIPPED
 from buildbot.interfaces import BuildSlaveTooOldError
+from buildbot import util
 from buildbot.util import json
 from buildbot import config
 
@@ -50,6 +51,7 @@ class _FileWriter(pb.Referenceable):
         fd, self.tmpname = tempfile.mkstemp(dir=dirname)
         self.fp = os.fdopen(fd, 'wb')
         self.remaining = maxsize
+        self.bytes = 0
 
     def remote_write(self, data):
         """
@@ -66,6 +68,7 @@ class _FileWriter(pb.Referenceable):
             self.remaining = self.remaining - len(data)
         else:
             self.fp.write(data)
+        self.bytes += len(data)
 
     def remote_utime(self, accessed_modified):
         os.utime(self.destfile,accessed_modified)
@@ -130,45 +133,180 @@ def _extractall(self, path=".", members=None):
             else:
                 self._dbg(1, "tarfile: %s" % e)
 
-class _DirectoryWriter(_FileWriter):
+class _UnpackStream(object):
     """
-    A DirectoryWriter is implemented as a FileWriter, with an added post-processing
-    step to unpack the archive, once the transfer has completed.
+    A file object read by the unpacking thread of a L{_DirectoryWriter}, and
+    fed with blocks in the reactor.
     """
 
-    def __init__(self, destroot, maxsize, compress, mode):
-        self.destroot = destroot
-        self.compress = compress
+    _ABORT = object()
+
+    # how often a waiting read checks whether the transfer was cancelled
+    pollInterval = 1
+
+    def __init__(self, consumed):
+        self.queue = Queue.Queue()
+        self.consumed = consumed
+        self.leftover = ''
+        self.aborted = False
+
+    # reactor
+
+    def feed(self, data):
+        self.queue.put(data)
+
+    def end(self):
+        self.queue.put(None)
+
+    def abort(self):
+        self.aborted = True
+        self.queue.put(self._ABORT)
+
+    # unpacking thread
+
+    def _get(self):
+        # wait for the next block, without missing a cancellation that is
+        # queued behind blocks that have not been read yet
+        while not self.aborted:
+            try:
+                data = self.queue.get(timeout=self.pollInterval)
+            except Queue.Empty:
+                continue
+            reactor.callFromThread(self.consumed)
+            return data
+        return self._ABORT
+
+    def read(self, size=-1):
+        data = self.leftover
+        if not data:
+            data = self._get()
+            if data is self._ABORT:
+                raise IOError("transfer cancelled")
+            if data is None:
+                # leave the marker for any further reads
+                self.queue.put(None)
+                return ''
+        if size >= 0:
+            data, self.leftover = data[:size], data[size:]
+        else:
+            self.leftover = ''
+        return data
 
-        self.fd, self.tarname = tempfile.mkstemp()
-        os.close(self.fd)
 
-        _FileWriter.__init__(self, self.tarname, maxsize, mode)
+class _DirectoryWriter(pb.Referenceable):
+    """
+    Helper class that unpacks the tar stream sent by the slave.  The stream
+    is unpacked in a thread as it arrives, so the archive is never written to
+    disk.  If the thread falls behind by C{maxQueuedBlocks} blocks, writes
+    are not acknowledged until it catches up.  The thread is not taken from
+    the reactor's pool, since it spends most of its time waiting for the
+    slave.
+    """
 
-    def remote_unpack(self):
-        """
-        Called by remote slave to state that no more data will be transfered
-        """
-        # Make sure remote_close is called, otherwise atomic rename wont happen
-        self.remote_close()
+    maxQueuedBlocks = 16
+
+    def __init__(self, destroot, maxsize, compress):
+        self.destroot = destroot
+        self.compress = compress
+        self.remaining = maxsize
+        self.bytes = 0
+        self.stream = None
+        self.thread = None
+        self.unpacked = None
+        self.waiting = []
+        self.failure = None
+
+    def _startUnpacking(self):
+        if self.stream is None:
+            self.stream = _UnpackStream(self._blockConsumed)
+            self.unpacked = defer.Deferred()
+            self.unpacked.addErrback(self._unpackFailed)
+            self.thread = threading.Thread(target=self._runUnpack,
+                    args=(self.unpacked,),
+                    name="unpack to %s" % self.destroot)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _runUnpack(self, d):
+        # runs in a thread
+        try:
+            self._unpack()
+        except:
+            reactor.callFromThread(d.errback, failure.Failure())
+        else:
+            reactor.callFromThread(d.callback, None)
 
-        # Map configured compression to a TarFile setting
+    def _unpack(self):
+        # runs in a thread
         if self.compress == 'bz2':
             mode='r|bz2'
         elif self.compress == 'gz':
             mode='r|gz'
         else:
-            mode = 'r'
+            mode = 'r|'
 
         # Support old python
         if not hasattr(tarfile.TarFile, 'extractall'):
             tarfile.TarFile.extractall = _extractall
 
-        # Unpack archive and clean up after self
-        archive = tarfile.open(name=self.tarname, mode=mode)
+        archive = tarfile.open(mode=mode, fileobj=self.stream)
         archive.extractall(path=self.destroot)
         archive.close()
-        os.remove(self.tarname)
+
+        # consume any padding after the end of the archive
+        while self.stream.read(64*1024):
+            pass
+
+    def _unpackFailed(self, failure):
+        self.failure = failure
+        waiting, self.waiting = self.waiting, []
+        for d in waiting:
+            d.errback(failure)
+        return failure
+
+    def _blockConsumed(self):
+        while self.waiting and \
+                self.stream.queue.qsize() < self.maxQueuedBlocks:
+            self.waiting.pop(0).callback(None)
+
+    def remote_write(self, data):
+        """
+        Called from remote slave to add L{data} to the stream being unpacked,
+        within boundaries of L{maxsize}
+
+        @type  data: C{string}
+        @param data: String of data to write
+        """
+        if self.failure:
+            return defer.fail(self.failure)
+        if self.remaining is not None:
+            data = data[:self.remaining]
+            self.remaining = self.remaining - len(data)
+        self.bytes += len(data)
+        self._startUnpacking()
+        self.stream.feed(data)
+        if self.stream.queue.qsize() >= self.maxQueuedBlocks:
+            d = defer.Deferred()
+            self.waiting.append(d)
+            return d
+
+    def remote_unpack(self):
+        """
+        Called by remote slave to state that no more data will be transfered;
+        returns when the archive is unpacked
+        """
+        self._startUnpacking()
+        self.stream.end()
+        d, self.unpacked = self.unpacked, None
+        return d
+
+    def cancel(self):
+        # stop the unpacking thread if the transfer did not complete
+        if self.unpacked is None:
+            return
+        self.stream.abort()
+        self.unpacked.addErrback(lambda _ : None)
+        self.unpacked = None
 
 
 def makeStatusRemoteCommand(step, remote_command, args):
@@ -189,6 +327,15 @@ class _TransferBuildStep(BuildStep):
     haltOnFailure = True
     flunkOnFailure = True
 
+    # slaves from this version on can keep several blocks in flight, which
+    # makes larger blocks worthwhile, too
+    PIPELINED_SLAVE_VERSION = "2.16"
+    DEFAULT_BLOCKSIZE = 16*1024
+    PIPELINED_BLOCKSIZE = 64*1024
+
+    transfer = None # the _FileWriter or _FileReader, once started
+    transferStarted = None
+
     def setDefaultWorkdir(self, workdir):
         if self.workdir is None:
             self.workdir = workdir
@@ -200,6 +347,35 @@ class _TransferBuildStep(BuildStep):
             workdir = self.workdir
         return workdir
 
+    def _getBlockArgs(self, command):
+        """
+        Return the 'blocksize' argument, and the 'window' argument if the
+        slave supports it, for the remote command
+        """
+        if self.window > 1 and not self.slaveVersionIsOlderThan(command,
+                                            self.PIPELINED_SLAVE_VERSION):
+            blocksize = self.blocksize or self.PIPELINED_BLOCKSIZE
+            return dict(blocksize=blocksize, window=self.window)
+        return dict(blocksize=self.blocksize or self.DEFAULT_BLOCKSIZE)
+
+    def _runTransfer(self, command, args, transfer):
+        self.transfer = transfer
+        self.transferStarted = util.now()
+        self.cmd = makeStatusRemoteCommand(self, command, args)
+        return self.runCommand(self.cmd)
+
+    def _recordThroughput(self):
+        if self.transfer is None:
+            return
+        nbytes = self.transfer.bytes
+        elapsed = util.now() - self.transferStarted
+        self.step_status.setStatistic('bytes_transferred', nbytes)
+        if elapsed > 0:
+            rate = nbytes / elapsed
+            self.step_status.setStatistic('transfer_rate', rate)
+            log.msg("%s transferred %d bytes in %.1fs (%d bytes/s)"
+                    % (self.name, nbytes, elapsed, rate))
+
     def interrupt(self, reason):
         self.addCompleteLog('interrupt', str(reason))
         if self.cmd:
@@ -213,6 +389,7 @@ class _TransferBuildStep(BuildStep):
         if result == SKIPPED:
             return BuildStep.finished(self, SKIPPED)
 
+        self._recordThroughput()
         if self.cmd.didFail():
             return BuildStep.finished(self, FAILURE)
         return BuildStep.finished(self, SUCCESS)
@@ -225,8 +402,8 @@ class FileUpload(_TransferBuildStep):
     renderables = [ 'slavesrc', 'masterdest', 'url' ]
 
     def __init__(self, slavesrc, masterdest,
-                 workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 keepstamp=False, url=None,
+                 workdir=None, maxsize=None, blocksize=None, mode=None,
+                 keepstamp=False, url=None, window=8,
                  **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
 
@@ -235,6 +412,7 @@ class FileUpload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
@@ -277,12 +455,11 @@ class FileUpload(_TransferBuildStep):
             'workdir': self._getWorkdir(),
             'writer': fileWriter,
             'maxsize': self.maxsize,
-            'blocksize': self.blocksize,
             'keepstamp': self.keepstamp,
             }
+        args.update(self._getBlockArgs('uploadFile'))
 
-        self.cmd = makeStatusRemoteCommand(self, 'uploadFile', args)
-        d = self.runCommand(self.cmd)
+        d = self._runTransfer('uploadFile', args, fileWriter)
         @d.addErrback
         def cancel(res):
             fileWriter.cancel()
@@ -297,8 +474,8 @@ class DirectoryUpload(_TransferBuildStep):
     renderables = [ 'slavesrc', 'masterdest', 'url' ]
 
     def __init__(self, slavesrc, masterdest,
-                 workdir=None, maxsize=None, blocksize=16*1024,
-                 compress=None, url=None, **buildstep_kwargs):
+                 workdir=None, maxsize=None, blocksize=None,
+                 compress=None, url=None, window=8, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
 
         self.slavesrc = slavesrc
@@ -306,6 +483,7 @@ class DirectoryUpload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if compress not in (None, 'gz', 'bz2'):
             config.error(
                 "'compress' must be one of None, 'gz', or 'bz2'")
@@ -334,7 +512,7 @@ class DirectoryUpload(_TransferBuildStep):
             self.addURL(os.path.basename(masterdest), self.url)
         
         # we use maxsize to limit the amount of data on both sides
-        dirWriter = _DirectoryWriter(masterdest, self.maxsize, self.compress, 0600)
+        dirWriter = _DirectoryWriter(masterdest, self.maxsize, self.compress)
 
         # default arguments
         args = {
@@ -342,29 +520,17 @@ class DirectoryUpload(_TransferBuildStep):
             'workdir': self._getWorkdir(),
             'writer': dirWriter,
             'maxsize': self.maxsize,
-            'blocksize': self.blocksize,
             'compress': self.compress
             }
+        args.update(self._getBlockArgs('uploadDirectory'))
 
-        self.cmd = makeStatusRemoteCommand(self, 'uploadDirectory', args)
-        d = self.runCommand(self.cmd)
-        @d.addErrback
+        d = self._runTransfer('uploadDirectory', args, dirWriter)
+        @d.addBoth
         def cancel(res):
             dirWriter.cancel()
             return res
         d.addCallback(self.finished).addErrback(self.failed)
 
-    def finished(self, result):
-        # Subclasses may choose to skip a transfer. In those cases, self.cmd
-        # will be None, and we should just let BuildStep.finished() handle
-        # the rest
-        if result == SKIPPED:
-            return BuildStep.finished(self, SKIPPED)
-
-        if self.cmd.didFail():
-            return BuildStep.finished(self, FAILURE)
-        return BuildStep.finished(self, SUCCESS)
-
 
 class _FileReader(pb.Referenceable):
     """
@@ -373,6 +539,7 @@ class _FileReader(pb.Referenceable):
 
     def __init__(self, fp):
         self.fp = fp
+        self.bytes = 0
 
     def remote_read(self, maxlength):
         """
@@ -388,6 +555,7 @@ class _FileReader(pb.Referenceable):
             return ''
 
         data = self.fp.read(maxlength)
+        self.bytes += len(data)
         return data
 
     def remote_close(self):
@@ -406,8 +574,8 @@ class FileDownload(_TransferBuildStep):
     renderables = [ 'mastersrc', 'slavedest' ]
 
     def __init__(self, mastersrc, slavedest,
-                 workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 **buildstep_kwargs):
+                 workdir=None, maxsize=None, blocksize=None, mode=None,
+                 window=8, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
 
         self.mastersrc = mastersrc
@@ -415,6 +583,7 @@ class FileDownload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
@@ -454,13 +623,12 @@ class FileDownload(_TransferBuildStep):
             'slavedest': slavedest,
             'maxsize': self.maxsize,
             'reader': fileReader,
-            'blocksize': self.blocksize,
             'workdir': self._getWorkdir(),
             'mode': self.mode,
             }
+        args.update(self._getBlockArgs('downloadFile'))
 
-        self.cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
-        d = self.runCommand(self.cmd)
+        d = self._runTransfer('downloadFile', args, fileReader)
         d.addCallback(self.finished).addErrback(self.failed)
 
 class StringDownload(_TransferBuildStep):
@@ -470,8 +638,8 @@ class StringDownload(_TransferBuildStep):
     renderables = [ 'slavedest', 's' ]
 
     def __init__(self, s, slavedest,
-                 workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 **buildstep_kwargs):
+                 workdir=None, maxsize=None, blocksize=None, mode=None,
+                 window=8, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
 
         self.s = s
@@ -479,6 +647,7 @@ class StringDownload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
@@ -507,13 +676,12 @@ class StringDownload(_TransferBuildStep):
             'slavedest': slavedest,
             'maxsize': self.maxsize,
             'reader': fileReader,
-            'blocksize': self.blocksize,
             'workdir': self._getWorkdir(),
             'mode': self.mode,
             }
+        args.update(self._getBlockArgs('downloadFile'))
 
-        self.cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
-        d = self.runCommand(self.cmd)
+        d = self._runTransfer('downloadFile', args, fileReader)
         d.addCallback(self.finished).addErrback(self.failed)
 
 class JSONStringDownload(StringDownload):
@@ -372,11 +372,20 @@ class FakeChangesComponent(FakeDBComponent):
             repository=repository,
             project=project,
             codebase=codebase)
-        ch.files = files
+        ch.files = files or []
         ch.properties = properties
+        ch.uid = uid
 
         return defer.succeed(changeid)
 
+    @defer.inlineCallbacks
+    def addChanges(self, changes):
+        changeids = []
+        for ch in changes:
+            changeid = yield self.addChange(**ch)
+            changeids.append(changeid)
+        defer.returnValue(changeids)
+
     def getLatestChangeid(self):
         if self.changes:
             return defer.succeed(max(self.changes.iterkeys()))
@@ -406,6 +415,10 @@ class FakeChangesComponent(FakeDBComponent):
 
         return defer.succeed(chdict)
 
+    def getChanges(self, changeids):
+        return defer.gatherResults([ self.getChange(changeid)
+                                     for changeid in changeids ])
+
     def getChangeUids(self, changeid):
         try:
             ch_uids = [self.changes[changeid].uid]
@@ -413,7 +426,9 @@ class FakeChangesComponent(FakeDBComponent):
             ch_uids = []
         return defer.succeed(ch_uids)
 
-    # TODO: getRecentChanges
+    def getRecentChanges(self, count):
+        changeids = sorted(self.changes.iterkeys())[-count:]
+        return self.getChanges(changeids)
 
     # fake methods
 
@@ -908,6 +923,24 @@ class FakeBuildRequestsComponent(FakeDBComponent):
             rv.append(self._brdictFromRow(br))
         return defer.succeed(rv)
 
+    def getUnclaimedBuildRequests(self, buildername):
+        d = self.getBuildRequests(buildername=buildername, claimed=False)
+        d.addCallback(lambda brdicts :
+                sorted(brdicts, key=lambda brd : brd['submitted_at']))
+        return d
+
+    def getUnclaimedBuildRequestCounts(self):
+        d = self.getBuildRequests(claimed=False)
+        def count(brdicts):
+            counts = {}
+            for brd in sorted(brdicts, key=lambda brd : brd['submitted_at'],
+                              reverse=True):
+                n, _ = counts.get(brd['buildername'], (0, None))
+                counts[brd['buildername']] = (n + 1, brd['submitted_at'])
+            return counts
+        d.addCallback(count)
+        return d
+
     def claimBuildRequests(self, brids, claimed_at=None):
         for brid in brids:
             if brid not in self.reqs or brid in self.claims:
@@ -924,6 +957,16 @@ class FakeBuildRequestsComponent(FakeDBComponent):
                 objectid=self.MASTER_ID, claimed_at=claimed_at)
         return defer.succeed(None)
 
+    def claimBuildRequestGroups(self, groups, claimed_at=None):
+        won = []
+        for group in groups:
+            d = self.claimBuildRequests(group, claimed_at=claimed_at)
+            d.addCallbacks(lambda _ : True,
+                    lambda f : f.trap(buildrequests.AlreadyClaimedError)
+                                and False)
+            d.addCallback(won.append)
+        return defer.succeed(won)
+
     def reclaimBuildRequests(self, brids):
         for brid in brids:
             if brid not in self.claims:
@@ -36,6 +36,12 @@ class FakeCache(object):
         d.addCallback(mkref)
         return d
 
+    def get_cached(self, key):
+        return None
+
+    def add(self, key, value):
+        pass
+
 
 class FakeCaches(object):
 
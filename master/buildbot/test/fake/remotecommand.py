@@ -15,6 +15,7 @@
 
 from twisted.internet import defer
 from twisted.python import failure
+from buildbot.status import logfile
 from buildbot.status.logfile import STDOUT, STDERR, HEADER
 from cStringIO import StringIO
 
@@ -119,15 +120,28 @@ class FakeLogFile(object):
         return ''.join([ c for str,c in self.chunks
                            if str in (STDOUT, STDERR)])
 
-    def getChunks(self, channels=[], onlyText=False):
+    def getChunks(self, channels=[], onlyText=False, start=None, end=None,
+                  lastLines=None):
+        chunks = [ (ch, data)
+                   for (ch, data) in self.chunks
+                   if not channels or ch in channels ]
+        if start is not None or end is not None:
+            trimmed = []
+            position = 0
+            for ch, data in chunks:
+                lo = max((start or 0) - position, 0)
+                hi = len(data)
+                if end is not None:
+                    hi = min(end - position, hi)
+                position += len(data)
+                if data[lo:hi]:
+                    trimmed.append((ch, data[lo:hi]))
+            chunks = trimmed
+        if lastLines is not None:
+            chunks = logfile._lastLines(chunks, lastLines)
         if onlyText:
-            return [ data
-                        for (ch, data) in self.chunks
-                        if not channels or ch in channels ]
-        else:
-            return [ (ch, data)
-                        for (ch, data) in self.chunks
-                        if not channels or ch in channels ]
+            return [ data for (ch, data) in chunks ]
+        return chunks
 
     def finish(self):
         pass
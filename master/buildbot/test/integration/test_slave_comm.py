@@ -24,7 +24,7 @@ from buildbot.test.util import compat
 from buildbot.process import botmaster, builder
 from buildbot import pbmanager, buildslave, config
 from buildbot.status import master
-from buildbot.test.fake import fakemaster
+from buildbot.test.fake import fakemaster, fakedb
 
 class FakeSlaveBuilder(pb.Referenceable):
     """
@@ -81,9 +81,6 @@ class FakeBuilder(builder.Builder):
     def detached(self, slave):
         pass
 
-    def getOldestRequestTime(self):
-        return 0
-
     def maybeStartBuild(self):
         return defer.succeed(None)
 
@@ -108,6 +105,7 @@ class TestSlaveComm(unittest.TestCase):
 
     def setUp(self):
         self.master = fakemaster.make_master()
+        self.master.db = fakedb.FakeDBConnector(self)
         # set the slave port to a loopback address with unspecified
         # port
         self.pbmanager = self.master.pbmanager = pbmanager.PBManager()
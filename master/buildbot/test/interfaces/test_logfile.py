@@ -78,7 +78,8 @@ class Tests(interfaces.InterfaceTests):
     def test_signature_getChunks(self):
         log = self.makeLogFile()
         @self.assertArgSpecMatches(log.getChunks)
-        def getChunks(self, channels=[], onlyText=False):
+        def getChunks(self, channels=[], onlyText=False, start=None, end=None,
+                      lastLines=None):
             pass
 
     def test_signature_finish(self):
@@ -35,6 +35,7 @@ class TestAbstractBuildSlave(unittest.TestCase):
         self.assertEqual(bs.properties.getProperty('slavename'), 'bot')
         self.assertEqual(bs.access, [])
         self.assertEqual(bs.keepalive_interval, 3600)
+        self.assertEqual(bs.compress_updates, False)
 
     def test_constructor_full(self):
         lock1, lock2 = mock.Mock(name='lock1'), mock.Mock(name='lock2')
@@ -44,13 +45,15 @@ class TestAbstractBuildSlave(unittest.TestCase):
                 missing_timeout=120,
                 properties={'a':'b'},
                 locks=[lock1, lock2],
-                keepalive_interval=60)
+                keepalive_interval=60,
+                compress_updates=True)
         self.assertEqual(bs.max_builds, 2)
         self.assertEqual(bs.notify_on_missing, ['me@me.com'])
         self.assertEqual(bs.missing_timeout, 120)
         self.assertEqual(bs.properties.getProperty('a'), 'b')
         self.assertEqual(bs.access, [lock1, lock2])
         self.assertEqual(bs.keepalive_interval, 60)
+        self.assertEqual(bs.compress_updates, True)
 
     def test_constructor_notify_on_missing_not_list(self):
         bs = self.ConcreteBuildSlave('bot', 'pass',
@@ -93,7 +96,8 @@ class TestAbstractBuildSlave(unittest.TestCase):
                 notify_on_missing=['her@me.com'],
                 missing_timeout=121,
                 properties={'a':'c'},
-                keepalive_interval=61)
+                keepalive_interval=61,
+                compress_updates=True)
 
         old.updateSlave = mock.Mock(side_effect=lambda : defer.succeed(None))
 
@@ -104,6 +108,7 @@ class TestAbstractBuildSlave(unittest.TestCase):
         self.assertEqual(old.missing_timeout, 121)
         self.assertEqual(old.properties.getProperty('a'), 'c')
         self.assertEqual(old.keepalive_interval, 61)
+        self.assertEqual(old.compress_updates, True)
         self.assertEqual(self.master.pbmanager._registrations, [])
         self.assertTrue(old.updateSlave.called)
 
@@ -24,6 +24,16 @@ from buildbot.util import epoch2datetime
 # Test that environment variables get propagated to subprocesses (See #2116)
 os.environ['TEST_THAT_ENVIRONMENT_GETS_PASSED_TO_SUBPROCESSES'] = 'TRUE'
 
+def gitLog(*commits):
+    "Fake the output of 'git log' run by GitPoller._get_commits"
+    out = []
+    for rev, timestamp, author, comments, files in commits:
+        out.append('\0%s\0%s\0%s\0%s\n\0\0' % (rev, timestamp, author,
+                                               comments))
+        if files:
+            out.append('\n' + ''.join([ f + '\0' for f in files ]))
+    return ''.join(out)
+
 class GitOutputParsing(gpo.GetProcessOutputMixin, unittest.TestCase):
     """Test GitPoller methods for parsing git output"""
     def setUp(self):
@@ -32,74 +42,69 @@ class GitOutputParsing(gpo.GetProcessOutputMixin, unittest.TestCase):
 
     def tearDown(self):
         self.tearDownGetProcessOutput()
-        
-    def _perform_git_output_test(self, methodToTest,
-                                 desiredGoodOutput, desiredGoodResult,
-                                 emptyRaisesException=True):
-        dummyRevStr = '12345abcde'
-
-        # make this call to self.patch here so that we raise a SkipTest if it
-        # is not supported
-        self.addGetProcessOutputResult(self.gpoAnyPattern(), '')
-
-        d = defer.succeed(None)
-        def call_empty(_):
-            # we should get an Exception with empty output from git
-            return methodToTest(dummyRevStr)
-        d.addCallback(call_empty)
-    
-        def cb_empty(_):
-            if emptyRaisesException:
-                self.fail("getProcessOutput should have failed on empty output")
-        def eb_empty(f):
-            if not emptyRaisesException:
-                self.fail("getProcessOutput should NOT have failed on empty output")
-        d.addCallbacks(cb_empty, eb_empty)
-
-        # and the method shouldn't supress any exceptions
-        def call_exception(_):
-            # we should get an Exception with empty output from git
-            self.addGetProcessOutputResult(self.gpoAnyPattern(),
-                    lambda b, a, **k: defer.fail(Exception('fake')))
-            return methodToTest(dummyRevStr)
-        d.addCallback(call_exception)
-    
-        def cb_exception(_):
-            self.fail("getProcessOutput should have failed on empty output")
-        def eb_exception(f):
-            pass
-        d.addCallbacks(cb_exception, eb_exception)
-
-        # finally we should get what's expected from good output
-        def call_desired(_):
-            self.addGetProcessOutputResult(self.gpoAnyPattern(),
-                desiredGoodOutput)
-            return methodToTest(dummyRevStr)
-        d.addCallback(call_desired)
-    
-        def cb_desired(r):
-            self.assertEquals(r, desiredGoodResult)
-        d.addCallback(cb_desired)
-        
-    def test_get_commit_author(self):
-        authorStr = 'Sammy Jankis <email@example.com>'
-        return self._perform_git_output_test(self.poller._get_commit_author,
-                authorStr, authorStr)
-        
-    def test_get_commit_comments(self):
-        commentStr = 'this is a commit message\n\nthat is multiline'
-        return self._perform_git_output_test(self.poller._get_commit_comments,
-                commentStr, commentStr)
-        
-    def test_get_commit_files(self):
-        filesStr = 'file1\nfile2'
-        return self._perform_git_output_test(self.poller._get_commit_files, filesStr, 
-                                      filesStr.split(), emptyRaisesException=False)    
-        
-    def test_get_commit_timestamp(self):
-        stampStr = '1273258009'
-        return self._perform_git_output_test(self.poller._get_commit_timestamp,
-                stampStr, float(stampStr))
+
+    def test_parse_log(self):
+        output = gitLog(
+            ('4423cdbc', '1273258009', 'Sammy Jankis <email@example.com>',
+             'this is a commit message\n\nthat is multiline',
+             ['file1', 'dir/file 2']),
+            ('64a5dc2a', '1273258010', 'Leonard <l@example.com>',
+             'empty', []),
+            ('8d1f6b3e', '1273258011', 'Natalie <n@example.com>',
+             'last', ['file3']))
+        self.assertEqual(self.poller._parse_log(output), [
+            ('4423cdbc', 1273258009.0, u'Sammy Jankis <email@example.com>',
+             ['file1', 'dir/file 2'],
+             u'this is a commit message\n\nthat is multiline'),
+            ('64a5dc2a', 1273258010.0, u'Leonard <l@example.com>', [],
+             u'empty'),
+            ('8d1f6b3e', 1273258011.0, u'Natalie <n@example.com>', ['file3'],
+             u'last'),
+        ])
+
+    def test_parse_log_empty(self):
+        self.assertEqual(self.poller._parse_log(''), [])
+
+    def test_parse_log_no_timestamps(self):
+        self.poller.usetimestamps = False
+        output = gitLog(('4423cdbc', '1273258009', 'a <a@b>', 'x', []))
+        self.assertEqual(self.poller._parse_log(output)[0][1], None)
+
+    def test_parse_log_bad_timestamp(self):
+        output = gitLog(('4423cdbc', 'xyz', 'a <a@b>', 'x', []))
+        self.assertRaises(ValueError,
+                lambda : self.poller._parse_log(output))
+
+    def test_parse_log_no_author(self):
+        output = gitLog(('4423cdbc', '1273258009', ' ', 'x', []))
+        self.assertRaises(EnvironmentError,
+                lambda : self.poller._parse_log(output))
+
+    def test_parse_log_no_comments(self):
+        output = gitLog(('4423cdbc', '1273258009', 'a <a@b>', '', []))
+        self.assertRaises(EnvironmentError,
+                lambda : self.poller._parse_log(output))
+
+    def test_get_commits(self):
+        def log(bin, args, **kwargs):
+            self.assertEqual(args, ['log', 'master..origin/master',
+                '--format=' + gitpoller.GitPoller.LOG_FORMAT,
+                '--name-only', '-z'])
+            return gitLog(('4423cdbc', '1273258009', 'a <a@b>', 'x', ['f']))
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'log'), log)
+        d = self.poller._get_commits('master')
+        def check(commits):
+            self.assertEqual(commits,
+                    [ ('4423cdbc', 1273258009.0, u'a <a@b>', ['f'], u'x') ])
+        d.addCallback(check)
+        return d
+
+    def test_get_commits_failure(self):
+        self.addGetProcessOutputResult(self.gpoAnyPattern(),
+                lambda b, a, **k: defer.fail(Exception('fake')))
+        d = self.poller._get_commits('master')
+        return self.assertFailure(d, Exception)
 
     # _get_changes is tested in TestGitPoller, below
 
@@ -139,28 +144,14 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                 "no interesting output")
         self.addGetProcessOutputResult(
                 self.gpoSubcommandPattern('git', 'log'),
-                '\n'.join([
-                    '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                    '4423cdbcbb89c14e50dd5f4152415afd686c5241']))
+                gitLog(('64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
+                        '1273258009', 'by:64a5dc2a', 'hello!', ['/etc/64a']),
+                       ('4423cdbcbb89c14e50dd5f4152415afd686c5241',
+                        '1273258009', 'by:4423cdbc', 'hello!', ['/etc/442'])))
         self.addGetProcessOutputAndValueResult(
                 self.gpoSubcommandPattern('git', 'reset'),
                 ('done', '', 0))
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         d = self.poller.poll()
 
@@ -183,3 +174,52 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
         d.addCallback(check_changes)
 
         return d
+
+    def test_poll_branches(self):
+        self.poller = gitpoller.GitPoller('git@example.com:foo/baz.git',
+                branches=['master', 'release', 'stable'])
+        self.poller.master = self.master
+
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'fetch'),
+                "no interesting output")
+        logs = {
+            'master..origin/master' :
+                gitLog(('4423cdbc', '1273258009', 'a <a@b>', 'on master',
+                        ['f'])),
+            'release..origin/release' : '',
+            'stable..origin/stable' :
+                gitLog(('8d1f6b3e', '1273258011', 'a <a@b>', 'second', []),
+                       ('64a5dc2a', '1273258010', 'a <a@b>', 'first', [])),
+        }
+        for i in range(3):
+            self.addGetProcessOutputResult(
+                    self.gpoSubcommandPattern('git', 'log'),
+                    lambda bin, args, **kw : logs[args[1]])
+        catch_up = []
+        def record(bin, args, **kw):
+            catch_up.append(args)
+            return ('', '', 0)
+        self.addGetProcessOutputAndValueResult(
+                self.gpoSubcommandPattern('git', 'reset'), record)
+        self.addGetProcessOutputAndValueResult(
+                self.gpoSubcommandPattern('git', 'branch'), record)
+
+        d = self.poller.poll()
+        def check(_):
+            self.assertEqual(
+                [ (ch['revision'], ch['branch'], ch['comments'])
+                  for ch in self.changes_added ],
+                [ ('4423cdbc', 'master', u'on master'),
+                  ('64a5dc2a', 'stable', u'first'),
+                  ('8d1f6b3e', 'stable', u'second') ])
+            self.assertEqual(catch_up, [
+                ['reset', '--hard', 'origin/master'],
+                ['branch', '-f', 'stable', 'origin/stable'] ])
+        d.addCallback(check)
+        return d
+
+    def test_describe_branches(self):
+        poller = gitpoller.GitPoller('git@example.com:foo/baz.git',
+                branches=['master', 'release'])
+        self.assertSubstring("master, release", poller.describe())
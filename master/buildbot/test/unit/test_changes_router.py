@@ -0,0 +1,158 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import re
+from twisted.trial import unittest
+from buildbot.changes import router
+from buildbot.changes.filter import ChangeFilter
+from buildbot.process import metrics
+
+class Change(object):
+    def __init__(self, branch='master', project='', repository='',
+                 category=None):
+        self.branch = branch
+        self.project = project
+        self.repository = repository
+        self.category = category
+
+    def __repr__(self):
+        return '<Change %s>' % (self.branch,)
+
+
+class ChangeRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.router = router.ChangeRouter()
+        self.evaluated = []
+        self.counts = {}
+        def log(counter, count=1, absolute=False):
+            self.counts[counter] = self.counts.get(counter, 0) + count
+        self.patch(metrics.MetricCountEvent, 'log', staticmethod(log))
+
+    def addRoute(self, name, **filter_args):
+        # count the evaluations of each filter; an instance attribute does not
+        # stop the router from indexing the filter
+        cf = ChangeFilter(**filter_args)
+        filter_change = cf.filter_change
+        def spy(change):
+            self.evaluated.append(name)
+            return filter_change(change)
+        cf.filter_change = spy
+        return self.router.addRoute(cf, name)
+
+    def route(self, change):
+        self.evaluated = []
+        return [ r.consumer for r in self.router.getRoutes(change) ]
+
+    def test_unfiltered(self):
+        self.router.addRoute(None, 'all')
+        self.assertEqual(self.route(Change()), [ 'all' ])
+
+    def test_exact(self):
+        self.addRoute('master', branch='master')
+        self.addRoute('release', branch=['release', 'stable'])
+        self.addRoute('proj', project='proj')
+        self.addRoute('trunk', branch=None)
+        self.assertEqual(self.route(Change(branch='stable')), [ 'release' ])
+        self.assertEqual(self.evaluated, [ 'release' ])
+        self.assertEqual(self.route(Change(branch=None, project='proj')),
+                         [ 'proj', 'trunk' ])
+        self.assertEqual(self.evaluated, [ 'proj', 'trunk' ])
+        self.assertEqual(self.route(Change(branch='other')), [])
+        self.assertEqual(self.evaluated, [])
+
+    def test_exact_other_checks(self):
+        # the filter is indexed on the branch, but its other checks still apply
+        self.addRoute('x', branch='master', project_re='^x')
+        self.assertEqual(self.route(Change(project='xyz')), [ 'x' ])
+        self.assertEqual(self.route(Change(project='abc')), [])
+        self.assertEqual(self.evaluated, [ 'x' ])
+
+    def test_regex(self):
+        self.addRoute('feature', branch_re='feature/')
+        self.addRoute('bugfix', branch_re=re.compile('bug'))
+        self.assertEqual(self.route(Change(branch='feature/x')),
+                         [ 'feature' ])
+        self.assertEqual(self.route(Change(branch='master')), [])
+        # the combined expression rejected the change without evaluating
+        # either filter
+        self.assertEqual(self.evaluated, [])
+        self.assertEqual(self.route(Change(branch=None)), [])
+        self.assertEqual(self.evaluated, [])
+
+    def test_regex_not_combinable(self):
+        # expressions with groups or flags are not combined, but still work
+        self.addRoute('groups', branch_re=r'(a)\1')
+        self.addRoute('flags', branch_re=re.compile('b', re.I))
+        self.addRoute('plain', branch_re='c')
+        self.assertEqual(self.route(Change(branch='aa')), [ 'groups' ])
+        self.assertEqual(self.route(Change(branch='B')), [ 'flags' ])
+        self.assertEqual(self.route(Change(branch='c')), [ 'plain' ])
+        self.assertEqual(self.route(Change(branch='x')), [])
+        self.assertEqual(self.evaluated, [ 'groups', 'flags' ])
+
+    def test_unindexed(self):
+        self.addRoute('fn', filter_fn=lambda c : c.branch.startswith('m'))
+        self.addRoute('branch_fn', branch_fn=lambda b : b == 'x')
+        self.assertEqual(self.route(Change(branch='master')), [ 'fn' ])
+        self.assertEqual(self.evaluated, [ 'fn', 'branch_fn' ])
+
+    def test_subclass(self):
+        # a subclass may accept changes that its checks would reject
+        class AlwaysFilter(ChangeFilter):
+            def filter_change(self, change):
+                return True
+        self.router.addRoute(AlwaysFilter(branch='master'), 'always')
+        self.assertEqual(self.route(Change(branch='other')), [ 'always' ])
+
+    def test_order(self):
+        self.addRoute('a', branch_re='m')
+        self.router.addRoute(None, 'b')
+        self.addRoute('c', branch='master')
+        self.assertEqual(self.route(Change()), [ 'a', 'b', 'c' ])
+
+    def test_unsubscribe(self):
+        route = self.addRoute('master', branch='master')
+        self.assertEqual(self.route(Change()), [ 'master' ])
+        route.unsubscribe()
+        self.assertEqual(self.route(Change()), [])
+        self.addRoute('master2', branch='master')
+        self.assertEqual(self.route(Change()), [ 'master2' ])
+
+    def test_filter_exception(self):
+        self.addRoute('broken', filter_fn=lambda c : 1/0)
+        self.addRoute('master', branch='master')
+        self.assertEqual(self.route(Change()), [ 'master' ])
+        self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 1)
+
+    def test_metrics(self):
+        self.addRoute('master', branch='master')
+        self.addRoute('release', branch='release')
+        self.router.addRoute(None, 'all')
+        self.route(Change())
+        self.route(Change(branch='other'))
+        self.assertEqual(self.counts, {
+            'ChangeRouter.changes_routed' : 2,
+            'ChangeRouter.filter_evaluations' : 1 })
+
+    def test_routeChanges(self):
+        self.addRoute('master', branch='master')
+        self.addRoute('release', branch='release')
+        self.router.addRoute(None, 'all')
+        ch1, ch2, ch3 = Change(), Change(branch='release'), Change()
+        self.assertEqual(self.router.routeChanges([ ch1, ch2, ch3 ]), [
+            ('master', [ ch1, ch3 ]),
+            ('release', [ ch2 ]),
+            ('all', [ ch1, ch2, ch3 ]) ])
@@ -46,6 +46,8 @@ global_defaults = dict(
     properties=properties.Properties(),
     mergeRequests=None,
     prioritizeBuilders=None,
+    batchBuildRequestClaims=False,
+    builderConcurrency=1,
     slavePortnum=None,
     multiMaster=False,
     debugPassword=None,
@@ -153,7 +155,7 @@ class MasterConfig(ConfigErrorsMixin, dirs.DirsMixin, unittest.TestCase):
                 db_url='sqlite:///state.sqlite',
                 db_poll_interval=None),
             metrics = None,
-            caches = dict(Changes=10, Builds=15),
+            caches = dict(Changes=10, Builds=15, BuildRequests=5000),
             schedulers = {},
             builders = [],
             slaves = [],
@@ -360,10 +362,14 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.do_test_load_global(dict(logCompressionMethod='gz'),
                                  logCompressionMethod='gz')
 
+    def test_load_global_logCompressionMethod_blocks(self):
+        self.do_test_load_global(dict(logCompressionMethod='blocks'),
+                                 logCompressionMethod='blocks')
+
     def test_load_global_logCompressionMethod_invalid(self):
         self.cfg.load_global(self.filename,
                 dict(logCompressionMethod='foo'), self.errors)
-        self.assertConfigError(self.errors, "must be 'bz2' or 'gz'")
+        self.assertConfigError(self.errors, "must be 'bz2', 'gz', or 'blocks'")
 
     def test_load_global_logMaxSize(self):
         self.do_test_load_global(dict(logMaxSize=123), logMaxSize=123)
@@ -406,6 +412,19 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
                 dict(prioritizeBuilders='yes'), self.errors)
         self.assertConfigError(self.errors, "must be a callable")
 
+    def test_load_global_batchBuildRequestClaims(self):
+        self.do_test_load_global(dict(batchBuildRequestClaims=True),
+                batchBuildRequestClaims=True)
+
+    def test_load_global_builderConcurrency(self):
+        self.do_test_load_global(dict(builderConcurrency=10),
+                builderConcurrency=10)
+
+    def test_load_global_builderConcurrency_invalid(self):
+        self.cfg.load_global(self.filename,
+                dict(builderConcurrency=0), self.errors)
+        self.assertConfigError(self.errors, "must be at least 1")
+
     def test_load_global_slavePortnum_int(self):
         self.do_test_load_global(dict(slavePortnum=123),
                 slavePortnum='tcp:123')
@@ -510,7 +529,8 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
 
     def test_load_caches_defaults(self):
         self.cfg.load_caches(self.filename, {}, self.errors)
-        self.assertResults(caches=dict(Changes=10, Builds=15))
+        self.assertResults(caches=dict(Changes=10, Builds=15,
+                                       BuildRequests=5000))
 
     def test_load_caches_invalid(self):
         self.cfg.load_caches(self.filename, dict(caches=13), self.errors)
@@ -520,7 +540,8 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.cfg.load_caches(self.filename,
                 dict(buildCacheSize=13),
                 self.errors)
-        self.assertResults(caches=dict(Builds=13, Changes=10))
+        self.assertResults(caches=dict(Builds=13, Changes=10,
+                                       BuildRequests=5000))
 
     def test_load_caches_buildCacheSize_and_caches(self):
         self.cfg.load_caches(self.filename,
@@ -532,7 +553,8 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.cfg.load_caches(self.filename,
                 dict(changeCacheSize=13),
                 self.errors)
-        self.assertResults(caches=dict(Changes=13, Builds=15))
+        self.assertResults(caches=dict(Changes=13, Builds=15,
+                                       BuildRequests=5000))
 
     def test_load_caches_changeCacheSize_and_caches(self):
         self.cfg.load_caches(self.filename,
@@ -544,7 +566,8 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.cfg.load_caches(self.filename,
                 dict(caches=dict(foo=1)),
                 self.errors)
-        self.assertResults(caches=dict(Changes=10, Builds=15, foo=1))
+        self.assertResults(caches=dict(Changes=10, Builds=15, foo=1,
+                                       BuildRequests=5000))
 
     def test_load_caches_entries_test(self):
         self.cfg.load_caches(self.filename,
@@ -424,6 +424,43 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_claimBuildRequestGroups(self):
+        clock = task.Clock()
+        clock.advance(1300305712)
+
+        d = self.insertTestData([
+            fakedb.BuildRequest(id=44, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=45, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=46, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=47, buildsetid=self.BSID),
+            fakedb.BuildRequestClaim(brid=46, objectid=self.OTHER_MASTER_ID,
+                    claimed_at=1300103810),
+        ])
+        d.addCallback(lambda _ :
+            self.db.buildrequests.claimBuildRequestGroups(
+                [ [ 44, 45 ], [ 46, 47 ] ], _reactor=clock))
+        def check(won):
+            self.assertEqual(won, [ True, False ])
+            def thd(conn):
+                tbl = self.db.model.buildrequest_claims
+                results = conn.execute(tbl.select()).fetchall()
+                self.assertEqual(
+                    sorted([ (r.brid, r.claimed_at, r.objectid)
+                             for r in results ]),
+                    [ (44, 1300305712, self.MASTER_ID),
+                      (45, 1300305712, self.MASTER_ID),
+                      (46, 1300103810, self.OTHER_MASTER_ID) ])
+            return self.db.pool.do(thd)
+        d.addCallback(check)
+        return d
+
+    def test_claimBuildRequestGroups_empty(self):
+        d = self.db.buildrequests.claimBuildRequestGroups([])
+        def check(won):
+            self.assertEqual(won, [])
+        d.addCallback(check)
+        return d
+
     def do_test_reclaimBuildRequests(self, rows, now, brids, expected=None,
                                   expfailure=None):
         clock = task.Clock()
@@ -675,3 +712,247 @@ class TestBuildsetsConnectorComponent(
             lambda : self.db.buildrequests.unclaimBuildRequests(to_unclaim),
             [44, 45, 47, 48])
 
+
+    def do_test_getUnclaimedBuildRequests(self, rows):
+        d = self.insertTestData(rows)
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getUnclaimedBuildRequests('bbb'))
+        return d
+
+    def test_getUnclaimedBuildRequests(self):
+        d = self.do_test_getUnclaimedBuildRequests([
+            fakedb.BuildRequest(id=44, buildsetid=self.BSID,
+                buildername="bbb", submitted_at=self.SUBMITTED_AT_EPOCH+10),
+            fakedb.BuildRequest(id=45, buildsetid=self.BSID,
+                buildername="bbb", submitted_at=self.SUBMITTED_AT_EPOCH),
+            fakedb.BuildRequest(id=46, buildsetid=self.BSID,
+                buildername="bbb", complete=1),
+            fakedb.BuildRequest(id=47, buildsetid=self.BSID,
+                buildername="bbb"),
+            fakedb.BuildRequestClaim(brid=47, objectid=self.OTHER_MASTER_ID,
+                claimed_at=self.CLAIMED_AT_EPOCH),
+            fakedb.BuildRequest(id=48, buildsetid=self.BSID,
+                buildername="ccc"),
+        ])
+        def check(brlist):
+            self.assertEqual([ br['brid'] for br in brlist ], [ 45, 44 ])
+        d.addCallback(check)
+        return d
+
+    def test_getUnclaimedBuildRequests_indexed(self):
+        d = self.do_test_getUnclaimedBuildRequests([
+            fakedb.BuildRequest(id=44, buildsetid=self.BSID,
+                buildername="bbb"),
+        ])
+        # rows added behind the index's back are not seen..
+        d.addCallback(lambda _ :
+            self.insertTestData([
+                fakedb.BuildRequest(id=45, buildsetid=self.BSID,
+                    buildername="bbb"),
+            ]))
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getUnclaimedBuildRequests('bbb'))
+        def check(brlist):
+            self.assertEqual([ br['brid'] for br in brlist ], [ 44 ])
+        d.addCallback(check)
+        # ..until a query for unclaimed requests refreshes it
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getBuildRequests(claimed=False))
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getUnclaimedBuildRequests('bbb'))
+        def check_refreshed(brlist):
+            self.assertEqual([ br['brid'] for br in brlist ], [ 44, 45 ])
+        d.addCallback(check_refreshed)
+        return d
+
+    def test_getUnclaimedBuildRequests_claim_unclaim(self):
+        d = self.do_test_getUnclaimedBuildRequests([
+            fakedb.BuildRequest(id=44, buildsetid=self.BSID,
+                buildername="bbb"),
+            fakedb.BuildRequest(id=45, buildsetid=self.BSID,
+                buildername="bbb"),
+        ])
+        d.addCallback(lambda _ :
+                self.db.buildrequests.claimBuildRequests([44]))
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getUnclaimedBuildRequests('bbb'))
+        def check_claimed(brlist):
+            self.assertEqual([ br['brid'] for br in brlist ], [ 45 ])
+        d.addCallback(check_claimed)
+        d.addCallback(lambda _ :
+                self.db.buildrequests.unclaimBuildRequests([44]))
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getUnclaimedBuildRequests('bbb'))
+        def check_unclaimed(brlist):
+            self.assertEqual([ br['brid'] for br in brlist ], [ 44, 45 ])
+        d.addCallback(check_unclaimed)
+        return d
+
+    def test_getUnclaimedBuildRequests_claimed_elsewhere(self):
+        d = self.do_test_getUnclaimedBuildRequests([
+            fakedb.BuildRequest(id=44, buildsetid=self.BSID,
+                buildername="bbb"),
+            fakedb.BuildRequest(id=45, buildsetid=self.BSID,
+                buildername="bbb"),
+        ])
+        # another master claims 44 without the index knowing
+        d.addCallback(lambda _ :
+            self.insertTestData([
+                fakedb.BuildRequestClaim(brid=44,
+                    objectid=self.OTHER_MASTER_ID,
+                    claimed_at=self.CLAIMED_AT_EPOCH),
+            ]))
+        d.addCallback(lambda _ :
+                self.db.buildrequests.claimBuildRequests([44]))
+        def claim_failed(f):
+            f.trap(buildrequests.AlreadyClaimedError)
+        d.addCallbacks(lambda _ : self.fail("claim should fail"),
+                       claim_failed)
+        # the builder is re-queried after the failed claim
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getUnclaimedBuildRequests('bbb'))
+        def check(brlist):
+            self.assertEqual([ br['brid'] for br in brlist ], [ 45 ])
+        d.addCallback(check)
+        return d
+
+    def test_getUnclaimedBuildRequestCounts(self):
+        d = self.insertTestData([
+            fakedb.BuildRequest(id=44, buildsetid=self.BSID,
+                buildername="bbb", submitted_at=self.SUBMITTED_AT_EPOCH+10),
+            fakedb.BuildRequest(id=45, buildsetid=self.BSID,
+                buildername="bbb", submitted_at=self.SUBMITTED_AT_EPOCH),
+            fakedb.BuildRequest(id=46, buildsetid=self.BSID,
+                buildername="bbb", complete=1),
+            fakedb.BuildRequest(id=47, buildsetid=self.BSID,
+                buildername="ddd"),
+            fakedb.BuildRequestClaim(brid=47, objectid=self.OTHER_MASTER_ID,
+                claimed_at=self.CLAIMED_AT_EPOCH),
+            fakedb.BuildRequest(id=48, buildsetid=self.BSID,
+                buildername="ccc", submitted_at=self.SUBMITTED_AT_EPOCH+5),
+        ])
+        expected = {
+            'bbb' : (2, self.SUBMITTED_AT),
+            'ccc' : (1, self.SUBMITTED_AT + datetime.timedelta(seconds=5)),
+        }
+        # counted with a query..
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getUnclaimedBuildRequestCounts())
+        d.addCallback(self.assertEqual, expected)
+        # ..or from the index, once it is loaded
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getUnclaimedBuildRequests('bbb'))
+        d.addCallback(lambda _ :
+                self.assertTrue(self.db.buildrequests.unclaimed.isCurrent()))
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getUnclaimedBuildRequestCounts())
+        d.addCallback(self.assertEqual, expected)
+        return d
+
+    def test_getUnclaimedBuildRequestCounts_reused(self):
+        clock = task.Clock()
+        def getCounts():
+            return self.db.buildrequests.getUnclaimedBuildRequestCounts(
+                    _reactor=clock)
+        def addRequest(brid):
+            return self.insertTestData([
+                fakedb.BuildRequest(id=brid, buildsetid=self.BSID,
+                    buildername="bbb"),
+            ])
+        def checkCount(counts, n):
+            self.assertEqual(counts['bbb'][0], n)
+        d = addRequest(44)
+        d.addCallback(lambda _ : getCounts())
+        d.addCallback(checkCount, 1)
+        # a request added behind the index's back is not counted at first..
+        d.addCallback(lambda _ : addRequest(45))
+        d.addCallback(lambda _ : getCounts())
+        d.addCallback(checkCount, 1)
+        # ..but is once the counts are too old
+        d.addCallback(lambda _ :
+            clock.advance(self.db.buildrequests.unclaimedCountsMaxAge))
+        d.addCallback(lambda _ : getCounts())
+        d.addCallback(checkCount, 2)
+        # and a claim is counted immediately
+        d.addCallback(lambda _ :
+                self.db.buildrequests.claimBuildRequests([44]))
+        d.addCallback(lambda _ : getCounts())
+        d.addCallback(checkCount, 1)
+        return d
+
+
+class TestUnclaimedBuildRequestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.idx = buildrequests.UnclaimedBuildRequestIndex()
+
+    def mkbrd(self, brid, buildername='bbb', submitted_at=None):
+        return buildrequests.BrDict(brid=brid, buildername=buildername,
+                submitted_at=epoch2datetime(submitted_at or brid))
+
+    def brids(self, buildername='bbb'):
+        return [ brd['brid']
+                 for brd in self.idx.getBuildRequests(buildername) ]
+
+    def test_load(self):
+        self.assertFalse(self.idx.isCurrent('bbb'))
+        tok = self.idx.startLoad()
+        self.idx.finishLoad(tok, [ self.mkbrd(3), self.mkbrd(1),
+                                   self.mkbrd(2, buildername='ccc') ])
+        self.assertTrue(self.idx.isCurrent('bbb'))
+        self.assertEqual(self.brids(), [ 1, 3 ])
+        self.assertEqual(self.brids('ccc'), [ 2 ])
+
+    def test_getCounts(self):
+        tok = self.idx.startLoad()
+        self.idx.finishLoad(tok, [ self.mkbrd(3), self.mkbrd(1),
+                                   self.mkbrd(2, buildername='ccc') ])
+        self.assertTrue(self.idx.isCurrent())
+        self.assertEqual(self.idx.getCounts(), {
+            'bbb' : (2, epoch2datetime(1)),
+            'ccc' : (1, epoch2datetime(2)) })
+        generation = self.idx.generation
+        self.idx.remove([ 2 ])
+        self.assertNotEqual(self.idx.generation, generation)
+        self.assertEqual(self.idx.getCounts(), {
+            'bbb' : (2, epoch2datetime(1)) })
+        self.idx.invalidate([ 'bbb' ])
+        self.assertFalse(self.idx.isCurrent())
+
+    def test_failed_load(self):
+        tok = self.idx.startLoad()
+        self.idx.finishLoad(tok, None)
+        self.assertFalse(self.idx.isCurrent('bbb'))
+
+    def test_add_remove(self):
+        tok = self.idx.startLoad()
+        self.idx.finishLoad(tok, [ self.mkbrd(1) ])
+        self.idx.add(self.mkbrd(2))
+        self.idx.add(self.mkbrd(3, submitted_at=1))
+        self.assertEqual(self.brids(), [ 1, 3, 2 ])
+        self.idx.remove([ 1, 2, 99 ])
+        self.assertEqual(self.brids(), [ 3 ])
+
+    def test_invalidate(self):
+        tok = self.idx.startLoad()
+        self.idx.finishLoad(tok, [ self.mkbrd(1) ])
+        self.idx.invalidate([ 'bbb' ])
+        self.assertFalse(self.idx.isCurrent('bbb'))
+        self.assertTrue(self.idx.isCurrent('ccc'))
+
+        tok = self.idx.startLoad()
+        self.idx.finishLoad(tok, [ self.mkbrd(2) ], buildername='bbb')
+        self.assertTrue(self.idx.isCurrent('bbb'))
+        self.assertEqual(self.brids(), [ 2 ])
+
+        self.idx.invalidate()
+        self.assertFalse(self.idx.isCurrent('ccc'))
+
+    def test_updates_during_load_replayed(self):
+        tok = self.idx.startLoad()
+        # these happen while the query is running
+        self.idx.add(self.mkbrd(5))
+        self.idx.remove([ 1 ])
+        # and the query results don't include them
+        self.idx.finishLoad(tok, [ self.mkbrd(1), self.mkbrd(2) ])
+        self.assertEqual(self.brids(), [ 2, 5 ])
@@ -20,6 +20,7 @@ from twisted.trial import unittest
 from twisted.internet import defer, task
 from buildbot.changes.changes import Change
 from buildbot.db import changes
+from buildbot.process import cache
 from buildbot.test.util import connector_component
 from buildbot.test.fake import fakedb
 from buildbot.util import epoch2datetime
@@ -479,6 +480,102 @@ class TestChangesConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_addChanges(self):
+        # use real caches, to check that the new changes are cached
+        self.db.master.caches = cache.CacheManager()
+        self.db.changes = changes.ChangesConnectorComponent(self.db)
+        self.db.changes.getChange.cache.set_max_size(10)
+        d = self.insertTestData([ fakedb.User(uid=1, identifier="one") ])
+        d.addCallback(lambda _ : self.db.changes.addChanges([
+            dict(author=u'dustin', files=[u'a.txt', u'b.txt'],
+                 comments=u'one', revision=u'1111',
+                 when_timestamp=epoch2datetime(266738400), branch=u'master',
+                 properties={u'platform': (u'linux', 'Change')}, uid=1),
+            dict(author=u'tom', comments=u'two', revision=u'2222',
+                 when_timestamp=epoch2datetime(266738401)),
+        ]))
+        def check_changes(changeids):
+            self.assertEqual(changeids, [1, 2])
+            def thd(conn):
+                r = conn.execute(self.db.model.changes.select())
+                self.assertEqual(sorted([ (row.changeid, row.author,
+                                           row.revision) for row in r ]),
+                        [ (1, 'dustin', '1111'), (2, 'tom', '2222') ])
+                r = conn.execute(self.db.model.change_files.select())
+                self.assertEqual(sorted([ (row.changeid, row.filename)
+                                          for row in r ]),
+                        [ (1, 'a.txt'), (1, 'b.txt') ])
+                r = conn.execute(self.db.model.change_properties.select())
+                self.assertEqual([ (row.changeid, row.property_name)
+                                   for row in r ], [ (1, 'platform') ])
+                r = conn.execute(self.db.model.change_users.select())
+                self.assertEqual([ (row.changeid, row.uid) for row in r ],
+                                 [ (1, 1) ])
+            return self.db.pool.do(thd)
+        d.addCallback(check_changes)
+        def check_cache(_):
+            # the cached chdicts match what is in the database
+            cached = self.db.changes.getChange.cache.get_cached(1)
+            self.assertNotEqual(cached, None)
+            d = self.db.changes.getChange(1, no_cache=True)
+            def compare(chdict):
+                cached['files'].sort()
+                chdict['files'].sort()
+                self.assertEqual(cached, chdict)
+            d.addCallback(compare)
+            return d
+        d.addCallback(check_cache)
+        return d
+
+    def test_addChanges_empty(self):
+        d = self.db.changes.addChanges([])
+        def check(changeids):
+            self.assertEqual(changeids, [])
+        d.addCallback(check)
+        return d
+
+    def test_getChanges(self):
+        d = self.insertTestData(self.change13_rows + self.change14_rows)
+        d.addCallback(lambda _ :
+                self.db.changes.getChanges([14, 99, 13]))
+        def check(chdicts):
+            self.assertEqual(chdicts[0], self.change14_dict)
+            self.assertEqual(chdicts[1], None)
+            self.assertEqual(chdicts[2]['changeid'], 13)
+            self.assertEqual(sorted(chdicts[2]['files']),
+                        sorted(['master/README.txt', 'slave/README.txt']))
+            self.assertEqual(chdicts[2]['properties'],
+                        { 'notest' : ('no', 'Change') })
+        d.addCallback(check)
+        return d
+
+    def test_getChanges_empty(self):
+        d = self.db.changes.getChanges([])
+        def check(chdicts):
+            self.assertEqual(chdicts, [])
+        d.addCallback(check)
+        return d
+
+    def test_getChanges_cached(self):
+        # the fake master's caches do not cache anything, so use real ones
+        self.db.master.caches = cache.CacheManager()
+        self.db.changes = changes.ChangesConnectorComponent(self.db)
+        d = self.insertTestData(self.change13_rows + self.change14_rows)
+        d.addCallback(lambda _ : self.db.changes.getChange(14))
+        def get_both(chdict14):
+            d = self.db.changes.getChanges([13, 14])
+            d.addCallback(lambda chdicts : (chdict14, chdicts))
+            return d
+        d.addCallback(get_both)
+        def check((chdict14, chdicts)):
+            # the cached chdict is re-used, and the other is now cached
+            self.assertIdentical(chdicts[1], chdict14)
+            self.assertIdentical(
+                    self.db.changes.getChange.cache.get_cached(13),
+                    chdicts[0])
+        d.addCallback(check)
+        return d
+
     def test_getRecentChanges_subset(self):
         d = self.insertTestData([
             fakedb.Change(changeid=8),
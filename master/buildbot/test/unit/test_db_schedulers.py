@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 from twisted.trial import unittest
+from twisted.internet import defer
 from buildbot.db import schedulers
 from buildbot.test.util import connector_component
 from buildbot.test.fake import fakedb
@@ -159,3 +160,66 @@ class TestSchedulersConnectorComponent(
             self.assertEqual(cls, { 6 : True })
         d.addCallback(check)
         return d
+
+    def countTransactions(self):
+        calls = []
+        do = self.db.pool.do
+        def counting_do(callable, *args, **kwargs):
+            calls.append(callable)
+            return do(callable, *args, **kwargs)
+        self.patch(self.db.pool, 'do', counting_do)
+        return calls
+
+    def test_classifyChanges_coalesced(self):
+        d = self.insertTestData([ self.change3, self.change4, self.change5,
+                                  fakedb.Object(id=25, name="sch25"),
+                                  self.scheduler24,
+                                  fakedb.SchedulerChange(objectid=24,
+                                                    changeid=3, important=0) ])
+        def classify(_):
+            calls = self.countTransactions()
+            # the first write starts immediately, and the next three are
+            # combined into a single transaction once it finishes
+            dl = [ self.db.schedulers.classifyChanges(24, { 3 : True }),
+                   self.db.schedulers.classifyChanges(24, { 4 : True }),
+                   self.db.schedulers.classifyChanges(25, { 4 : False,
+                                                            5 : True }),
+                   self.db.schedulers.classifyChanges(24, { 4 : False }) ]
+            d = defer.gatherResults(dl)
+            d.addCallback(lambda _ : self.assertEqual(len(calls), 2))
+            return d
+        d.addCallback(classify)
+        def check(_):
+            def thd(conn):
+                sch_chgs_tbl = self.db.model.scheduler_changes
+                q = sch_chgs_tbl.select(order_by=[sch_chgs_tbl.c.objectid,
+                                                  sch_chgs_tbl.c.changeid])
+                rows = [ (row.objectid, row.changeid, row.important)
+                         for row in conn.execute(q).fetchall() ]
+                self.assertEqual(rows, [ (24, 3, 1), (24, 4, 0),
+                                         (25, 4, 0), (25, 5, 1) ])
+            return self.db.pool.do(thd)
+        d.addCallback(check)
+        return d
+
+    def test_getChangeClassifications_coalesced(self):
+        d = self.insertTestData([ self.change3, self.change4,
+                                  fakedb.Object(id=25, name="sch25"),
+                                  fakedb.Object(id=26, name="sch26"),
+                                  self.scheduler24 ])
+        d.addCallback(self.addClassifications, 24, (3, 1), (4, 0))
+        d.addCallback(self.addClassifications, 25, (4, 1))
+        def get(_):
+            calls = self.countTransactions()
+            dl = [ self.db.schedulers.getChangeClassifications(objectid)
+                   for objectid in (24, 25, 26, 24) ]
+            d = defer.gatherResults(dl)
+            def check(results):
+                self.assertEqual(results, [ { 3 : True, 4 : False },
+                                            { 4 : True }, {},
+                                            { 3 : True, 4 : False } ])
+                self.assertEqual(len(calls), 2)
+            d.addCallback(check)
+            return d
+        d.addCallback(get)
+        return d
@@ -26,7 +26,7 @@ from buildbot.db import connector
 from buildbot.test.util import dirs, compat, misc
 from buildbot.test.fake import fakedb
 from buildbot.util import epoch2datetime
-from buildbot.changes import changes
+from buildbot.changes import changes, filter
 from buildbot.process.users import users
 
 class Subscriptions(dirs.DirsMixin, unittest.TestCase):
@@ -64,10 +64,10 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
 
         # patch out everything we're about to call
         self.master.db = mock.Mock()
-        self.master.db.changes.addChange.return_value = \
-            defer.succeed(changeid)
-        self.master.db.changes.getChange.return_value = \
-            defer.succeed(chdict)
+        self.master.db.changes.addChanges.return_value = \
+            defer.succeed([changeid])
+        self.master.db.changes.getChanges.return_value = \
+            defer.succeed([chdict])
         self.patch(changes.Change, 'fromChdict',
                 classmethod(lambda cls, master, chdict :
                                 defer.succeed(newchange)))
@@ -75,21 +75,80 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
         cb = mock.Mock()
         sub = self.master.subscribeToChanges(cb)
         self.assertIsInstance(sub, subscription.Subscription)
+        batch_cb = mock.Mock()
+        self.master.subscribeToChangeBatches(batch_cb)
 
         d = self.master.addChange()
         def check(change):
             # master called the right thing in the db component, including with
             # appropriate default values
-            self.master.db.changes.addChange.assert_called_with(author=None,
+            self.master.db.changes.addChanges.assert_called_with([
+                dict(author=None,
                     files=None, comments=None, is_dir=0,
-                    revision=None, when_timestamp=None, branch=None, codebase='',
-                    category=None, revlink='', properties={}, repository='', project='', uid=None)
+                    revision=None, when_timestamp=None, branch=None,
+                    codebase='', category=None, revlink='', properties={},
+                    repository='', project='', uid=None) ])
 
-            self.master.db.changes.getChange.assert_called_with(changeid)
+            self.master.db.changes.getChanges.assert_called_with([changeid])
             # addChange returned the right value
             self.failUnless(change is newchange) # fromChdict's return value
-            # and the notification sub was called correctly
+            # and the notification subs were called correctly
             cb.assert_called_with(newchange)
+            batch_cb.assert_called_with([newchange])
+        d.addCallback(check)
+        return d
+
+    def test_addChanges(self):
+        self.master.db = fakedb.FakeDBConnector(self)
+        self.master.caches = mock.Mock()
+        self.master.caches.get_cache = lambda name, miss_fn : mock.Mock(
+                get=lambda changeid, **kw : miss_fn(changeid, **kw))
+        looked_up = []
+        def createUserObject(master, author, src):
+            looked_up.append(author)
+            return defer.succeed(dict(me=1, you=2)[author])
+        self.patch(users, 'createUserObject', createUserObject)
+
+        cb = mock.Mock()
+        self.master.subscribeToChanges(cb)
+        batch_cb = mock.Mock()
+        self.master.subscribeToChangeBatches(batch_cb)
+        filtered_cb = mock.Mock()
+        self.master.subscribeToChangeBatches(filtered_cb,
+                change_filter=filter.ChangeFilter(branch='release'))
+
+        d = self.master.addChanges([
+            dict(author='me', comments='one', src='git'),
+            dict(author='you', comments='two', src='git', branch='release'),
+            dict(author='me', comments='three', src='git', files=['a']) ])
+        def check(added):
+            self.assertEqual([ (ch.number, ch.who, ch.comments, ch.files)
+                               for ch in added ],
+                    [ (500, 'me', 'one', []), (501, 'you', 'two', []),
+                      (502, 'me', 'three', ['a']) ])
+            self.assertEqual([ self.master.db.changes.changes[n].uid
+                               for n in (500, 501, 502) ], [ 1, 2, 1 ])
+            # each author was only looked up once
+            self.assertEqual(sorted(looked_up), [ 'me', 'you' ])
+            # per-change subscribers get each change, while batch
+            # subscribers get them all at once
+            self.assertEqual(cb.call_args_list,
+                    [ ((ch,), {}) for ch in added ])
+            batch_cb.assert_called_once_with(added)
+            # and filtered subscribers get only the changes they want
+            filtered_cb.assert_called_once_with([ added[1] ])
+        d.addCallback(check)
+        return d
+
+    def test_addChanges_empty(self):
+        self.master.db = mock.Mock()
+        batch_cb = mock.Mock()
+        self.master.subscribeToChangeBatches(batch_cb)
+        d = self.master.addChanges([])
+        def check(added):
+            self.assertEqual(added, [])
+            self.assertFalse(self.master.db.changes.addChanges.called)
+            self.assertFalse(batch_cb.called)
         d.addCallback(check)
         return d
 
@@ -105,17 +164,17 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
 
         self.master.db = mock.Mock()
         got = []
-        def db_addChange(*args, **kwargs):
-            got[:] = args, kwargs
+        def db_addChanges(changes):
+            got[:] = changes
             # use an exception as a quick way to bail out of the remainder
             # of the addChange method
             return defer.fail(RuntimeError)
-        self.master.db.changes.addChange = db_addChange
+        self.master.db.changes.addChanges = db_addChanges
 
         d = self.master.addChange(*args, **kwargs)
         d.addCallback(lambda _ : self.fail("should not succeed"))
         def check(f):
-            self.assertEqual(got, [(), exp_db_kwargs])
+            self.assertEqual(got, [exp_db_kwargs])
         d.addErrback(check)
         return d
 
@@ -185,6 +244,8 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
         self.master.db = mock.Mock()
         self.master.db.buildsets.addBuildset.return_value = \
             defer.succeed((938593, dict(a=19,b=20)))
+        self.master.db.buildrequests.getBuildRequests.return_value = \
+            defer.succeed([])
 
         cb = mock.Mock()
         sub = self.master.subscribeToBuildsets(cb)
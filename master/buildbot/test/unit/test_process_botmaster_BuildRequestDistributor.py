@@ -18,7 +18,7 @@ from twisted.trial import unittest
 from twisted.internet import defer, reactor
 from twisted.python import failure
 from buildbot.test.util import compat
-from buildbot.process import botmaster
+from buildbot.process import botmaster, metrics
 from buildbot.util import epoch2datetime
 
 class Test(unittest.TestCase):
@@ -31,6 +31,8 @@ class Test(unittest.TestCase):
             return sorted(builders, lambda b1,b2 : cmp(b1.name, b2.name))
         self.master = self.botmaster.master = mock.Mock(name='master')
         self.master.config.prioritizeBuilders = prioritizeBuilders
+        self.master.config.batchBuildRequestClaims = False
+        self.master.config.builderConcurrency = 1
         self.brd = botmaster.BuildRequestDistributor(self.botmaster)
         self.brd.startService()
 
@@ -53,9 +55,10 @@ class Test(unittest.TestCase):
         if self.brd.running:
             return self.brd.stopService()
 
-    def addBuilders(self, names):
+    def addBuilders(self, names, slavenames={}):
         for name in names:
             bldr = mock.Mock(name=name)
+            bldr.config.slavenames = slavenames.get(name, [])
             self.botmaster.builders[name] = bldr
             self.builders[name] = bldr
             def maybeStartBuild(n=name):
@@ -149,21 +152,94 @@ class Test(unittest.TestCase):
         self.quiet_deferred.addCallback(check)
         return self.quiet_deferred
 
+    def addSlowBuilders(self, names, slavenames={}):
+        # builders whose maybeStartBuild calls finish only when the test says
+        self.addBuilders(names, slavenames)
+        self.running = {}
+        for name in names:
+            def maybeStartBuild(n=name):
+                self.maybeStartBuild_calls.append(n)
+                d = self.running[n] = defer.Deferred()
+                return d
+            self.builders[name].maybeStartBuild = maybeStartBuild
+
+    def finishBuilder(self, name):
+        self.maybeStartBuild_calls.append(name + '-finished')
+        self.running.pop(name).callback(None)
+
+    def test_maybeStartBuildsOn_concurrent(self):
+        self.master.config.builderConcurrency = 2
+        self.addSlowBuilders(['bldr1', 'bldr2', 'bldr3'])
+        d = self.quiet_deferred
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2', 'bldr3'])
+        # two builders start right away, and the third waits for a free slot
+        self.assertEqual(self.maybeStartBuild_calls, ['bldr1', 'bldr2'])
+        self.finishBuilder('bldr2')
+        self.assertEqual(self.maybeStartBuild_calls,
+                ['bldr1', 'bldr2', 'bldr2-finished', 'bldr3'])
+        self.finishBuilder('bldr1')
+        self.finishBuilder('bldr3')
+        def check(_):
+            self.assertEqual(self.running, {})
+        d.addCallback(check)
+        return d
+
+    def test_maybeStartBuildsOn_concurrent_shared_slaves(self):
+        self.master.config.builderConcurrency = 3
+        self.addSlowBuilders(['bldr1', 'bldr2', 'bldr3'], slavenames=dict(
+            bldr1=['slave1'], bldr2=['slave1', 'slave2'], bldr3=['slave3']))
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2', 'bldr3'])
+        # bldr2 shares a slave with bldr1, so it must wait
+        self.assertEqual(self.maybeStartBuild_calls, ['bldr1', 'bldr3'])
+        self.finishBuilder('bldr1')
+        self.assertEqual(self.maybeStartBuild_calls,
+                ['bldr1', 'bldr3', 'bldr1-finished', 'bldr2'])
+        self.finishBuilder('bldr2')
+        self.finishBuilder('bldr3')
+        return self.quiet_deferred
+
+    def test_maybeStartBuildsOn_concurrent_same_builder(self):
+        self.master.config.builderConcurrency = 2
+        self.addSlowBuilders(['bldr1'])
+        self.brd.maybeStartBuildsOn(['bldr1'])
+        self.brd.maybeStartBuildsOn(['bldr1'])
+        # the second invocation waits for the first to finish
+        self.assertEqual(self.maybeStartBuild_calls, ['bldr1'])
+        self.finishBuilder('bldr1')
+        self.assertEqual(self.maybeStartBuild_calls,
+                ['bldr1', 'bldr1-finished', 'bldr1'])
+        self.finishBuilder('bldr1')
+        return self.quiet_deferred
+
+    def test_queue_wait_timer(self):
+        events = []
+        self.patch(metrics.Timer, 'start',
+                lambda timer : events.append(('start', timer.name)))
+        self.patch(metrics.Timer, 'stop',
+                lambda timer : events.append(('stop', timer.name)))
+        self.addBuilders(['bldr1'])
+        self.brd.maybeStartBuildsOn(['bldr1'])
+        def check(_):
+            name = 'BuildRequestDistributor.queueWait.bldr1'
+            self.assertEqual([ ev for ev in events if ev[1] == name ],
+                    [ ('start', name), ('stop', name) ])
+        self.quiet_deferred.addCallback(check)
+        return self.quiet_deferred
+
     def do_test_sortBuilders(self, prioritizeBuilders, oldestRequestTimes,
             expected, returnDeferred=False):
         self.addBuilders(oldestRequestTimes.keys())
         self.master.config.prioritizeBuilders = prioritizeBuilders
 
-        def mklambda(t): # work around variable-binding issues
-            if returnDeferred:
-                return lambda : defer.succeed(t)
-            else:
-                return lambda : t
-
+        counts = {}
         for n, t in oldestRequestTimes.iteritems():
             if t is not None:
-                t = epoch2datetime(t)
-            self.builders[n].getOldestRequestTime = mklambda(t)
+                counts[n] = (1, epoch2datetime(t))
+        if returnDeferred:
+            getCounts = lambda : defer.succeed(counts)
+        else:
+            getCounts = lambda : counts
+        self.master.db.buildrequests.getUnclaimedBuildRequestCounts = getCounts
 
         d = self.brd._sortBuilders(oldestRequestTimes.keys())
         def check(result):
@@ -253,3 +329,73 @@ class Test(unittest.TestCase):
                     ['A', 'A-finished', '(stopped)'])
         self.quiet_deferred.addCallback(check)
         return self.quiet_deferred
+
+    # batched claims
+
+    def addPlanningBuilders(self, plans):
+        """C{plans} maps builder name to a list of (slavename, brids)"""
+        self.master.config.batchBuildRequestClaims = True
+        self.addBuilders(plans.keys())
+        self.slaves = {}
+        self.started = []
+        self.reserved = {}
+        for name, plan in plans.iteritems():
+            bldr = self.builders[name]
+            bldr.slaves = []
+            planned = []
+            for slavename, brids in plan:
+                sb = mock.Mock(name=slavename)
+                sb.slave = self.slaves.setdefault(slavename,
+                                        mock.Mock(name=slavename))
+                planned.append((sb, [ dict(brid=brid) for brid in brids ]))
+            def planBuilds(reserved_slaves, name=name, planned=planned):
+                # only plan builds the first time
+                self.reserved.setdefault(name, set(reserved_slaves))
+                rv, planned[:] = planned[:], []
+                return defer.succeed(rv)
+            bldr.planBuilds = planBuilds
+            def startClaimedBuild(sb, brdicts, name=name):
+                self.started.append((name, [ brd['brid'] for brd in brdicts ]))
+                return defer.succeed(True)
+            bldr.startClaimedBuild = startClaimedBuild
+
+    def test_batched_claims(self):
+        self.addPlanningBuilders({
+            'bldr1' : [ ('slave1', [ 10, 11 ]) ],
+            'bldr2' : [ ('slave2', [ 20 ]), ('slave3', [ 21 ]) ],
+        })
+        claimed = []
+        def claimBuildRequestGroups(groups):
+            claimed.append(groups)
+            return defer.succeed([ True, False, True ])
+        self.master.db.buildrequests.claimBuildRequestGroups = \
+                claimBuildRequestGroups
+
+        # everything here happens synchronously, so hang on to the deferred
+        d = self.quiet_deferred
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2'])
+        def check(_):
+            # one claim for everything
+            self.assertEqual(claimed, [ [ [ 10, 11 ], [ 20 ], [ 21 ] ] ])
+            self.assertEqual(self.started,
+                    [ ('bldr1', [ 10, 11 ]), ('bldr2', [ 21 ]) ])
+            self.assertEqual(self.maybeStartBuild_calls, [])
+        d.addCallback(check)
+        return d
+
+    def test_batched_claims_slaves_reserved(self):
+        self.addPlanningBuilders({
+            'bldr1' : [ ('slave1', [ 10 ]) ],
+            'bldr2' : [],
+        })
+        self.master.db.buildrequests.claimBuildRequestGroups = \
+                lambda groups : defer.succeed([ True ] * len(groups))
+
+        d = self.quiet_deferred
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2'])
+        def check(_):
+            # bldr1 planned slave1, so bldr2 was not allowed to use it
+            self.assertEqual(self.reserved['bldr2'],
+                    set([ self.slaves['slave1'] ]))
+        d.addCallback(check)
+        return d
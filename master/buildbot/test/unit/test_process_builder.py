@@ -21,7 +21,7 @@ from twisted.internet import defer
 from buildbot import config
 from buildbot.status import master
 from buildbot.test.fake import fakedb, fakemaster
-from buildbot.process import builder
+from buildbot.process import builder, buildrequest, cache
 from buildbot.db import buildrequests
 from buildbot.util import epoch2datetime
 
@@ -349,6 +349,89 @@ class TestBuilderBuildCreation(unittest.TestCase):
                 exp_claims=[42880, 42922],
                 exp_builds=[('bldr', [42880, 42922])])
 
+    # planBuilds and startClaimedBuild
+
+    def setPlanningSlaveBuilders(self, slavebuilders):
+        self.setSlaveBuilders(slavebuilders)
+        for sb in self.bldr.slaves:
+            sb.slave = sb.name
+
+    @defer.inlineCallbacks
+    def test_planBuilds(self):
+        yield self.makeBuilder(mergeRequests=False, patch_random=True)
+
+        self.setPlanningSlaveBuilders({'test-slave1':1, 'test-slave2':1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr",
+                submitted_at=130000),
+            fakedb.BuildRequest(id=11, buildsetid=11, buildername="bldr",
+                submitted_at=135000),
+            fakedb.BuildRequest(id=12, buildsetid=11, buildername="bldr",
+                submitted_at=136000),
+        ]
+        yield self.db.insertTestData(rows)
+        plan = yield self.bldr.planBuilds()
+        self.assertEqual([ (sb.name, [ brd['brid'] for brd in brdicts ])
+                           for sb, brdicts in plan ],
+                [ ('test-slave2', [ 10 ]), ('test-slave1', [ 11 ]) ])
+        # nothing was claimed or started
+        self.db.buildrequests.assertMyClaims([])
+        self.assertBuildsStarted([])
+
+    @defer.inlineCallbacks
+    def test_planBuilds_reserved_slaves(self):
+        yield self.makeBuilder(mergeRequests=False)
+
+        self.setPlanningSlaveBuilders({'test-slave1':1, 'test-slave2':1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr"),
+        ]
+        yield self.db.insertTestData(rows)
+        plan = yield self.bldr.planBuilds(reserved_slaves=set(['test-slave2']))
+        self.assertEqual([ (sb.name, [ brd['brid'] for brd in brdicts ])
+                           for sb, brdicts in plan ],
+                [ ('test-slave1', [ 10 ]) ])
+
+    @defer.inlineCallbacks
+    def test_startClaimedBuild(self):
+        yield self.makeBuilder()
+
+        self.setSlaveBuilders({'test-slave1':1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr"),
+        ]
+        yield self.db.insertTestData(rows)
+        yield self.db.buildrequests.claimBuildRequests([10])
+        brdicts = yield self.db.buildrequests.getBuildRequests(
+                buildername='bldr')
+        started = yield self.bldr.startClaimedBuild(self.bldr.slaves[0],
+                brdicts)
+        self.assertTrue(started)
+        self.assertBuildsStarted([('test-slave1', [10])])
+
+    @defer.inlineCallbacks
+    def test_startClaimedBuild_fails(self):
+        yield self.makeBuilder()
+        self.bldr._startBuildFor = lambda sb, breqs : defer.succeed(False)
+        self.bldr.botmaster.maybeStartBuildsForBuilder = mock.Mock()
+        self.db.buildrequests.unclaimBuildRequests = mock.Mock(
+                return_value=defer.succeed(None))
+
+        self.setSlaveBuilders({'test-slave1':1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr"),
+        ]
+        yield self.db.insertTestData(rows)
+        brdicts = yield self.db.buildrequests.getBuildRequests(
+                buildername='bldr')
+        started = yield self.bldr.startClaimedBuild(self.bldr.slaves[0],
+                brdicts)
+        self.assertFalse(started)
+        # the requests were unclaimed and the builder re-triggered
+        self.db.buildrequests.unclaimBuildRequests.assert_called_with([10])
+        self.bldr.botmaster.maybeStartBuildsForBuilder.assert_called_with(
+                'bldr')
+
     # _chooseSlave
 
     def do_test_chooseSlave(self, nextSlave, exp_choice=None, exp_fail=None):
@@ -463,6 +546,40 @@ class TestBuilderBuildCreation(unittest.TestCase):
 
         self.bldr._breakBrdictRefloops([brdict])
 
+    @defer.inlineCallbacks
+    def test_brdictToBuildRequest_cached(self):
+        yield self.makeBuilder()
+        self.master.caches = cache.CacheManager()
+        yield self.master.caches.reconfigService(config.MasterConfig())
+
+        yield self.db.insertTestData([
+                fakedb.SourceStampSet(id=234),
+                fakedb.SourceStamp(id=234,sourcestampsetid=234),
+                fakedb.Buildset(id=30, sourcestampsetid=234, reason='foo',
+                    submitted_at=1300305712, results=-1),
+                fakedb.BuildRequest(id=19, buildsetid=30, buildername='bldr',
+                    priority=13, submitted_at=1300305712, results=-1),
+            ])
+
+        brdict = yield self.db.buildrequests.getBuildRequest(19)
+        br = yield self.bldr._brdictToBuildRequest(brdict)
+        self.bldr._breakBrdictRefloops([brdict])
+
+        # a later pass gets a fresh brdict, but the master's BuildRequests
+        # cache should not need to construct the BuildRequest again
+        def _make_br(*args, **kwargs):
+            self.fail("should not be called")
+        self.patch(buildrequest.BuildRequest, '_make_br', _make_br)
+
+        brdict2 = yield self.db.buildrequests.getBuildRequest(19)
+        br2 = yield self.bldr._brdictToBuildRequest(brdict2)
+
+        self.assertIdentical(br2, br)
+        self.assertIdentical(br2.brdict, brdict2)
+        self.assertIdentical(brdict2['brobj'], br2)
+
+        self.bldr._breakBrdictRefloops([brdict2])
+
     # _getMergeRequestsFn
 
     @defer.inlineCallbacks
@@ -619,6 +736,42 @@ class TestBuilderBuildCreation(unittest.TestCase):
                                              mergeRequests_fn)
         self.assertEqual(res, [ brdicts[0], brdicts[1], brdicts[2] ])
 
+    @defer.inlineCallbacks
+    def test_mergeRequests_default(self):
+        yield self.makeBuilder()
+
+        # requests 19 and 20 have changes on the same branch, while 21 has a
+        # change on a different branch
+        rows = []
+        for id, branch in [ (30, 'a'), (31, 'a'), (32, 'b') ]:
+            rows.extend([
+                fakedb.SourceStampSet(id=id),
+                fakedb.SourceStamp(id=id, sourcestampsetid=id, branch=branch),
+                fakedb.Change(changeid=id, branch=branch),
+                fakedb.SourceStampChange(sourcestampid=id, changeid=id),
+                fakedb.Buildset(id=id, sourcestampsetid=id, reason='foo',
+                    submitted_at=1300305712, results=-1),
+                fakedb.BuildRequest(id=id - 11, buildsetid=id,
+                    buildername='bldr', priority=13, submitted_at=1300305712,
+                    results=-1),
+            ])
+        yield self.db.insertTestData(rows)
+
+        brdicts = yield defer.gatherResults([
+                self.db.buildrequests.getBuildRequest(id)
+                for id in (19, 20, 21)
+            ])
+
+        res = yield self.bldr._mergeRequests(brdicts[0], brdicts,
+                                builder.Builder._defaultMergeRequestFn)
+        self.assertEqual(res, [ brdicts[0], brdicts[1] ])
+
+        res = yield self.bldr._mergeRequests(brdicts[2], brdicts,
+                                builder.Builder._defaultMergeRequestFn)
+        self.assertEqual(res, [ brdicts[2] ])
+
+        self.bldr._breakBrdictRefloops(brdicts)
+
     @defer.inlineCallbacks
     def test_mergeRequests_no_merging(self):
         yield self.makeBuilder()
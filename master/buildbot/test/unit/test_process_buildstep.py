@@ -14,11 +14,12 @@
 # Copyright Buildbot Team Members
 
 import re
+import zlib
 import mock
 from twisted.trial import unittest
 from twisted.internet import defer, reactor
 from twisted.python import log
-from buildbot.process import buildstep
+from buildbot.process import buildstep, metrics
 from buildbot.process.buildstep import regex_log_evaluator
 from buildbot.status.results import FAILURE, SUCCESS, WARNINGS, EXCEPTION
 from buildbot.test.fake import fakebuild, remotecommand
@@ -252,3 +253,153 @@ class TestCustomStepExecution(steps.BuildStepMixin, unittest.TestCase):
             self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
         return d
 
+
+
+class TestLineSplitter(unittest.TestCase):
+
+    def test_split(self):
+        splitter = buildstep.LineSplitter()
+        self.assertEqual(splitter.split('a\nb'), [ 'a' ])
+        self.assertEqual(splitter.split('c'), [])
+        self.assertEqual(splitter.split('\n\nd\ne\n'), [ 'bc', '', 'd', 'e' ])
+        self.assertEqual(splitter.partial, '')
+
+    def test_delimiter(self):
+        splitter = buildstep.LineSplitter()
+        splitter.delimiter = '\r\n'
+        self.assertEqual(splitter.split('a\r'), [])
+        self.assertEqual(splitter.split('\nb\nc\r\n'), [ 'a', 'b\nc' ])
+
+    def test_long_lines(self):
+        splitter = buildstep.LineSplitter()
+        splitter.MAX_LENGTH = 4
+        self.assertEqual(splitter.split('abcde\nabcd\n'), [ 'abcd' ])
+        # a long line is dropped even if it arrives in pieces
+        self.assertEqual(splitter.split('abc'), [])
+        self.assertEqual(splitter.split('de'), [])
+        self.assertEqual(splitter.split('fgh\nab\n'), [ 'ab' ])
+
+
+class TestLogLineObserver(unittest.TestCase):
+
+    def test_lines(self):
+        lines = []
+        obs = buildstep.LogLineObserver()
+        obs.outLineReceived = lambda line : lines.append(('out', line))
+        obs.errLineReceived = lambda line : lines.append(('err', line))
+        obs.outReceived('a\nb')
+        obs.errReceived('c\n')
+        obs.outReceived('\n')
+        self.assertEqual(lines, [ ('out', 'a'), ('err', 'c'), ('out', 'b') ])
+
+    def test_batches(self):
+        batches = []
+        obs = buildstep.LogLineObserver()
+        obs.outLinesReceived = batches.append
+        obs.outReceived('a\nb\nc')
+        obs.outReceived('d')
+        obs.outReceived('\n')
+        self.assertEqual(batches, [ [ 'a', 'b' ], [ 'cd' ] ])
+
+    def test_setMaxLineLength(self):
+        lines = []
+        obs = buildstep.LogLineObserver()
+        obs.outLineReceived = lines.append
+        obs.setMaxLineLength(3)
+        obs.outReceived('abcd\nabc\n')
+        self.assertEqual(lines, [ 'abc' ])
+
+
+class TestRemoteCommand(unittest.TestCase):
+
+    def makeCommand(self, slaveVersion, compress_updates=False):
+        cmd = buildstep.RemoteCommand('shell', { 'command' : 'make' })
+        cmd.buildslave = mock.Mock()
+        cmd.buildslave.slavename = 'bot1'
+        cmd.buildslave.compress_updates = compress_updates
+        step = mock.Mock()
+        step.slaveVersionIsOlderThan = lambda command, minversion : \
+                map(int, slaveVersion.split('.')) < \
+                map(int, minversion.split('.'))
+        remote = mock.Mock()
+        remote.callRemote.return_value = defer.Deferred()
+        cmd.run(step, remote)
+        return cmd
+
+    def test_start_old_slave(self):
+        cmd = self.makeCommand('2.16')
+        cmd.remote.callRemote.assert_called_with('startCommand', cmd,
+                cmd.commandID, 'shell', { 'command' : 'make' })
+
+    def test_start_ordered_updates(self):
+        cmd = self.makeCommand('2.17')
+        cmd.remote.callRemote.assert_called_with('startCommand', cmd,
+                cmd.commandID, 'shell',
+                { 'command' : 'make', 'ordered_updates' : True })
+        self.assertEqual(cmd.args, { 'command' : 'make' })
+
+    def test_remote_update_ordered(self):
+        cmd = self.makeCommand('2.17')
+        added = []
+        cmd.addStdout = lambda data : added.append(('stdout', data))
+        cmd.addStderr = lambda data : added.append(('stderr', data))
+        cmd.addToLog = lambda name, data : added.append((name, data))
+        cmd.remote_update([
+            [ [ ('stdout', 'a'), ('stderr', 'b'), (('log', 'x'), 'c'),
+                ('stdout', 'd') ], 0 ],
+            [ { 'stdout' : 'e' }, 0 ] ])
+        self.assertEqual(added, [ ('stdout', 'a'), ('stderr', 'b'),
+                                  ('x', 'c'), ('stdout', 'd'),
+                                  ('stdout', 'e') ])
+
+    def test_remote_update_counters(self):
+        counts = {}
+        def log(counter, count=1, absolute=False):
+            if counter.startswith('RemoteCommand.'):
+                counts[counter] = counts.get(counter, 0) + count
+        self.patch(metrics.MetricCountEvent, 'log', staticmethod(log))
+
+        cmd = self.makeCommand('2.17')
+        cmd.addStdout = lambda data : None
+        cmd.addStderr = lambda data : None
+        cmd.remote_update([
+            [ [ ('stdout', 'a'), ('stderr', 'b') ], 0 ],
+            [ { 'stdout' : 'c' }, 0 ] ])
+        # each piece of an ordered update is delivered through remoteUpdate
+        self.assertEqual(counts, {
+            'RemoteCommand.remoteOrderedUpdate()' : 1,
+            'RemoteCommand.remoteUpdate()' : 3 })
+
+    def test_start_compressed_updates(self):
+        cmd = self.makeCommand('2.18', compress_updates=True)
+        cmd.remote.callRemote.assert_called_with('startCommand', cmd,
+                cmd.commandID, 'shell',
+                { 'command' : 'make', 'ordered_updates' : True,
+                  'compress_updates' : True })
+
+    def test_start_compressed_updates_old_slave(self):
+        cmd = self.makeCommand('2.17', compress_updates=True)
+        cmd.remote.callRemote.assert_called_with('startCommand', cmd,
+                cmd.commandID, 'shell',
+                { 'command' : 'make', 'ordered_updates' : True })
+
+    def test_remote_update_compressed(self):
+        counts = {}
+        def log(counter, count=1, absolute=False):
+            if counter.startswith('SlaveUpdates.'):
+                counts[counter] = counts.get(counter, 0) + count
+        self.patch(metrics.MetricCountEvent, 'log', staticmethod(log))
+
+        cmd = self.makeCommand('2.18', compress_updates=True)
+        added = []
+        cmd.addStdout = lambda data : added.append(('stdout', data))
+        cmd.addStderr = lambda data : added.append(('stderr', data))
+        zdata = zlib.compress('a' * 100 + 'bc')
+        cmd.remote_update([
+            [ { 'zlib' : ([ ('stdout', 100), ('stderr', 2) ], zdata) }, 0 ],
+            [ { 'stdout' : 'd' }, 0 ] ])
+        self.assertEqual(added, [ ('stdout', 'a' * 100), ('stderr', 'bc'),
+                                  ('stdout', 'd') ])
+        self.assertEqual(counts, {
+            'SlaveUpdates.bot1.raw_bytes' : 103,
+            'SlaveUpdates.bot1.wire_bytes' : len(zdata) + 1 })
@@ -160,10 +160,10 @@ class BaseScheduler(scheduler.SchedulerMixin, unittest.TestCase):
         def test(_):
             # check that it registered a callback
             callbacks = self.master.getSubscriptionCallbacks()
-            self.assertNotEqual(callbacks['changes'], None)
+            self.assertNotEqual(callbacks['change_batches'], None)
 
             # invoke the callback with the change, and check the result
-            callbacks['changes'](change)
+            callbacks['change_batches']([ change ])
             self.assertEqual(change_received[0], expected_result)
         d.addCallback(test)
         d.addCallback(lambda _ : sched.stopService())
@@ -229,6 +229,47 @@ class BaseScheduler(scheduler.SchedulerMixin, unittest.TestCase):
                 self.makeFakeChange(),
                 True)
 
+    def test_change_consumption_batch(self):
+        sched = self.makeScheduler()
+        sched.startService()
+
+        batches = []
+        def gotChanges(changes):
+            batches.append(changes)
+            return defer.succeed(None)
+        sched.gotChanges = gotChanges
+
+        ch1, ch2, ch3 = [ self.makeFakeChange(number=n) for n in (1, 2, 3) ]
+        d = sched.startConsumingChanges(
+                fileIsImportant=lambda c : c.number != 2,
+                change_filter=mock.Mock(filter_change=lambda c : c is not ch3))
+        def test(_):
+            callbacks = self.master.getSubscriptionCallbacks()
+            callbacks['change_batches']([ ch1, ch2, ch3 ])
+            # the whole batch is handled in one call, without the filtered
+            # change
+            self.assertEqual(batches, [ [ (ch1, True), (ch2, False) ] ])
+        d.addCallback(test)
+        d.addCallback(lambda _ : sched.stopService())
+        return d
+
+    def test_gotChanges(self):
+        sched = self.makeScheduler()
+        got = []
+        def gotChange(change, important):
+            got.append((change, important))
+            if change == 'bad':
+                raise RuntimeError('oops')
+            return defer.succeed(None)
+        sched.gotChange = gotChange
+        d = sched.gotChanges([ ('a', True), ('bad', True), ('c', False) ])
+        def check(_):
+            # an error in one change does not stop the others
+            self.assertEqual(got, [ ('a', True), ('bad', True), ('c', False) ])
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        d.addCallback(check)
+        return d
+
     def test_addBuilsetForLatest_args(self):
         sched = self.makeScheduler(name='xyz', builderNames=['y', 'z'])
         d = sched.addBuildsetForLatest(reason='cuz', branch='default',
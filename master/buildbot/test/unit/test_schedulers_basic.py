@@ -249,6 +249,69 @@ class BaseBasicScheduler(CommonStuffMixin,
 
         yield sched.stopService()
 
+    def test_startService_treeStableTimer_many(self):
+        sched = self.makeScheduler(self.Subclass, treeStableTimer=10)
+        self.master.db.insertTestData([
+            fakedb.Change(changeid=20),
+            fakedb.Change(changeid=21),
+            fakedb.SchedulerChange(objectid=self.OBJECTID,
+                                                changeid=20, important=0),
+            fakedb.SchedulerChange(objectid=self.OBJECTID,
+                                                changeid=21, important=1),
+        ])
+        getChanges = mock.Mock(wraps=self.db.changes.getChanges)
+        self.db.changes.getChanges = getChanges
+        classifyChanges = mock.Mock(
+                wraps=self.db.schedulers.classifyChanges)
+        self.db.schedulers.classifyChanges = classifyChanges
+
+        d = sched.startService(_returnDeferred=True)
+
+        # the changes were fetched and classified again as a single batch
+        def check(_):
+            getChanges.assert_called_once_with([ 20, 21 ])
+            classifyChanges.assert_called_once_with(self.OBJECTID,
+                                                    { 20 : False, 21 : True })
+            self.assertEqual(sched.getPendingBuildTimes(), [ 10 ])
+            self.clock.advance(10)
+            self.assertEqual(self.events, [ 'B[20,21]@10' ])
+        d.addCallback(check)
+        d.addCallback(lambda _ : sched.stopService())
+        return d
+
+    @defer.inlineCallbacks
+    def test_gotChanges_treeStableTimer(self):
+        sched = self.makeScheduler(self.Subclass, treeStableTimer=10)
+        classifyChanges = mock.Mock(
+                wraps=self.db.schedulers.classifyChanges)
+        self.db.schedulers.classifyChanges = classifyChanges
+        sched.startService()
+
+        yield sched.gotChanges([
+            (self.makeFakeChange(branch='master', number=1), False),
+            (self.makeFakeChange(branch='master', number=2), True),
+            (self.makeFakeChange(branch='master', number=3), False) ])
+        classifyChanges.assert_called_once_with(self.OBJECTID,
+                                        { 1 : False, 2 : True, 3 : False })
+        self.assertEqual(sched.getPendingBuildTimes(), [ 10 ])
+
+        self.clock.advance(10)
+        self.assertEqual(self.events, [ 'B[1,2,3]@10' ])
+        yield sched.stopService()
+
+    @defer.inlineCallbacks
+    def test_gotChanges_no_treeStableTimer(self):
+        sched = self.makeScheduler(self.Subclass, treeStableTimer=None)
+        sched.startService()
+
+        yield sched.gotChanges([
+            (self.makeFakeChange(branch='master', number=1), True),
+            (self.makeFakeChange(branch='master', number=2), False),
+            (self.makeFakeChange(branch='master', number=3), True) ])
+        self.assertEqual(self.events, [ 'B[1]@0', 'B[3]@0' ])
+        self.db.schedulers.assertClassifications(self.OBJECTID, {})
+        yield sched.stopService()
+
 
 class SingleBranchScheduler(CommonStuffMixin,
         scheduler.SchedulerMixin, unittest.TestCase):
@@ -344,3 +407,26 @@ class AnyBranchScheduler(CommonStuffMixin,
         d.addCallback(check)
 
         d.addCallback(lambda _ : sched.stopService())
+
+    @defer.inlineCallbacks
+    def test_gotChanges_treeStableTimer_multiple_branches(self):
+        sched = self.makeScheduler(basic.AnyBranchScheduler,
+                            treeStableTimer=10, branches=['master', 'devel'])
+        sched.startService()
+
+        def mkch(**kwargs):
+            ch = self.makeFakeChange(**kwargs)
+            self.db.changes.fakeAddChangeInstance(ch)
+            return ch
+
+        # a batch starts a timer only for the branches with important changes
+        yield sched.gotChanges([ (mkch(branch='master', number=13), True),
+                                 (mkch(branch='devel', number=15), False),
+                                 (mkch(branch='master', number=14), False) ])
+        self.assertEqual(sched.getPendingBuildTimes(), [10])
+        self.clock.advance(5)
+        yield sched.gotChanges([ (mkch(branch='devel', number=16), True) ])
+        self.assertEqual(sorted(sched.getPendingBuildTimes()), [10, 15])
+        self.clock.pump([1]*10)
+        self.assertEqual(self.events, [ 'B[13,14]@10', 'B[15,16]@15' ])
+        yield sched.stopService()
@@ -20,9 +20,11 @@ import mock
 from twisted.trial import unittest
 from twisted.internet import defer
 from buildbot.scripts import upgrade_master
-from buildbot import config as config_module
+from buildbot import config as config_module, sourcestamp
+from buildbot.status import builder, buildindex
 from buildbot.db import connector, model
 from buildbot.test.util import dirs, misc, compat
+from buildbot.test.fake import fakemaster
 
 def mkconfig(**kwargs):
     config = dict(quiet=False, replace=False, basedir='test')
@@ -62,6 +64,10 @@ class TestUpgradeMaster(dirs.DirsMixin, misc.StdoutAssertionsMixin,
             self.calls.append('upgradeDatabase')
         self.patch(upgrade_master, 'upgradeDatabase', upgradeDatabase)
 
+        def upgradeBuildIndexes(config, master_cfg):
+            self.calls.append('upgradeBuildIndexes')
+        self.patch(upgrade_master, 'upgradeBuildIndexes', upgradeBuildIndexes)
+
     # tests
 
     def test_upgradeMaster_success(self):
@@ -256,3 +262,28 @@ class TestUpgradeMasterFunctions(dirs.DirsMixin, misc.StdoutAssertionsMixin,
         setup.asset_called_with(check_version=False, verbose=False)
         upgrade.assert_called()
         self.assertWasQuiet()
+
+    def test_upgradeBuildIndexes(self):
+        bs = builder.BuilderStatus('bldr', None, fakemaster.make_master())
+        bs.basedir = os.path.abspath('test/bdir')
+        os.mkdir(bs.basedir)
+        bs.determineNextBuildNumber()
+        for i in xrange(2):
+            build = bs.newBuild()
+            build.setSourceStamps([ sourcestamp.SourceStamp(branch='br') ])
+            build.buildStarted(build)
+            build.buildFinished()
+            build.saveYourself()
+        os.unlink('test/bdir/build-index')
+
+        master_cfg = config_module.MasterConfig()
+        master_cfg.builders = [ config_module.BuilderConfig(name='bldr',
+                    slavename='slv', builddir='bdir', factory=mock.Mock()) ]
+        upgrade_master.upgradeBuildIndexes(mkconfig(basedir='test'),
+                                           master_cfg)
+
+        entries = buildindex.BuildIndex('test/bdir').getEntries()
+        self.assertEqual(sorted(entries.keys()), [ 0, 1 ])
+        self.assertEqual(entries[1].branches, [ 'br' ])
+        self.assertInStdout('rebuilding build history indexes')
+
@@ -171,4 +171,30 @@ class TestBuilderBuildCreation(unittest.TestCase):
                 project='p', repository='r', codebase='cbA', changes=[])
         ss2 = sourcestamp.SourceStamp(branch='dev', revision='xyz',
                 project='p', repository='r', codebase='cbB', changes=[])
-        self.assertFalse(ss1.canBeMergedWith(ss2))        
\ No newline at end of file
+        self.assertFalse(ss1.canBeMergedWith(ss2))
+
+    def test_getMergeKey(self):
+        c1 = mock.Mock()
+        c1.codebase = 'cb'
+        c1.branch = 'dev'
+        stamps = [
+            sourcestamp.SourceStamp(branch='dev', revision='xyz',
+                project='p', repository='r', codebase='cb', changes=[c1]),
+            sourcestamp.SourceStamp(branch='dev', revision='abc',
+                project='p', repository='r', codebase='cb', changes=[c1]),
+            sourcestamp.SourceStamp(branch='dev', revision='xyz',
+                project='p', repository='r', codebase='cb'),
+            sourcestamp.SourceStamp(branch='dev', revision='abc',
+                project='p', repository='r', codebase='cb'),
+            sourcestamp.SourceStamp(branch='dev', revision='xyz',
+                project='p', repository='r', codebase='cb',
+                patch=(1, 'diff')),
+            sourcestamp.SourceStamp(branch='other', revision='xyz',
+                project='p', repository='r', codebase='cb'),
+        ]
+        # keys must agree with canBeMergedWith for every pair
+        for ss1 in stamps:
+            for ss2 in stamps:
+                key1, key2 = ss1.getMergeKey(), ss2.getMergeKey()
+                self.assertEqual(key1 is not None and key1 == key2,
+                                 ss1.canBeMergedWith(ss2))
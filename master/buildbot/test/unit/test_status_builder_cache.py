@@ -16,7 +16,9 @@
 import os
 from mock import Mock
 from twisted.trial import unittest
+from buildbot import sourcestamp
 from buildbot.status import builder, master
+from buildbot.util import lru
 from buildbot.test.fake import fakemaster
 
 class TestBuildStatus(unittest.TestCase):
@@ -71,3 +73,29 @@ class TestBuildStatus(unittest.TestCase):
                              'propval%d' % build.number)
             self.assertEqual(b.buildCache.hits, hits+1)
             hits = hits + 1
+
+    def testGenerateFinishedBuilds_index(self):
+        b = self.setupBuilder('builder_1')
+        for i in xrange(4):
+            build = b.newBuild()
+            build.setSourceStamps([ sourcestamp.SourceStamp(
+                                        branch=('even', 'odd')[i % 2]) ])
+            build.buildStarted(build)
+            build.buildFinished()
+            build.saveYourself()
+
+        # start over with an empty cache, as after a restart, and track the
+        # builds that get unpickled
+        b.currentBuilds = []
+        b.buildCache = lru.LRUCache(b.cacheMiss)
+        loaded = []
+        loadBuildFromFile = b.loadBuildFromFile
+        def trackingLoadBuildFromFile(number):
+            loaded.append(number)
+            return loadBuildFromFile(number)
+        b.loadBuildFromFile = trackingLoadBuildFromFile
+
+        builds = list(b.generateFinishedBuilds(branches=['odd']))
+        self.assertEqual([ bs.number for bs in builds ], [ 3, 1 ])
+        self.assertEqual(loaded, [ 3, 1 ])
+
@@ -0,0 +1,117 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+import mock
+from twisted.trial import unittest
+from buildbot.status import buildindex
+from buildbot.util import json
+from buildbot.test.util import dirs
+
+class TestBuildIndex(dirs.DirsMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('basedir')
+        return self.setUpDirs(self.basedir)
+
+    def tearDown(self):
+        return self.tearDownDirs()
+
+    def makeBuild(self, number, branch='master', finished=20):
+        build = mock.Mock(name='build %d' % number)
+        build.getNumber.return_value = number
+        build.getTimes.return_value = (10, finished)
+        build.getResults.return_value = 0
+        ss = mock.Mock(name='sourcestamp')
+        ss.branch = branch
+        ss.revision = 'rev%d' % number
+        build.sources = [ ss ]
+        build.getSourceStamps.return_value = [ ss ]
+        build.getSlavename.return_value = 'slv'
+        build.getResponsibleUsers.return_value = [ 'dustin' ]
+        return build
+
+    def test_empty(self):
+        index = buildindex.BuildIndex(self.basedir)
+        self.assertEqual(index.getEntries(), {})
+        self.assertEqual(index.getEntry(1), None)
+
+    def test_add_and_read(self):
+        index = buildindex.BuildIndex(self.basedir)
+        index.add(self.makeBuild(1))
+        index.add(self.makeBuild(2, branch='dev'))
+
+        # read it back with a new instance
+        entry = buildindex.BuildIndex(self.basedir).getEntry(2)
+        self.assertEqual(entry.asList(), [ 2, 10, 20, 0, [ 'dev' ],
+                                    [ 'rev2' ], 'slv', [ 'dustin' ] ])
+        self.assertTrue(entry.isFinished())
+        self.assertTrue(entry.matchesBranches([ 'dev', 'other' ]))
+        self.assertFalse(entry.matchesBranches([ 'master' ]))
+
+    def test_add_updates_loaded_entries(self):
+        index = buildindex.BuildIndex(self.basedir)
+        index.getEntries()
+        index.add(self.makeBuild(1))
+        self.assertEqual(index.getEntry(1).number, 1)
+
+    def test_last_entry_wins(self):
+        index = buildindex.BuildIndex(self.basedir)
+        index.add(self.makeBuild(1, finished=20))
+        index.add(self.makeBuild(1, finished=30))
+        self.assertEqual(
+                buildindex.BuildIndex(self.basedir).getEntry(1).finished, 30)
+
+    def test_partial_line(self):
+        index = buildindex.BuildIndex(self.basedir)
+        index.add(self.makeBuild(1))
+        with open(os.path.join(self.basedir, 'build-index'), 'a') as f:
+            f.write('[2, 10, ')
+        entries = buildindex.BuildIndex(self.basedir).getEntries()
+        self.assertEqual(entries.keys(), [ 1 ])
+
+    def readNumbers(self):
+        with open(os.path.join(self.basedir, 'build-index')) as f:
+            return [ json.loads(line)[0] for line in f ]
+
+    def test_prune(self):
+        index = buildindex.BuildIndex(self.basedir)
+        index.pruneThreshold = 3
+        for number in range(5):
+            index.add(self.makeBuild(number))
+        index.prune(2)
+        self.assertEqual(sorted(index.getEntries().keys()), [ 2, 3, 4 ])
+        self.assertEqual(index.getEntry(1), None)
+        # the file is left alone until there are enough stale entries
+        self.assertEqual(self.readNumbers(), [ 0, 1, 2, 3, 4 ])
+        index.prune(3)
+        self.assertEqual(sorted(index.getEntries().keys()), [ 3, 4 ])
+        self.assertEqual(self.readNumbers(), [ 3, 4 ])
+        self.assertEqual(index.stale, 0)
+
+    def test_prune_skips_stale_entries(self):
+        index = buildindex.BuildIndex(self.basedir)
+        for number in range(5):
+            index.add(self.makeBuild(number))
+        # a new index, as after a restart, still has the stale entries in its
+        # file, but not once its horizon is set
+        index = buildindex.BuildIndex(self.basedir)
+        index.prune(3)
+        self.assertEqual(index.getEntry(2), None)
+        self.assertEqual(index.getEntry(3).number, 3)
+        self.assertEqual(index.stale, 3)
+        self.assertEqual(self.readNumbers(), [ 0, 1, 2, 3, 4 ])
@@ -0,0 +1,139 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import task
+from buildbot.status import eventlog
+from buildbot.util import eventual
+
+class StatusEventLog(unittest.TestCase):
+
+    def setUp(self):
+        self.log = eventlog.StatusEventLog()
+        self.log._reactor = self.clock = task.Clock()
+
+    def tearDown(self):
+        return eventual.flushEventualQueue()
+
+    def makeBuild(self, builderName='bldr', number=7):
+        build = mock.Mock(name='build')
+        build.getBuilder().getName.return_value = builderName
+        build.getNumber.return_value = number
+        return build
+
+    def makeStep(self, name='compile'):
+        step = mock.Mock(name='step')
+        step.getName.return_value = name
+        return step
+
+    def test_events(self):
+        build = self.makeBuild()
+        step = self.makeStep()
+        self.clock.advance(10)
+        self.assertIdentical(self.log.builderAdded('bldr', mock.Mock()),
+                             self.log)
+        self.assertIdentical(self.log.buildStarted('bldr', build), self.log)
+        self.log.stepStarted(build, step)
+        self.log.stepFinished(build, step, (0, []))
+        self.log.buildFinished('bldr', build, 0)
+        self.log.slaveConnected('sl')
+        self.assertEqual(self.log.sequence, 6)
+        self.assertEqual(self.log.getEvents(self.log.epoch, 2), (True, [
+            dict(sequence=3, time=10, event='stepStarted', builderName='bldr',
+                 number=7, step='compile'),
+            dict(sequence=4, time=10, event='stepFinished',
+                 builderName='bldr', number=7, step='compile', results=0),
+            dict(sequence=5, time=10, event='buildFinished',
+                 builderName='bldr', number=7, results=0),
+            dict(sequence=6, time=10, event='slaveConnected',
+                 slaveName='sl'),
+        ]))
+
+    def test_getEvents_current(self):
+        self.assertEqual(self.log.getEvents(self.log.epoch, 0), (True, []))
+        self.log.slaveConnected('sl')
+        self.assertEqual(self.log.getEvents(self.log.epoch, 1), (True, []))
+
+    def test_getEvents_discarded(self):
+        self.log.maxEvents = 3
+        for i in range(5):
+            self.log.slaveConnected('sl%d' % i)
+        self.assertEqual(len(self.log.events), 3)
+        self.assertEqual(self.log.getEvents(self.log.epoch, 1), (False, []))
+        complete, events = self.log.getEvents(self.log.epoch, 2)
+        self.assertTrue(complete)
+        self.assertEqual([ e['sequence'] for e in events ], [ 3, 4, 5 ])
+
+    def test_getEvents_future(self):
+        # for example, from before the master restarted
+        self.log.slaveConnected('sl')
+        self.assertEqual(self.log.getEvents(self.log.epoch, 10), (False, []))
+
+    def test_getEvents_other_epoch(self):
+        # a new master starts counting from one again
+        old = eventlog.StatusEventLog()
+        self.assertNotEqual(old.epoch, self.log.epoch)
+        self.log.slaveConnected('sl')
+        self.assertEqual(self.log.getEvents(old.epoch, 0), (False, []))
+        self.assertEqual(self.log.getEvents(old.epoch, 1), (False, []))
+
+    def test_waitForEvents_other_epoch(self):
+        fired = []
+        self.log.waitForEvents('other', 0, 30).addCallback(fired.append)
+        self.assertEqual(fired, [ None ])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_waitForEvents_ready(self):
+        self.log.slaveConnected('sl')
+        fired = []
+        self.log.waitForEvents(self.log.epoch, 0, 30).addCallback(fired.append)
+        self.assertEqual(fired, [ None ])
+
+    def test_waitForEvents(self):
+        fired = []
+        self.log.waitForEvents(self.log.epoch, 0, 30).addCallback(fired.append)
+        self.log.waitForEvents(self.log.epoch, 0, 30).addCallback(fired.append)
+        self.log.slaveConnected('sl')
+        self.log.slaveDisconnected('sl')
+        self.assertEqual(fired, [])
+        d = eventual.flushEventualQueue()
+        def check(_):
+            # both waiters woke once, and their timeouts were cancelled
+            self.assertEqual(fired, [ None, None ])
+            self.assertEqual(self.log.waiters, {})
+            self.assertEqual(self.clock.getDelayedCalls(), [])
+        d.addCallback(check)
+        return d
+
+    def test_waitForEvents_timeout(self):
+        fired = []
+        self.log.waitForEvents(self.log.epoch, 0, 30).addCallback(fired.append)
+        self.clock.advance(29)
+        self.assertEqual(fired, [])
+        self.clock.advance(1)
+        self.assertEqual(fired, [ None ])
+        self.assertEqual(self.log.waiters, {})
+
+    def test_stopWaiting(self):
+        fired = []
+        d = self.log.waitForEvents(self.log.epoch, 0, 30)
+        d.addCallback(fired.append)
+        self.log.stopWaiting(d)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.log.slaveConnected('sl')
+        d = eventual.flushEventualQueue()
+        d.addCallback(lambda _ : self.assertEqual(fired, []))
+        return d
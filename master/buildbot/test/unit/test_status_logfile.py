@@ -22,6 +22,7 @@ from twisted.trial import unittest
 from twisted.internet import defer
 from buildbot.status import logfile
 from buildbot.test.util import dirs
+from buildbot.util import eventual
 from buildbot import config
 
 class TestLogFileProducer(unittest.TestCase):
@@ -48,10 +49,41 @@ class TestLogFileProducer(unittest.TestCase):
     # Remainder of LogFileProduer has a wacky interface that's not
     # well-defined, so it's not tested yet
 
+class TestTailBuffer(unittest.TestCase):
+
+    def test_wraparound(self):
+        tail = logfile.TailBuffer(8)
+        tail.append(0, 'abcde')
+        tail.append(1, 'fgh')
+        self.assertEqual(tail.getEntries(), [(0, 'abcde'), (1, 'fgh')])
+        tail.append(1, 'ij')
+        self.assertEqual(tail.getEntries(), [(0, 'cde'), (1, 'fghij')])
+        tail.append(0, 'klm')
+        self.assertEqual(tail.getEntries(), [(1, 'fghij'), (0, 'klm')])
+        self.assertEqual((tail.length, tail.dropped), (8, 5))
+
+    def test_large_text(self):
+        tail = logfile.TailBuffer(4)
+        tail.append(0, 'ab')
+        tail.append(1, 'cdefghij')
+        self.assertEqual(tail.getEntries(), [(1, 'ghij')])
+        self.assertEqual((tail.length, tail.dropped), (4, 6))
+
+    def test_many_chunks(self):
+        tail = logfile.TailBuffer(10)
+        for i in range(1000):
+            tail.append(i % 2, str(i % 10))
+        self.assertEqual(''.join([ t for c, t in tail.getEntries() ]),
+                         '0123456789')
+        self.assertEqual(len(tail.runs), 10)
+        self.assertEqual(tail.dropped, 990)
+
+
 class TestLogFile(unittest.TestCase, dirs.DirsMixin):
 
     def setUp(self):
         step = self.build_step_status = mock.Mock(name='build_step_status')
+        step.getStatistic.side_effect = lambda name, default=None : default
         self.basedir = step.build.builder.basedir = os.path.abspath('basedir')
         self.setUpDirs(self.basedir)
         self.logfile = logfile.LogFile(step, 'testlf', '123-stdio')
@@ -114,6 +146,12 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
             f.write("hi")
         self.assertTrue(self.logfile.hasContents())
 
+    def test_hasContents_blocks(self):
+        self.delete_logfile()
+        with open(os.path.join(self.basedir, '123-stdio.blocks'), "w") as f:
+            f.write("hi")
+        self.assertTrue(self.logfile.hasContents())
+
     def test_getName(self):
         self.assertEqual(self.logfile.getName(), 'testlf')
 
@@ -227,14 +265,15 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
     def test_addEntry_logMaxTailSize(self):
         self.config.logMaxSize = 10
         self.config.logMaxTailSize = 14
-        return self.do_test_addEntry([(0, 'abcdef')] * 10 ,
+        self.do_test_addEntry([(0, 'abcdef')] * 10 ,
             '11:0abcdefabcd,'
             '64:2\nOutput exceeded 10 bytes, remaining output has been '
             'truncated\n,'
-            # NOTE: this gets too few bytes; this is OK for now, and
-            # easier than subdividing chunks in the tail tracking
-            '31:2\nFinal 12 bytes follow below:\n,'
-            '13:0abcdefabcdef,')
+            '31:2\nFinal 14 bytes follow below:\n,'
+            '15:0efabcdefabcdef,')
+        # 50 bytes were truncated, of which the tail kept 14
+        self.build_step_status.setStatistic.assert_called_with(
+                'log_bytes_dropped', 36)
 
     def test_addEntry_logMaxTailSize_divisor(self):
         self.config.logMaxSize = 10
@@ -246,7 +285,27 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
             '31:2\nFinal 12 bytes follow below:\n,'
             '13:0abcdefabcdef,')
 
-    # TODO: test that head and tail don't discriminate between stderr and stdout
+    def test_addEntry_logMaxTailSize_channels(self):
+        self.config.logMaxSize = 4
+        self.config.logMaxTailSize = 6
+        return self.do_test_addEntry([(0, 'abcdef'), (1, 'ghi'), (1, 'jk'),
+                                      (0, 'lm')],
+            '5:0abcd,'
+            '63:2\nOutput exceeded 4 bytes, remaining output has been '
+            'truncated\n,'
+            '30:2\nFinal 6 bytes follow below:\n,'
+            '5:1hijk,3:0lm,')
+
+    def test_addEntry_logMaxSize_dropped(self):
+        self.config.logMaxSize = 10
+        self.do_test_addEntry([(0, 'abcdef')] * 10 ,
+            '11:0abcdefabcd,'
+            '64:2\nOutput exceeded 10 bytes, remaining output has been '
+            'truncated\n,')
+        self.assertEqual(self.logfile.droppedBytes, 50)
+        self.build_step_status.setStatistic.assert_called_with(
+                'log_bytes_dropped', 50)
+
 
     def test_addEntry_chunkSize(self):
         self.logfile.chunkSize = 11
@@ -291,6 +350,152 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
                             for args in watcher.logChunk.call_args_list ]
         self.assertEqual(logChunk_chunks, [(0, 'x')] * 15)
 
+    def test_chunkIndex(self):
+        self.logfile.chunkIndexInterval = 2
+        self.logfile.chunkSize = 4
+        self.do_test_addEntry([(0, 'ab\ncd\nef'), (1, 'gh\n')],
+                '5:0ab\nc,5:0d\nef,4:1gh\n,')
+        self.assertEqual(self.logfile.chunkIndex, [
+            (0, 0, {}, {}),
+            (16, 1, {0 : 8}, {0 : 2}),
+        ])
+
+    def do_test_getChunks(self, expected, _no_index=False, **kwargs):
+        self.logfile.chunkIndexInterval = 1
+        for chan, txt in [ (0, 'abcdef'), (1, 'ghij'), (0, 'klm') ]:
+            self.logfile.addEntry(chan, txt)
+        self.logfile.finish()
+        if _no_index:
+            # as for a log written by an older version
+            self.logfile.chunkIndex = None
+        self.assertEqual(list(self.logfile.getChunks(**kwargs)), expected)
+
+    def test_getChunks_range(self):
+        self.do_test_getChunks([ (0, 'ef'), (1, 'ghij'), (0, 'kl') ],
+                               start=4, end=12)
+
+    def test_getChunks_range_channels(self):
+        self.do_test_getChunks([ (0, 'ef'), (0, 'kl') ],
+                               channels=[0], start=4, end=8)
+
+    def test_getChunks_range_no_index(self):
+        self.do_test_getChunks([ (1, 'hij'), (0, 'k') ], _no_index=True,
+                               start=7, end=11)
+
+    def test_getChunks_range_onlyText(self):
+        self.do_test_getChunks([ 'ghij' ], start=6, end=10, onlyText=True)
+
+    def test_getTextLength(self):
+        self.logfile.addEntry(0, 'abc')
+        self.logfile.addEntry(2, 'header')
+        self.logfile._merge()
+        self.logfile.addEntry(1, 'de')
+        self.assertEqual(self.logfile.getTextLength([0, 1]), 5)
+        self.assertEqual(self.logfile.getTextLength([1]), 2)
+        self.logfile.chunkIndex = None
+        self.assertEqual(self.logfile.getTextLength([0, 1]), None)
+
+    def test_produceChunks(self):
+        self.logfile.chunkIndexInterval = 1
+        for chan, txt in [ (0, 'abcdef'), (1, 'ghij'), (0, 'klm') ]:
+            self.logfile.addEntry(chan, txt)
+        self.logfile._merge()
+        consumer = mock.Mock()
+        chunks = []
+        consumer.writeChunk = chunks.append
+        self.logfile.produceChunks(consumer, [0, 1], start=4, end=12)
+        d = eventual.flushEventualQueue()
+        def check(_):
+            self.assertEqual(chunks, [ (0, 'ef'), (1, 'ghij'), (0, 'kl') ])
+            # the consumer is finished, although the log is not
+            self.assertTrue(consumer.unregisterProducer.called)
+            self.assertTrue(consumer.finish.called)
+            self.assertEqual(self.logfile.watchers, [])
+        d.addCallback(check)
+        return d
+
+    def test_produceChunks_lastLines(self):
+        for i in range(10):
+            self.logfile.addEntry(0, 'line %d\n' % i)
+        self.logfile._merge()
+        consumer = mock.Mock()
+        chunks = []
+        consumer.writeChunk = chunks.append
+        d = self.logfile.produceChunks(consumer, [0], lastLines=2)
+        d.addCallback(lambda _ : eventual.flushEventualQueue())
+        def check(_):
+            self.assertEqual("".join([ text for chan, text in chunks ]),
+                             'line 8\nline 9\n')
+            self.assertTrue(consumer.finish.called)
+        d.addCallback(check)
+        return d
+
+    def test_LastLines(self):
+        # only the chunks that the last lines can come from are kept
+        tail = logfile._LastLines(2)
+        for i in range(1000):
+            tail.add((0, 'line %d\n' % i))
+        self.assertEqual(len(tail.kept), 3)
+        self.assertEqual(tail.getChunks(),
+                         [ (0, 'line 998\n'), (0, 'line 999\n') ])
+
+    def test_getChunks_lastLines(self):
+        self.logfile.chunkIndexInterval = 1
+        self.logfile.chunkSize = 4
+        self.do_test_addEntry([(0, 'l1\nl2\nl3\nl4\n')],
+                '5:0l1\nl,5:02\nl3,5:0\nl4\n,')
+        self.assertEqual(list(self.logfile.getChunks(lastLines=2)),
+                         [ (0, 'l3'), (0, '\nl4\n') ])
+        self.assertEqual(
+                "".join(self.logfile.getChunks(lastLines=3, onlyText=True)),
+                'l2\nl3\nl4\n')
+        self.assertEqual(
+                "".join(self.logfile.getChunks(lastLines=10, onlyText=True)),
+                'l1\nl2\nl3\nl4\n')
+
+    def test_getChunks_lastLines_unfinished(self):
+        self.logfile.addEntry(0, 'one\ntwo\n')
+        self.logfile._merge()
+        self.logfile.addEntry(0, 'thr')
+        self.assertEqual(
+                "".join(self.logfile.getChunks(lastLines=2, onlyText=True)),
+                'two\nthr')
+
+    def make_blocks_logfile(self):
+        self.delete_logfile()
+        step = self.build_step_status
+        step.build.builder.master.config.logCompressionMethod = 'blocks'
+        self.patch(logfile.LogFile, 'compressionBlockSize', 16)
+        self.logfile = logfile.LogFile(step, 'testlf', '123-stdio')
+        self.logfile.master = self.master
+
+    @defer.inlineCallbacks
+    def test_blocks(self):
+        self.make_blocks_logfile()
+        self.logfile.chunkIndexInterval = 1
+        self.logfile.chunkSize = 8
+        self.logfile.addStdout('012345678\n' * 4)
+        self.logfile.addStderr('error\n')
+        # everything is on disk, and readable, before it is compressed
+        self.assertFalse(os.path.exists(self.logfile.getFilename()))
+        self.assertEqual(self.logfile.getText(),
+                         '012345678\n' * 4 + 'error\n')
+        openfile = self.logfile.openfile
+        self.logfile.finish()
+        # the log file is read through the open file until it finishes
+        self.assertIdentical(self.logfile.openfile, openfile)
+        yield openfile.finish()
+        self.assertIdentical(self.logfile.openfile, None)
+        self.assertTrue(len(openfile.offsets) > 1)
+        self.pickle_and_restore()
+        self.assertTrue(self.logfile.hasContents())
+        self.assertEqual(self.logfile.getText(),
+                         '012345678\n' * 4 + 'error\n')
+        self.assertEqual(list(self.logfile.getChunks(start=33, end=42)),
+                         [ (0, '345678\n'), (1, 'er') ])
+        self.assertEqual(list(self.logfile.getChunks(lastLines=1)),
+                         [ (1, 'error\n') ])
+
     def test_addStdout(self):
         addEntry = mock.Mock()
         self.patch(self.logfile, 'addEntry', addEntry)
@@ -330,6 +535,10 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
         self.config.logCompressionMethod = 'bz2'
         return self.do_test_compressLog('.bz2')
 
+    def test_compressLog_blocks(self):
+        self.config.logCompressionMethod = 'blocks'
+        return self.do_test_compressLog('.blocks')
+
     def test_compressLog_none(self):
         self.config.logCompressionMethod = None
         return self.do_test_compressLog('', expect_comp=False)
@@ -48,6 +48,15 @@ class TestStatus(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_eventLog(self):
+        s = self.makeStatus()
+        s.slaveConnected('sl')
+        s.changeAdded(mock.Mock(name='change', number=13))
+        self.assertEqual(s.eventLog.sequence, 2)
+        complete, events = s.eventLog.getEvents(s.eventLog.epoch, 0)
+        self.assertEqual([ (e['event'], e.get('number')) for e in events ],
+                [ ('slaveConnected', None), ('changeAdded', 13) ])
+
     @defer.inlineCallbacks
     def test_reconfigService(self):
         m = mock.Mock(name='master')
@@ -0,0 +1,154 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import mock
+from twisted.trial import unittest
+from buildbot import sourcestamp, util
+from buildbot.changes import changes
+from buildbot.status import builder
+from buildbot.status.results import SUCCESS, FAILURE
+from buildbot.status.web import console
+from buildbot.test.fake import fakemaster
+
+def describe(cb):
+    d = dict(vars(cb))
+    d['changes'] = [ (ch.revision, ch.when) for ch in cb.changes ]
+    return d
+
+
+class ConsoleColumn(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000
+        self.patch(util, 'now', lambda _reactor=None : self.now)
+        m = fakemaster.make_master()
+        self.builder = b = builder.BuilderStatus(buildername='bldr',
+                                                 category='cat', master=m)
+        b.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(b.basedir)
+        b.determineNextBuildNumber()
+        b.currentBigState = 'idle'
+        b.status = mock.Mock()
+        self.cache = console.ConsoleCache(mock.Mock())
+
+    def startBuild(self, revision):
+        self.now += 10
+        bs = self.builder.newBuild()
+        change = changes.Change('me', [], 'fixed it', revision=revision,
+                                when=self.now)
+        bs.setSourceStamps([ sourcestamp.SourceStamp(changes=[ change ]) ])
+        bs.setProperty('got_revision', revision, 'test')
+        bs.buildStarted(bs)
+        self.cache.buildStarted('bldr', bs)
+        return bs
+
+    def addStep(self, bs, name, results=SUCCESS):
+        self.now += 10
+        step = bs.addStepWithName(name)
+        step.stepStarted()
+        step.setText([ name, '<b>%s</b>' % results ])
+        step.addHTMLLog('stdio', 'output')
+        step.stepFinished(results)
+        return step
+
+    def finishBuild(self, bs, results=SUCCESS):
+        self.now += 10
+        bs.setResults(results)
+        bs.buildFinished()
+        self.cache.buildFinished('bldr', bs, results)
+
+    def runBuild(self, revision, results=SUCCESS):
+        bs = self.startBuild(revision)
+        self.addStep(bs, 'compile', results=results)
+        self.addStep(bs, 'test')
+        self.finishBuild(bs, results)
+        return bs
+
+    def assertSameBuilds(self, column):
+        head = self.builder.getBuild(-1) or self.builder.getBuild(-2)
+        self.assertEqual(map(describe, column.getBuilds()),
+                         map(describe, console.historyBuilds(head)))
+
+    def test_load(self):
+        self.runBuild('10')
+        self.runBuild('11', results=FAILURE)
+        column = self.cache.getColumn(self.builder)
+        self.assertSameBuilds(column)
+        builds = list(column.getBuilds())
+        self.assertEqual([ cb.number for cb in builds ], [ 1, 0 ])
+        self.assertEqual(builds[0].failure, dict(step='compile',
+                         status='compile 2', reason=[], logs=[ 'stdio' ]))
+        self.assertEqual(builds[1].failure, None)
+
+    def test_incremental(self):
+        self.runBuild('10')
+        column = self.cache.getColumn(self.builder)
+        self.assertSameBuilds(column)
+        bs = self.startBuild('11')
+        self.addStep(bs, 'compile', results=FAILURE)
+        # the running build is summarized from its status
+        self.assertIdentical(column.builds[-1], bs)
+        running = list(column.getBuilds())[0]
+        self.assertFalse(running.isFinished)
+        self.assertEqual(running.failure['step'], 'compile')
+        self.assertSameBuilds(column)
+        self.finishBuild(bs, FAILURE)
+        self.assertTrue(isinstance(column.builds[-1], console.ConsoleBuild))
+        self.assertSameBuilds(column)
+
+    def test_maxBuilds(self):
+        self.cache.maxBuilds = 2
+        self.runBuild('10')
+        self.runBuild('11')
+        column = self.cache.getColumn(self.builder)
+        column.load()
+        self.runBuild('12')
+        self.assertEqual([ cb.number for cb in column.builds ], [ 1, 2 ])
+        # the older builds come from the builder's history
+        self.assertSameBuilds(column)
+
+    def test_getBuildsForRevision(self):
+        self.runBuild('10')
+        self.runBuild('11', results=FAILURE)
+        self.runBuild('12')
+        resource = console.ConsoleStatusResource()
+        request = mock.Mock()
+        request.childLink = lambda path : path
+        def getBuilds(cache):
+            request.site.buildbot_service.getConsoleCache = lambda : cache
+            debugInfo = dict(builds_scanned=0)
+            builds = resource.getBuildsForRevision(request, self.builder,
+                                                   'bldr', '11', 2, debugInfo)
+            return [ vars(b) for b in builds ]
+        builds = getBuilds(self.cache)
+        self.assertEqual(builds, getBuilds(None))
+        self.assertEqual([ b['number'] for b in builds ], [ 2, 1 ])
+        self.assertEqual(builds[1]['details']['logs'], [ dict(name='stdio',
+                url='../builders/bldr/builds/1/steps/compile/logs/stdio') ])
+
+
+class ConsoleCache(unittest.TestCase):
+
+    def test_getColumn(self):
+        cache = console.ConsoleCache(mock.Mock())
+        bldr = mock.Mock(name='builder')
+        bldr.getName.return_value = 'bldr'
+        column = cache.getColumn(bldr)
+        self.assertIdentical(cache.getColumn(bldr), column)
+        self.assertIdentical(cache.builderAdded('bldr', bldr), cache)
+        cache.builderRemoved('bldr')
+        self.assertEqual(cache.watched, [])
+        self.assertNotIdentical(cache.getColumn(bldr), column)
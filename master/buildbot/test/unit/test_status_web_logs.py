@@ -0,0 +1,146 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from buildbot.status import logfile
+from buildbot.status.web import logs
+from buildbot.test.fake.web import FakeRequest
+
+class FakeLogFile(object):
+    """A log with the given chunks, which are all that any part of it
+    contains."""
+
+    def __init__(self, chunks, length=None, finished=True):
+        self.chunks = chunks
+        self.length = length
+        self.finished = finished
+        self.produced = None
+        self.subscribed = False
+
+    def produceChunks(self, consumer, channels=[], **kwargs):
+        self.produced = (channels, kwargs)
+        p = logfile.LogFileProducer(self, consumer, iter(self.chunks))
+        p.resumeProducing()
+        return defer.succeed(None)
+
+    def subscribeConsumer(self, consumer):
+        self.subscribed = True
+
+    def getTextLength(self, channels):
+        return self.length
+
+    def isFinished(self):
+        return self.finished
+
+
+class TestTextLog(unittest.TestCase):
+
+    def makeTextLog(self, chunks, length=None, finished=True):
+        textlog = logs.TextLog(FakeLogFile(chunks, length, finished))
+        textlog.asText = True
+        return textlog
+
+    def makeRequest(self, args={}, range=None):
+        req = FakeRequest(args=args)
+        req.method = 'GET'
+        req.getHeader = lambda name : name == 'range' and range or None
+        return req
+
+    def getHeaders(self, req):
+        return dict(call[0] for call in req.setHeader.call_args_list)
+
+    def test_tail(self):
+        textlog = self.makeTextLog([ (logfile.STDOUT, 'b\n'),
+                                     (logfile.STDERR, 'c\n') ])
+        req = self.makeRequest(args={'tail' : ['2']})
+        d = req.test_render(textlog)
+        def check(_):
+            self.assertEqual(textlog.original.produced,
+                    ([logfile.STDOUT, logfile.STDERR], dict(lastLines=2)))
+            self.assertEqual(req.written, 'b\nc\n')
+            self.assertFalse(textlog.original.subscribed)
+        d.addCallback(check)
+        return d
+
+    def test_tail_invalid(self):
+        textlog = self.makeTextLog([])
+        req = self.makeRequest(args={'tail' : ['x']})
+        textlog.render(req)
+        self.assertEqual(textlog.original.produced, None)
+        self.assertTrue(textlog.original.subscribed)
+
+    def test_range(self):
+        textlog = self.makeTextLog([ (logfile.STDOUT, 'cde') ], length=10)
+        req = self.makeRequest(range='bytes=2-4')
+        d = req.test_render(textlog)
+        def check(_):
+            self.assertEqual(textlog.original.produced,
+                    ([logfile.STDOUT, logfile.STDERR], dict(start=2, end=5)))
+            req.setResponseCode.assert_called_with(206)
+            headers = self.getHeaders(req)
+            self.assertEqual(headers['content-range'], 'bytes 2-4/10')
+            self.assertEqual(headers['content-length'], 3)
+            self.assertEqual(headers['accept-ranges'], 'bytes')
+            self.assertEqual(req.written, 'cde')
+        d.addCallback(check)
+        return d
+
+    def test_range_open(self):
+        textlog = self.makeTextLog([ (logfile.STDOUT, 'cd') ], length=4,
+                                   finished=False)
+        req = self.makeRequest(range='bytes=2-')
+        d = req.test_render(textlog)
+        def check(_):
+            self.assertEqual(textlog.original.produced,
+                    ([logfile.STDOUT, logfile.STDERR], dict(start=2, end=4)))
+            # the log is still growing, so its length is not given
+            self.assertEqual(self.getHeaders(req)['content-range'],
+                             'bytes 2-3/*')
+        d.addCallback(check)
+        return d
+
+    def test_range_unsatisfiable(self):
+        textlog = self.makeTextLog([], length=10)
+        req = self.makeRequest(range='bytes=100-')
+        d = req.test_render(textlog)
+        def check(_):
+            req.setResponseCode.assert_called_with(416)
+            self.assertEqual(self.getHeaders(req)['content-range'],
+                             'bytes */10')
+            self.assertEqual(textlog.original.produced, None)
+            self.assertEqual(req.written, '')
+        d.addCallback(check)
+        return d
+
+    def test_range_old_log(self):
+        # without a length, the whole log is sent
+        textlog = self.makeTextLog([], length=None)
+        req = self.makeRequest(range='bytes=2-4')
+        textlog.render(req)
+        self.assertTrue(textlog.original.subscribed)
+        self.assertFalse(req.setResponseCode.called)
+
+    def test_getRange(self):
+        textlog = self.makeTextLog([])
+        def getRange(header):
+            return textlog._getRange(self.makeRequest(range=header))
+        self.assertEqual(getRange('bytes=0-9'), (0, 10))
+        self.assertEqual(getRange('bytes=10-'), (10, None))
+        self.assertEqual(getRange(None), None)
+        self.assertEqual(getRange('bytes=-10'), None)
+        self.assertEqual(getRange('bytes=5-2'), None)
+        self.assertEqual(getRange('bytes=0-1,4-5'), None)
+        self.assertEqual(getRange('lines=1-2'), None)
@@ -0,0 +1,310 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from buildbot.status import eventlog
+from buildbot.status.web import status_json
+from buildbot.process import metrics
+from buildbot.test.fake.web import FakeRequest
+from buildbot.util import eventual, json
+
+class CountingResource(status_json.JsonResource):
+
+    def __init__(self, status):
+        status_json.JsonResource.__init__(self, status)
+        self.calls = 0
+
+    def asDict(self, request):
+        self.calls += 1
+        return { 'calls' : self.calls }
+
+
+class JsonCache(unittest.TestCase):
+
+    def setUp(self):
+        self.status = mock.Mock(name='status')
+        self.cache = status_json.JsonCache(self.status)
+        self.cache._reactor = self.clock = task.Clock()
+        self.counts = {}
+        def log(counter, count=1, absolute=False):
+            self.counts[counter] = self.counts.get(counter, 0) + count
+        self.patch(metrics.MetricCountEvent, 'log', staticmethod(log))
+
+    def test_get_put(self):
+        self.assertEqual(self.cache.get('k'), None)
+        self.cache.put('k', '"etag"', 'data')
+        self.assertEqual(self.cache.get('k'), ('"etag"', 'data'))
+        self.assertEqual(self.counts,
+                { 'JsonCache.hits' : 1, 'JsonCache.misses' : 1 })
+
+    def test_maxAge(self):
+        self.cache.put('k', '"etag"', 'data')
+        self.clock.advance(self.cache.maxAge + 1)
+        self.assertEqual(self.cache.get('k'), None)
+        self.assertEqual(self.cache.entries, { None : {} })
+
+    def test_maxEntries(self):
+        self.cache.maxEntries = 2
+        self.cache.put('a', '"a"', 'a')
+        self.cache.put('b', '"b"', 'b', 'bldr')
+        self.cache.put('c', '"c"', 'c')
+        self.assertEqual(self.cache.entries.keys(), [ None ])
+        self.assertEqual(self.cache.entries[None].keys(), [ 'c' ])
+
+    def test_invalidated_by_events(self):
+        builder = mock.Mock(name='builder')
+        build = mock.Mock(name='build')
+        events = [
+            lambda : self.cache.builderAdded('b', builder),
+            lambda : self.cache.builderChangedState('b', 'idle'),
+            lambda : self.cache.buildStarted('b', build),
+            lambda : self.cache.stepFinished(build, mock.Mock(), 0),
+            lambda : self.cache.buildFinished('b', build, 0),
+            lambda : self.cache.requestSubmitted(mock.Mock()),
+            lambda : self.cache.changeAdded(mock.Mock()),
+            lambda : self.cache.slaveConnected('s'),
+        ]
+        for event in events:
+            self.cache.put('k', '"etag"', 'data')
+            event()
+            self.assertEqual(self.cache.entries, {})
+
+    def test_invalidated_by_builder_events(self):
+        build = mock.Mock(name='build')
+        build.getBuilder().getName.return_value = 'b1'
+        request = mock.Mock(name='request')
+        request.getBuilderName.return_value = 'b1'
+        builder = mock.Mock(name='builder')
+        builder.getName.return_value = 'b1'
+        events = [
+            lambda : self.cache.builderChangedState('b1', 'idle'),
+            lambda : self.cache.buildStarted('b1', build),
+            lambda : self.cache.stepFinished(build, mock.Mock(), 0),
+            lambda : self.cache.buildFinished('b1', build, 0),
+            lambda : self.cache.requestSubmitted(request),
+            lambda : self.cache.requestCancelled(builder, request),
+        ]
+        for event in events:
+            self.cache.put('k', '"all"', 'all')
+            self.cache.put('k1', '"b1"', 'b1', 'b1')
+            self.cache.put('k2', '"b2"', 'b2', 'b2')
+            event()
+            # only the entries for b1, and those for all builders, are gone
+            self.assertEqual(self.cache.get('k'), None)
+            self.assertEqual(self.cache.get('k1', 'b1'), None)
+            self.assertEqual(self.cache.get('k2', 'b2'), ('"b2"', 'b2'))
+
+    def test_subscriptions(self):
+        builder = mock.Mock(name='builder')
+        self.cache.startService()
+        self.status.subscribe.assert_called_with(self.cache)
+        self.assertIdentical(self.cache.builderAdded('b', builder), self.cache)
+        self.assertIdentical(self.cache.buildStarted('b', mock.Mock()),
+                             self.cache)
+        self.cache.stopService()
+        self.status.unsubscribe.assert_called_with(self.cache)
+        builder.unsubscribe.assert_called_with(self.cache)
+
+
+class JsonResource(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = status_json.JsonCache(mock.Mock(name='status'))
+        self.resource = CountingResource(mock.Mock(name='status'))
+
+    def render(self, args={}, ifNoneMatch=None, cache=True):
+        req = FakeRequest(args=dict(args))
+        req.method = 'GET'
+        req.prepath = [ 'json', 'counting' ]
+        req.site.buildbot_service.jsonCache = cache and self.cache or None
+        req.getHeader = lambda name : (name == 'if-none-match'
+                                       and ifNoneMatch or None)
+        d = req.test_render(self.resource)
+        d.addCallback(lambda _ : req)
+        return d
+
+    def getETag(self, req):
+        for call in req.setHeader.call_args_list:
+            if call[0][0] == 'ETag':
+                return call[0][1]
+
+    def test_etag(self):
+        d = self.render()
+        def check(req):
+            self.assertEqual(req.written, '{"calls":1}')
+            self.assertEqual(self.getETag(req),
+                             status_json.MakeETag('{"calls":1}'))
+        d.addCallback(check)
+        return d
+
+    def test_cached(self):
+        d = self.render()
+        d.addCallback(lambda _ : self.render())
+        def check(req):
+            self.assertEqual(self.resource.calls, 1)
+            self.assertEqual(req.written, '{"calls":1}')
+            self.assertEqual(self.getETag(req),
+                             status_json.MakeETag('{"calls":1}'))
+        d.addCallback(check)
+        # a different query string is cached separately
+        d.addCallback(lambda _ : self.render(args={ 'as_text' : [ '1' ] }))
+        d.addCallback(lambda _ : self.assertEqual(self.resource.calls, 2))
+        # and everything is recomputed once the status changes
+        d.addCallback(lambda _ : self.cache.buildFinished('b', None, 0))
+        d.addCallback(lambda _ : self.render())
+        d.addCallback(lambda req : self.assertEqual(req.written,
+                                                    '{"calls":3}'))
+        return d
+
+    def test_cached_per_builder(self):
+        self.resource.builderName = 'b2'
+        d = self.render()
+        # an event on another builder leaves the response cached
+        d.addCallback(lambda _ : self.cache.buildFinished('b1', None, 0))
+        d.addCallback(lambda _ : self.render())
+        d.addCallback(lambda _ : self.assertEqual(self.resource.calls, 1))
+        d.addCallback(lambda _ : self.cache.buildFinished('b2', None, 0))
+        d.addCallback(lambda _ : self.render())
+        d.addCallback(lambda _ : self.assertEqual(self.resource.calls, 2))
+        return d
+
+    def test_uncacheable(self):
+        self.resource.cacheable = False
+        d = self.render()
+        d.addCallback(lambda _ : self.render())
+        d.addCallback(lambda _ : self.assertEqual(self.resource.calls, 2))
+        return d
+
+    def test_not_modified(self):
+        etag = status_json.MakeETag('{"calls":1}')
+        d = self.render(ifNoneMatch='"other", %s' % etag, cache=False)
+        def check(req):
+            req.setResponseCode.assert_called_with(304)
+            self.assertEqual(req.written, '')
+            self.assertTrue(req.finished)
+        d.addCallback(check)
+        return d
+
+    def test_modified(self):
+        d = self.render(ifNoneMatch='"other"')
+        def check(req):
+            self.assertFalse(req.setResponseCode.called)
+            self.assertEqual(req.written, '{"calls":1}')
+        d.addCallback(check)
+        return d
+
+    def test_MatchesETag(self):
+        def matches(header):
+            req = mock.Mock()
+            req.getHeader = lambda name : header
+            return status_json.MatchesETag(req, '"abc"')
+        self.assertTrue(matches('"abc"'))
+        self.assertTrue(matches('W/"abc"'))
+        self.assertTrue(matches('*'))
+        self.assertTrue(matches('"x" , "abc"'))
+        self.assertFalse(matches('"abcd"'))
+        self.assertFalse(matches(None))
+
+
+class EventsJsonResource(unittest.TestCase):
+
+    def setUp(self):
+        self.eventLog = eventlog.StatusEventLog()
+        self.eventLog._reactor = self.clock = task.Clock()
+        self.eventLog.epoch = 'e1'
+        status = mock.Mock(name='status')
+        status.eventLog = self.eventLog
+        self.resource = status_json.EventsJsonResource(status)
+
+    def tearDown(self):
+        return eventual.flushEventualQueue()
+
+    def render(self, **args):
+        req = FakeRequest(args=dict((k, [ v ]) for k, v in args.items()))
+        req.method = 'GET'
+        req.prepath = [ 'json', 'events' ]
+        req.site.buildbot_service.jsonCache = None
+        req.getHeader = lambda name : None
+        req.disconnect = defer.Deferred()
+        req.notifyFinish = lambda : req.disconnect
+        d = req.test_render(self.resource)
+        d.addCallback(lambda _ : json.loads(req.written))
+        return req, d
+
+    def test_current(self):
+        self.eventLog.slaveConnected('sl')
+        req, d = self.render()
+        d.addCallback(self.assertEqual,
+                { 'epoch' : 'e1', 'sequence' : 1, 'complete' : True,
+                  'events' : [] })
+        return d
+
+    def test_since(self):
+        self.eventLog.slaveConnected('sl')
+        self.eventLog.slaveDisconnected('sl')
+        req, d = self.render(since='e1:1')
+        def check(res):
+            self.assertEqual(res['sequence'], 2)
+            self.assertEqual([ e['event'] for e in res['events'] ],
+                             [ 'slaveDisconnected' ])
+        d.addCallback(check)
+        return d
+
+    def test_wait(self):
+        req, d = self.render(since='e1:0', wait='30')
+        self.assertFalse(req.finished)
+        self.eventLog.slaveConnected('sl')
+        def check(res):
+            self.assertEqual(res['sequence'], 1)
+            self.assertEqual([ e['event'] for e in res['events'] ],
+                             [ 'slaveConnected' ])
+        d.addCallback(check)
+        return d
+
+    def test_wait_timeout(self):
+        req, d = self.render(since='e1:0', wait='600')
+        # the wait is limited to maxWait
+        self.clock.advance(self.resource.maxWait)
+        d.addCallback(self.assertEqual,
+                { 'epoch' : 'e1', 'sequence' : 0, 'complete' : True,
+                  'events' : [] })
+        return d
+
+    def test_other_epoch(self):
+        self.eventLog.slaveConnected('sl')
+        # the client's sequence number is from before a restart, so it does
+        # not wait, and is told to re-read the status
+        req, d = self.render(since='e0:5', wait='30')
+        d.addCallback(self.assertEqual,
+                { 'epoch' : 'e1', 'sequence' : 1, 'complete' : False,
+                  'events' : [] })
+        return d
+
+    def test_no_epoch(self):
+        self.eventLog.slaveConnected('sl')
+        req, d = self.render(since='0')
+        d.addCallback(self.assertEqual,
+                { 'epoch' : 'e1', 'sequence' : 1, 'complete' : False,
+                  'events' : [] })
+        return d
+
+    def test_disconnect(self):
+        req, d = self.render(since='e1:0', wait='30')
+        req.disconnect.errback(Exception('connection lost'))
+        self.assertEqual(self.eventLog.waiters, {})
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertFalse(req.finished)
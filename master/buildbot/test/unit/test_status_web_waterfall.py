@@ -0,0 +1,189 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer
+from buildbot import sourcestamp, util
+from buildbot.status import builder, build, buildstep
+from buildbot.status.results import SUCCESS, FAILURE
+from buildbot.status.web import waterfall
+from buildbot.status.web.base import IBox, createJinjaEnv
+from buildbot.test.fake import fakemaster, fakedb
+
+def describe(e):
+    if isinstance(e, (build.BuildStatus, waterfall.BuildSummary)):
+        return ('build', e.getTimes()[0])
+    if isinstance(e, (buildstep.BuildStepStatus, waterfall.StepSummary)):
+        return ('step', e.getTimes()[0], e.getText())
+    return ('event', e.getTimes()[0], e.getText())
+
+
+class WaterfallColumn(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000
+        self.patch(util, 'now', lambda _reactor=None : self.now)
+        m = fakemaster.make_master()
+        self.builder = b = builder.BuilderStatus(buildername='bldr',
+                                                 category='cat', master=m)
+        b.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(b.basedir)
+        b.determineNextBuildNumber()
+        b.currentBigState = 'idle'
+        b.status = mock.Mock()
+        self.cache = waterfall.WaterfallCache(mock.Mock())
+
+    def startBuild(self, branch='master'):
+        self.now += 10
+        bs = self.builder.newBuild()
+        bs.setSourceStamps([ sourcestamp.SourceStamp(branch=branch) ])
+        bs.setReason('because')
+        bs.buildStarted(bs)
+        self.cache.buildStarted('bldr', bs)
+        return bs
+
+    def addStep(self, bs, name, results=SUCCESS, hidden=False, finish=True):
+        self.now += 10
+        step = bs.addStepWithName(name)
+        step.stepStarted()
+        step.setText([ name ])
+        step.setHidden(hidden)
+        if finish:
+            step.stepFinished(results)
+        return step
+
+    def finishBuild(self, bs, results=SUCCESS):
+        self.now += 10
+        bs.setResults(results)
+        bs.buildFinished()
+        self.cache.buildFinished('bldr', bs, results)
+
+    def runBuild(self, branch='master', results=SUCCESS):
+        bs = self.startBuild(branch)
+        self.addStep(bs, 'compile')
+        self.addStep(bs, 'hidden', hidden=True)
+        self.addStep(bs, 'test', results=results)
+        self.finishBuild(bs, results)
+        return bs
+
+    def assertSameEvents(self, column, **filters):
+        self.assertEqual(map(describe, column.eventGenerator(**filters)),
+                         map(describe, self.builder.eventGenerator(**filters)))
+
+    def test_load(self):
+        self.runBuild()
+        self.builder.addPointEvent(['point'])
+        self.runBuild(branch='other', results=FAILURE)
+        column = self.cache.getColumn(self.builder)
+        events = list(column.eventGenerator())
+        self.assertTrue(isinstance(events[0], waterfall.StepSummary))
+        self.assertTrue(isinstance(events[3], waterfall.BuildSummary))
+        self.assertSameEvents(column)
+        self.assertSameEvents(column, branches=['other'])
+        self.assertSameEvents(column, categories=['nope'])
+        self.assertSameEvents(column, minTime=1045)
+
+    def test_incremental(self):
+        self.runBuild()
+        column = self.cache.getColumn(self.builder)
+        self.assertSameEvents(column)
+        bs = self.startBuild()
+        self.addStep(bs, 'compile')
+        step = self.addStep(bs, 'test', finish=False)
+        # the running build is read from its status
+        events = list(column.eventGenerator())
+        self.assertIdentical(events[0], step)
+        self.assertIdentical(events[2], bs)
+        self.assertSameEvents(column)
+        step.stepFinished(SUCCESS)
+        self.finishBuild(bs)
+        events = list(column.eventGenerator())
+        self.assertTrue(isinstance(events[0], waterfall.StepSummary))
+        self.assertSameEvents(column)
+
+    def test_maxBuilds(self):
+        self.cache.maxBuilds = 2
+        self.runBuild()
+        self.runBuild()
+        self.builder.addPointEvent(['point'])
+        column = self.cache.getColumn(self.builder)
+        column.load()
+        self.runBuild()
+        self.assertEqual([ wb.number for wb in column.builds ], [ 1, 2 ])
+        # the older builds come from the builder's history
+        self.assertSameEvents(column)
+
+    def test_boxes(self):
+        bs = self.runBuild()
+        req = mock.Mock()
+        req.prepath = [ 'waterfall' ]
+        req.site.buildbot_service.templates = createJinjaEnv()
+        column = self.cache.getColumn(self.builder)
+        summaries = list(column.eventGenerator())
+        live = [ bs.getSteps()[2], bs.getSteps()[1], bs.getSteps()[0], bs ]
+        for summary, original in zip(summaries, live):
+            self.assertEqual(IBox(summary).getBox(req).td(),
+                             IBox(original).getBox(req).td())
+
+
+class WaterfallCache(unittest.TestCase):
+
+    def setUp(self):
+        self.master = fakemaster.make_master()
+        self.master.db = fakedb.FakeDBConnector(self)
+        self.master.db.insertTestData([ fakedb.Change(changeid=n)
+                                        for n in range(1, 6) ])
+        self.cache = waterfall.WaterfallCache(mock.Mock())
+        self.cache.maxChanges = 3
+
+    def makeChange(self, number):
+        ch = mock.Mock(name='change')
+        ch.number = number
+        return ch
+
+    @defer.inlineCallbacks
+    def test_getRecentChanges(self):
+        changes = yield self.cache.getRecentChanges(self.master)
+        self.assertEqual([ ch.number for ch in changes ], [ 3, 4, 5 ])
+
+        # later changes are added without another query
+        self.master.db.changes.getRecentChanges = None
+        self.cache.changeAdded(self.makeChange(6))
+        changes = yield self.cache.getRecentChanges(self.master)
+        self.assertEqual([ ch.number for ch in changes ], [ 4, 5, 6 ])
+
+    @defer.inlineCallbacks
+    def test_getRecentChanges_added_while_loading(self):
+        d = defer.Deferred()
+        getRecentChanges = self.master.db.changes.getRecentChanges
+        self.master.db.changes.getRecentChanges = lambda count : d
+        changes_d = self.cache.getRecentChanges(self.master)
+        self.cache.changeAdded(self.makeChange(6))
+        chdicts = yield getRecentChanges(3)
+        d.callback(chdicts)
+        changes = yield changes_d
+        self.assertEqual([ ch.number for ch in changes ], [ 4, 5, 6 ])
+
+    def test_getColumn(self):
+        bldr = mock.Mock(name='builder')
+        bldr.getName.return_value = 'bldr'
+        column = self.cache.getColumn(bldr)
+        self.assertIdentical(self.cache.getColumn(bldr), column)
+        self.assertIdentical(self.cache.builderAdded('bldr', bldr), self.cache)
+        self.cache.builderRemoved('bldr')
+        self.assertEqual(self.cache.watched, [])
+        self.assertNotIdentical(self.cache.getColumn(bldr), column)
@@ -15,7 +15,7 @@
 
 from buildbot.status.results import SUCCESS
 from buildbot.steps.package.rpm import rpmlint
-from buildbot.test.fake.remotecommand import ExpectShell
+from buildbot.test.fake.remotecommand import ExpectShell, Expect
 from buildbot.test.util import steps
 from twisted.trial import unittest
 
@@ -54,3 +54,21 @@ class TestRpmLint(steps.BuildStepMixin, unittest.TestCase):
         self.expectOutcome(result=SUCCESS, status_text=['Finished checking RPM/SPEC issues'])
         return self.runStep()
 
+    def test_warnings_not_counted(self):
+        # RpmLint does its own parsing, so its output is not counted as
+        # warnings by WarningCountingShellCommand
+        self.setupStep(rpmlint.RpmLint())
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                    command=['rpmlint', '-i', '.'])
+            + Expect.log('stdio',
+                    stdout='foo.spec: W: warning: something\n')
+            +0)
+        self.expectOutcome(result=SUCCESS,
+                status_text=['Finished checking RPM/SPEC issues'])
+        d = self.runStep()
+        def check(_):
+            self.assertEqual(self.step.warnCount, 0)
+            self.assertNotIn('warnings', self.step_status.logs)
+        d.addCallback(check)
+        return d
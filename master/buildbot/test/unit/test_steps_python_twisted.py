@@ -13,6 +13,7 @@
 #
 # Copyright Buildbot Team Members
 
+import mock
 from twisted.trial import unittest
 from buildbot.steps import python_twisted
 from buildbot.status.results import SUCCESS
@@ -22,6 +23,20 @@ from buildbot.process.properties import Property
 
 
 
+class TrialTestCaseCounter(unittest.TestCase):
+
+    def test_counts(self):
+        counter = python_twisted.TrialTestCaseCounter()
+        counter.step = mock.Mock()
+        counter.outReceived('a.b.test_one ... [OK]\nnoise\n'
+                            'Doctest: a.c ... [FAIL]\n')
+        counter.step.setProgress.assert_called_once_with('tests', 2)
+        counter.outReceived('=' * 40 + '\na.b.test_two ... [OK]\n')
+        self.assertEqual(counter.numTests, 2)
+        self.assertTrue(counter.finished)
+        self.assertEqual(counter.step.setProgress.call_count, 1)
+
+
 class Trial(steps.BuildStepMixin, unittest.TestCase):
 
     def setUp(self):
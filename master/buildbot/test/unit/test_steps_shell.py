@@ -21,7 +21,7 @@ from buildbot.status.results import SKIPPED, SUCCESS, WARNINGS, FAILURE
 from buildbot.status.results import EXCEPTION
 from buildbot.test.util import steps, compat
 from buildbot.test.fake.remotecommand import ExpectShell, Expect
-from buildbot.test.fake.remotecommand import ExpectRemoteRef
+from buildbot.test.fake.remotecommand import ExpectRemoteRef, FakeLogFile
 from buildbot import config
 from buildbot.process import properties
 
@@ -487,7 +487,7 @@ class WarningCountingShellCommand(steps.BuildStepMixin, unittest.TestCase):
         )
         self.expectOutcome(result=WARNINGS, status_text=["'make'", "warnings"])
         self.expectProperty("warnings-count", 1)
-        self.expectLogfile("warnings (1)", "warning: blarg!\n")
+        self.expectLogfile("warnings", "warning: blarg!\n")
         return self.runStep()
 
     def test_custom_pattern(self):
@@ -502,7 +502,7 @@ class WarningCountingShellCommand(steps.BuildStepMixin, unittest.TestCase):
         )
         self.expectOutcome(result=WARNINGS, status_text=["'make'", "warnings"])
         self.expectProperty("warnings-count", 2)
-        self.expectLogfile("warnings (2)", "scary: foo\nscary: bar\n")
+        self.expectLogfile("warnings", "scary: foo\nscary: bar\n")
         return self.runStep()
 
     def test_maxWarnCount(self):
@@ -528,7 +528,77 @@ class WarningCountingShellCommand(steps.BuildStepMixin, unittest.TestCase):
         )
         self.expectOutcome(result=FAILURE, status_text=["'make'", "failed"])
         self.expectProperty("warnings-count", 1)
-        self.expectLogfile("warnings (1)", "warning: I might fail\n")
+        self.expectLogfile("warnings", "warning: I might fail\n")
+        return self.runStep()
+
+    def test_warnings_across_chunks(self):
+        self.setupStep(shell.WarningCountingShellCommand(command=['make']))
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                        command=["make"])
+            + ExpectShell.log('stdio', stdout='warn')
+            + ExpectShell.log('stdio', stdout='ing: a\nwarning: b\nnor')
+            + ExpectShell.log('stdio', stderr='mal\n')
+            + ExpectShell.log('stdio', stdout='warning: c')
+            + 0
+        )
+        self.expectOutcome(result=WARNINGS, status_text=["'make'", "warnings"])
+        self.expectProperty("warnings-count", 3)
+        self.expectLogfile("warnings",
+                "warning: a\nwarning: b\nwarning: c\n")
+        return self.runStep()
+
+    def test_warnings_while_running(self):
+        self.setupStep(shell.WarningCountingShellCommand(command=['make']))
+        def check(command):
+            self.assertEqual(self.step.getProperty("warnings-count"), 1)
+            self.assertEqual(self.step_statistics['warnings'], 1)
+            self.assertEqual(self.step.step_status.logs['warnings'].stdout,
+                             "warning: a\n")
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                        command=["make"])
+            + ExpectShell.log('stdio', stdout='warning: a\nwarning: b')
+            + Expect.behavior(check)
+            + 0
+        )
+        self.expectOutcome(result=WARNINGS, status_text=["'make'", "warnings"])
+        self.expectProperty("warnings-count", 2)
+        self.expectLogfile("warnings", "warning: a\nwarning: b\n")
+        return self.runStep()
+
+    def test_createSummary_unobserved(self):
+        # a subclass that overrides start does not observe the output, so the
+        # whole log is checked at the end
+        self.setupStep(shell.WarningCountingShellCommand(command=['make']))
+        step = self.step
+        self.properties.setProperty("warnings-count", 2, "test")
+        log = FakeLogFile('stdio', step)
+        log.fakeData(stdout='warning: a\nnormal\n', stderr='warning: b')
+        step.createSummary(log)
+        self.assertEqual(step.warnCount, 2)
+        self.assertEqual(step.getProperty("warnings-count"), 4)
+        self.assertEqual(step.step_status.logs['warnings'].stdout,
+                         "warning: a\nwarning: b\n")
+
+    def test_uncombinable_patterns(self):
+        # patterns with flags or backreferences are checked line by line
+        step = shell.WarningCountingShellCommand(command=['make'],
+                warningPattern=re.compile('.*warn', re.I),
+                directoryEnterPattern=r'(\w)\1 (.*)')
+        step._compileWarningPatterns()
+        self.assertEqual(step._candidateRe, None)
+        self.setupStep(step)
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                        command=["make"])
+            + ExpectShell.log('stdio',
+                stdout='WARN: a\nxx WARN: not a warning\nxy WARN: b\n')
+            + 0
+        )
+        self.expectOutcome(result=WARNINGS, status_text=["'make'", "warnings"])
+        self.expectProperty("warnings-count", 2)
+        self.expectLogfile("warnings", "WARN: a\nxy WARN: b\n")
         return self.runStep()
 
     def do_test_suppressions(self, step, supps_file='', stdout='',
@@ -564,7 +634,7 @@ class WarningCountingShellCommand(steps.BuildStepMixin, unittest.TestCase):
             if exp_warning_count != 0:
                 self.expectOutcome(result=WARNINGS,
                                 status_text=["'make'", "warnings"])
-                self.expectLogfile("warnings (%d)" % exp_warning_count,
+                self.expectLogfile("warnings",
                                 exp_warning_log)
             else:
                 self.expectOutcome(result=SUCCESS,
@@ -684,6 +754,20 @@ class WarningCountingShellCommand(steps.BuildStepMixin, unittest.TestCase):
             self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1))
         return d
 
+    def test_suppressions_warningExtractor_exc_streaming(self):
+        # an exception while the output arrives fails the step at the end
+        def warningExtractor(step, line, match):
+            raise RuntimeError("oh noes")
+        step = shell.WarningCountingShellCommand(command=['make'],
+                                suppressionFile='supps',
+                                warningExtractor=warningExtractor)
+        stdout = "abc.c:99: warning: seen 1\nabc.c:100: warning: seen 2\n"
+        d = self.do_test_suppressions(step, 'x:y', stdout,
+                                         exp_exception=True)
+        d.addCallback(lambda _ :
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1))
+        return d
+
     def test_suppressions_addSuppression(self):
         # call addSuppression "manually" from a subclass
         class MyWCSC(shell.WarningCountingShellCommand):
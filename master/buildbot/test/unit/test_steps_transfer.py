@@ -19,6 +19,7 @@ import tempfile, os
 import shutil
 import tarfile
 from twisted.trial import unittest
+from twisted.internet import defer, threads
 
 from mock import Mock
 
@@ -167,21 +168,141 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
             archive = tarfile.TarFile(fileobj=f, name='fake.tar', mode='w')
             archive.addfile(tarfile.TarInfo("test"), StringIO("Hello World!"))
             writer = command.args['writer']
-            writer.remote_write(f.getvalue())
-            writer.remote_unpack()
+            self.tarball = f.getvalue()
+            writer.remote_write(self.tarball)
+            return writer.remote_unpack()
 
         self.expectCommands(
             Expect('uploadDirectory', dict(
                 slavesrc="srcdir", workdir='wkdir',
-                blocksize=16384, compress=None, maxsize=None,
+                blocksize=65536, window=8, compress=None, maxsize=None,
                 writer=ExpectRemoteRef(transfer._DirectoryWriter)))
             + Expect.behavior(upload_behavior)
             + 0)
 
         self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcdir"])
         d = self.runStep()
+        def check(_):
+            self.assertEqual(self.step_statistics['bytes_transferred'],
+                             len(self.tarball))
+        d.addCallback(check)
         return d
 
+    def do_test_blockArgs(self, step, slave_version, expected_args):
+        self.setupStep(step, slave_version=slave_version)
+
+        def upload_behavior(command):
+            from cStringIO import StringIO
+            f = StringIO()
+            tarfile.TarFile(fileobj=f, name='fake.tar', mode='w').close()
+            writer = command.args['writer']
+            writer.remote_write(f.getvalue())
+            return writer.remote_unpack()
+
+        args = dict(slavesrc="srcdir", workdir='wkdir', compress=None,
+                    maxsize=None,
+                    writer=ExpectRemoteRef(transfer._DirectoryWriter))
+        args.update(expected_args)
+        self.expectCommands(
+            Expect('uploadDirectory', args)
+            + Expect.behavior(upload_behavior)
+            + 0)
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcdir"])
+        return self.runStep()
+
+    def test_blockArgs_old_slave(self):
+        return self.do_test_blockArgs(
+            transfer.DirectoryUpload(slavesrc="srcdir",
+                                     masterdest=self.destdir),
+            {'*' : "2.15"}, dict(blocksize=16384))
+
+    def test_blockArgs_blocksize(self):
+        return self.do_test_blockArgs(
+            transfer.DirectoryUpload(slavesrc="srcdir",
+                                     masterdest=self.destdir,
+                                     blocksize=1024, window=4),
+            {'*' : "2.16"}, dict(blocksize=1024, window=4))
+
+    def test_blockArgs_no_window(self):
+        return self.do_test_blockArgs(
+            transfer.DirectoryUpload(slavesrc="srcdir",
+                                     masterdest=self.destdir, window=1),
+            {'*' : "2.16"}, dict(blocksize=16384))
+
+class TestDirectoryWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.destdir = os.path.abspath('destdir')
+        if os.path.exists(self.destdir):
+            shutil.rmtree(self.destdir)
+
+    def tearDown(self):
+        if os.path.exists(self.destdir):
+            shutil.rmtree(self.destdir)
+
+    def makeTarball(self, mode):
+        from cStringIO import StringIO
+        f = StringIO()
+        archive = tarfile.open(fileobj=f, mode=mode)
+        for name in 'abc':
+            data = name * 10000
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, StringIO(data))
+        archive.close()
+        return f.getvalue()
+
+    def test_stream(self):
+        writer = transfer._DirectoryWriter(self.destdir, None, 'gz')
+        writer.maxQueuedBlocks = 2
+        tarball = self.makeTarball('w:gz')
+        d = defer.succeed(None)
+        # write the tarball in small blocks, waiting when asked to
+        for i in range(0, len(tarball), 100):
+            d.addCallback(lambda _, i=i : writer.remote_write(tarball[i:i+100]))
+        d.addCallback(lambda _ : writer.remote_unpack())
+        def check(_):
+            for name in 'abc':
+                with open(os.path.join(self.destdir, name)) as f:
+                    self.assertEqual(f.read(), name * 10000)
+            self.assertEqual(writer.bytes, len(tarball))
+        d.addCallback(check)
+        return d
+
+    def test_corrupt(self):
+        writer = transfer._DirectoryWriter(self.destdir, None, None)
+        writer.remote_write('this is not a tarball' * 100)
+        d = writer.remote_unpack()
+        self.assertFailure(d, tarfile.ReadError)
+        return d
+
+    def test_cancel(self):
+        writer = transfer._DirectoryWriter(self.destdir, None, None)
+        writer.remote_write(self.makeTarball('w')[:1000])
+        unpacked = writer.unpacked
+        writer.cancel()
+        # the thread stops, and its failure is consumed
+        return unpacked
+
+    def test_own_thread(self):
+        # unpacking waits for the slave, so it must not tie up the reactor's
+        # thread pool
+        self.patch(threads, 'deferToThread',
+                lambda *args, **kwargs : self.fail("used the thread pool"))
+        writer = transfer._DirectoryWriter(self.destdir, None, None)
+        writer.remote_write(self.makeTarball('w'))
+        self.assertTrue(writer.thread.isAlive())
+        d = writer.remote_unpack()
+        d.addCallback(lambda _ : writer.thread.join())
+        return d
+
+    def test_abort_queued(self):
+        # an abort is noticed even with blocks still queued
+        stream = transfer._UnpackStream(lambda : None)
+        stream.feed('x' * 512)
+        stream.abort()
+        self.assertRaises(IOError, lambda : stream.read())
+
 class TestStringDownload(unittest.TestCase):
     def testBasic(self):
         s = transfer.StringDownload("Hello World", "hello.txt")
@@ -0,0 +1,141 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+from twisted.internet import defer
+from twisted.trial import unittest
+from buildbot.util import blockfile
+from buildbot.test.util import dirs
+
+DATA = "".join([ "line %d\n" % i for i in range(100) ])
+
+class BlockFile(unittest.TestCase, dirs.DirsMixin):
+
+    def setUp(self):
+        self.setUpDirs('basedir')
+        self.filename = os.path.join('basedir', 'f.blocks')
+
+    def tearDown(self):
+        self.tearDownDirs()
+
+    def write(self, data=DATA, finish=True):
+        f = blockfile.BlockFile(self.filename, 'w', blockSize=64)
+        for i in range(0, len(data), 10):
+            f.write(data[i:i+10])
+        if finish:
+            f.finish()
+        f.flush()
+        return f
+
+    def test_write_blocks(self):
+        f = self.write(finish=False)
+        # full blocks are written as they fill
+        self.assertEqual(len(f.offsets), len(DATA) / 64)
+        self.assertEqual(f.offsets[:3], [0, 64, 128])
+        self.assertEqual(f.tell(), len(DATA))
+        f.finish()
+        self.assertEqual(len(f.offsets), len(DATA) / 64 + 1)
+
+    def test_read_while_writing(self):
+        f = self.write(finish=False)
+        f.seek(0)
+        self.assertEqual(f.read(), DATA)
+        f.seek(len(DATA) - 20)
+        self.assertEqual(f.read(5), DATA[-20:-15])
+
+    def test_read_after_finish(self):
+        f = self.write()
+        f.seek(100)
+        self.assertEqual(f.read(100), DATA[100:200])
+        self.assertRaises(IOError, lambda : f.write('x'))
+
+    def test_reopen(self):
+        self.write().close()
+        f = blockfile.BlockFile(self.filename)
+        self.assertEqual(f.read(), DATA)
+        f.seek(-8, 2)
+        self.assertEqual(f.read(), DATA[-8:])
+        f.seek(300)
+        f.seek(10, 1)
+        self.assertEqual(f.tell(), 310)
+        self.assertEqual(f.read(3), DATA[310:313])
+
+    def test_tail_file(self):
+        tail = self.filename + blockfile.TAIL_SUFFIX
+        f = self.write(finish=False)
+        self.assertTrue(os.path.exists(tail))
+        f.finish()
+        self.assertFalse(os.path.exists(tail))
+
+    def test_reopen_unfinished(self):
+        # without a block table, the blocks are found, and the rest of the
+        # data is read from the tail file
+        self.write(finish=False)
+        f = blockfile.BlockFile(self.filename)
+        self.assertEqual(f.read(), DATA)
+        self.assertEqual(len(f.offsets), len(DATA) / 64)
+
+    def test_reopen_partial_block(self):
+        # a partially-written block is ignored, and its data read from the
+        # tail file instead
+        f = self.write(finish=False)
+        f.file.truncate(f.positions[-1] + blockfile.BLOCK_HEADER_SIZE + 2)
+        f.file.close()
+        f = blockfile.BlockFile(self.filename)
+        self.assertEqual(len(f.offsets), len(DATA) / 64 - 1)
+        self.assertEqual(f.read(), DATA)
+
+    def test_reopen_no_tail(self):
+        # without the tail file, only complete blocks can be read
+        self.write(finish=False)
+        os.unlink(self.filename + blockfile.TAIL_SUFFIX)
+        f = blockfile.BlockFile(self.filename)
+        self.assertEqual(f.read(), DATA[:len(DATA) / 64 * 64])
+
+    def test_reopen_empty(self):
+        self.write(data='').close()
+        f = blockfile.BlockFile(self.filename)
+        self.assertEqual(f.read(), '')
+
+    def test_not_blocks(self):
+        with open(self.filename, 'w') as f:
+            f.write('13:0hello, world,')
+        self.assertRaises(IOError,
+                lambda : blockfile.BlockFile(self.filename))
+
+    @defer.inlineCallbacks
+    def test_threaded(self):
+        f = blockfile.BlockFile(self.filename, 'w', blockSize=64,
+                                threaded=True)
+        for i in range(0, len(DATA), 10):
+            f.write(DATA[i:i+10])
+        # blocks are compressed later, but the data is on disk already
+        self.assertEqual(f.offsets, [])
+        f.flush()
+        self.assertEqual(blockfile.BlockFile(self.filename).read(), DATA)
+        f.seek(0)
+        self.assertEqual(f.read(), DATA)
+        yield f.finish()
+        self.assertEqual(len(f.offsets), len(DATA) / 64 + 1)
+        f.seek(100)
+        self.assertEqual(f.read(100), DATA[100:200])
+        yield f.close()
+        self.assertEqual(blockfile.BlockFile(self.filename).read(), DATA)
+
+    def test_compresses(self):
+        self.write(data='x' * 10000).close()
+        self.assertTrue(os.path.getsize(self.filename) < 10000)
@@ -246,6 +246,28 @@ class LRUCacheTest(unittest.TestCase):
         self.assertEqual(self.lru.get('p'), set(['PPP']))
         self.assertEqual(self.lru.get('q'), set(['QQQ'])) # not updated
 
+    def test_get_cached(self):
+        self.assertEqual(self.lru.get_cached('a'), None)
+        self.lru.get('a')
+        self.check_result(self.lru.get_cached('a'), short('a'), 1, 1)
+        self.lru.inv()
+
+    def test_add(self):
+        self.lru.add('a', set(['added']))
+        self.check_result(self.lru.get('a'), set(['added']), 1, 0)
+        self.lru.inv()
+
+    def test_add_evicts(self):
+        for k in 'abcd':
+            self.lru.add(k, short(k))
+        self.assertEqual(sorted(self.lru.keys()), ['b', 'c', 'd'])
+        self.lru.inv()
+
+    def test_add_none(self):
+        self.lru.add('a', None)
+        self.assertEqual(self.lru.get_cached('a'), None)
+        self.lru.inv()
+
 
 class AsyncLRUCacheTest(unittest.TestCase):
 
@@ -23,6 +23,7 @@ class FakeMaster(object):
         self.basedir = basedir
         self.db = db
         self.changes_subscr_cb = None
+        self.change_batches_subscr_cb = None
         self.bset_subscr_cb = None
         self.bset_completion_subscr_cb = None
         self.caches = mock.Mock(name="caches")
@@ -46,6 +47,18 @@ class FakeMaster(object):
         self.changes_subscr_cb = callback
         return self._makeSubscription('changes_subscr_cb')
 
+    def subscribeToChangeBatches(self, callback, change_filter=None):
+        assert not self.change_batches_subscr_cb
+        # apply the filter as the master's change router would
+        def deliver(changes):
+            if change_filter:
+                changes = [ ch for ch in changes
+                            if change_filter.filter_change(ch) ]
+            if changes:
+                callback(changes)
+        self.change_batches_subscr_cb = deliver
+        return self._makeSubscription('change_batches_subscr_cb')
+
     def subscribeToBuildsets(self, callback):
         assert not self.bset_subscr_cb
         self.bset_subscr_cb = callback
@@ -67,10 +80,12 @@ class FakeMaster(object):
 
     def getSubscriptionCallbacks(self):
         """get the subscription callbacks set on the master, in a dictionary
-        with keys @{buildsets}, @{buildset_completion}, and C{changes}."""
+        with keys @{buildsets}, @{buildset_completion}, C{changes}, and
+        C{change_batches}."""
         return dict(buildsets=self.bset_subscr_cb,
                     buildset_completion=self.bset_completion_subscr_cb,
-                    changes=self.changes_subscr_cb)
+                    changes=self.changes_subscr_cb,
+                    change_batches=self.change_batches_subscr_cb)
 
 
 class SchedulerMixin(object):
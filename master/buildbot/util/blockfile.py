@@ -0,0 +1,287 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import bisect
+import os
+import struct
+import zlib
+from twisted.internet import defer, threads
+from twisted.python import log
+
+# The file begins with MAGIC, followed by any number of blocks, each of which
+# is a BLOCK_HEADER giving the compressed and uncompressed lengths of the
+# block, followed by the zlib-compressed data.  A finished file ends with a
+# table of (uncompressed offset, file offset) pairs, one per block, and a
+# FOOTER giving the offset of the table and the uncompressed size.
+#
+# While the file is being written, everything written so far is also kept,
+# uncompressed, in a file of its own named with TAIL_SUFFIX, from which the
+# blocks are compressed.  Both files are only ever appended to, and the tail
+# file is removed once the table is written.  Files without a footer (for
+# example, from a master that was killed) are read by scanning the block
+# headers, ignoring a partially-written block at the end, and then reading
+# the rest of the data from the tail file.
+MAGIC = "BBZBLK1\n"
+BLOCK_HEADER = ">II"
+BLOCK_HEADER_SIZE = struct.calcsize(BLOCK_HEADER)
+TABLE_ENTRY = ">QQ"
+TABLE_ENTRY_SIZE = struct.calcsize(TABLE_ENTRY)
+FOOTER_MAGIC = "BBZTBL1\n"
+FOOTER = ">QQ8s"
+FOOTER_SIZE = struct.calcsize(FOOTER)
+TAIL_SUFFIX = ".tail"
+
+def _compressBlock(filename, offset, length, level):
+    # read a block from a tail file and compress it; this may run in a
+    # thread, so it uses a file object of its own
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    return zlib.compress(data, level)
+
+class BlockFile(object):
+    """
+    A file of independently-compressed blocks, which can be read and seeked
+    like an ordinary file without decompressing more than the blocks that are
+    actually read.  Offsets are always in terms of the uncompressed data.
+
+    A file opened with mode C{'w'} is written by appending; each write goes to
+    the end of the file, no matter where the file position is.  The data goes
+    to a separate, uncompressed tail file as it is written, and is compressed
+    from there a block at a time as blocks fill, so little of it is kept in
+    memory.  All of the written data can be read back through the same
+    object, or by opening the file again.  If C{threaded} is true, the blocks
+    are compressed in a thread, rather than in the thread calling C{write}.
+    Call C{finish} to compress the rest of the data, write the block table
+    and remove the tail file, after which the object can still be used for
+    reading.
+    """
+
+    blockSize = 1024*1024
+    compressionLevel = 6
+
+    def __init__(self, filename, mode='r', blockSize=None, threaded=False):
+        if blockSize is not None:
+            self.blockSize = blockSize
+        self.filename = filename
+        self.tailFilename = filename + TAIL_SUFFIX
+        self.writing = (mode == 'w')
+        self.threaded = threaded
+        self.pos = 0
+        self.offsets = [] # uncompressed offset of each block
+        self.positions = [] # file offset of each block
+        self.tailFile = None # the uncompressed data, if not finished
+        self.compressing = False # a block is being compressed in a thread
+        self.finishing = False
+        self.finishWaiters = []
+        self.cachedBlock = None
+        if self.writing:
+            self.file = open(filename, 'w+b')
+            self.file.write(MAGIC)
+            self.fileSize = len(MAGIC)
+            self.blockedSize = 0
+            self.tailFile = open(self.tailFilename, 'w+b')
+            self.size = 0
+        else:
+            self.file = open(filename, 'rb')
+            if self.file.read(len(MAGIC)) != MAGIC:
+                self.file.close()
+                raise IOError("%s is not a block-compressed file" % filename)
+            self._readTable()
+
+    def _readTable(self):
+        f = self.file
+        f.seek(0, 2)
+        self.fileSize = f.tell()
+        if self.fileSize >= len(MAGIC) + FOOTER_SIZE:
+            f.seek(-FOOTER_SIZE, 2)
+            tableOffset, size, magic = struct.unpack(FOOTER,
+                                                     f.read(FOOTER_SIZE))
+            if magic == FOOTER_MAGIC:
+                f.seek(tableOffset)
+                count = (self.fileSize - FOOTER_SIZE - tableOffset) \
+                        / TABLE_ENTRY_SIZE
+                table = f.read(count * TABLE_ENTRY_SIZE)
+                for i in range(count):
+                    offset, position = struct.unpack_from(TABLE_ENTRY, table,
+                                                          i * TABLE_ENTRY_SIZE)
+                    self.offsets.append(offset)
+                    self.positions.append(position)
+                self.blockedSize = self.size = size
+                return
+        # no table, so find the blocks by their headers, ignoring a
+        # partially-written block at the end
+        position = len(MAGIC)
+        offset = 0
+        while position + BLOCK_HEADER_SIZE <= self.fileSize:
+            f.seek(position)
+            clen, ulen = struct.unpack(BLOCK_HEADER,
+                                       f.read(BLOCK_HEADER_SIZE))
+            if position + BLOCK_HEADER_SIZE + clen > self.fileSize:
+                break
+            self.offsets.append(offset)
+            self.positions.append(position)
+            position += BLOCK_HEADER_SIZE + clen
+            offset += ulen
+        self.blockedSize = self.size = offset
+        # and the rest is in the tail file, if it is still there
+        try:
+            self.tailFile = open(self.tailFilename, 'rb')
+        except IOError:
+            return
+        self.tailFile.seek(0, 2)
+        self.size = max(self.blockedSize, self.tailFile.tell())
+
+    def write(self, data):
+        if not self.writing or self.finishing:
+            raise IOError("%s is not open for writing" % self.filename)
+        if not data:
+            return
+        self.tailFile.seek(self.size)
+        self.tailFile.write(data)
+        self.size += len(data)
+        self.pos = self.size
+        self._compressBlocks()
+
+    def _compressBlocks(self):
+        # compress the full blocks following the last compressed block, or,
+        # once finishing, all of the rest; in a thread, one block at a time
+        while not self.compressing:
+            length = min(self.size - self.blockedSize, self.blockSize)
+            if not length or (length < self.blockSize and not self.finishing):
+                break
+            # the block is read back from the tail file
+            self.tailFile.flush()
+            args = (self.tailFilename, self.blockedSize, length,
+                    self.compressionLevel)
+            if not self.threaded:
+                self._addBlock(_compressBlock(*args), length)
+                continue
+            self.compressing = True
+            d = threads.deferToThread(_compressBlock, *args)
+            def compressed(compressed, length=length):
+                self.compressing = False
+                self._addBlock(compressed, length)
+                self._compressBlocks()
+            def failed(f):
+                log.err(f, "while compressing a block of %s" % self.filename)
+                # compress the rest here, instead
+                self.compressing = False
+                self.threaded = False
+                self._compressBlocks()
+            d.addCallbacks(compressed, failed)
+            return
+        if self.finishing and not self.compressing:
+            self._writeTable()
+
+    def _addBlock(self, compressed, length):
+        f = self.file
+        f.seek(self.fileSize)
+        f.write(struct.pack(BLOCK_HEADER, len(compressed), length))
+        f.write(compressed)
+        self.offsets.append(self.blockedSize)
+        self.positions.append(self.fileSize)
+        self.blockedSize += length
+        self.fileSize += BLOCK_HEADER_SIZE + len(compressed)
+
+    def _writeTable(self):
+        f = self.file
+        f.seek(self.fileSize)
+        for entry in zip(self.offsets, self.positions):
+            f.write(struct.pack(TABLE_ENTRY, *entry))
+        f.write(struct.pack(FOOTER, self.fileSize, self.size, FOOTER_MAGIC))
+        f.flush()
+        self.writing = False
+        # the blocks have everything now
+        self.tailFile.close()
+        self.tailFile = None
+        os.unlink(self.tailFilename)
+        waiters, self.finishWaiters = self.finishWaiters, []
+        for d in waiters:
+            d.callback(None)
+
+    def _readBlock(self, i):
+        if self.cachedBlock and self.cachedBlock[0] == i:
+            return self.cachedBlock[1]
+        f = self.file
+        f.seek(self.positions[i])
+        clen, ulen = struct.unpack(BLOCK_HEADER, f.read(BLOCK_HEADER_SIZE))
+        data = zlib.decompress(f.read(clen))
+        self.cachedBlock = (i, data)
+        return data
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.size - self.pos
+        pieces = []
+        while size > 0 and self.pos < self.size:
+            if self.pos >= self.blockedSize:
+                self.tailFile.seek(self.pos)
+                piece = self.tailFile.read(min(size, self.size - self.pos))
+                if not piece:
+                    break
+            else:
+                i = bisect.bisect_right(self.offsets, self.pos) - 1
+                data = self._readBlock(i)
+                start = self.pos - self.offsets[i]
+                piece = data[start:start+size]
+            pieces.append(piece)
+            self.pos += len(piece)
+            size -= len(piece)
+        return "".join(pieces)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        if offset < 0:
+            raise IOError("invalid seek to %d" % offset)
+        self.pos = offset
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        if self.tailFile:
+            self.tailFile.flush()
+        self.file.flush()
+
+    def finish(self):
+        """
+        Compress any remaining data, write the block table and remove the
+        tail file.  The file can still be read, but not written, afterward.
+
+        @returns: Deferred that fires when the table is written
+        """
+        if not self.writing:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.finishWaiters.append(d)
+        if not self.finishing:
+            self.finishing = True
+            self._compressBlocks()
+        return d
+
+    def close(self):
+        d = self.finish()
+        def closeFiles(_):
+            if self.tailFile:
+                self.tailFile.close()
+            self.file.close()
+        d.addCallback(closeFiles)
+        return d
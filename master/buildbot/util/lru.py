@@ -67,6 +67,29 @@ class LRUCache(object):
 
         return result
 
+    def get_cached(self, key):
+        """
+        Return the value for C{key} if it is in the cache, or None; unlike
+        L{get}, this never invokes the miss_fn.
+        """
+        try:
+            return self._get_hit(key)
+        except KeyError:
+            return None
+
+    def add(self, key, value):
+        """
+        Add a value that was fetched without the miss_fn (for example, as part
+        of a bulk fetch) to the cache, exactly as if the miss_fn had returned
+        it.
+        """
+        if value is None:
+            return
+        self.cache[key] = value
+        self.weakrefs[key] = value
+        self._ref_key(key)
+        self._purge()
+
     def keys(self):
         return self.cache.keys()
 
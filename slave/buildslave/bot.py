@@ -27,7 +27,7 @@ from twisted.cred import credentials
 import buildslave
 from buildslave.pbutil import ReconnectingPBClientFactory
 from buildslave.commands import registry, base
-from buildslave import monkeypatches
+from buildslave import monkeypatches, util
 
 class UnknownCommand(pb.Error):
     pass
@@ -54,9 +54,26 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # when the step is started
     remoteStep = None
 
+    # .orderedUpdates is true if the master accepts output updates that are
+    # lists of (logname, data) tuples; it is set when each command starts
+    orderedUpdates = False
+
+    # .compressUpdates is true if the master asked for those updates to be
+    # compressed
+    compressUpdates = False
+
+    # .unackedUpdates counts the updates sent to the master that it has not
+    # yet acknowledged, and .ackLatency is a smoothed estimate of the time it
+    # takes to acknowledge one (None until the first acknowledgement)
+    unackedUpdates = 0
+    ackLatency = None
+
+    _reactor = reactor
+
     def __init__(self, name):
         #service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
+        self._ackWaiters = []
 
     def __repr__(self):
         return "<SlaveBuilder '%s' at %d>" % (self.name, id(self))
@@ -104,6 +121,8 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def lostRemoteStep(self, remotestep):
         log.msg("lost remote step")
         self.remoteStep = None
+        # nothing more will be acknowledged, so don't keep anyone waiting
+        self._fireAckWaiters(force=True)
         if self.stopCommandOnShutdown:
             self.stopCommand()
 
@@ -133,6 +152,8 @@ class SlaveBuilder(pb.Referenceable, service.Service):
             factory = registry.getFactory(command)
         except KeyError:
             raise UnknownCommand, "unrecognized SlaveCommand '%s'" % command
+        self.orderedUpdates = bool(args.get('ordered_updates'))
+        self.compressUpdates = bool(args.get('compress_updates'))
         self.command = factory(self, stepId, args)
 
         log.msg(" startCommand:%s [id %s]" % (command,stepId))
@@ -185,10 +206,40 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         if self.remoteStep:
             update = [data, 0]
             updates = [update]
+            self.unackedUpdates += 1
             d = self.remoteStep.callRemote("update", updates)
+            d.addBoth(self._updateAcked, util.now(self._reactor))
             d.addCallback(self.ackUpdate)
             d.addErrback(self._ackFailed, "SlaveBuilder.sendUpdate")
 
+    def _updateAcked(self, res, sent):
+        self.unackedUpdates -= 1
+        latency = util.now(self._reactor) - sent
+        if self.ackLatency is None:
+            self.ackLatency = latency
+        else:
+            self.ackLatency = 0.75 * self.ackLatency + 0.25 * latency
+        self._fireAckWaiters()
+        return res
+
+    def waitForAcks(self, maxUnacked):
+        """Return a Deferred that fires once no more than maxUnacked updates
+        are awaiting acknowledgement from the master."""
+        if self.unackedUpdates <= maxUnacked:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._ackWaiters.append((maxUnacked, d))
+        return d
+
+    def _fireAckWaiters(self, force=False):
+        waiters = self._ackWaiters
+        self._ackWaiters = []
+        for maxUnacked, d in waiters:
+            if force or self.unackedUpdates <= maxUnacked:
+                d.callback(None)
+            else:
+                self._ackWaiters.append((maxUnacked, d))
+
     def ackUpdate(self, acknum):
         self.activity() # update the "last activity" timer
 
@@ -13,15 +13,79 @@
 #
 # Copyright Buildbot Team Members
 
-import os, tarfile, tempfile
+import os, tarfile, threading
 
-from twisted.python import log
-from twisted.internet import defer
+from twisted.python import log, failure
+from twisted.internet import defer, threads
 
 from buildslave.commands.base import Command
 
 class TransferCommand(Command):
 
+    # number of blocks to keep in flight at once; masters that support
+    # pipelined transfers send a 'window' argument
+    window = 1
+
+    def _loop(self, fire_when_done):
+        """
+        Call C{self._transferBlock} until the transfer is complete, and fire
+        C{fire_when_done} when it is.  C{_transferBlock} returns True when
+        there is nothing more to transfer, None if it must wait for blocks in
+        flight before deciding, or a Deferred that fires with True or False
+        when the block has been transferred.  Up to C{self.window} of those
+        Deferreds are outstanding at a time; PB delivers the remote calls in
+        order, so with a window of 1 this is a simple stop-and-wait loop.
+        """
+        self.inflight = 0
+        self.transferDone = False
+        self.filling = False
+        self._fillWindow(fire_when_done)
+        return None
+
+    def _fillWindow(self, fire_when_done):
+        if self.filling:
+            # a block completed synchronously; the loop below will continue
+            return
+        self.filling = True
+        try:
+            while not self.transferDone and self.inflight < self.window:
+                try:
+                    d = self._transferBlock()
+                except:
+                    self._transferFailed(failure.Failure(), fire_when_done)
+                    break
+                if d is None:
+                    break
+                if not isinstance(d, defer.Deferred):
+                    self.transferDone = d
+                    continue
+                self.inflight += 1
+                d.addCallbacks(self._blockDone, self._blockFailed,
+                               callbackArgs=(fire_when_done,),
+                               errbackArgs=(fire_when_done,))
+        finally:
+            self.filling = False
+        if self.transferDone and self.inflight == 0 \
+                and not fire_when_done.called:
+            fire_when_done.callback(None)
+
+    def _blockDone(self, finished, fire_when_done):
+        self.inflight -= 1
+        if finished:
+            self.transferDone = True
+        self._fillWindow(fire_when_done)
+
+    def _blockFailed(self, why, fire_when_done):
+        self.inflight -= 1
+        self._transferFailed(why, fire_when_done)
+
+    def _transferFailed(self, why, fire_when_done):
+        # stop sending, and report the first failure right away; any blocks
+        # still in flight are ignored
+        self.transferDone = True
+        if not fire_when_done.called:
+            fire_when_done.errback(why)
+
     def finished(self, res):
         if self.debug:
             log.msg('finished: stderr=%r, rc=%r' % (self.stderr, self.rc))
@@ -56,6 +120,8 @@ class SlaveFileUploadCommand(TransferCommand):
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
         - ['keepstamp']: whether to preserve file modified and accessed times
+        - ['window']:    number of blocks to send before waiting for the
+                         first to be acknowledged
     """
     debug = False
 
@@ -66,6 +132,7 @@ class SlaveFileUploadCommand(TransferCommand):
         self.remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.keepstamp = args.get('keepstamp', False)
+        self.window = args.get('window', 1)
         self.stderr = None
         self.rc = 0
 
@@ -121,17 +188,8 @@ class SlaveFileUploadCommand(TransferCommand):
         d.addBoth(self.finished)
         return d
 
-    def _loop(self, fire_when_done):
-        d = defer.maybeDeferred(self._writeBlock)
-        def _done(finished):
-            if finished:
-                fire_when_done.callback(None)
-            else:
-                self._loop(fire_when_done)
-        def _err(why):
-            fire_when_done.errback(why)
-        d.addCallbacks(_done, _err)
-        return None
+    def _transferBlock(self):
+        return self._writeBlock()
 
     def _writeBlock(self):
         """Write a block of data to the remote writer"""
@@ -169,9 +227,117 @@ class SlaveFileUploadCommand(TransferCommand):
         return d
 
 
+class _BlockPipe(object):
+    """
+    A file object that is written by a thread and read, a block at a time, in
+    the reactor.  At most C{maxBlocks} blocks are held at once; beyond that,
+    the writing thread waits for the reactor to catch up.
+    """
+
+    def __init__(self, _reactor, blocksize, maxBlocks):
+        self._reactor = _reactor
+        self.blocksize = blocksize
+        self.slots = threading.Semaphore(maxBlocks)
+        self.aborted = False
+        # used in the writing thread
+        self.buffer = []
+        self.buffered = 0
+        # used in the reactor
+        self.blocks = []
+        self.readers = []
+        self.done = False
+        self.failure = None
+
+    # writing thread
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.blocksize:
+            data = "".join(self.buffer)
+            while len(data) >= self.blocksize:
+                self._send(data[:self.blocksize])
+                data = data[self.blocksize:]
+            self.buffer = [ data ]
+            self.buffered = len(data)
+
+    def flush(self):
+        data = "".join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        if data:
+            self._send(data)
+
+    def _send(self, block):
+        self.slots.acquire()
+        if self.aborted:
+            raise IOError("transfer aborted")
+        self._reactor.callFromThread(self._blockReady, block)
+
+    # reactor
+
+    def _blockReady(self, block):
+        if self.readers:
+            self.slots.release()
+            self.readers.pop(0).callback(block)
+        else:
+            self.blocks.append(block)
+
+    def read(self):
+        """
+        Return a Deferred that fires with the next block, or with an empty
+        string once everything has been read.
+        """
+        if self.blocks:
+            self.slots.release()
+            return defer.succeed(self.blocks.pop(0))
+        if self.failure:
+            return defer.fail(self.failure)
+        if self.done:
+            return defer.succeed('')
+        d = defer.Deferred()
+        self.readers.append(d)
+        return d
+
+    def finish(self, failure=None):
+        """The writer is finished, possibly with a failure"""
+        self.done = True
+        self.failure = failure
+        readers, self.readers = self.readers, []
+        for d in readers:
+            if failure:
+                d.errback(failure)
+            else:
+                d.callback('')
+
+    def abort(self):
+        """Make the writing thread stop at its next block"""
+        self.aborted = True
+        self.slots.release()
+
+
 class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
+    """
+    Upload a directory from slave to build master, as a tar stream
+    Arguments:
+
+        - ['workdir']:   base directory to use
+        - ['slavesrc']:  name of the slave-side directory to read from
+        - ['writer']:    RemoteReference to a transfer._DirectoryWriter object
+        - ['maxsize']:   max size (in bytes) of the tar stream
+        - ['blocksize']: max size for each data block
+        - ['compress']:  None, 'bz2', or 'gz'
+        - ['window']:    number of blocks to send before waiting for the
+                         first to be acknowledged
+
+    The archive is built in a thread as it is sent, rather than in a
+    temporary file.
+    """
     debug = False
 
+    # blocks the packing thread may produce ahead of the transfer
+    maxQueuedBlocks = 16
+
     def setup(self, args):
         self.workdir = args['workdir']
         self.dirname = args['slavesrc']
@@ -179,8 +345,10 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         self.remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.compress = args['compress']
+        self.window = args.get('window', 1)
         self.stderr = None
         self.rc = 0
+        self.pipe = None
 
     def start(self):
         if self.debug:
@@ -192,22 +360,11 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         if self.debug:
             log.msg("path: %r" % self.path)
 
-        # Create temporary archive
-        fd, self.tarname = tempfile.mkstemp()
-        fileobj = os.fdopen(fd, 'w')
-        if self.compress == 'bz2':
-            mode='w|bz2'
-        elif self.compress == 'gz':
-            mode='w|gz'
-        else:
-            mode = 'w'
-        archive = tarfile.open(name=self.tarname, mode=mode, fileobj=fileobj)
-        archive.add(self.path, '')
-        archive.close()
-        fileobj.close()
-
-        # Transfer it
-        self.fp = open(self.tarname, 'rb')
+        # pack the archive in a thread, feeding blocks to the transfer loop
+        self.pipe = _BlockPipe(self._reactor, self.blocksize,
+                               self.maxQueuedBlocks + self.window)
+        d = threads.deferToThread(self._pack)
+        d.addCallbacks(lambda _ : self.pipe.finish(), self.pipe.finish)
 
         self.sendStatus({'header': "sending %s" % self.path})
 
@@ -222,12 +379,60 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
             d1.addCallback(lambda ignored: res)
             return d1
         d.addCallback(unpack)
+        def loop_err(f):
+            self.rc = 1
+            return f
+        d.addErrback(loop_err)
         d.addBoth(self.finished)
         return d
 
+    def _pack(self):
+        # runs in a thread
+        if self.compress == 'bz2':
+            mode='w|bz2'
+        elif self.compress == 'gz':
+            mode='w|gz'
+        else:
+            mode = 'w|'
+        archive = tarfile.open(mode=mode, fileobj=self.pipe)
+        archive.add(self.path, '')
+        archive.close()
+        self.pipe.flush()
+
+    def _writeBlock(self):
+        """Write the next block of the archive to the remote writer"""
+
+        if self.interrupted:
+            if self.debug:
+                log.msg('SlaveDirectoryUploadCommand._writeBlock(): end')
+            return True
+
+        d = self.pipe.read()
+        def send(data):
+            if self.debug:
+                log.msg('SlaveDirectoryUploadCommand._writeBlock(): '+
+                        'readlen=%d' % len(data))
+            if len(data) == 0 or self.interrupted:
+                return True
+            if self.remaining is not None:
+                if self.remaining <= 0:
+                    if self.stderr is None:
+                        self.stderr = 'Maximum filesize reached, ' \
+                                'truncating archive of \'%s\'' % self.path
+                        self.rc = 1
+                    return True
+                data = data[:self.remaining]
+                self.remaining -= len(data)
+            d = self.writer.callRemote('write', data)
+            d.addCallback(lambda res: False)
+            return d
+        d.addCallback(send)
+        return d
+
     def finished(self, res):
-        self.fp.close()
-        os.remove(self.tarname)
+        # stop the packing thread, if it is still running
+        if self.pipe:
+            self.pipe.abort()
         return TransferCommand.finished(self, res)
 
 
@@ -242,6 +447,8 @@ class SlaveFileDownloadCommand(TransferCommand):
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
         - ['mode']:      access mode for the new file
+        - ['window']:    number of blocks to request before waiting for the
+                         first to arrive
     """
     debug = False
 
@@ -250,8 +457,10 @@ class SlaveFileDownloadCommand(TransferCommand):
         self.filename = args['slavedest']
         self.reader = args['reader']
         self.bytes_remaining = args['maxsize']
+        self.bytes_requested = 0 # requested, but not yet received
         self.blocksize = args['blocksize']
         self.mode = args['mode']
+        self.window = args.get('window', 1)
         self.stderr = None
         self.rc = 0
 
@@ -301,17 +510,8 @@ class SlaveFileDownloadCommand(TransferCommand):
         d.addBoth(self.finished)
         return d
 
-    def _loop(self, fire_when_done):
-        d = defer.maybeDeferred(self._readBlock)
-        def _done(finished):
-            if finished:
-                fire_when_done.callback(None)
-            else:
-                self._loop(fire_when_done)
-        def _err(why):
-            fire_when_done.errback(why)
-        d.addCallbacks(_done, _err)
-        return None
+    def _transferBlock(self):
+        return self._readBlock()
 
     def _readBlock(self):
         """Read a block of data from the remote reader."""
@@ -322,24 +522,31 @@ class SlaveFileDownloadCommand(TransferCommand):
             return True
 
         length = self.blocksize
-        if self.bytes_remaining is not None and length > self.bytes_remaining:
-            length = self.bytes_remaining
+        if self.bytes_remaining is not None:
+            available = self.bytes_remaining - self.bytes_requested
+            if length > available:
+                length = available
 
         if length <= 0:
+            if self.inflight:
+                # the blocks in flight may yet turn out to be short
+                return None
             if self.stderr is None:
                 self.stderr = "Maximum filesize reached, truncating file '%s'" \
                                 % self.path
                 self.rc = 1
             return True
         else:
+            self.bytes_requested += length
             d = self.reader.callRemote('read', length)
-            d.addCallback(self._writeData)
+            d.addCallback(self._writeData, length)
             return d
 
-    def _writeData(self, data):
+    def _writeData(self, data, length):
         if self.debug:
             log.msg('SlaveFileDownloadCommand._readBlock(): readlen=%d' %
                     len(data))
+        self.bytes_requested -= length
         if len(data) == 0:
             return True
 
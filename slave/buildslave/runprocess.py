@@ -25,6 +25,7 @@ import re
 import subprocess
 import traceback
 import stat
+import zlib
 from collections import deque
 from tempfile import NamedTemporaryFile
 
@@ -214,10 +215,31 @@ class RunProcess:
     interruptSignal = "KILL"
     CHUNK_LIMIT = 128*1024
 
-    # Don't send any data until at least BUFFER_SIZE bytes have been collected
-    # or BUFFER_TIMEOUT elapsed
+    # Output is buffered until enough has been collected to be worth sending,
+    # the command falls quiet, or BUFFER_TIMEOUT elapses.  The amount that is
+    # enough is the output expected in one round trip to the master (but at
+    # least MIN_FLUSH_INTERVAL), between MIN_BUFFER_SIZE and BUFFER_SIZE
+    # bytes.  The command is considered quiet after twice the round-trip time,
+    # between MIN_IDLE_TIMEOUT and MAX_IDLE_TIMEOUT seconds.
     BUFFER_SIZE = 64*1024
     BUFFER_TIMEOUT = 5
+    MIN_BUFFER_SIZE = 4*1024
+    MIN_FLUSH_INTERVAL = 0.1
+    MIN_IDLE_TIMEOUT = 0.1
+    MAX_IDLE_TIMEOUT = 1
+
+    # Stop reading the command's output while more than MAX_UNACKED_UPDATES
+    # updates are awaiting acknowledgement from the master, until half of
+    # them have been acknowledged
+    MAX_UNACKED_UPDATES = 10
+
+    # when the master asks for compressed updates, output smaller than
+    # COMPRESS_MIN_SIZE is sent as-is
+    COMPRESS_MIN_SIZE = 512
+    COMPRESSION_LEVEL = 6
+
+    # fired when the command completes
+    deferred = None
 
     # For sending elapsed time:
     startTime = None
@@ -329,6 +351,15 @@ class RunProcess:
         self.buffered = deque()
         self.buflen = 0
         self.buftimer = None
+        self.bufstart = None
+        self.bufferSize = self.MIN_BUFFER_SIZE
+        self.idleTimeout = self.MIN_IDLE_TIMEOUT
+        self.outputRate = None
+        self.lastFlush = None
+        self.flushedBytes = 0
+        self.paused = False
+        self.pausedAt = None
+        self.pauseCount = 0
 
         if usePTY == "slave-config":
             self.usePTY = self.builder.usePTY
@@ -605,11 +636,15 @@ class RunProcess:
     def _bufferTimeout(self):
         self.buftimer = None
         self._sendBuffers()
+        self._checkBackpressure()
 
     def _sendBuffers(self):
         """
         Send all the content in our buffers.
         """
+        if self.builder.orderedUpdates:
+            self._sendOrderedBuffers()
+            return
         msg = {}
         msg_size = 0
         lastlog = None
@@ -622,9 +657,8 @@ class RunProcess:
             # out the message so far.  This is because the message is
             # transferred as a dictionary, which makes the ordering of keys
             # unspecified, and makes it impossible to interleave data from
-            # different logs.  A future enhancement could be to change the
-            # master to support a list of (logname, data) tuples instead of a
-            # dictionary.
+            # different logs.  Masters that can handle it are sent a list of
+            # (logname, data) tuples instead; see _sendOrderedBuffers.
             # On our first pass through this loop lastlog is None
             if lastlog is None:
                 lastlog = logname
@@ -650,29 +684,154 @@ class RunProcess:
                     msg = {}
                     logdata = msg.setdefault(logname, [])
                     msg_size = 0
-        self.buflen = 0
         if logdata:
             self._sendMessage(msg)
+        self._bufferSent()
+
+    def _sendOrderedBuffers(self):
+        """
+        Send all the content in our buffers as lists of (logname, data)
+        tuples, so that output from several logs can share a message and
+        still arrive in order.
+        """
+        msg = []
+        msg_size = 0
+        while self.buffered:
+            logname, data = self.buffered.popleft()
+            for chunk in self._chunkForSend(data):
+                if len(chunk) == 0: continue
+                # consecutive chunks for the same log are joined
+                if msg and msg[-1][0] == logname:
+                    msg[-1][1].append(chunk)
+                else:
+                    msg.append((logname, [ chunk ]))
+                msg_size += len(chunk)
+                if msg_size >= self.CHUNK_LIMIT:
+                    self._sendOrderedMessage(msg)
+                    msg = []
+                    msg_size = 0
+        self._sendOrderedMessage(msg)
+        self._bufferSent()
+
+    def _sendOrderedMessage(self, msg):
+        if not msg:
+            return
+        update = [ (logname, "".join(chunks)) for logname, chunks in msg ]
+        if self.builder.compressUpdates:
+            update = self._compressUpdate(update)
+        self.sendStatus(update)
+
+    def _compressUpdate(self, update):
+        """
+        Compress the data of an ordered update into a single zlib stream,
+        unless it is too small to be worth it or does not get any smaller.
+        """
+        data = "".join([ d for logname, d in update ])
+        if len(data) < self.COMPRESS_MIN_SIZE:
+            return update
+        zdata = zlib.compress(data, self.COMPRESSION_LEVEL)
+        if len(zdata) >= len(data):
+            return update
+        return { 'zlib' : ([ (logname, len(d)) for logname, d in update ],
+                           zdata) }
+
+    def _bufferSent(self):
+        self._adaptBuffering()
+        self.buflen = 0
+        self.bufstart = None
         if self.buftimer:
             if self.buftimer.active():
                 self.buftimer.cancel()
             self.buftimer = None
 
+    def _adaptBuffering(self):
+        """
+        Update the estimated output rate with the data just sent, and choose
+        the flush size and idle timeout for the data to come.
+        """
+        now = util.now(self._reactor)
+        since = self.lastFlush
+        if since is None:
+            since = self.bufstart
+        if since is not None and self.buflen:
+            elapsed = max(now - since, 0.001)
+            rate = self.buflen / elapsed
+            if self.outputRate is None:
+                self.outputRate = rate
+            else:
+                self.outputRate = 0.5 * self.outputRate + 0.5 * rate
+        self.lastFlush = now
+        self.flushedBytes += self.buflen
+
+        latency = self.builder.ackLatency or 0
+        if self.outputRate is not None:
+            interval = max(latency, self.MIN_FLUSH_INTERVAL)
+            self.bufferSize = int(min(max(self.outputRate * interval,
+                                          self.MIN_BUFFER_SIZE),
+                                      self.BUFFER_SIZE))
+        self.idleTimeout = min(max(2 * latency, self.MIN_IDLE_TIMEOUT),
+                               self.MAX_IDLE_TIMEOUT)
+
+    def _checkBackpressure(self):
+        if (self.builder.unackedUpdates > self.MAX_UNACKED_UPDATES
+                and not self.paused):
+            self._pauseOutput()
+
+    def _pauseOutput(self):
+        pauseProducing = getattr(self.process, 'pauseProducing', None)
+        if not pauseProducing:
+            return
+        log.msg("pausing output: %d updates awaiting acknowledgement"
+                % self.builder.unackedUpdates)
+        pauseProducing()
+        self.paused = True
+        self.pausedAt = util.now(self._reactor)
+        self.pauseCount += 1
+        d = self.builder.waitForAcks(self.MAX_UNACKED_UPDATES / 2)
+        d.addCallback(lambda _ : self._resumeOutput())
+
+    def _resumeOutput(self):
+        if not self.paused:
+            return
+        log.msg("resuming output after %0.3fs"
+                % (util.now(self._reactor) - self.pausedAt))
+        self.paused = False
+        if self.deferred is None:
+            # already finished
+            return
+        self.process.resumeProducing()
+        # time spent waiting for the master is not time without output
+        if self.timer:
+            self.timer.reset(self.timeout)
+
     def _addToBuffers(self, logname, data):
         """
         Add data to the buffer for logname
-        Start a timer to send the buffers if BUFFER_TIMEOUT elapses.
-        If adding data causes the buffer size to grow beyond BUFFER_SIZE, then
-        the buffers will be sent.
+        Start a timer to send the buffers if no more output arrives within the
+        idle timeout, or BUFFER_TIMEOUT elapses.
+        If adding data causes the buffer size to grow beyond the current flush
+        size, then the buffers will be sent.
         """
         n = len(data)
 
         self.buflen += n
         self.buffered.append((logname, data))
-        if self.buflen > self.BUFFER_SIZE:
+        now = util.now(self._reactor)
+        if self.bufstart is None:
+            self.bufstart = now
+        if self.buflen > self.bufferSize:
             self._sendBuffers()
-        elif not self.buftimer:
-            self.buftimer = self._reactor.callLater(self.BUFFER_TIMEOUT, self._bufferTimeout)
+            self._checkBackpressure()
+            return
+
+        # send the buffers when the command falls quiet, but don't hold the
+        # oldest data for longer than BUFFER_TIMEOUT
+        delay = min(self.idleTimeout, self.bufstart + self.BUFFER_TIMEOUT - now)
+        if self.buftimer:
+            self.buftimer.reset(max(delay, 0))
+        else:
+            self.buftimer = self._reactor.callLater(max(delay, 0),
+                                                    self._bufferTimeout)
 
     def addStdout(self, data):
         if self.sendStdout:
@@ -705,6 +864,7 @@ class RunProcess:
             # this will send the final updates
             w.stop()
         self._sendBuffers()
+        self._logBuffering()
         if sig is not None:
             rc = -1
         if self.sendRC:
@@ -729,6 +889,19 @@ class RunProcess:
         else:
             log.msg("Hey, command %s finished twice" % self)
 
+    def _logBuffering(self):
+        if self.outputRate is None:
+            return
+        latency = self.builder.ackLatency
+        if latency is None:
+            latency = "unknown"
+        else:
+            latency = "%0.3fs" % latency
+        log.msg("output buffering: %d bytes sent at %d bytes/s, "
+                "ack latency %s, flush size %d bytes, idle timeout %0.3fs, "
+                "paused %d times" % (self.flushedBytes, self.outputRate,
+                latency, self.bufferSize, self.idleTimeout, self.pauseCount))
+
     def failed(self, why):
         self._sendBuffers()
         log.msg("RunProcess.failed: command failed: %s" % (why,))
@@ -771,6 +944,8 @@ class RunProcess:
         if self.buftimer:
             self.buftimer.cancel()
             self.buftimer = None
+        # the process can't be seen to exit unless its output is read
+        self._resumeOutput()
         msg += ", attempting to kill"
         log.msg(msg)
         self.sendStatus({'header': "\n" + msg + "\n"})
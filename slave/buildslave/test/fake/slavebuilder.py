@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import pprint
+from twisted.internet import defer
 
 class FakeSlaveBuilder:
     """
@@ -22,8 +23,13 @@ class FakeSlaveBuilder:
     showing the updates.  Set debug to True to show updates as they happen.
     """
     debug = False
+    orderedUpdates = False
+    compressUpdates = False
+    unackedUpdates = 0
+    ackLatency = None
     def __init__(self, usePTY=False, basedir="/slavebuilder/basedir"):
         self.updates = []
+        self.ackWaiters = []
         self.basedir = basedir
         self.usePTY = usePTY
         self.unicode_encoding = 'utf-8'
@@ -33,6 +39,11 @@ class FakeSlaveBuilder:
             print "FakeSlaveBuilder.sendUpdate", data
         self.updates.append(data)
 
+    def waitForAcks(self, maxUnacked):
+        d = defer.Deferred()
+        self.ackWaiters.append((maxUnacked, d))
+        return d
+
     def show(self):
         return pprint.pformat(self.updates)
 
@@ -268,6 +268,64 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_startCommand_ordered_updates(self):
+        st = FakeStep()
+        self.patch_runprocess(
+            Expect([ 'echo', 'hello' ], os.path.join(self.basedir, 'sb', 'workdir'))
+            + { 'stdout' : 'hello\n' } + 0,
+        )
+
+        d = self.sb.callRemote("startCommand", FakeRemote(st),
+                               "13", "shell", dict(
+                                         command=[ 'echo', 'hello' ],
+                                         workdir='workdir',
+                                         ordered_updates=True,
+                                         compress_updates=True,
+                                     ))
+        d.addCallback(lambda _ : st.wait_for_finish())
+        def check(_):
+            self.assertTrue(self.sb.original.orderedUpdates)
+            self.assertTrue(self.sb.original.compressUpdates)
+        d.addCallback(check)
+        return d
+
+    def test_sendUpdate_acks(self):
+        sb = self.sb.original
+        clock = task.Clock()
+        sb._reactor = clock
+        acks = []
+        sb.remoteStep = mock.Mock()
+        def callRemote(meth, updates):
+            d = defer.Deferred()
+            acks.append(d)
+            return d
+        sb.remoteStep.callRemote = callRemote
+        sb.sendUpdate({'stdout' : 'a'})
+        clock.advance(1)
+        sb.sendUpdate({'stdout' : 'b'})
+        self.assertEqual(sb.unackedUpdates, 2)
+        waited = []
+        sb.waitForAcks(0).addCallback(waited.append)
+        clock.advance(1)
+        acks[0].callback(None)
+        self.assertEqual(sb.unackedUpdates, 1)
+        self.assertEqual(sb.ackLatency, 2)
+        self.assertEqual(waited, [])
+        acks[1].callback(None)
+        self.assertEqual(sb.unackedUpdates, 0)
+        self.assertEqual(sb.ackLatency, 0.75 * 2 + 0.25 * 1)
+        self.assertEqual(waited, [ None ])
+
+    def test_waitForAcks_lostRemoteStep(self):
+        sb = self.sb.original
+        sb.remoteStep = mock.Mock()
+        sb.remoteStep.callRemote.return_value = defer.Deferred()
+        sb.sendUpdate({'stdout' : 'a'})
+        waited = []
+        sb.waitForAcks(0).addCallback(waited.append)
+        sb.lostRemoteStep(None)
+        self.assertEqual(waited, [ None ])
+
     def test_startCommand_interruptCommand(self):
         # set up a fake step to receive updates
         st = FakeStep()
@@ -49,6 +49,9 @@ class FakeMasterMethods(object):
         self.read = False
         self.data = ''
 
+        self.writes_in_flight = 0
+        self.max_writes_in_flight = 0
+
     def remote_write(self, data):
         if self.write_out_of_space_at is not None:
             self.write_out_of_space_at -= len(data)
@@ -64,10 +67,17 @@ class FakeMasterMethods(object):
         if self.keep_data:
             self.data += data
 
+        self.writes_in_flight += 1
+        self.max_writes_in_flight = max(self.max_writes_in_flight,
+                                        self.writes_in_flight)
         if self.delay_write:
             d = defer.Deferred()
-            reactor.callLater(0.01, d.callback, None)
+            def done():
+                self.writes_in_flight -= 1
+                d.callback(None)
+            reactor.callLater(0.01, done)
             return d
+        self.writes_in_flight -= 1
 
     def remote_read(self, length):
         if self.count_reads:
@@ -144,6 +154,33 @@ class TestUploadFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_window(self):
+        self.fakemaster.delay_write = True
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=16,
+            keepstamp=False,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datafile},
+                    'write(s)', 'close',
+                    {'rc': 0}
+                ])
+            self.assertEqual(self.fakemaster.data, "this is some data\n" * 10)
+            self.assertEqual(self.fakemaster.max_writes_in_flight, 4)
+        d.addCallback(check)
+        return d
+
     def test_truncated(self):
         self.fakemaster.count_writes = True    # get actual byte counts
 
@@ -365,6 +402,82 @@ class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
 
         return d
 
+    def test_window(self):
+        self.fakemaster.keep_data = True
+        self.fakemaster.delay_write = True
+
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=512,
+            compress='gz',
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datadir},
+                    'write(s)', 'unpack',
+                    {'rc': 0}
+                ])
+            f = StringIO.StringIO(self.fakemaster.data)
+            a = tarfile.open(fileobj=f, name='check.tar', mode='r:gz')
+            self.assertEqual(a.extractfile('aa').read(), "lots of a" * 100)
+            a.close()
+        d.addCallback(check)
+        return d
+
+    def test_truncated(self):
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=512,
+            compress=None,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datadir},
+                    'write(s)', 'unpack',
+                    {'rc': 1,
+                     'stderr': "Maximum filesize reached, truncating "
+                               "archive of '%s'" % self.datadir}
+                ])
+            self.assertEqual(len(self.fakemaster.data), 1000)
+        d.addCallback(check)
+        return d
+
+    def test_missing(self):
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data-nosuch',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=512,
+            compress=None,
+        ))
+
+        d = self.run_command()
+        self.assertFailure(d, OSError)
+
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % (self.datadir + '-nosuch')},
+                    {'rc': 1}
+                ])
+        d.addCallback(check)
+        return d
+
     # this is just a subclass of SlaveUpload, so the remaining permutations
     # are already tested
 
@@ -415,6 +528,63 @@ class TestDownloadFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_window(self):
+        self.fakemaster.count_reads = True
+        self.fakemaster.delay_read = True
+        self.fakemaster.data = test_data = '1234' * 13
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=100,
+            blocksize=16,
+            mode=None,
+            window=3,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            # three reads are sent before the first is answered, and the file
+            # is not treated as truncated even though reads beyond its end
+            # were sent
+            updates = self.get_updates()
+            self.assertEqual(updates[:3],
+                    ['read 16', 'read 16', 'read 16'])
+            self.assertEqual(updates[-3:-1], ['close', {'rc': 0}])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data)
+        d.addCallback(check)
+        return d
+
+    def test_window_truncated(self):
+        self.fakemaster.data = test_data = 'tenchars--' * 10
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=50,
+            blocksize=32,
+            mode=None,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    'read(s)', 'close',
+                    {'rc': 1,
+                     'stderr': "Maximum filesize reached, truncating file '%s'"
+                                % os.path.join(self.basedir, '.', 'data')}
+                ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data[:50])
+        d.addCallback(check)
+        return d
+
     def test_mkdir(self):
         self.fakemaster.data = test_data = 'hi'
 
@@ -18,6 +18,8 @@ import re
 import os
 import time
 import signal
+import zlib
+import mock
 
 from twisted.trial import unittest
 from twisted.internet import task, defer, reactor
@@ -657,6 +659,56 @@ class TestLogging(BasedirMixin, unittest.TestCase):
             {'stdout': 'world'},
             ])
 
+    def testSendBufferedOrdered(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        b.orderedUpdates = True
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s._addToBuffers('stdout', 'hello ')
+        s._addToBuffers('stdout', 'world')
+        s._addToBuffers('stderr', 'DIEEEEEEE')
+        s._addToBuffers(('log', 'a'), 'log')
+        s._addToBuffers('stdout', '!')
+        s._sendBuffers()
+        self.failUnlessEqual(b.updates, [
+            [ ('stdout', 'hello world'), ('stderr', 'DIEEEEEEE'),
+              (('log', 'a'), 'log'), ('stdout', '!') ],
+            ])
+
+    def testSendChunkedOrdered(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        b.orderedUpdates = True
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        data = "x" * (runprocess.RunProcess.CHUNK_LIMIT * 3 / 2)
+        s._addToBuffers('stderr', 'y')
+        s._addToBuffers('stdout', data)
+        self.failUnlessEqual([ [ (l, len(d)) for l, d in u ]
+                               for u in b.updates ], [
+            [ ('stderr', 1),
+              ('stdout', runprocess.RunProcess.CHUNK_LIMIT) ],
+            [ ('stdout', runprocess.RunProcess.CHUNK_LIMIT / 2) ],
+            ])
+
+    def testSendBufferedCompressed(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        b.orderedUpdates = b.compressUpdates = True
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s._addToBuffers('stdout', 'hello\n' * 100)
+        s._addToBuffers('stderr', 'oops\n')
+        s._sendBuffers()
+        self.failUnlessEqual(len(b.updates), 1)
+        pieces, zdata = b.updates[0]['zlib']
+        self.failUnlessEqual(pieces, [ ('stdout', 600), ('stderr', 5) ])
+        self.failUnlessEqual(zlib.decompress(zdata), 'hello\n' * 100 + 'oops\n')
+
+    def testSendBufferedCompressedSmall(self):
+        # small updates are not worth compressing
+        b = FakeSlaveBuilder(False, self.basedir)
+        b.orderedUpdates = b.compressUpdates = True
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s._addToBuffers('stdout', 'hello\n')
+        s._sendBuffers()
+        self.failUnlessEqual(b.updates, [ [ ('stdout', 'hello\n') ] ])
+
     def testSendChunked(self):
         b = FakeSlaveBuilder(False, self.basedir)
         s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
@@ -672,6 +724,83 @@ class TestLogging(BasedirMixin, unittest.TestCase):
         s._addToBuffers('stdout', data)
         self.failUnlessEqual(len(b.updates), 1)
 
+class TestAdaptiveBuffering(BasedirMixin, unittest.TestCase):
+    def setUp(self):
+        self.setUpBasedir()
+        self.builder = FakeSlaveBuilder(False, self.basedir)
+        self.clock = task.Clock()
+        self.s = runprocess.RunProcess(self.builder, stdoutCommand('hello'),
+                                       self.basedir)
+        self.s._reactor = self.clock
+
+    def tearDown(self):
+        self.tearDownBasedir()
+
+    def test_idle_flush(self):
+        # a quiet command's output is sent soon after it stops
+        s = self.s
+        s._addToBuffers('stdout', 'a')
+        self.clock.advance(s.MIN_IDLE_TIMEOUT / 2)
+        s._addToBuffers('stdout', 'b')
+        self.clock.advance(s.MIN_IDLE_TIMEOUT / 2)
+        self.assertEqual(self.builder.updates, [])
+        self.clock.advance(s.MIN_IDLE_TIMEOUT / 2)
+        self.assertEqual(self.builder.updates, [ {'stdout' : 'ab'} ])
+
+    def test_buffer_timeout(self):
+        # output that never stops is still sent every BUFFER_TIMEOUT
+        s = self.s
+        s.bufferSize = s.BUFFER_SIZE
+        for i in range(int(s.BUFFER_TIMEOUT / 0.05) + 2):
+            s._addToBuffers('stdout', 'a')
+            self.clock.advance(0.05)
+        self.assertEqual(len(self.builder.updates), 1)
+
+    def test_flush_size(self):
+        s = self.s
+        self.assertEqual(s.bufferSize, s.MIN_BUFFER_SIZE)
+        # fast output is sent in larger updates, up to BUFFER_SIZE
+        s._addToBuffers('stdout', 'x' * s.MIN_BUFFER_SIZE)
+        self.clock.advance(0.001)
+        s._addToBuffers('stdout', 'x')
+        self.assertEqual(len(self.builder.updates), 1)
+        self.assertEqual(s.bufferSize, s.BUFFER_SIZE)
+        # once the output slows down, it is sent in smaller updates, with an
+        # idle timeout that follows the ack latency
+        self.builder.ackLatency = 0.2
+        for i in range(10):
+            s._addToBuffers('stdout', 'x')
+            self.clock.advance(1)
+        self.assertEqual(len(self.builder.updates), 11)
+        self.assertEqual(s.bufferSize, s.MIN_BUFFER_SIZE)
+        self.assertEqual(s.idleTimeout, 0.4)
+
+    def test_backpressure(self):
+        s = self.s
+        s.process = mock.Mock()
+        s.deferred = defer.Deferred()
+        self.builder.unackedUpdates = s.MAX_UNACKED_UPDATES + 1
+        s._addToBuffers('stdout', 'x' * (s.BUFFER_SIZE + 1))
+        self.assertTrue(s.process.pauseProducing.called)
+        self.assertEqual(len(self.builder.ackWaiters), 1)
+        maxUnacked, d = self.builder.ackWaiters[0]
+        self.assertEqual(maxUnacked, s.MAX_UNACKED_UPDATES / 2)
+        # more output while paused doesn't pause again
+        s._addToBuffers('stdout', 'x' * (s.BUFFER_SIZE + 1))
+        self.assertEqual(len(self.builder.ackWaiters), 1)
+        d.callback(None)
+        self.assertTrue(s.process.resumeProducing.called)
+        self.assertEqual(s.pauseCount, 1)
+
+    def test_backpressure_finished(self):
+        # a command that finished while paused is not resumed
+        s = self.s
+        s.process = mock.Mock()
+        self.builder.unackedUpdates = s.MAX_UNACKED_UPDATES + 1
+        s._addToBuffers('stdout', 'x' * (s.BUFFER_SIZE + 1))
+        self.builder.ackWaiters[0][1].callback(None)
+        self.assertFalse(s.process.resumeProducing.called)
+
 class TestLogFileWatcher(BasedirMixin, unittest.TestCase):
     def setUp(self):
         self.setUpBasedir()